@@ -7,12 +7,20 @@ Top-level package re-exports the Metabase connection helpers so callers can do:
 
 from indicadors_iso.connection import (
     METABASE_SILENT_ROW_CAP,
+    MetabaseClient,
     execute_query,
+    execute_query_in_batches,
+    execute_query_partitioned,
     execute_query_yearly,
+    get_client,
 )
 
 __all__ = [
     "METABASE_SILENT_ROW_CAP",
+    "MetabaseClient",
     "execute_query",
+    "execute_query_in_batches",
+    "execute_query_partitioned",
     "execute_query_yearly",
+    "get_client",
 ]
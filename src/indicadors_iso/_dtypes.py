@@ -0,0 +1,110 @@
+"""Tipos compactos para los DataFrames que devuelven los loaders.
+
+Un *schema* es un dict `{columna: tipo}` con los tipos lógicos de abajo.
+`apply_schema` lo aplica una sola vez al cargar (solo a las columnas
+presentes) e informa de la memoria ahorrada. Cada loader declara el
+suyo (p.ej. `demographics/_schemas.py`).
+
+Tipos:
+    REF       identificadores (`patient_ref`, `episode_ref`…) → int64
+              (Int64 si hay nulos). Si la columna contiene valores no
+              numéricos (IDs sintéticos `SYN2025-…`) se deja como está.
+    INT       enteros sin nulos → el int más pequeño que los contiene;
+              con nulos se deja como está.
+    NULLABLE_INT  Int64 nullable (claves de merge como `stay_id`).
+    FLAG      0/1 → int8 (Int8 si hay nulos). Se prefiere a bool para
+              que los CSV exportados sigan escribiendo 0/1 y las
+              comparaciones `== 1` aguas abajo no cambien.
+    CATEGORY  texto de baja cardinalidad (unidades, sexo, "Yes"/"No").
+    DATETIME  datetime64 con zona Europe/Madrid (texto ISO 8601, como lo
+              devuelve Metabase; admite mezclas con Timestamps ya
+              parseados). Se conserva la hora local del hospital para
+              que `.dt.year` y los CSV exportados no se desplacen.
+    FLOAT32   medidas continuas donde 7 cifras significativas bastan.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+import pandas as pd
+
+# Igual que `connection.DB_TIMEZONE`.
+DB_TIMEZONE = "Europe/Madrid"
+
+REF = "ref"
+INT = "int"
+NULLABLE_INT = "Int64"
+FLAG = "flag"
+CATEGORY = "category"
+DATETIME = "datetime"
+FLOAT32 = "float32"
+
+
+def _convert(col: pd.Series, kind: str) -> pd.Series:
+    if kind == CATEGORY:
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            return col
+        return col.astype("category")
+    if kind == DATETIME:
+        if not isinstance(col.dtype, pd.DatetimeTZDtype):
+            col = pd.to_datetime(col, errors="coerce", utc=True, format="ISO8601")
+        return col.dt.tz_convert(DB_TIMEZONE)
+    if kind == FLOAT32:
+        return pd.to_numeric(col, errors="coerce").astype("float32")
+
+    num = pd.to_numeric(col, errors="coerce")
+    if num.isna().sum() > col.isna().sum():
+        # Había valores no numéricos: convertir los perdería.
+        return col
+    has_na = bool(num.isna().any())
+    if kind == REF:
+        return num.astype("Int64" if has_na else "int64")
+    if kind == NULLABLE_INT:
+        return num.astype("Int64")
+    if kind == FLAG:
+        return num.astype("Int8" if has_na else "int8")
+    if kind == INT:
+        return col if has_na else pd.to_numeric(num, downcast="integer")
+    raise ValueError(f"Tipo de schema desconocido: {kind!r}")
+
+
+def apply_schema(
+    df: pd.DataFrame,
+    schema: dict[str, str],
+    label: Optional[str] = None,
+    verbose: bool = True,
+) -> pd.DataFrame:
+    """Devuelve `df` con las columnas de `schema` convertidas.
+
+    Si `label` y `verbose`, imprime la memoria antes/después. Los bytes
+    ahorrados quedan también en `df.attrs["dtype_bytes_saved"]`.
+    """
+    if df.empty:
+        return df
+    before = int(df.memory_usage(deep=True).sum())
+    out = df.copy()
+    for name, kind in schema.items():
+        if name in out.columns:
+            out[name] = _convert(out[name], kind)
+    after = int(out.memory_usage(deep=True).sum())
+    out.attrs["dtype_bytes_saved"] = before - after
+    if verbose and label:
+        pct = (before - after) / before * 100 if before else 0.0
+        print(
+            f"[{label}] dtypes compactos: {before / 1e6:.1f} MB → "
+            f"{after / 1e6:.1f} MB (−{pct:.0f}%)"
+        )
+    return out
+
+
+__all__ = [
+    "CATEGORY",
+    "DATETIME",
+    "FLAG",
+    "FLOAT32",
+    "INT",
+    "NULLABLE_INT",
+    "REF",
+    "apply_schema",
+]
@@ -0,0 +1,133 @@
+"""Lock de fichero portable (Windows / macOS / Linux) sin dependencias.
+
+Se basa en la creación atómica `os.open(..., O_CREAT | O_EXCL)`: el
+proceso que consigue crear el fichero tiene el lock; el resto espera
+sondeando. Si el propietario muere sin liberar, el lock se considera
+abandonado cuando su mtime supera `stale_after` segundos y se rompe.
+
+Pensado para coordinar scripts lanzados en paralelo sobre la misma
+carpeta `output/` (cache de queries, limitador de concurrencia…), no
+para exclusión de alta frecuencia.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Union
+
+
+class FileLockTimeout(TimeoutError):
+    """No se consiguió el lock dentro del `timeout` pedido."""
+
+
+class FileLock:
+    """Lock exclusivo materializado como fichero `path`.
+
+    Uso:
+        with FileLock(cache_dir / "abc.lock"):
+            ...
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        timeout: Optional[float] = None,
+        stale_after: float = 3600.0,
+        poll_interval: float = 0.1,
+    ):
+        self.path = Path(path)
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self._held = False
+
+    def try_acquire(self) -> bool:
+        """Intenta coger el lock una vez, sin esperar."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(str(self.path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            self._break_if_stale()
+            return False
+        with os.fdopen(fd, "w") as fh:
+            fh.write(f"{os.getpid()}\n")
+        self._held = True
+        return True
+
+    def acquire(self) -> float:
+        """Espera hasta tener el lock. Devuelve los segundos esperados."""
+        start = time.monotonic()
+        while not self.try_acquire():
+            waited = time.monotonic() - start
+            if self.timeout is not None and waited >= self.timeout:
+                raise FileLockTimeout(
+                    f"Timeout ({self.timeout:.0f}s) esperando el lock {self.path}"
+                )
+            time.sleep(self.poll_interval)
+        return time.monotonic() - start
+
+    def release(self) -> None:
+        if not self._held:
+            return
+        self._held = False
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def touch(self) -> None:
+        """Refresca el mtime para que un lock largo no parezca abandonado."""
+        if self._held:
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _break_if_stale(self) -> None:
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return
+        if time.time() - st.st_mtime <= self.stale_after:
+            return
+        # Se aparta con un nombre único antes de borrar: `os.replace` es
+        # atómico, así que de varios que esperan solo uno se lleva este
+        # fichero. Si entretanto otro ya lo rompió y cogió un lock nuevo,
+        # lo que nos hemos llevado no es el fichero abandonado que vimos
+        # (otro inode / mtime) y se devuelve a su sitio.
+        moved = self.path.with_name(
+            f"{self.path.name}.stale.{os.getpid()}.{uuid.uuid4().hex}"
+        )
+        try:
+            os.replace(self.path, moved)
+        except FileNotFoundError:
+            return
+        try:
+            now = moved.stat()
+            if (now.st_ino, now.st_mtime_ns) != (st.st_ino, st.st_mtime_ns):
+                try:
+                    os.link(moved, self.path)
+                except FileExistsError:
+                    pass
+        finally:
+            try:
+                moved.unlink()
+            except FileNotFoundError:
+                pass
+
+    @property
+    def held(self) -> bool:
+        return self._held
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+__all__ = ["FileLock", "FileLockTimeout"]
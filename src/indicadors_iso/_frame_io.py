@@ -0,0 +1,84 @@
+"""Lectura / escritura atómica de DataFrames en disco.
+
+Formato compartido por la cache de queries (`_query_cache`), la réplica
+de `movements` (`_mirror`) y la cache de capacidad de camas
+(`demographics._bed_occupancy`): Parquet si hay pyarrow y el frame se
+deja serializar, pickle si no. Se escribe a un temporal y se publica con
+`os.replace`, así que un lector nunca ve un fichero a medias; al
+terminar se borra la copia con el otro sufijo.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+FRAME_SUFFIXES = (".parquet", ".pkl")
+
+
+def write_frame(base: Path, df: pd.DataFrame) -> Path:
+    """Guarda `df` como `base.parquet` (o `base.pkl`) y devuelve la ruta."""
+    base = Path(base)
+    base.parent.mkdir(parents=True, exist_ok=True)
+    tmp = base.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    suffix = ".pkl"
+    if HAS_PYARROW and len(df.columns):
+        try:
+            df.to_parquet(tmp, index=False)
+            suffix = ".parquet"
+        except (ValueError, TypeError, ImportError, OSError):
+            # Columnas object con tipos mezclados: pyarrow no sabe
+            # serializarlas. El pickle conserva el DataFrame tal cual.
+            suffix = ".pkl"
+    if suffix == ".pkl":
+        df.to_pickle(tmp)
+    path = base.with_suffix(suffix)
+    os.replace(tmp, path)
+    for other in FRAME_SUFFIXES:
+        if other != suffix:
+            base.with_suffix(other).unlink(missing_ok=True)
+    return path
+
+
+def read_frame(path: Path, columns: Optional[list[str]] = None) -> pd.DataFrame:
+    """Lee un fichero de `write_frame`. Con `columns`, en Parquet solo se
+    leen esas; en pickle se proyectan después (las ausentes se omiten)."""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path, columns=columns)
+    df = pd.read_pickle(path)
+    if columns:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+
+def find_frame(base: Path) -> Optional[Path]:
+    """Ruta legible de `base` (Parquet solo si hay pyarrow) o None."""
+    for suffix in FRAME_SUFFIXES:
+        path = Path(base).with_suffix(suffix)
+        if path.exists() and (suffix == ".pkl" or HAS_PYARROW):
+            return path
+    return None
+
+
+def remove_frame(base: Path) -> None:
+    """Borra `base` con cualquiera de los sufijos."""
+    for suffix in FRAME_SUFFIXES:
+        Path(base).with_suffix(suffix).unlink(missing_ok=True)
+
+
+__all__ = [
+    "FRAME_SUFFIXES",
+    "HAS_PYARROW",
+    "find_frame",
+    "read_frame",
+    "remove_frame",
+    "write_frame",
+]
@@ -0,0 +1,144 @@
+"""Limitador de queries concurrentes a Metabase compartido por todo el host.
+
+Varios scripts lanzados a la vez (`per_unit`, `predominant_unit`, `drg`,
+`data_quality`…), cada uno con sus hilos, pueden saturar Metabase /
+Athena. El governor es un semáforo materializado como directorio con
+`max_concurrent` ficheros de slot (`slot_00.lock`, `slot_01.lock`…):
+una query solo se lanza tras coger uno de ellos con `FileLock`, así que
+el límite se respeta entre hilos y entre procesos del mismo usuario.
+
+Mientras se tiene un slot, un hilo de fondo refresca su mtime cada
+`heartbeat_s`; un slot sin refrescar durante `stale_after` segundos
+pertenece a un proceso muerto y se rompe.
+
+El tiempo de espera en cola se devuelve al llamante (y
+`connection.execute_query` lo escribe en la traza como `queue_wait_s`)
+para poder dimensionar el límite con datos reales.
+"""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from indicadors_iso._filelock import FileLock, FileLockTimeout
+
+DEFAULT_MAX_CONCURRENT = 4
+DEFAULT_STALE_AFTER_S = 120.0
+DEFAULT_HEARTBEAT_S = 15.0
+POLL_INTERVAL_S = 0.05
+POLL_INTERVAL_MAX_S = 0.5
+
+
+class ConcurrencyGovernor:
+    """Ver docstring del módulo. `max_concurrent` None o <= 0 = sin límite."""
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int],
+        root: Path,
+        stale_after: float = DEFAULT_STALE_AFTER_S,
+        heartbeat_s: float = DEFAULT_HEARTBEAT_S,
+    ):
+        self.max_concurrent = max_concurrent if max_concurrent and max_concurrent > 0 else None
+        self.root = Path(root)
+        self.stale_after = stale_after
+        self.heartbeat_s = heartbeat_s
+        self._lock = threading.Lock()
+        self._held: set[FileLock] = set()
+        self._heartbeat: Optional[threading.Thread] = None
+        self.acquisitions = 0
+        self.queued = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent is not None
+
+    def _slots(self) -> list[FileLock]:
+        slots = [
+            FileLock(self.root / f"slot_{i:02d}.lock", stale_after=self.stale_after)
+            for i in range(self.max_concurrent)
+        ]
+        # Orden aleatorio: que no compitan todos por el slot 0.
+        random.shuffle(slots)
+        return slots
+
+    def acquire(self, timeout: Optional[float] = None) -> tuple[Optional[FileLock], float]:
+        """Espera a un slot libre. Devuelve `(slot, segundos_en_cola)`;
+        el slot es None si el governor está desactivado."""
+        if not self.enabled:
+            return None, 0.0
+        start = time.monotonic()
+        poll = POLL_INTERVAL_S
+        while True:
+            for slot in self._slots():
+                if slot.try_acquire():
+                    waited = time.monotonic() - start
+                    self._register(slot, waited)
+                    return slot, waited
+            waited = time.monotonic() - start
+            if timeout is not None and waited >= timeout:
+                raise FileLockTimeout(
+                    f"Timeout ({timeout:.0f}s) esperando un slot de query "
+                    f"({self.max_concurrent} concurrentes, {self.root})"
+                )
+            time.sleep(poll)
+            poll = min(poll * 2, POLL_INTERVAL_MAX_S)
+
+    def release(self, slot: Optional[FileLock]) -> None:
+        if slot is None:
+            return
+        with self._lock:
+            self._held.discard(slot)
+        slot.release()
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None) -> Iterator[float]:
+        """`with governor.slot() as waited:` — `waited` = segundos en cola."""
+        held, waited = self.acquire(timeout)
+        try:
+            yield waited
+        finally:
+            self.release(held)
+
+    def _register(self, slot: FileLock, waited: float) -> None:
+        with self._lock:
+            self._held.add(slot)
+            self.acquisitions += 1
+            self.total_wait_s += waited
+            self.max_wait_s = max(self.max_wait_s, waited)
+            if waited >= POLL_INTERVAL_S:
+                self.queued += 1
+            if self._heartbeat is None or not self._heartbeat.is_alive():
+                self._heartbeat = threading.Thread(
+                    target=self._beat, name="governor-heartbeat", daemon=True
+                )
+                self._heartbeat.start()
+
+    def _beat(self) -> None:
+        while True:
+            time.sleep(self.heartbeat_s)
+            with self._lock:
+                held = list(self._held)
+            for slot in held:
+                slot.touch()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "acquisitions": self.acquisitions,
+                "queued": self.queued,
+                "total_wait_s": round(self.total_wait_s, 3),
+                "max_wait_s": round(self.max_wait_s, 3),
+                "held": len(self._held),
+            }
+
+
+__all__ = ["DEFAULT_MAX_CONCURRENT", "ConcurrencyGovernor"]
@@ -0,0 +1,372 @@
+"""Réplica local de `movements` particionada por mes.
+
+Estancias, capacidad de camas, estancias DRG, ventanas de nutrición y
+cobertura de deliris salen todas de `datascope_gestor_prod.movements`
+para un puñado de unidades. `MovementsMirror.sync` copia esas filas a
+disco y `MovementsMirror.read` las sirve con poda de particiones y
+proyección de columnas, sin pasar por Metabase.
+
+Layout bajo `output/_mirror/movements/`:
+
+    manifest.json                          {"YYYY-MM": {watermark, units,
+                                            rows, suffix, synced_at}}
+    year=YYYY/month=MM/part-0.parquet      movimientos con `start_date`
+                                           en ese mes (`.pkl` si no hay
+                                           pyarrow, ver `_frame_io`)
+    sync.lock                              un solo `sync` a la vez
+
+Sincronización incremental:
+    Una query de sondeo devuelve por mes `COUNT(*)` y `MAX(load_date)`
+    de las unidades replicadas. Solo se re-descargan los meses cuya
+    marca de agua cambió (o replicados con otra lista de unidades); el
+    resto se queda en disco. Un movimiento abierto que se cierra se
+    recarga con `load_date` nuevo, así que su mes se refresca solo. No
+    hay upsert por fila: `movements` no tiene clave primaria y el mes es
+    la unidad de reemplazo. Cada mes se pide con
+    `connection.execute_query_partitioned`, que lo parte en semanas /
+    días si satura el tope de 2000 filas.
+
+Fechas:
+    Los meses son de calendario local (`year(start_date)` en Athena, con
+    los timestamps guardados en hora del hospital). Los límites que
+    recibe `read` se interpretan en esa misma hora local.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from indicadors_iso._filelock import FileLock
+from indicadors_iso._frame_io import read_frame, remove_frame, write_frame
+from indicadors_iso._paths import OUTPUT_DIR
+from indicadors_iso.connection import execute_query, execute_query_partitioned, get_client
+
+DEFAULT_MIRROR_DIR = OUTPUT_DIR / "_mirror" / "movements"
+
+# Unidades que consumen los módulos locales: UCIs de deliris y SOFA
+# (`demographics.sofa._config.ICU_UNITS`), que incluyen E073/I073.
+DEFAULT_UNITS = ["E016", "E103", "E014", "E015", "E037", "E057", "E073", "E043", "I073"]
+MIRROR_UNITS_ENV = "INDICADORS_MIRROR_UNITS"
+
+# Igual que `demographics._stays_sql.DB_TIMEZONE`.
+DB_TIMEZONE = "Europe/Madrid"
+
+DEFAULT_MAX_WORKERS = 4
+
+# `{units}` = lista IN; `{start}` / `{end}` = 'YYYY-MM-DD HH:MM:SS',
+# rango semiabierto sobre `start_date`.
+MONTH_SQL = """
+SELECT *
+FROM datascope_gestor_prod.movements
+WHERE ou_loc_ref IN ({units})
+  AND start_date >= timestamp '{start}'
+  AND start_date <  timestamp '{end}'
+"""
+
+PROBE_SQL = """
+SELECT
+    year(start_date)  AS year,
+    month(start_date) AS month,
+    COUNT(*)          AS n_rows,
+    MAX(load_date)    AS max_load_date
+FROM datascope_gestor_prod.movements
+WHERE ou_loc_ref IN ({units})
+  AND start_date >= timestamp '{start}'
+  AND start_date <  timestamp '{end}'
+GROUP BY year(start_date), month(start_date)
+"""
+
+
+def default_units() -> list[str]:
+    """`INDICADORS_MIRROR_UNITS` (separadas por comas) o `DEFAULT_UNITS`."""
+    raw = os.environ.get(MIRROR_UNITS_ENV, "").strip()
+    if not raw:
+        return list(DEFAULT_UNITS)
+    return [u.strip() for u in raw.split(",") if u.strip()]
+
+
+def _month_key(year: int, month: int) -> str:
+    return f"{year:04d}-{month:02d}"
+
+
+def _month_bounds(key: str) -> tuple[datetime, datetime]:
+    year, month = (int(p) for p in key.split("-"))
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+
+def _fmt(dt: datetime) -> str:
+    return f"{dt:%Y-%m-%d %H:%M:%S}"
+
+
+def _local_naive(col: pd.Series) -> pd.Series:
+    """Timestamps en hora local sin zona (Metabase los da con zona)."""
+    if not isinstance(col.dtype, pd.DatetimeTZDtype):
+        col = pd.to_datetime(col, errors="coerce", format="ISO8601")
+    if isinstance(col.dtype, pd.DatetimeTZDtype):
+        return col.dt.tz_convert(DB_TIMEZONE).dt.tz_localize(None)
+    return col
+
+
+class MovementsMirror:
+    """Ver docstring del módulo.
+
+    `month_sql` / `probe_sql` permiten cambiar las plantillas (p.ej.
+    SQL SQLite en los tests contra `metabase_standin`).
+    """
+
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        units: Optional[Iterable[str]] = None,
+        month_sql: str = MONTH_SQL,
+        probe_sql: str = PROBE_SQL,
+    ):
+        self.root = Path(root) if root is not None else DEFAULT_MIRROR_DIR
+        self.units = sorted(units) if units is not None else sorted(default_units())
+        if not self.units:
+            raise ValueError("MovementsMirror: lista de unidades vacía.")
+        self.month_sql = month_sql
+        self.probe_sql = probe_sql
+        self.manifest_path = self.root / "manifest.json"
+
+    # ------------------------------------------------------------------
+    # Manifiesto y rutas
+    # ------------------------------------------------------------------
+    def manifest(self) -> dict:
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest: dict) -> None:
+        tmp = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, self.manifest_path)
+
+    def _partition_dir(self, key: str) -> Path:
+        year, month = key.split("-")
+        return self.root / f"year={year}" / f"month={month}"
+
+    def _units_sql(self) -> str:
+        return ", ".join(f"'{u}'" for u in self.units)
+
+    # ------------------------------------------------------------------
+    # Sincronización
+    # ------------------------------------------------------------------
+    def sync(
+        self,
+        min_year: int,
+        max_year: int,
+        *,
+        force_refresh: bool = False,
+        client=None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        verbose: bool = False,
+    ) -> dict:
+        """Trae a disco los meses de [min_year, max_year] que cambiaron.
+
+        Devuelve `{"refetched": [...], "unchanged": [...], "removed":
+        [...]}` con claves "YYYY-MM".
+        """
+        client = client or get_client()
+        start, end = datetime(int(min_year), 1, 1), datetime(int(max_year) + 1, 1, 1)
+        units_sql = self._units_sql()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        with FileLock(self.root / "sync.lock", stale_after=3 * 3600):
+            probe = execute_query(
+                self.probe_sql.format(units=units_sql, start=_fmt(start), end=_fmt(end)),
+                verbose=verbose,
+                client=client,
+                cache=False,
+                force_refresh=True,
+                label="mirror:probe",
+            )
+            marks = {}
+            for row in probe.to_dict("records"):
+                year, month = row.pop("year"), row.pop("month")
+                if pd.isna(year) or pd.isna(month):
+                    continue
+                marks[_month_key(int(year), int(month))] = {
+                    k: None if pd.isna(v) else str(v) for k, v in sorted(row.items())
+                }
+
+            manifest = self.manifest()
+            in_range = {
+                k for k in manifest if start <= _month_bounds(k)[0] < end
+            }
+            stale, unchanged = [], []
+            for key in sorted(marks):
+                entry = manifest.get(key)
+                if (
+                    force_refresh
+                    or entry is None
+                    or entry.get("watermark") != marks[key]
+                    or entry.get("units") != self.units
+                ):
+                    stale.append(key)
+                else:
+                    unchanged.append(key)
+            # Meses que ya no tienen filas en origen (o de otras unidades).
+            removed = sorted(in_range - set(marks))
+
+            if verbose:
+                print(
+                    f"  [mirror] movements {min_year}-{max_year} ({len(self.units)} unidades): "
+                    f"{len(unchanged)} mes(es) sin cambios · descargando {len(stale)}"
+                    + (f" · eliminando {len(removed)}" if removed else "")
+                )
+
+            def fetch(key):
+                m_start, m_end = _month_bounds(key)
+                return execute_query_partitioned(
+                    lambda s, e: self.month_sql.format(
+                        units=units_sql, start=_fmt(s), end=_fmt(e)
+                    ),
+                    m_start,
+                    m_end,
+                    label="mirror:movements",
+                    plan_key="",
+                    verbose=verbose,
+                    client=client,
+                    cache=False,
+                    force_refresh=True,
+                )
+
+            workers = max(1, min(max_workers or 1, len(stale) or 1))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for key, df in zip(stale, pool.map(fetch, stale)):
+                    manifest[key] = self._write_partition(key, df, marks[key])
+                    self._write_manifest(manifest)
+
+            for key in removed:
+                self._remove_partition(key)
+                manifest.pop(key, None)
+            self._write_manifest(manifest)
+
+        return {"refetched": stale, "unchanged": unchanged, "removed": removed}
+
+    def _write_partition(self, key: str, df: pd.DataFrame, watermark: dict) -> dict:
+        suffix = write_frame(self._partition_dir(key) / "part-0", df).suffix
+        return {
+            "watermark": watermark,
+            "units": self.units,
+            "rows": int(len(df)),
+            "suffix": suffix,
+            "synced_at": time.time(),
+        }
+
+    def _remove_partition(self, key: str) -> None:
+        remove_frame(self._partition_dir(key) / "part-0")
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+    def partitions(self, start=None, end=None) -> list[str]:
+        """Meses replicados ("YYYY-MM") que solapan `[start, end)`."""
+        start = pd.Timestamp(start).to_pydatetime() if start is not None else None
+        end = pd.Timestamp(end).to_pydatetime() if end is not None else None
+        keys = []
+        for key in sorted(self.manifest()):
+            m_start, m_end = _month_bounds(key)
+            if start is not None and m_end <= start:
+                continue
+            if end is not None and m_start >= end:
+                continue
+            keys.append(key)
+        return keys
+
+    def read(
+        self,
+        start=None,
+        end=None,
+        units: Optional[Iterable[str]] = None,
+        columns: Optional[list[str]] = None,
+    ) -> pd.DataFrame:
+        """Movimientos con `start_date` en `[start, end)` (hora local).
+
+        Solo abre los meses que solapan el rango y, en Parquet, solo las
+        `columns` pedidas (más `start_date` / `ou_loc_ref` si hacen falta
+        para filtrar). `units` debe ser un subconjunto de las
+        replicadas en cada mes leído (ValueError si no). En
+        `df.attrs["partitions_read"]` quedan los meses leídos.
+        """
+        manifest = self.manifest()
+        keys = self.partitions(start, end)
+        if units is not None:
+            units = list(units)
+            # Cada mes se sincronizó con su propia lista de unidades.
+            missing = {
+                key: sorted(set(units) - set(manifest[key].get("units", [])))
+                for key in keys
+            }
+            missing = {key: m for key, m in missing.items() if m}
+            if missing:
+                detail = ", ".join(f"{key}: {m}" for key, m in missing.items())
+                raise ValueError(
+                    f"Unidades no replicadas en {self.root} ({detail}). "
+                    f"Añádelas con `python -m indicadors_iso.mirror sync --units …`."
+                )
+
+        need = []
+        if columns is not None:
+            need = list(columns)
+            if (start is not None or end is not None) and "start_date" not in need:
+                need.append("start_date")
+            if units is not None and "ou_loc_ref" not in need:
+                need.append("ou_loc_ref")
+
+        lo = pd.Timestamp(start) if start is not None else None
+        hi = pd.Timestamp(end) if end is not None else None
+        parts = []
+        for key in keys:
+            m_start, m_end = _month_bounds(key)
+            path = (self._partition_dir(key) / "part-0").with_suffix(
+                manifest[key].get("suffix", ".pkl")
+            )
+            df = read_frame(path, columns=need or None)
+            if units is not None and "ou_loc_ref" in df.columns:
+                df = df[df["ou_loc_ref"].isin(units)]
+            # Solo los meses de los bordes necesitan filtro por fila.
+            edge = (lo is not None and m_start < lo) or (hi is not None and m_end > hi)
+            if edge and "start_date" in df.columns:
+                local = _local_naive(df["start_date"])
+                mask = pd.Series(True, index=df.index)
+                if lo is not None:
+                    mask &= local >= lo
+                if hi is not None:
+                    mask &= local < hi
+                df = df[mask]
+            parts.append(df)
+
+        parts = [p for p in parts if len(p)]
+        out = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=need)
+        if columns is not None:
+            out = out[[c for c in columns if c in out.columns]]
+        out.attrs["partitions_read"] = keys
+        return out
+
+
+def read_movements(start=None, end=None, units=None, columns=None) -> pd.DataFrame:
+    """`MovementsMirror().read(...)` sobre la réplica por defecto."""
+    return MovementsMirror().read(start=start, end=end, units=units, columns=columns)
+
+
+__all__ = [
+    "DEFAULT_MIRROR_DIR",
+    "DEFAULT_UNITS",
+    "MIRROR_UNITS_ENV",
+    "MovementsMirror",
+    "default_units",
+    "read_movements",
+]
@@ -0,0 +1,304 @@
+"""Cache en disco, direccionada por contenido, de resultados de queries.
+
+Clave = SHA-256 del SQL normalizado (sin comentarios `--`, espacios
+colapsados, sin `;` final) + el nombre de la base de Metabase (+ la
+variante que pase el llamador, p.ej. el modo `export`). Dos
+plantillas que solo difieren en indentación o comentarios comparten
+entrada; cualquier cambio real en el SQL genera una clave nueva.
+
+Layout bajo `output/_query_cache/`:
+
+    <k[:2]>/<k>.parquet    resultado (o `.pkl` si no hay pyarrow o la
+                           tabla no es serializable a Parquet)
+    <k[:2]>/<k>.json       metadatos: created, rows, bytes, formato,
+                           primeras líneas del SQL (para inspección)
+    <k[:2]>/<k>.lock       lock mientras un proceso calcula esa clave
+
+Política:
+    - TTL: una entrada con más de `ttl_s` segundos se trata como miss.
+    - LRU por tamaño: tras cada escritura, si la carpeta supera
+      `max_bytes` se borran las entradas menos recientemente usadas
+      (mtime del fichero de datos, que se refresca en cada hit).
+    - Concurrencia: el cálculo de una clave se hace bajo lock de
+      fichero; un segundo script que pida la misma query espera y
+      reutiliza el resultado en lugar de lanzarla otra vez. Las
+      escrituras son atómicas (`tmp` + `os.replace`).
+
+La cache es **opt-in**: `connection.execute_query(..., cache=True)`, o
+globalmente con la variable de entorno `INDICADORS_QUERY_CACHE=1`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import pandas as pd
+
+from indicadors_iso._filelock import FileLock
+from indicadors_iso._frame_io import read_frame, write_frame
+from indicadors_iso._paths import OUTPUT_DIR
+
+DEFAULT_CACHE_DIR = OUTPUT_DIR / "_query_cache"
+DEFAULT_TTL_S = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+
+def normalize_sql(sql: str) -> str:
+    """Normaliza SQL para el hash: quita comentarios `--` y colapsa espacios.
+
+    Respeta los literales entre comillas simples (un `--` o un doble
+    espacio dentro de `'...'` no se tocan).
+    """
+    out: list[str] = []
+    i, n = 0, len(sql)
+    pending_space = False
+    while i < n:
+        ch = sql[i]
+        if ch == "'":
+            j = i + 1
+            while j < n:
+                if sql[j] == "'":
+                    if j + 1 < n and sql[j + 1] == "'":
+                        j += 2
+                        continue
+                    break
+                j += 1
+            if pending_space and out:
+                out.append(" ")
+            pending_space = False
+            out.append(sql[i:j + 1])
+            i = j + 1
+            continue
+        if ch == "-" and sql.startswith("--", i):
+            j = sql.find("\n", i)
+            i = n if j == -1 else j
+            pending_space = True
+            continue
+        if ch.isspace():
+            pending_space = True
+            i += 1
+            continue
+        if pending_space and out:
+            out.append(" ")
+        pending_space = False
+        out.append(ch)
+        i += 1
+    return "".join(out).rstrip(" ;")
+
+
+def query_fingerprint(sql: str, database_name: str = "") -> str:
+    """Hash hexadecimal (SHA-256) de `normalize_sql(sql)` + base."""
+    payload = f"{database_name}\0{normalize_sql(sql)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class QueryCache:
+    """Cache de DataFrames por huella de query. Ver docstring del módulo."""
+
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        ttl_s: Optional[float] = DEFAULT_TTL_S,
+        max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+    ):
+        self.root = Path(root) if root is not None else DEFAULT_CACHE_DIR
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self._counter_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    # ------------------------------------------------------------------
+    # Rutas
+    # ------------------------------------------------------------------
+    def _base(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def _meta_path(self, key: str) -> Path:
+        return self._base(key).with_suffix(".json")
+
+    def _data_paths(self, key: str) -> list[Path]:
+        base = self._base(key)
+        return [base.with_suffix(".parquet"), base.with_suffix(".pkl")]
+
+    # ------------------------------------------------------------------
+    # Lectura / escritura
+    # ------------------------------------------------------------------
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Devuelve el DataFrame cacheado o None (ausente, caducado o corrupto)."""
+        meta_path = self._meta_path(key)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if self.ttl_s is not None and time.time() - meta.get("created", 0) > self.ttl_s:
+            return None
+        data_path = self._base(key).with_suffix(meta.get("suffix", ".pkl"))
+        try:
+            df = read_frame(data_path)
+            os.utime(data_path)  # marca de uso para la política LRU
+        except (OSError, ValueError, ImportError, EOFError):
+            return None
+        return df
+
+    def put(self, key: str, df: pd.DataFrame, sql: str = "") -> None:
+        """Guarda `df` de forma atómica y aplica la política de tamaño."""
+        data_path = write_frame(self._base(key), df)
+        suffix = data_path.suffix
+
+        meta = {
+            "created": time.time(),
+            "rows": int(len(df)),
+            "bytes": data_path.stat().st_size,
+            "suffix": suffix,
+            "sql_head": normalize_sql(sql)[:300],
+        }
+        meta_tmp = self._meta_path(key).with_suffix(f".{os.getpid()}.jtmp")
+        meta_tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(meta_tmp, self._meta_path(key))
+        with self._counter_lock:
+            self.writes += 1
+        self.evict()
+
+    def get_or_compute(
+        self,
+        sql: str,
+        database_name: str,
+        compute: Callable[[], pd.DataFrame],
+        force_refresh: bool = False,
+        variant: str = "",
+        store_if: Optional[Callable[[pd.DataFrame], bool]] = None,
+    ) -> pd.DataFrame:
+        """Hit → DataFrame cacheado. Miss → `compute()` bajo lock y se guarda.
+
+        Con `force_refresh=True` siempre se recalcula y se sobrescribe
+        la entrada. `variant` entra en la clave junto al SQL (p.ej. el
+        modo de exportación: mismo SQL, resultado distinto). Si
+        `store_if(df)` es falso el resultado se devuelve sin guardarlo
+        (p.ej. una respuesta truncada).
+        """
+        key = query_fingerprint(
+            sql, f"{database_name}\0{variant}" if variant else database_name
+        )
+        if not force_refresh:
+            df = self.get(key)
+            if df is not None:
+                self._count_hit()
+                return df
+
+        lock = FileLock(self._base(key).with_suffix(".lock"), stale_after=3 * 3600)
+        with lock:
+            # Otro proceso puede haberla calculado mientras esperábamos.
+            if not force_refresh:
+                df = self.get(key)
+                if df is not None:
+                    self._count_hit()
+                    return df
+            with self._counter_lock:
+                self.misses += 1
+            df = compute()
+            if store_if is None or store_if(df):
+                self.put(key, df, sql=sql)
+        return df
+
+    def _count_hit(self) -> None:
+        with self._counter_lock:
+            self.hits += 1
+
+    # ------------------------------------------------------------------
+    # Mantenimiento
+    # ------------------------------------------------------------------
+    def _entries(self) -> list[tuple[float, int, str]]:
+        """(último uso, bytes, clave) de cada entrada con datos en disco."""
+        entries = []
+        if not self.root.exists():
+            return entries
+        for path in self.root.glob("*/*"):
+            if path.suffix not in (".parquet", ".pkl"):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path.stem))
+        return entries
+
+    def total_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def remove(self, key: str) -> None:
+        for path in [*self._data_paths(key), self._meta_path(key)]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def evict(self) -> int:
+        """Borra entradas LRU hasta quedar por debajo de `max_bytes`."""
+        if self.max_bytes is None:
+            return 0
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        with FileLock(self.root / ".evict.lock", stale_after=600):
+            for _, size, key in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self.remove(key)
+                total -= size
+                removed += 1
+        with self._counter_lock:
+            self.evictions += removed
+        return removed
+
+    def clear(self) -> None:
+        for _, _, key in self._entries():
+            self.remove(key)
+
+    def stats(self) -> dict:
+        """Contadores del proceso + tamaño actual de la cache."""
+        with self._counter_lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "bytes_on_disk": self.total_bytes(),
+            }
+
+
+_DEFAULT_CACHE: Optional[QueryCache] = None
+
+
+def get_default_cache() -> QueryCache:
+    """Cache compartida del proceso bajo `output/_query_cache/`."""
+    global _DEFAULT_CACHE
+    if _DEFAULT_CACHE is None:
+        _DEFAULT_CACHE = QueryCache()
+    return _DEFAULT_CACHE
+
+
+def cache_enabled_by_env() -> bool:
+    return os.getenv("INDICADORS_QUERY_CACHE", "").strip().lower() in {"1", "true", "yes"}
+
+
+__all__ = [
+    "DEFAULT_CACHE_DIR",
+    "QueryCache",
+    "cache_enabled_by_env",
+    "get_default_cache",
+    "normalize_sql",
+    "query_fingerprint",
+]
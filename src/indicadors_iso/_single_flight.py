@@ -0,0 +1,152 @@
+"""Deduplicación en proceso de queries idénticas ("single-flight").
+
+Si varios hilos piden la misma clave a la vez, solo el primero ejecuta;
+el resto espera y recibe el mismo resultado (o la misma excepción).
+
+Conservar el resultado una vez terminada es opt-in (`memoize=True`): se
+guarda en memoria (LRU acotada por bytes y con caducidad `memo_ttl_s`)
+y las peticiones repetidas dentro del mismo proceso no vuelven a
+Metabase: p.ej. `per_unit` y `predominant_unit` cargando las mismas
+cohortes de nutrición / autopsia en una misma ejecución.
+
+Cada llamante recibe su propia copia del DataFrame, de modo que las
+mutaciones in-place aguas abajo (`fillna`, columnas nuevas…) no se
+propagan a otros.
+
+Los errores no se memorizan: la siguiente petición vuelve a ejecutar.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import pandas as pd
+
+DEFAULT_MEMO_MAX_BYTES = 1024**3
+DEFAULT_MEMO_TTL_S = 15 * 60
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[pd.DataFrame] = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Ver docstring del módulo."""
+
+    def __init__(
+        self,
+        memo_max_bytes: Optional[int] = DEFAULT_MEMO_MAX_BYTES,
+        memo_ttl_s: Optional[float] = DEFAULT_MEMO_TTL_S,
+    ):
+        self.memo_max_bytes = memo_max_bytes
+        self.memo_ttl_s = memo_ttl_s
+        self._lock = threading.Lock()
+        self._inflight: dict[str, _Call] = {}
+        # clave -> (df, bytes, instante en que se guardó)
+        self._memo: OrderedDict[str, tuple[pd.DataFrame, int, float]] = OrderedDict()
+        self._memo_bytes = 0
+        self.executions = 0
+        self.shared_inflight = 0
+        self.memo_hits = 0
+
+    def run(
+        self,
+        key: str,
+        fn: Callable[[], pd.DataFrame],
+        force: bool = False,
+        memoize: bool = False,
+    ) -> tuple[pd.DataFrame, Optional[str]]:
+        """Devuelve `(df, origen)`; origen es None (ejecutado aquí),
+        "inflight" (compartido con una ejecución en curso) o "memo".
+
+        Solo con `memoize=True` se consulta la memoria y se guarda el
+        resultado al terminar. Con `force=True` se ignora la memoria
+        (pero se sigue compartiendo una ejecución ya en curso) y el
+        resultado la sobrescribe si `memoize`.
+        """
+        with self._lock:
+            if memoize and not force and key in self._memo:
+                df, size, stored_at = self._memo[key]
+                if self._expired(stored_at):
+                    del self._memo[key]
+                    self._memo_bytes -= size
+                else:
+                    self._memo.move_to_end(key)
+                    self.memo_hits += 1
+                    return df.copy(), "memo"
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+                self.executions += 1
+            else:
+                self.shared_inflight += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result.copy(), "inflight"
+
+        try:
+            df = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        else:
+            call.result = df
+            if memoize:
+                self._remember(key, df)
+            return df.copy(), None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.memo_ttl_s is not None and time.monotonic() - stored_at > self.memo_ttl_s
+
+    def _remember(self, key: str, df: pd.DataFrame) -> None:
+        if self.memo_max_bytes is None or self.memo_max_bytes <= 0:
+            return
+        # `deep=True`: las columnas de texto (object) pesan mucho más que
+        # los punteros que cuenta `deep=False`.
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.memo_max_bytes:
+            return
+        with self._lock:
+            if key in self._memo:
+                self._memo_bytes -= self._memo.pop(key)[1]
+            self._memo[key] = (df, size, time.monotonic())
+            self._memo_bytes += size
+            while self._memo_bytes > self.memo_max_bytes:
+                _, (_, old_size, _) = self._memo.popitem(last=False)
+                self._memo_bytes -= old_size
+
+    def clear(self) -> None:
+        """Vacía la memoria (no afecta a ejecuciones en curso)."""
+        with self._lock:
+            self._memo.clear()
+            self._memo_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executions": self.executions,
+                "shared_inflight": self.shared_inflight,
+                "memo_hits": self.memo_hits,
+                "saved": self.shared_inflight + self.memo_hits,
+                "memo_entries": len(self._memo),
+                "memo_bytes": self._memo_bytes,
+            }
+
+
+__all__ = ["SingleFlight"]
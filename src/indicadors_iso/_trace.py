@@ -0,0 +1,50 @@
+"""Escritura de la traza JSONL por query (ver `indicadors_iso.trace`).
+
+Módulo aparte del CLI para que `connection.py` lo importe sin cargar
+`indicadors_iso.trace` (así `python -m indicadors_iso.trace` no lo
+encuentra ya importado).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from indicadors_iso._paths import OUTPUT_DIR
+
+TRACE_DIR = OUTPUT_DIR / "_traces"
+
+_WRITE_LOCK = threading.Lock()
+
+
+def trace_path() -> Optional[Path]:
+    """Fichero de traza activo, o None si está desactivada."""
+    setting = os.getenv("INDICADORS_TRACE", "").strip()
+    if setting.lower() in {"0", "false", "no", "off"}:
+        return None
+    if setting and setting.lower() not in {"1", "true", "yes", "on"}:
+        return Path(setting)
+    return TRACE_DIR / f"{datetime.now():%Y-%m-%d}.jsonl"
+
+
+def write_event(event: dict) -> None:
+    """Añade `event` como una línea JSON. Nunca interrumpe la query."""
+    path = trace_path()
+    if path is None:
+        return
+    line = json.dumps(event, default=str, ensure_ascii=False) + "\n"
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Una sola escritura en modo append por línea: varios procesos
+        # pueden compartir el fichero sin intercalar registros.
+        with _WRITE_LOCK, open(path, "a", encoding="utf-8") as fh:
+            fh.write(line)
+    except OSError:
+        pass
+
+
+__all__ = ["TRACE_DIR", "trace_path", "write_event"]
@@ -0,0 +1,88 @@
+"""Almacén local de resultados anuales para la sincronización incremental.
+
+Cada año de una query anual (`connection.execute_query_yearly_incremental`)
+se guarda como una partición independiente junto con su huella: hash del
+SQL de ese año + la marca de agua (`watermark`) que devolvió la query de
+sondeo (p.ej. nº de filas y `max(load_date)` de `movements` de ese año).
+En la siguiente ejecución, un año cuya huella no ha cambiado se lee de
+disco en lugar de volver a Metabase.
+
+Layout bajo `output/_yearly_store/<name>/`:
+
+    manifest.json          {año: {fingerprint, watermark, rows, synced_at}}
+    <k[:2]>/<k>.parquet    datos de cada año (formato de `QueryCache`)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from indicadors_iso._filelock import FileLock
+from indicadors_iso._paths import OUTPUT_DIR
+from indicadors_iso._query_cache import QueryCache
+
+DEFAULT_STORE_DIR = OUTPUT_DIR / "_yearly_store"
+
+
+class YearlyStore:
+    """Particiones anuales + manifiesto de huellas. Ver docstring del módulo."""
+
+    def __init__(self, name: str, root: Optional[Path] = None):
+        self.name = name
+        self.dir = Path(root if root is not None else DEFAULT_STORE_DIR) / name
+        # Sin TTL ni límite de tamaño: la validez la decide la huella.
+        self._data = QueryCache(root=self.dir, ttl_s=None, max_bytes=None)
+        self.manifest_path = self.dir / "manifest.json"
+
+    @staticmethod
+    def _key(year: int) -> str:
+        return f"year_{int(year)}"
+
+    def manifest(self) -> dict:
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def get(
+        self, year: int, fingerprint: str, max_age_s: Optional[float] = None
+    ) -> Optional[pd.DataFrame]:
+        """Partición de `year` si su huella coincide y no es más antigua que
+        `max_age_s`; None en otro caso."""
+        entry = self.manifest().get(str(year))
+        if entry is None or entry.get("fingerprint") != fingerprint:
+            return None
+        if max_age_s is not None and time.time() - entry.get("synced_at", 0) > max_age_s:
+            return None
+        return self._data.get(self._key(year))
+
+    def put(self, year: int, df: pd.DataFrame, fingerprint: str, watermark: dict) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._data.put(self._key(year), df)
+        with FileLock(self.dir / "manifest.lock", stale_after=600):
+            manifest = self.manifest()
+            manifest[str(year)] = {
+                "fingerprint": fingerprint,
+                "watermark": watermark,
+                "rows": int(len(df)),
+                "synced_at": time.time(),
+            }
+            tmp = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+            os.replace(tmp, self.manifest_path)
+
+    def clear(self) -> None:
+        self._data.clear()
+        try:
+            self.manifest_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+__all__ = ["DEFAULT_STORE_DIR", "YearlyStore"]
@@ -1,11 +1,40 @@
 # connection.py - Conexión vía API de Metabase
+import hashlib
+import json
+import numbers
 import os
+import random
+import re
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
 import pandas as pd
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from indicadors_iso._governor import DEFAULT_MAX_CONCURRENT, ConcurrencyGovernor
+from indicadors_iso._paths import OUTPUT_DIR
+from indicadors_iso._query_cache import (
+    cache_enabled_by_env,
+    get_default_cache,
+    normalize_sql,
+    query_fingerprint,
+)
+from indicadors_iso._single_flight import SingleFlight
+from indicadors_iso._trace import write_event
+from indicadors_iso._yearly_store import YearlyStore
+
+# Tope silencioso del backend Metabase. Si una query devuelve >= 2000 filas,
+# la respuesta queda truncada sin error. `execute_query` relanza
+# entonces la query por el endpoint de exportación (sin tope); los
+# helpers por año / por rango avisan al acercarse.
+METABASE_SILENT_ROW_CAP = 2000
+
 
 _ENV_PATH_CACHE = None
 
@@ -69,94 +98,925 @@ def _load_metabase_config():
     }
 
 
+# Estado persistido entre lanzamientos (token de sesión + mapa de bases).
+# Vive fuera del repo (contiene un token válido) y se invalida solo:
+# Metabase mantiene las sesiones 14 días por defecto, nosotros somos
+# más conservadores. Si el token caduca antes, el 401 fuerza re-login.
+_STATE_DIR = Path.home() / ".cache" / "indicadors_iso"
+SESSION_STATE_TTL_S = 12 * 3600
+DB_MAP_STATE_TTL_S = 24 * 3600
+
+# Exportación sin tope (`/api/dataset/csv`): tamaño de bloque al volcar
+# la respuesta a disco, filas por lote al parsear y timeout de lectura
+# (una exportación grande tarda bastante más que /api/dataset).
+EXPORT_CHUNK_BYTES = 1024 * 1024
+EXPORT_PARSE_ROWS = 200_000
+EXPORT_READ_TIMEOUT_S = 900
+
+# Reintentos ante fallos transitorios (gateway, throttling, red). Espera
+# exponencial con jitter completo: uniforme en [0, min(max, base·2^n)].
+# Un `Retry-After` numérico del servidor tiene prioridad.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE_S = 1.0
+DEFAULT_BACKOFF_MAX_S = 60.0
+# Sondeo de respuestas 202 sin resultado (ver `_resolve_async`).
+ASYNC_POLL_TIMEOUT_S = 30 * 60
+
+# Límite de queries simultáneas en todo el host (ver `_governor.py`).
+# Se ajusta con `INDICADORS_MAX_CONCURRENT_QUERIES` (0 = sin límite).
+MAX_CONCURRENT_ENV = "INDICADORS_MAX_CONCURRENT_QUERIES"
+_GOVERNOR_DIR = _STATE_DIR / "governor"
+
+
+class MetabaseClient:
+    """Cliente persistente de la API de Metabase.
+
+    Reutiliza una única `requests.Session` (pool de conexiones keep-alive,
+    un solo handshake TCP/TLS por host), el token de sesión y el mapa
+    `{database_name: database_id}` entre queries. Ambos se guardan
+    también en disco con caducidad para que lanzamientos consecutivos de
+    scripts no repitan `/api/session` ni `/api/database`.
+
+    Solo se vuelve a autenticar cuando Metabase responde 401.
+
+    Los 429/5xx y los errores de conexión se reintentan hasta
+    `max_retries` veces con espera exponencial + jitter; cada intento
+    (estado, duración, error) queda en `last_attempts()`.
+
+    Uso típico (los scripts no lo necesitan: `execute_query` ya usa el
+    cliente compartido de `get_client()`):
+
+        client = MetabaseClient.from_env()
+        df = client.execute_query("SELECT 1 AS x")
+    """
+
+    def __init__(
+        self,
+        metabase_url,
+        email,
+        password,
+        database_name,
+        *,
+        state_path=None,
+        persist_state=True,
+        pool_maxsize=8,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff_base_s=DEFAULT_BACKOFF_BASE_S,
+        backoff_max_s=DEFAULT_BACKOFF_MAX_S,
+    ):
+        self.metabase_url = metabase_url.rstrip("/")
+        self.email = email
+        self.password = password
+        self.database_name = database_name
+        self.persist_state = persist_state
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.total_retries = 0
+        # Intentos de la última petición lógica, por hilo (los helpers
+        # por año / por rango lanzan queries desde un pool).
+        self._attempts = threading.local()
+
+        if state_path is None:
+            # Un fichero por (url, usuario): cambiar de cuenta o de
+            # servidor no reutiliza un token ajeno.
+            tag = hashlib.sha256(
+                f"{self.metabase_url}|{self.email}".encode("utf-8")
+            ).hexdigest()[:16]
+            state_path = _STATE_DIR / f"metabase_state_{tag}.json"
+        self.state_path = Path(state_path)
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize
+        )
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+
+        self._lock = threading.RLock()
+        self._session_id = None
+        self._session_ts = 0.0
+        self._db_map = None
+        self._db_map_ts = 0.0
+        self._load_state()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Construye el cliente con la configuración del .env de OneDrive."""
+        config = _load_metabase_config()
+        return cls(
+            config["metabase_url"],
+            config["email"],
+            config["password"],
+            config["database_name"],
+            **kwargs,
+        )
+
+    # ------------------------------------------------------------------
+    # Estado persistido
+    # ------------------------------------------------------------------
+    def _load_state(self):
+        if not self.persist_state or not self.state_path.exists():
+            return
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        if now - state.get("session_ts", 0) < SESSION_STATE_TTL_S:
+            self._session_id = state.get("session_id")
+            self._session_ts = state.get("session_ts", 0)
+        if now - state.get("db_map_ts", 0) < DB_MAP_STATE_TTL_S:
+            self._db_map = state.get("db_map")
+            self._db_map_ts = state.get("db_map_ts", 0)
+
+    def _save_state(self):
+        if not self.persist_state:
+            return
+        state = {
+            "session_id": self._session_id,
+            "session_ts": self._session_ts,
+            "db_map": self._db_map,
+            "db_map_ts": self._db_map_ts,
+        }
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.state_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(state), encoding="utf-8")
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, self.state_path)
+        except OSError:
+            # El estado en disco es una optimización: si no se puede
+            # escribir (permisos, disco lleno) seguimos con el de memoria.
+            pass
+
+    def invalidate(self):
+        """Olvida token y mapa de bases (memoria y disco)."""
+        with self._lock:
+            self._session_id = None
+            self._session_ts = 0.0
+            self._db_map = None
+            self._db_map_ts = 0.0
+            self._save_state()
+
+    # ------------------------------------------------------------------
+    # Autenticación y mapa de bases
+    # ------------------------------------------------------------------
+    def authenticate(self):
+        """Fuerza un login en `/api/session` y devuelve el session_id."""
+        response = self._send(
+            "POST",
+            "/api/session",
+            json={"username": self.email, "password": self.password},
+            timeout=60,
+        )
+        response.raise_for_status()
+
+        session_id = response.json().get("id")
+        if not session_id:
+            raise ValueError("No se pudo obtener session_id desde /api/session.")
+        with self._lock:
+            self._session_id = session_id
+            self._session_ts = time.time()
+            self._save_state()
+        return session_id
+
+    @property
+    def session_id(self):
+        """Token vigente; se autentica solo si no hay ninguno en caché."""
+        with self._lock:
+            if self._session_id is None:
+                self.authenticate()
+            return self._session_id
+
+    def _send(self, method, path, session_id=None, **kwargs):
+        """Una petición HTTP con reintentos ante 429/5xx y errores de red.
+
+        Devuelve la última respuesta (que puede seguir siendo un 5xx si
+        se agotan los reintentos; el llamante decide). Un error de
+        conexión en el último intento se propaga.
+        """
+        url = f"{self.metabase_url}{path}"
+        if session_id is not None:
+            kwargs["headers"] = {"X-Metabase-Session": session_id}
+        attempts = self._attempts.log = []
+        for attempt in range(self.max_retries + 1):
+            t0 = time.monotonic()
+            record = {"path": path, "attempt": attempt}
+            try:
+                response = self.http.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                record.update(elapsed_s=time.monotonic() - t0, error=type(exc).__name__)
+                attempts.append(record)
+                if attempt == self.max_retries:
+                    raise
+                self._backoff(attempt, path, type(exc).__name__)
+                continue
+            record.update(elapsed_s=time.monotonic() - t0, status=response.status_code)
+            attempts.append(record)
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            self._backoff(attempt, path, response.status_code, retry_after)
+        return response
+
+    def _backoff(self, attempt, path, reason, retry_after=None):
+        delay = random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * 2 ** attempt))
+        if retry_after is not None:
+            try:
+                delay = min(self.backoff_max_s, float(retry_after))
+            except ValueError:
+                pass
+        with self._lock:
+            self.total_retries += 1
+        self._attempts.retries = getattr(self._attempts, "retries", 0) + 1
+        print(
+            f"  ↻ {path}: {reason} — reintento {attempt + 1}/{self.max_retries} "
+            f"en {delay:.1f}s"
+        )
+        time.sleep(delay)
+
+    def last_attempts(self):
+        """Intentos (path, attempt, status/error, elapsed_s) de la última
+        petición lógica de este hilo, incluidos los re-login."""
+        return list(getattr(self._attempts, "request_log", []))
+
+    def _request(self, method, path, **kwargs):
+        """Petición autenticada con reintentos (`_send`).
+
+        Ante un 401 re-autentica y reintenta una vez.
+        """
+        session_id = self.session_id
+        response = self._send(method, path, session_id=session_id, **kwargs)
+        log = list(self._attempts.log)
+        if response.status_code == 401:
+            with self._lock:
+                # Otro hilo puede haber renovado el token mientras tanto.
+                if self._session_id == session_id:
+                    self.authenticate()
+                    log.extend(self._attempts.log)
+                session_id = self._session_id
+            response.close()
+            response = self._send(method, path, session_id=session_id, **kwargs)
+            log.extend(self._attempts.log)
+        self._attempts.request_log = log
+        return response
+
+    def map_databases(self, refresh=False):
+        """Devuelve `{database_name: database_id}`, cacheado salvo `refresh`."""
+        with self._lock:
+            if self._db_map is not None and not refresh:
+                return self._db_map
+        response = self._request("GET", "/api/database", timeout=30)
+        response.raise_for_status()
+
+        data = response.json().get("data", [])
+        db_map = {d["name"]: d["id"] for d in data if "name" in d and "id" in d}
+        with self._lock:
+            self._db_map = db_map
+            self._db_map_ts = time.time()
+            self._save_state()
+        return db_map
+
+    def database_id(self):
+        """ID de `database_name`; refresca el mapa una vez si no aparece."""
+        db_map = self.map_databases()
+        if self.database_name not in db_map:
+            db_map = self.map_databases(refresh=True)
+        if self.database_name not in db_map:
+            available = ", ".join(sorted(db_map.keys()))
+            raise ValueError(
+                f"No existe la base '{self.database_name}' en Metabase. "
+                f"Disponibles: {available}"
+            )
+        return db_map[self.database_name]
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def run_dataset(self, query):
+        """POST `/api/dataset` con SQL nativo; devuelve el JSON de respuesta.
+
+        Metabase contesta 202 en cuanto acepta la query y luego vuelca el
+        resultado en el mismo cuerpo, así que un 202 no implica éxito:
+        ver `_resolve_async`.
+        """
+        payload = {**self._native_payload(query), "cache_ttl": 0}
+        response = self._request("POST", "/api/dataset", json=payload, timeout=120)
+
+        if response.status_code not in (200, 202):
+            try:
+                detail = response.json()
+            except ValueError:
+                detail = response.text
+            raise RuntimeError(f"Error query request ({response.status_code}): {detail}")
+        self._attempts.payload_bytes = len(response.content)
+        result = response.json()
+        if response.status_code == 202:
+            result = self._resolve_async(response, result)
+        return result
+
+    def _resolve_async(self, response, result):
+        """Completa una respuesta 202 de `/api/dataset`.
+
+        - `status: "failed"` en el cuerpo → RuntimeError con el error de
+          Metabase (error de SQL / Athena; no se reintenta).
+        - Cuerpo con `data` → resultado final.
+        - Sin `data` pero con cabecera `Location` (proxies que devuelven
+          la query como trabajo asíncrono) → se sondea esa URL con espera
+          creciente hasta obtener el resultado o `ASYNC_POLL_TIMEOUT_S`.
+        """
+        if result.get("status") == "failed" or result.get("error"):
+            raise RuntimeError(f"Error query request (202 failed): {result.get('error')}")
+        if "data" in result:
+            return result
+        location = response.headers.get("Location")
+        if not location:
+            raise RuntimeError("Respuesta 202 de /api/dataset sin resultado ni Location.")
+        if location.startswith(self.metabase_url):
+            location = location[len(self.metabase_url):]
+        deadline = time.monotonic() + ASYNC_POLL_TIMEOUT_S
+        delay = self.backoff_base_s
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            poll = self._request("GET", location, timeout=120)
+            if poll.status_code not in (200, 202):
+                raise RuntimeError(f"Error polling {location} ({poll.status_code}): {poll.text[:500]}")
+            result = poll.json()
+            if result.get("status") == "failed" or result.get("error"):
+                raise RuntimeError(f"Error query request (202 failed): {result.get('error')}")
+            if "data" in result:
+                return result
+            delay = min(self.backoff_max_s, delay * 2)
+        raise TimeoutError(f"La query no terminó en {ASYNC_POLL_TIMEOUT_S}s ({location}).")
+
+    def _native_payload(self, query):
+        return {
+            "database": self.database_id(),
+            "type": "native",
+            "native": {"query": query},
+        }
+
+    def export_csv(self, query, cols=None, chunk_bytes=EXPORT_CHUNK_BYTES,
+                   parse_rows=EXPORT_PARSE_ROWS):
+        """Ejecuta `query` por `/api/dataset/csv`, que no aplica el tope.
+
+        La respuesta se vuelca en streaming a un fichero temporal en
+        bloques de `chunk_bytes` (nunca está entera en memoria como
+        texto) y se parsea por lotes de `parse_rows` filas. Si se pasan
+        los `cols` de una respuesta previa de `/api/dataset`, cada lote
+        se tipa igual que en `metabase_response_to_frame`; sin ellos las
+        columnas quedan como texto.
+
+        Se pide `format_rows=false` para recibir valores crudos (ISO
+        8601, sin separadores de miles) en lugar del formato de la UI.
+        """
+        form = {
+            "query": json.dumps(self._native_payload(query)),
+            "format_rows": "false",
+        }
+        response = self._request(
+            "POST",
+            "/api/dataset/csv",
+            data=form,
+            stream=True,
+            timeout=(30, EXPORT_READ_TIMEOUT_S),
+        )
+        if response.status_code != 200:
+            detail = response.text[:500]
+            response.close()
+            raise RuntimeError(f"Error export request ({response.status_code}): {detail}")
+
+        fd, tmp_name = tempfile.mkstemp(prefix="metabase_export_", suffix=".csv")
+        n_bytes = 0
+        try:
+            with os.fdopen(fd, "wb") as fh, response:
+                for block in response.iter_content(chunk_size=chunk_bytes):
+                    if block:
+                        fh.write(block)
+                        n_bytes += len(block)
+            self._attempts.payload_bytes = n_bytes
+            return _read_export_csv(tmp_name, cols, parse_rows)
+        finally:
+            try:
+                os.remove(tmp_name)
+            except OSError:
+                pass
+
+    def execute_query(self, query, verbose=True, export="auto"):
+        """Ejecuta SQL nativo en Metabase y devuelve un DataFrame de pandas.
+
+        `export`:
+            "auto" (por defecto) → `/api/dataset`; si la respuesta llega
+                con >= `METABASE_SILENT_ROW_CAP` filas (truncada), se
+                relanza por `/api/dataset/csv` y se devuelve completa.
+                Si la exportación falla (p.ej. sin permiso de descarga)
+                se avisa y se devuelve el resultado truncado.
+            "csv" → directamente por exportación CSV.
+            False → solo `/api/dataset` (comportamiento con tope).
+
+        Con "auto", una query cuyo `LIMIT` final ya es <=
+        `METABASE_SILENT_ROW_CAP` no se relanza: sus 2000 filas son el
+        resultado completo (ver `explicit_row_limit`).
+        """
+        if verbose:
+            print("Ejecutando query...")
+
+        start = time.perf_counter()
+        self._attempts.retries = 0
+        self._attempts.payload_bytes = 0
+        stats = self._attempts.query_stats = {}
+        # Login y mapa de bases por separado para poder atribuir la
+        # latencia (ambos son ~0 s cuando vienen de la caché).
+        t0 = time.perf_counter()
+        _ = self.session_id
+        stats["auth_s"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        self.database_id()
+        stats["db_map_s"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        if export == "csv":
+            df = self.export_csv(query)
+            stats["export_s"] = time.perf_counter() - t0
+        else:
+            response_json = self.run_dataset(query)
+            stats["dataset_s"] = time.perf_counter() - t0
+            stats["running_time_ms"] = response_json.get("running_time")
+            t0 = time.perf_counter()
+            df = metabase_response_to_frame(response_json)
+            stats["parse_s"] = time.perf_counter() - t0
+            if (
+                export == "auto"
+                and len(df) >= METABASE_SILENT_ROW_CAP
+                and not _limited_below_cap(query)
+            ):
+                if verbose:
+                    print(
+                        f"  ↪ {len(df)} filas (tope silencioso) — relanzando vía "
+                        "/api/dataset/csv…"
+                    )
+                cols = response_json.get("data", {}).get("cols")
+                t0 = time.perf_counter()
+                try:
+                    df = self.export_csv(query, cols=cols)
+                    stats["exported"] = True
+                except (RuntimeError, requests.RequestException) as exc:
+                    print(f"  ⚠️  exportación fallida ({exc}); resultado truncado.")
+                stats["export_s"] = time.perf_counter() - t0
+
+        stats["payload_bytes"] = self._attempts.payload_bytes
+        stats["retries"] = self._attempts.retries
+        stats["rows"] = len(df)
+        if verbose:
+            print(f"Éxito en {time.perf_counter() - start:.2f}s ({len(df)} filas)")
+        return df
+
+    def last_query_stats(self):
+        """Desglose de la última `execute_query` de este hilo.
+
+        Claves: auth_s, db_map_s, dataset_s, parse_s, export_s (si hubo
+        exportación), running_time_ms (el que reporta Metabase),
+        payload_bytes, retries, rows.
+        """
+        return dict(getattr(self._attempts, "query_stats", {}))
+
+    def close(self):
+        self.http.close()
+
+
+_TRAILING_LIMIT_RE = re.compile(
+    r"\blimit\s+(\d+)(?:\s+offset\s+\d+)?\s*;?\s*$", re.IGNORECASE
+)
+
+
+def explicit_row_limit(query):
+    """`n` del `LIMIT n` con el que termina la query, o None.
+
+    Solo cuenta el LIMIT final (el de la SELECT exterior); uno dentro de
+    una subquery o CTE no acota el resultado.
+    """
+    match = _TRAILING_LIMIT_RE.search(normalize_sql(query))
+    return int(match.group(1)) if match else None
+
+
+def _limited_below_cap(query):
+    limit = explicit_row_limit(query)
+    return limit is not None and limit <= METABASE_SILENT_ROW_CAP
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client():
+    """Cliente compartido del proceso (se construye en la primera llamada)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = MetabaseClient.from_env()
+        return _CLIENT
+
+
+def set_client(client):
+    """Sustituye el cliente compartido (p.ej. apuntando a otro servidor)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        _CLIENT = client
+
+
 def authenticate():
     """Autentica contra Metabase y devuelve el session_id."""
-    config = _load_metabase_config()
-    response = requests.post(
-        f"{config['metabase_url']}/api/session",
-        json={"username": config["email"], "password": config["password"]},
-        timeout=60,
-    )
-    response.raise_for_status()
+    return get_client().authenticate()
 
-    session_id = response.json().get("id")
-    if not session_id:
-        raise ValueError("No se pudo obtener session_id desde /api/session.")
-    return session_id
 
+def map_databases(session_id=None):
+    """Devuelve un diccionario {database_name: database_id} de Metabase.
 
-def map_databases(session_id):
-    """Devuelve un diccionario {database_name: database_id} de Metabase."""
-    config = _load_metabase_config()
-    response = requests.get(
-        f"{config['metabase_url']}/api/database",
-        headers={"X-Metabase-Session": session_id},
-        timeout=30,
-    )
-    response.raise_for_status()
-
-    data = response.json().get("data", [])
-    return {d["name"]: d["id"] for d in data if "name" in d and "id" in d}
+    `session_id` se conserva por compatibilidad: el cliente compartido
+    gestiona ya su propio token.
+    """
+    return get_client().map_databases()
 
 
 def parse_metabase_response(response_json):
-    """Convierte la respuesta de /api/dataset a lista de diccionarios por fila."""
+    """Convierte la respuesta de /api/dataset a lista de diccionarios por fila.
+
+    Se mantiene por compatibilidad; `execute_query` usa
+    `metabase_response_to_frame`, que no crea un dict por fila.
+    """
     data = response_json.get("data", {})
     cols = [c["name"] for c in data.get("cols", [])]
     rows = data.get("rows", [])
     return [dict(zip(cols, row)) for row in rows]
 
-def execute_query(query, verbose=True):
-    """Ejecuta SQL nativo en Metabase y devuelve un DataFrame de pandas."""
-    if verbose:
-        print("Ejecutando query...")
 
-    start = time.time()
-    config = _load_metabase_config()
+# `base_type` / `effective_type` de Metabase → familia de dtype pandas.
+_INT_TYPES = {"type/Integer", "type/BigInteger"}
+_FLOAT_TYPES = {"type/Float", "type/Decimal", "type/Number"}
+_BOOL_TYPES = {"type/Boolean"}
+_DATETIME_TYPES = {
+    "type/DateTime",
+    "type/DateTimeWithTZ",
+    "type/DateTimeWithLocalTZ",
+    "type/DateTimeWithZoneOffset",
+    "type/DateTimeWithZoneID",
+    "type/Instant",
+}
+_DATE_TYPES = {"type/Date"}
+# Zona del hospital (igual que `demographics._stays_sql.DB_TIMEZONE`).
+DB_TIMEZONE = "Europe/Madrid"
 
-    session_id = authenticate()
-    db_map = map_databases(session_id)
-    database_name = config["database_name"]
 
-    if database_name not in db_map:
-        available = ", ".join(sorted(db_map.keys()))
-        raise ValueError(
-            f"No existe la base '{database_name}' en Metabase. Disponibles: {available}"
+def _typed_column(values, metabase_type):
+    """Convierte la tupla de valores de una columna al dtype que le toca.
+
+    - Enteros → `int64`, o `Int64` (nullable) si hay NULLs.
+    - Decimales → `float64`.
+    - Booleanos → `boolean` (nullable).
+    - Timestamps → `datetime64[ns, Europe/Madrid]` (Metabase los
+      devuelve en ISO con el offset CET/CEST de la zona del informe).
+      Se mantiene la hora local del hospital: `.dt.year` / `.dt.month`
+      y los CSV exportados dan la misma fecha de calendario que el
+      texto original (`2024-01-01 00:30:00+01:00`, no `2023-12-31
+      23:30:00+00:00`).
+    - `type/Date` → `datetime64` naive a medianoche (sin zona: es una
+      fecha de calendario, no un instante).
+    - Texto y tipos no reconocidos → `object`, tal cual.
+
+    Si los valores no encajan con el tipo declarado (p.ej. un BigInteger
+    serializado como string no numérico) se devuelve `object` sin
+    perder datos.
+    """
+    if metabase_type in _INT_TYPES:
+        try:
+            arr = pd.array(values, dtype="Int64")
+        except (TypeError, ValueError):
+            try:
+                arr = pd.array(
+                    pd.to_numeric(pd.Series(values, dtype=object)), dtype="Int64"
+                )
+            except (TypeError, ValueError):
+                return pd.array(values, dtype=object)
+        return arr if arr.isna().any() else arr.to_numpy(dtype="int64")
+    if metabase_type in _FLOAT_TYPES:
+        try:
+            return pd.to_numeric(pd.Series(values, dtype=object)).to_numpy(dtype="float64")
+        except (TypeError, ValueError):
+            return pd.array(values, dtype=object)
+    if metabase_type in _BOOL_TYPES:
+        try:
+            return pd.array(values, dtype="boolean")
+        except (TypeError, ValueError):
+            return pd.array(values, dtype=object)
+    if metabase_type in _DATETIME_TYPES:
+        return (
+            pd.to_datetime(
+                pd.Series(values, dtype=object), utc=True, errors="coerce", format="ISO8601"
+            )
+            .dt.tz_convert(DB_TIMEZONE)
+            .array
         )
+    if metabase_type in _DATE_TYPES:
+        return pd.to_datetime(
+            pd.Series(values, dtype=object).str[:10], errors="coerce", format="%Y-%m-%d"
+        ).array
+    return pd.array(values, dtype=object)
 
-    payload = {
-        "database": db_map[database_name],
-        "type": "native",
-        "native": {"query": query},
-        "cache_ttl": 0,
-    }
 
-    response = requests.post(
-        f"{config['metabase_url']}/api/dataset",
-        headers={"X-Metabase-Session": session_id},
-        json=payload,
-        timeout=120,
-    )
+def metabase_response_to_frame(response_json):
+    """Convierte la respuesta de /api/dataset en un DataFrame ya tipado.
 
-    if response.status_code not in (200, 202):
+    Transpone `rows` a columnas (`zip(*rows)`) en lugar de crear un dict
+    por fila, y asigna a cada columna el dtype derivado del
+    `effective_type` (o `base_type`) que Metabase devuelve en `cols`.
+    Así los loaders no tienen que re-inferir ni volver a llamar a
+    `pd.to_numeric` / `pd.to_datetime` sobre los mismos campos.
+    """
+    data = response_json.get("data", {})
+    cols = data.get("cols", [])
+    rows = data.get("rows", [])
+    if not rows:
+        return pd.DataFrame()
+
+    names = [c["name"] for c in cols]
+    columns = zip(*rows)
+    typed = {}
+    for name, col, values in zip(names, cols, columns):
+        metabase_type = col.get("effective_type") or col.get("base_type")
+        typed[name] = _typed_column(values, metabase_type)
+    return pd.DataFrame(typed, copy=False)
+
+
+def _read_export_csv(path, cols=None, parse_rows=EXPORT_PARSE_ROWS):
+    """Parsea por lotes el CSV de `/api/dataset/csv` (ver `export_csv`)."""
+    types = {}
+    if cols:
+        types = {
+            c.get("display_name") or c["name"]: c.get("effective_type") or c.get("base_type")
+            for c in cols
+        }
+        types.update({c["name"]: c.get("effective_type") or c.get("base_type") for c in cols})
+    parts = []
+    try:
+        reader = pd.read_csv(path, dtype=object, chunksize=parse_rows)
+        for chunk in reader:
+            if types:
+                for name in chunk.columns:
+                    metabase_type = types.get(name)
+                    if metabase_type in _BOOL_TYPES:
+                        values = chunk[name].str.lower().map({"true": True, "false": False})
+                        chunk[name] = pd.array(values, dtype="boolean")
+                    elif metabase_type is not None:
+                        values = tuple(None if pd.isna(v) else v for v in chunk[name])
+                        chunk[name] = _typed_column(values, metabase_type)
+            parts.append(chunk)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+    if not parts:
+        return pd.DataFrame()
+    if cols:
+        # La cabecera del CSV usa el display_name; volvemos al nombre SQL.
+        rename = {c.get("display_name"): c["name"] for c in cols if c.get("display_name")}
+        parts = [p.rename(columns=rename) for p in parts]
+    return pd.concat(parts, ignore_index=True)
+
+
+def categorize_text_columns(df, max_unique_ratio=0.5, min_rows=50):
+    """Pasa a `category` las columnas de texto de baja cardinalidad.
+
+    Una columna object se convierte si tiene al menos `min_rows` filas y
+    `nunique / n <= max_unique_ratio` (sexo, unidad, flags 'Yes'/'No'…).
+    Es opt-in (`execute_query(..., categorize=True)`): el código que
+    hace `fillna("")` o asigna valores nuevos sobre esas columnas tiene
+    que contar con que las categorías son cerradas.
+    """
+    if len(df) < min_rows:
+        return df
+    for name in df.columns:
+        col = df[name]
+        if not pd.api.types.is_string_dtype(col.dtype):
+            continue
+        non_null = col.dropna()
+        if non_null.empty or not all(isinstance(v, str) for v in non_null.iloc[:100]):
+            continue
+        if col.nunique(dropna=True) <= max_unique_ratio * len(col):
+            df[name] = col.astype("category")
+    return df
+
+
+def execute_query(
+    query,
+    verbose=True,
+    *,
+    client=None,
+    cache=None,
+    force_refresh=False,
+    categorize=False,
+    export="auto",
+    label=None,
+    dedup=True,
+    memoize=False,
+):
+    """Ejecuta SQL nativo en Metabase y devuelve un DataFrame de pandas.
+
+    Las columnas llegan ya tipadas según los metadatos de Metabase (ver
+    `metabase_response_to_frame`).
+
+    Delegado fino sobre `MetabaseClient.execute_query`: por defecto usa
+    el cliente compartido del proceso (`get_client()`), de modo que el
+    token, el mapa de bases y las conexiones HTTP se reutilizan.
+
+    Args:
+        cache: cache de resultados en disco (`_query_cache.QueryCache`).
+            `True` usa la compartida bajo `output/_query_cache/`; None
+            la activa solo si `INDICADORS_QUERY_CACHE=1`; `False` la
+            desactiva aunque esté la variable de entorno. La clave
+            incluye `export`, y un resultado de exactamente
+            `METABASE_SILENT_ROW_CAP` filas no exportado no se guarda
+            (salvo que lo acote el `LIMIT` final de la query).
+        force_refresh: ignora la entrada cacheada, relanza la query y
+            sobrescribe la cache.
+        categorize: si True, convierte a `category` las columnas de
+            texto de baja cardinalidad (`categorize_text_columns`).
+        export: "auto" relanza por `/api/dataset/csv` (sin tope) las
+            respuestas truncadas a `METABASE_SILENT_ROW_CAP` filas;
+            "csv" usa siempre la exportación; False nunca (ver
+            `MetabaseClient.execute_query`).
+        label: etiqueta con la que la query aparece en la traza JSONL
+            (ver `indicadors_iso.trace`).
+        dedup: si True (por defecto), la misma query (SQL normalizado,
+            misma base y modo `export`) pedida a la vez desde varios
+            hilos se ejecuta una sola vez (`single_flight_stats()`).
+        memoize: si True (y `dedup`), el resultado se conserva en
+            memoria del proceso durante `DEFAULT_MEMO_TTL_S` y la misma
+            query repetida más tarde se sirve de ahí. `force_refresh=True`
+            ignora esa memoria.
+
+    Cada query que llega a Metabase ocupa antes un slot del governor de
+    concurrencia del host (`get_governor()`); la espera queda en la
+    traza como `queue_wait_s`.
+    """
+    client = client or get_client()
+    query_cache = _resolve_cache(cache)
+    start = time.perf_counter()
+    fingerprint = query_fingerprint(query, client.database_name)
+    event = {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "pid": os.getpid(),
+        "label": label,
+        "fingerprint": fingerprint[:16],
+        "sql_head": normalize_sql(query)[:160],
+        "cache_hit": query_cache is not None,
+    }
+
+    def compute():
+        event["cache_hit"] = False
         try:
-            detail = response.json()
-        except ValueError:
-            detail = response.text
-        raise RuntimeError(f"Error query request ({response.status_code}): {detail}")
+            with get_governor().slot() as waited:
+                event["queue_wait_s"] = round(waited, 4)
+                return client.execute_query(query, verbose=verbose, export=export)
+        finally:
+            event.update(
+                (k, round(v, 4) if isinstance(v, float) else v)
+                for k, v in client.last_query_stats().items()
+            )
 
-    rows = parse_metabase_response(response.json())
-    df = pd.DataFrame(rows) if rows else pd.DataFrame()
+    def fetch():
+        if query_cache is None:
+            return compute()
+        return query_cache.get_or_compute(
+            query,
+            client.database_name,
+            compute,
+            force_refresh=force_refresh,
+            variant=f"export={export}",
+            store_if=_complete_result,
+        )
+
+    def _complete_result(df):
+        # Una respuesta con exactamente el tope silencioso que no llegó
+        # por exportación (ni la acota un LIMIT) puede estar truncada: no
+        # se guarda.
+        return (
+            len(df) != METABASE_SILENT_ROW_CAP
+            or export == "csv"
+            or bool(event.get("exported"))
+            or _limited_below_cap(query)
+        )
+
+    try:
+        if dedup:
+            key = f"{client.metabase_url}|{export}|{fingerprint}"
+            df, shared = _SINGLE_FLIGHT.run(
+                key, fetch, force=force_refresh, memoize=memoize
+            )
+            if shared:
+                event["cache_hit"] = False
+                event["dedup"] = shared
+        else:
+            df = fetch().copy()
+    except Exception as exc:
+        event["error"] = f"{type(exc).__name__}: {exc}"[:300]
+        raise
+    else:
+        event["rows"] = len(df)
+        event["cap_ratio"] = round(len(df) / METABASE_SILENT_ROW_CAP, 3)
+        event["truncated"] = (
+            len(df) == METABASE_SILENT_ROW_CAP
+            and not event.get("exported")
+            and not _limited_below_cap(query)
+        )
+    finally:
+        event["total_s"] = round(time.perf_counter() - start, 4)
+        write_event(event)
 
-    if verbose:
-        print(f"Éxito en {time.time() - start:.2f}s")
+    if categorize:
+        df = categorize_text_columns(df)
     return df
 
 
-# Tope silencioso del backend Metabase. Si una query devuelve >= 2000 filas,
-# la respuesta queda truncada sin error. Avisamos al acercarnos para que el
-# llamante slicee a granularidad más fina (mes, unidad).
-METABASE_SILENT_ROW_CAP = 2000
+_SINGLE_FLIGHT = SingleFlight()
+
+
+def single_flight_stats():
+    """Contadores de deduplicación del proceso: `executions` (queries
+    realmente lanzadas), `shared_inflight` + `memo_hits` = `saved`."""
+    return _SINGLE_FLIGHT.stats()
+
+
+def clear_single_flight():
+    """Olvida los resultados memorizados por la deduplicación."""
+    _SINGLE_FLIGHT.clear()
+
+
+_GOVERNOR = None
+_GOVERNOR_LOCK = threading.Lock()
+
+
+def get_governor():
+    """Governor de concurrencia compartido por todos los procesos del
+    host. Límite = `INDICADORS_MAX_CONCURRENT_QUERIES` (por defecto
+    `DEFAULT_MAX_CONCURRENT`; 0 lo desactiva)."""
+    global _GOVERNOR
+    with _GOVERNOR_LOCK:
+        if _GOVERNOR is None:
+            raw = os.getenv(MAX_CONCURRENT_ENV, "").strip()
+            try:
+                limit = int(raw) if raw else DEFAULT_MAX_CONCURRENT
+            except ValueError:
+                raise ValueError(
+                    f"{MAX_CONCURRENT_ENV} debe ser un entero (recibido {raw!r})."
+                ) from None
+            _GOVERNOR = ConcurrencyGovernor(limit, _GOVERNOR_DIR)
+        return _GOVERNOR
+
+
+def set_governor(governor):
+    """Sustituye el governor compartido (None = se reconstruye desde el
+    entorno en la siguiente query)."""
+    global _GOVERNOR
+    with _GOVERNOR_LOCK:
+        _GOVERNOR = governor
+
+
+def governor_stats():
+    """Slots pedidos, cuántos tuvieron que esperar y tiempo en cola."""
+    return get_governor().stats()
+
+
+def _resolve_cache(cache):
+    if cache is None:
+        cache = cache_enabled_by_env()
+    if cache is True:
+        return get_default_cache()
+    if cache is False:
+        return None
+    return cache
+
+
+_YEARLY_CHUNK_ADVICE = (
+    "Cortar este año a mayor granularidad (mes / unidad) si esperas más datos."
+)
+
+
+def _report_chunk(label, chunk_label, n, row_warn_threshold, advice=_YEARLY_CHUNK_ADVICE):
+    """Imprime el recuento de un chunk y avisa si roza el tope silencioso.
+
+    `advice` es el consejo que acompaña al aviso; cada llamante da el
+    suyo (la partición adaptativa ya corta sola).
+    """
+    marker = ""
+    if n >= row_warn_threshold:
+        marker = (
+            f"  ⚠️  {n} filas — cerca del tope silencioso "
+            f"({METABASE_SILENT_ROW_CAP})."
+        )
+        if advice:
+            marker += f" {advice}"
+    print(f"  [{label}] {chunk_label}: {n} filas{marker}")
 
 
 def execute_query_yearly(
@@ -167,6 +1027,13 @@ def execute_query_yearly(
     label="query",
     row_warn_threshold=METABASE_SILENT_ROW_CAP - 100,
     verbose=False,
+    client=None,
+    cache=None,
+    force_refresh=False,
+    max_workers=1,
+    export="auto",
+    dedup=True,
+    memoize=False,
 ):
     """Ejecuta `render_sql(year)` año a año y concatena los resultados.
 
@@ -185,29 +1052,662 @@ def execute_query_yearly(
         row_warn_threshold: límite por chunk a partir del cual emitimos
             aviso. Por defecto, 100 filas por debajo del tope silencioso.
         verbose: si True, propaga `verbose=True` a cada `execute_query`.
+        client: `MetabaseClient` a usar; por defecto el compartido.
+        cache, force_refresh, export, dedup, memoize: se propagan a
+            `execute_query`
+            (cache en disco por chunk anual, ver `_query_cache.py`; con
+            `export="auto"` un año truncado se recupera completo por la
+            exportación CSV).
+        max_workers: nº de años lanzados a la vez en un pool de hilos.
+            Cada año es una query Athena independiente que pasa casi
+            todo el tiempo esperando al servidor, así que con
+            `max_workers >= nº de años` la latencia total ≈ la del año
+            más lento. Con 1 (por defecto) se ejecutan en serie. Si un
+            año falla se cancelan los pendientes y se propaga el error.
+            Conviene no superar el `pool_maxsize` del cliente (8).
+
+    Si un año puede superar el tope, usar `execute_query_partitioned`,
+    que parte automáticamente los chunks saturados.
 
     Returns:
         Un DataFrame concatenado, o vacío si todos los chunks vinieron
         vacíos. Conserva el orden cronológico (años ascendentes).
     """
-    chunks = []
-    total = 0
-    for year in range(int(min_year), int(max_year) + 1):
-        sql = render_sql(year)
-        df = execute_query(sql, verbose=verbose)
-        n = len(df)
-        total += n
-        marker = ""
-        if n >= row_warn_threshold:
-            marker = (
-                f"  ⚠️  {n} filas — cerca del tope silencioso "
-                f"({METABASE_SILENT_ROW_CAP}). Cortar este año a mayor "
-                "granularidad (mes / unidad) si esperas más datos."
-            )
-        print(f"  [{label}] {year}: {n} filas{marker}")
-        if n:
-            chunks.append(df)
+    years = list(range(int(min_year), int(max_year) + 1))
+
+    def run_year(year):
+        return execute_query(
+            render_sql(year),
+            verbose=verbose,
+            client=client,
+            cache=cache,
+            force_refresh=force_refresh,
+            export=export,
+            label=label,
+            dedup=dedup,
+            memoize=memoize,
+        )
+
+    results = {}
+    if max_workers is None or max_workers <= 1 or len(years) <= 1:
+        for year in years:
+            results[year] = run_year(year)
+            _report_chunk(label, year, len(results[year]), row_warn_threshold)
+    else:
+        # El cliente compartido se construye antes de abrir el pool para
+        # que los hilos no compitan por leer el .env.
+        client = client or get_client()
+        executor = ThreadPoolExecutor(
+            max_workers=min(max_workers, len(years)),
+            thread_name_prefix=f"metabase-{label}",
+        )
+        try:
+            futures = {executor.submit(run_year, year): year for year in years}
+            for fut in as_completed(futures):
+                year = futures[fut]
+                results[year] = fut.result()
+                _report_chunk(label, year, len(results[year]), row_warn_threshold)
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+
+    chunks = [results[year] for year in years if len(results[year])]
+    total = sum(len(df) for df in chunks)
     if not chunks:
         return pd.DataFrame()
     print(f"  [{label}] total: {total} filas en {max_year - min_year + 1} años.")
     return pd.concat(chunks, ignore_index=True)
+
+
+
+def _watermarks(probe_df, year_col="year"):
+    """`{año: {columna: valor}}` a partir del resultado de la query de sondeo."""
+    if probe_df.empty or year_col not in probe_df.columns:
+        return {}
+    marks = {}
+    for row in probe_df.to_dict("records"):
+        year = row.pop(year_col)
+        if pd.isna(year):
+            continue
+        marks[int(year)] = {k: None if pd.isna(v) else str(v) for k, v in sorted(row.items())}
+    return marks
+
+
+def execute_query_yearly_incremental(
+    render_sql,
+    render_probe_sql,
+    min_year,
+    max_year,
+    *,
+    store,
+    label="query",
+    max_age_days=30,
+    is_final=None,
+    force_refresh=False,
+    verbose=False,
+    client=None,
+    max_workers=1,
+):
+    """Como `execute_query_yearly`, pero solo re-descarga los años que cambiaron.
+
+    1. Lanza una única query de sondeo barata, `render_probe_sql(min_year,
+       max_year)`, que debe devolver una fila por año con una columna
+       `year` y cualquier otra columna que sirva de marca de agua (p.ej.
+       `COUNT(*)` y `MAX(load_date)` de la tabla de origen).
+    2. Para cada año calcula la huella = SQL de ese año + su marca de
+       agua y la compara con la guardada en `store`
+       (`_yearly_store.YearlyStore`).
+    3. Solo los años sin partición, con huella distinta, con partición
+       más antigua que `max_age_days` o no definitivos se piden a
+       Metabase (en paralelo con `max_workers`). El resto se lee de
+       disco. Los años descargados se guardan para la siguiente vez.
+
+    Args:
+        store: `YearlyStore` o nombre (se crea bajo `output/_yearly_store/`).
+        max_age_days: red de seguridad para cambios que la marca de agua
+            no ve (p.ej. un diagnóstico cargado tarde en otra tabla).
+            None = sin caducidad.
+        is_final: callable `DataFrame -> bool`. Una partición guardada
+            para la que devuelve False (p.ej. con estancias aún abiertas)
+            se re-descarga siempre.
+        force_refresh: ignora el almacén y re-descarga todos los años.
+        verbose, client, max_workers: como en `execute_query_yearly`.
+
+    Returns:
+        DataFrame concatenado en orden cronológico; en
+        `df.attrs["refetched_years"]` quedan los años pedidos a Metabase.
+    """
+    if isinstance(store, str):
+        store = YearlyStore(store)
+    client = client or get_client()
+    years = list(range(int(min_year), int(max_year) + 1))
+    max_age_s = None if max_age_days is None else max_age_days * 86400
+
+    probe = execute_query(
+        render_probe_sql(min_year, max_year),
+        verbose=verbose,
+        client=client,
+        cache=False,
+        label=f"{label}:probe",
+        dedup=False,
+    )
+    marks = _watermarks(probe)
+
+    fingerprints = {}
+    results = {}
+    stale = []
+    for year in years:
+        watermark = marks.get(year, {})
+        fingerprints[year] = hashlib.sha256(
+            (
+                query_fingerprint(render_sql(year), client.database_name)
+                + json.dumps(watermark, sort_keys=True)
+            ).encode("utf-8")
+        ).hexdigest()
+        df = None
+        if not force_refresh:
+            df = store.get(year, fingerprints[year], max_age_s)
+            if df is not None and is_final is not None and not is_final(df):
+                df = None
+        if df is None:
+            stale.append(year)
+        else:
+            results[year] = df
+
+    fresh = [y for y in years if y not in stale]
+    print(
+        f"  [{label}] sync incremental: {len(fresh)} año(s) sin cambios "
+        f"{fresh if fresh else ''} · descargando {stale if stale else 'ninguno'}"
+    )
+
+    def run_year(year):
+        # `force_refresh`: el año ha cambiado, no vale un resultado
+        # memorizado antes en este mismo proceso.
+        return execute_query(
+            render_sql(year),
+            verbose=verbose,
+            client=client,
+            cache=False,
+            force_refresh=True,
+            label=label,
+        )
+
+    for year, df in zip(stale, _map_concurrent(run_year, stale, max_workers, label)):
+        _report_chunk(label, year, len(df), METABASE_SILENT_ROW_CAP - 100)
+        store.put(year, df, fingerprints[year], marks.get(year, {}))
+        results[year] = df
+
+    chunks = [results[year] for year in years if len(results[year])]
+    out = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    print(f"  [{label}] total: {len(out)} filas en {len(years)} años.")
+    out.attrs["refetched_years"] = stale
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Partición temporal adaptativa
+# ---------------------------------------------------------------------------
+# Escalera de granularidades: un chunk saturado se parte en los trozos
+# del siguiente nivel (alineados a calendario). Si el rango ya es más
+# pequeño que un nivel, se salta al siguiente.
+PARTITION_LEVELS = ("year", "half", "quarter", "month", "week", "day")
+
+_PARTITION_PLAN_DIR = OUTPUT_DIR / "_partition_plans"
+# Rango fijo con el que se renderiza la plantilla para identificar su plan.
+_PLAN_TEMPLATE_RANGE = (datetime(2000, 1, 1), datetime(2000, 1, 2))
+
+
+def sql_timestamp(dt):
+    """Literal Athena/Trino `timestamp 'YYYY-MM-DD HH:MM:SS[.fff]'` para `dt`."""
+    if dt.microsecond:
+        return f"timestamp '{dt:%Y-%m-%d %H:%M:%S}.{dt.microsecond // 1000:03d}'"
+    return f"timestamp '{dt:%Y-%m-%d %H:%M:%S}'"
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(str(value))
+
+
+def _next_boundary(dt, level):
+    """Primer límite de `level` estrictamente posterior a `dt`."""
+    if level == "year":
+        return datetime(dt.year + 1, 1, 1)
+    if level in ("half", "quarter", "month"):
+        step = {"half": 6, "quarter": 3, "month": 1}[level]
+        month0 = (dt.month - 1) // step * step + step
+        return datetime(dt.year + month0 // 12, month0 % 12 + 1, 1)
+    day = datetime(dt.year, dt.month, dt.day)
+    if level == "week":
+        return day + timedelta(days=7 - day.weekday())
+    return day + timedelta(days=1)
+
+
+def _split_range(start, end, level):
+    """Corta [start, end) por los límites de `level`."""
+    parts = []
+    cursor = start
+    while cursor < end:
+        nxt = min(_next_boundary(cursor, level), end)
+        parts.append((cursor, nxt))
+        cursor = nxt
+    return parts
+
+
+def _children(start, end, level):
+    """Trozos del primer nivel por debajo de `level` que parta el rango.
+
+    Devuelve `(nivel_hijo, [(s, e), ...])`, o `(None, [])` si ya estamos
+    en días (no se puede partir más).
+    """
+    idx = PARTITION_LEVELS.index(level)
+    for child_level in PARTITION_LEVELS[idx + 1:]:
+        parts = _split_range(start, end, child_level)
+        if len(parts) > 1:
+            return child_level, parts
+    return None, []
+
+
+def _plan_path(plan_key):
+    safe = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in plan_key)
+    return _PARTITION_PLAN_DIR / f"{safe}.json"
+
+
+def _load_plan(plan_key):
+    path = _plan_path(plan_key)
+    if not path.exists():
+        return []
+    try:
+        leaves = json.loads(path.read_text(encoding="utf-8")).get("leaves", [])
+    except (OSError, ValueError):
+        return []
+    return [
+        (datetime.fromisoformat(s), datetime.fromisoformat(e), level)
+        for s, e, level in leaves
+    ]
+
+
+def _save_plan(plan_key, leaves):
+    path = _plan_path(plan_key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    stored = {leaf[:2]: leaf for leaf in _load_plan(plan_key)}
+    for leaf in leaves:
+        # Un rango nuevo reemplaza cualquier hoja antigua que solape.
+        stored = {
+            k: v for k, v in stored.items()
+            if v[1] <= leaf[0] or v[0] >= leaf[1]
+        }
+    for leaf in leaves:
+        stored[leaf[:2]] = leaf
+    payload = {
+        "updated": datetime.now().isoformat(timespec="seconds"),
+        "leaves": [
+            [s.isoformat(), e.isoformat(), level]
+            for s, e, level in sorted(stored.values())
+        ],
+    }
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(payload, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _initial_ranges(start, end, plan_key):
+    """Rangos de arranque: hojas del plan guardado + años para los huecos."""
+    stored = sorted(
+        leaf for leaf in (_load_plan(plan_key) if plan_key else [])
+        if leaf[0] >= start and leaf[1] <= end
+    )
+    ranges = []
+    cursor = start
+    for s, e, level in stored:
+        if s < cursor:
+            continue
+        while cursor < s:
+            nxt = min(_next_boundary(cursor, "year"), s)
+            ranges.append((cursor, nxt, "year"))
+            cursor = nxt
+        ranges.append((s, e, level))
+        cursor = e
+    while cursor < end:
+        nxt = min(_next_boundary(cursor, "year"), end)
+        ranges.append((cursor, nxt, "year"))
+        cursor = nxt
+    return ranges
+
+
+def execute_query_partitioned(
+    render_sql_for_range,
+    start,
+    end,
+    *,
+    label="query",
+    split_at=METABASE_SILENT_ROW_CAP,
+    plan_key=None,
+    verbose=False,
+    client=None,
+    cache=None,
+    force_refresh=False,
+    max_workers=1,
+    dedup=True,
+):
+    """Ejecuta una query por rangos temporales partiendo los que saturan.
+
+    Empieza por años naturales (o por la partición que se guardó en la
+    ejecución anterior con el mismo `plan_key`). Todo chunk que devuelva
+    `>= split_at` filas se considera truncado por el tope silencioso y se
+    descarta y relanza partido en el siguiente nivel de
+    `PARTITION_LEVELS` (año → semestre → trimestre → mes → semana →
+    día), recursivamente, hasta que todas las hojas quedan por debajo.
+    Un día que siga saturado se devuelve tal cual con aviso.
+
+    `render_sql_for_range(s, e)` recibe `datetime` y debe filtrar por un
+    único instante con semántica semiabierta `[s, e)` (p.ej.
+    `admission_date >= {s} AND admission_date < {e}`, ver
+    `sql_timestamp`), de modo que cada fila caiga en una sola hoja.
+
+    Args:
+        start, end: rango semiabierto `[start, end)`; admite `date`,
+            `datetime` o ISO string.
+        label: etiqueta de logs.
+        split_at: nº de filas a partir del cual un chunk se parte.
+        plan_key: nombre del plan en `output/_partition_plans/`. Por
+            defecto `<label>-<huella>`, con la huella de la plantilla
+            SQL (renderizada sobre un rango fijo) y la base, para que
+            queries distintas con la misma etiqueta no compartan plan.
+            Pasar "" para no leer ni guardar plan.
+        max_workers: chunks de una misma ronda lanzados a la vez.
+        verbose, client, cache, force_refresh, dedup: como en
+            `execute_query`. La exportación CSV se desactiva aquí
+            (`export=False`): la partición necesita ver el tope para
+            decidir dónde cortar.
+
+    Returns:
+        DataFrame concatenado en orden cronológico. En
+        `df.attrs["partition_leaves"]` queda la lista de hojas
+        `(inicio, fin, nivel)` usada.
+    """
+    start, end = _as_datetime(start), _as_datetime(end)
+    if end <= start:
+        raise ValueError("execute_query_partitioned: end debe ser > start.")
+    if plan_key is None:
+        client = client or get_client()
+        template = render_sql_for_range(*_PLAN_TEMPLATE_RANGE)
+        plan_key = f"{label}-{query_fingerprint(template, client.database_name)[:16]}"
+
+    def run_range(rng):
+        s, e, _level = rng
+        return execute_query(
+            render_sql_for_range(s, e),
+            verbose=verbose,
+            client=client,
+            cache=cache,
+            force_refresh=force_refresh,
+            export=False,
+            label=label,
+            dedup=dedup,
+        )
+
+    leaves = {}
+    pending = _initial_ranges(start, end, plan_key)
+    n_splits = 0
+    if max_workers is not None and max_workers > 1:
+        client = client or get_client()
+    while pending:
+        results = zip(pending, _map_concurrent(run_range, pending, max_workers, label))
+
+        pending = []
+        for (s, e, level), df in results:
+            chunk_label = f"{s:%Y-%m-%d}→{e:%Y-%m-%d} ({level})"
+            if len(df) >= split_at:
+                child_level, parts = _children(s, e, level)
+                if child_level is not None:
+                    n_splits += 1
+                    print(
+                        f"  [{label}] {chunk_label}: {len(df)} filas ≥ {split_at} "
+                        f"→ se parte en {len(parts)} ({child_level})"
+                    )
+                    pending.extend((ps, pe, child_level) for ps, pe in parts)
+                    continue
+                print(
+                    f"  [{label}] {chunk_label}: ⚠️  {len(df)} filas en un solo "
+                    "día — no se puede partir más; resultado posiblemente truncado."
+                )
+            else:
+                # Por debajo de `split_at` la hoja está completa; solo se
+                # avisa si ronda el umbral.
+                _report_chunk(
+                    label,
+                    chunk_label,
+                    len(df),
+                    int(split_at * 0.95),
+                    advice=f"Se partirá sola si llega a {split_at} filas.",
+                )
+            leaves[(s, e, level)] = df
+
+    ordered = sorted(leaves)
+    if plan_key:
+        _save_plan(plan_key, ordered)
+
+    chunks = [leaves[k] for k in ordered if len(leaves[k])]
+    out = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    print(
+        f"  [{label}] total: {len(out)} filas en {len(ordered)} chunks "
+        f"({n_splits} particiones adaptativas)."
+    )
+    out.attrs["partition_leaves"] = ordered
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Listas IN por lotes
+# ---------------------------------------------------------------------------
+# Athena rechaza queries de más de 256 KB de texto; dejamos margen para el
+# resto de la plantilla. El nº de claves por lote se limita además para
+# que el planificador no sufra con listas enormes.
+BATCH_MAX_KEYS = 1000
+BATCH_MAX_SQL_CHARS = 200_000
+KEY_FILTER_PLACEHOLDER = "{key_filter}"
+KEY_VALUES_PLACEHOLDER = "{key_values}"
+
+
+def sql_literal(value):
+    """Literal SQL (Athena/Trino) para un valor de clave."""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    if isinstance(value, numbers.Real):
+        # Las claves enteras llegan a menudo como float tras un NaN.
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+    if isinstance(value, datetime):
+        return sql_timestamp(value)
+    if isinstance(value, date):
+        return f"date '{value:%Y-%m-%d}'"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _normalize_keys(keys, n_cols):
+    """Claves únicas y ordenadas como tuplas, sin nulos."""
+    if isinstance(keys, pd.DataFrame):
+        rows = keys.itertuples(index=False, name=None)
+    elif isinstance(keys, pd.Series):
+        rows = ((v,) for v in keys)
+    else:
+        rows = (k if isinstance(k, tuple) else (k,) for k in keys)
+    out = set()
+    for row in rows:
+        if len(row) != n_cols:
+            raise ValueError(
+                f"Cada clave debe tener {n_cols} valor(es) (key_cols); recibida {row!r}."
+            )
+        if any(pd.isna(v) for v in row):
+            continue
+        out.add(tuple(v.item() if hasattr(v, "item") else v for v in row))
+    return sorted(out)
+
+
+def _key_filter(key_cols, keys):
+    if len(key_cols) == 1:
+        return f"{key_cols[0]} IN ({', '.join(sql_literal(k[0]) for k in keys)})"
+    tuples = ", ".join("(" + ", ".join(sql_literal(v) for v in k) + ")" for k in keys)
+    return f"({', '.join(key_cols)}) IN ({tuples})"
+
+
+def _key_values(key_cols, keys):
+    rows = ", ".join("(" + ", ".join(sql_literal(v) for v in k) + ")" for k in keys)
+    return f"(VALUES {rows}) AS k ({', '.join(key_cols)})"
+
+
+def _plan_batches(keys, base_chars, max_keys, max_sql_chars):
+    """Cortes `(lo, hi)` sobre `keys` que respetan nº de claves y longitud."""
+    batches = []
+    lo, chars = 0, base_chars
+    for i, key in enumerate(keys):
+        key_chars = sum(len(sql_literal(v)) for v in key) + 2 * len(key) + 2
+        if i > lo and (i - lo >= max_keys or chars + key_chars > max_sql_chars):
+            batches.append((lo, i))
+            lo, chars = i, base_chars
+        chars += key_chars
+    if lo < len(keys):
+        batches.append((lo, len(keys)))
+    return batches
+
+
+def _map_concurrent(fn, items, max_workers, label):
+    """`[fn(x) for x in items]` en un pool de hilos; cancela al primer error."""
+    if max_workers is None or max_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(items)),
+        thread_name_prefix=f"metabase-{label}",
+    ) as executor:
+        futures = [executor.submit(fn, item) for item in items]
+        try:
+            return [fut.result() for fut in futures]
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def execute_query_in_batches(
+    sql_template,
+    keys,
+    key_cols,
+    *,
+    label="batches",
+    rows_per_key=None,
+    max_keys=BATCH_MAX_KEYS,
+    max_sql_chars=BATCH_MAX_SQL_CHARS,
+    split_at=METABASE_SILENT_ROW_CAP,
+    max_workers=4,
+    verbose=False,
+    client=None,
+    cache=None,
+    force_refresh=False,
+    dedup=True,
+):
+    """Ejecuta `sql_template` filtrando por `keys` en lotes de listas IN.
+
+    `sql_template` debe contener `{key_filter}`, que se sustituye por
+    `col IN (v1, v2, …)` (una columna) o `(c1, c2) IN ((a, b), …)`
+    (varias), p.ej.:
+
+        execute_query_in_batches(
+            "SELECT … FROM datascope_gestor_prod.antibiograms ab WHERE {key_filter}",
+            refs, ["ab.antibiogram_ref"],
+        )
+
+    o bien `{key_values}`, que se sustituye por una tabla en línea
+    `(VALUES (a, b), …) AS k (c1, c2)` con la que hacer JOIN (aquí
+    `key_cols` son los nombres de sus columnas), p.ej. para pasar
+    estancias con sus fechas (`demographics._stays_sql`).
+
+    Los lotes se dimensionan para no pasar de `max_keys` claves ni de
+    `max_sql_chars` caracteres de SQL y, si se indica `rows_per_key`
+    (filas esperadas por clave), para que cada lote quede holgadamente
+    por debajo de `split_at`. Un lote que vuelve con `>= split_at` filas
+    (truncado por el tope silencioso) se parte por la mitad y se relanza,
+    recursivamente; una clave sola que siga saturada se relanza por la
+    exportación CSV (`export="auto"`). Los lotes de cada ronda se lanzan
+    a la vez (`max_workers`).
+
+    Args:
+        keys: iterable de valores (una columna) o de tuplas, o un
+            DataFrame / Series con las columnas en el orden de
+            `key_cols`. Se deduplican y se descartan nulos.
+        key_cols: expresiones SQL de las columnas clave.
+        verbose, client, cache, force_refresh, dedup: como en
+            `execute_query`.
+
+    Returns:
+        DataFrame concatenado en el orden de las claves (ordenadas), o
+        vacío si no hay claves o ningún lote devuelve filas.
+    """
+    if KEY_VALUES_PLACEHOLDER in sql_template:
+        placeholder, render_keys = KEY_VALUES_PLACEHOLDER, _key_values
+    elif KEY_FILTER_PLACEHOLDER in sql_template:
+        placeholder, render_keys = KEY_FILTER_PLACEHOLDER, _key_filter
+    else:
+        raise ValueError(
+            f"sql_template debe contener {KEY_FILTER_PLACEHOLDER} o {KEY_VALUES_PLACEHOLDER}."
+        )
+    if isinstance(key_cols, str):
+        key_cols = [key_cols]
+    keys = _normalize_keys(keys, len(key_cols))
+    if not keys:
+        print(f"  [{label}] sin claves — no se lanza ninguna query.")
+        return pd.DataFrame()
+
+    if rows_per_key:
+        max_keys = max(1, min(max_keys, int(0.8 * split_at / rows_per_key)))
+    pending = _plan_batches(keys, len(sql_template), max_keys, max_sql_chars)
+    client = client or get_client()
+
+    def run_batch(batch, export=False):
+        lo, hi = batch
+        sql = sql_template.replace(placeholder, render_keys(key_cols, keys[lo:hi]))
+        return execute_query(
+            sql,
+            verbose=verbose,
+            client=client,
+            cache=cache,
+            force_refresh=force_refresh,
+            export=export,
+            label=label,
+            dedup=dedup,
+        )
+
+    results = {}
+    n_queries = n_splits = 0
+    while pending:
+        frames = _map_concurrent(run_batch, pending, max_workers, label)
+        n_queries += len(pending)
+        next_pending = []
+        for (lo, hi), df in zip(pending, frames):
+            if len(df) >= split_at:
+                if hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    n_splits += 1
+                    print(
+                        f"  [{label}] lote de {hi - lo} claves: {len(df)} filas ≥ "
+                        f"{split_at} → se parte en dos"
+                    )
+                    next_pending += [(lo, mid), (mid, hi)]
+                    continue
+                print(f"  [{label}] clave {keys[lo]} saturada → exportación CSV")
+                df = run_batch((lo, hi), export="auto")
+                n_queries += 1
+            results[(lo, hi)] = df
+        pending = next_pending
+
+    chunks = [results[b] for b in sorted(results) if len(results[b])]
+    out = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    print(
+        f"  [{label}] total: {len(out)} filas para {len(keys)} claves "
+        f"({n_queries} queries, {n_splits} lotes partidos)."
+    )
+    return out
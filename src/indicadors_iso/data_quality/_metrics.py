@@ -24,6 +24,10 @@ MONTH_NAMES_ES = [
 ]
 
 
+# Zona horaria de los timestamps de DataNex (hora local del hospital).
+LOCAL_TZ = "Europe/Madrid"
+
+
 def _parse_naive_dt(series: pd.Series) -> pd.Series:
     """Parse Metabase ISO-8601 timestamps ignoring the trailing timezone offset.
 
@@ -31,9 +35,17 @@ def _parse_naive_dt(series: pd.Series) -> pd.Series:
     and CEST offsets, which breaks ``pd.to_datetime`` (it falls back to object
     dtype). We strip the offset so every value becomes a naive local timestamp
     — safe because we only need calendar dates and month-level lags.
+
+    ``execute_query`` already returns timestamp columns as tz-aware
+    Europe/Madrid; dropping the zone gives Madrid wall-clock time, which
+    is exactly what stripping the CET/CEST offset used to yield.
     """
     if series.empty:
         return pd.to_datetime(series, errors="coerce")
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return series.dt.tz_convert(LOCAL_TZ).dt.tz_localize(None)
+    if pd.api.types.is_datetime64_dtype(series.dtype):
+        return series
     stripped = series.astype(str).str[:19]
     return pd.to_datetime(stripped, errors="coerce")
 
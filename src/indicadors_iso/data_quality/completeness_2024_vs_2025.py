@@ -46,7 +46,9 @@ def _prompt(msg: str, default: str) -> str:
 def _run(template: str, label: str, **fmt_kwargs) -> pd.DataFrame:
     print(f"  -> {label}...", flush=True)
     query = _sql.format_query(template, **fmt_kwargs)
-    return execute_query(query, verbose=False)
+    # Si se repite una plantilla con los mismos años en el proceso, se
+    # sirve de memoria.
+    return execute_query(query, verbose=False, memoize=True)
 
 
 def main() -> None:
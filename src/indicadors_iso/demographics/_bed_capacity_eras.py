@@ -30,9 +30,15 @@ límites de las épocas pueden ajustarse cuando se valide con clínica.
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import date
+from datetime import date, timedelta
+from functools import lru_cache
 from typing import Optional
 
+import numpy as np
+import pandas as pd
+
+from indicadors_iso.demographics._stays_sql import DB_TIMEZONE
+
 # Etiqueta de la unidad sintética usada en la época `covid`.
 COMBINED_UNIT_LABEL = "UCI"
 
@@ -42,6 +48,9 @@ COMBINED_UNIT_LABEL = "UCI"
 # refleje directamente la presión sobre la dotación pre-pandemia.
 PRE_COVID_TOTAL_BEDS = 12
 
+# Unidades reales que la época `covid` agrega en COMBINED_UNIT_LABEL.
+COVID_RAW_UNITS = ("E073", "I073")
+
 
 @dataclass(frozen=True)
 class CapacityEra:
@@ -79,7 +88,7 @@ def lookup_capacity_for_month(
         if not (era.start <= target <= era.end):
             continue
         if era.regimen == "covid":
-            if raw_unit in {"E073", "I073"}:
+            if raw_unit in COVID_RAW_UNITS:
                 return COMBINED_UNIT_LABEL, era.nominal_beds, "covid"
             continue
         if era.unit == raw_unit:
@@ -87,6 +96,101 @@ def lookup_capacity_for_month(
     return None
 
 
+@lru_cache(maxsize=1)
+def era_table() -> pd.DataFrame:
+    """`NOMINAL_CAPACITY_HISTORY` como tabla de intervalos `[start, end)`
+    (fin exclusivo = `era.end` + 1 día), una fila por (raw_unit, época).
+    Las épocas `covid` se expanden a cada unidad de `COVID_RAW_UNITS`.
+    Columnas: raw_unit, start, end, effective_unit, nominal_beds,
+    regimen. No modificar el resultado (está cacheado)."""
+    rows = []
+    for era in NOMINAL_CAPACITY_HISTORY:
+        raw_units = COVID_RAW_UNITS if era.regimen == "covid" else (era.unit,)
+        for raw_unit in raw_units:
+            rows.append({
+                "raw_unit": raw_unit,
+                "start": pd.Timestamp(era.start).as_unit("ns"),
+                "end": pd.Timestamp(era.end + timedelta(days=1)).as_unit("ns"),
+                "effective_unit": era.unit,
+                "nominal_beds": era.nominal_beds,
+                "regimen": era.regimen,
+            })
+    return pd.DataFrame(rows).sort_values(["raw_unit", "start"], ignore_index=True)
+
+
+def era_boundaries() -> pd.DatetimeIndex:
+    """Instantes (naive, hora local) en los que empieza o acaba alguna época."""
+    table = era_table()
+    return pd.DatetimeIndex(pd.concat([table["start"], table["end"]]).unique()).sort_values()
+
+
+@lru_cache(maxsize=None)
+def _compiled_eras(key: str) -> dict[str, tuple[pd.IntervalIndex, pd.DataFrame]]:
+    """`era_table()` agrupada por `key` ("raw_unit" o "effective_unit"):
+    intervalos y, en el mismo orden, (effective_unit, nominal_beds,
+    regimen)."""
+    table = era_table().drop_duplicates([key, "start"])
+    compiled = {}
+    for unit, eras in table.groupby(key, sort=True):
+        intervals = pd.IntervalIndex.from_arrays(eras["start"], eras["end"], closed="left")
+        compiled[unit] = (
+            intervals,
+            eras[["effective_unit", "nominal_beds", "regimen"]].reset_index(drop=True),
+        )
+    return compiled
+
+
+def _lookup(key: str, units, when) -> pd.DataFrame:
+    index = units.index if isinstance(units, pd.Series) else None
+    units = np.asarray(pd.Series(units).astype(str))
+    when = pd.DatetimeIndex(pd.to_datetime(when))
+    if when.tz is not None:
+        when = when.tz_convert(DB_TIMEZONE).tz_localize(None)
+    when = when.as_unit("ns")
+    effective = np.full(len(units), None, dtype=object)
+    beds = np.full(len(units), -1, dtype="int64")
+    regimen = np.full(len(units), None, dtype=object)
+    for unit, (intervals, eras) in _compiled_eras(key).items():
+        rows = np.flatnonzero(units == unit)
+        if not len(rows):
+            continue
+        pos = intervals.get_indexer(when[rows])
+        hit = pos >= 0
+        rows, pos = rows[hit], pos[hit]
+        effective[rows] = eras["effective_unit"].to_numpy()[pos]
+        beds[rows] = eras["nominal_beds"].to_numpy()[pos]
+        regimen[rows] = eras["regimen"].to_numpy()[pos]
+    return pd.DataFrame(
+        {
+            "effective_unit": effective,
+            "nominal_beds": pd.arrays.IntegerArray(beds, mask=beds < 0),
+            "regimen": regimen,
+        },
+        index=index,
+    )
+
+
+def lookup_capacity(raw_units, when) -> pd.DataFrame:
+    """Versión vectorizada de `lookup_capacity_for_month`.
+
+    `raw_units` y `when` (fechas de cualquier granularidad: mes, día u
+    hora; con zona se pasan a hora local) van alineados. Devuelve un
+    DataFrame con el mismo índice que `raw_units` (si es Series) y
+    columnas `effective_unit`, `nominal_beds` (Int64) y `regimen`; nulos
+    donde ninguna época encaja. Un `get_indexer` por unidad sobre los
+    intervalos precompilados, sin recorrer filas.
+    """
+    return _lookup("raw_unit", raw_units, when)
+
+
+def lookup_effective_capacity(effective_units, when) -> pd.DataFrame:
+    """Como `lookup_capacity`, pero partiendo de la unidad efectiva
+    ("E073", "I073" o COMBINED_UNIT_LABEL): capacidad nominal vigente
+    para esa unidad en cada instante, o nulos si no existe entonces
+    (p.ej. "UCI" fuera de la época `covid`)."""
+    return _lookup("effective_unit", effective_units, when)
+
+
 def hours_in_year(year: int) -> int:
     """Horas totales del año (8784 en bisiestos, 8760 en normales)."""
     leap = (year % 4 == 0 and year % 100 != 0) or year % 400 == 0
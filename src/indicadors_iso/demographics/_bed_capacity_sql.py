@@ -29,7 +29,7 @@ WITH monthly_calendar AS (
         date_diff('hour', month_start, date_add('month', 1, month_start))
             AS hours_in_month
     FROM (
-        SELECT date_add('month', m, timestamp '{min_year}-01-01 00:00:00')
+        SELECT date_add('month', m, timestamp '{calendar_start} 00:00:00')
             AS month_start
         FROM UNNEST(sequence(0, {n_months} - 1)) AS t(m)
     ) months
@@ -45,7 +45,7 @@ clean_moves AS (
       AND place_ref IS NOT NULL
       AND COALESCE(end_date, current_timestamp) > start_date
       AND start_date < timestamp '{exclusive_max} 00:00:00'
-      AND COALESCE(end_date, current_timestamp) >= timestamp '{min_year}-01-01 00:00:00'
+      AND COALESCE(end_date, current_timestamp) >= timestamp '{calendar_start} 00:00:00'
       {fake_bed_filter}
 ),
 move_month_overlap AS (
@@ -89,6 +89,8 @@ def build_sql(
     min_year: int,
     max_year: int,
     fake_bed_place_refs: Optional[Iterable[int]] = None,
+    start_month: int = 1,
+    end_month: int = 12,
 ) -> str:
     """Construye la SQL Athena/Trino para el rango y unidades pedidos.
 
@@ -98,16 +100,26 @@ def build_sql(
             del 1-ene-`min_year` al 1-ene-(max_year+1).
         fake_bed_place_refs: place_refs a excluir tanto del numerador
             como del denominador. Si es vacío/None no excluye nada.
+        start_month, end_month: recortan el calendario a
+            `start_month`/`min_year` … `end_month`/`max_year` (ambos
+            inclusivos); los usa la cache mensual de `_bed_occupancy.py`
+            para pedir sólo los meses que le faltan.
     """
     units_list = list(units)
     if not units_list:
         raise ValueError("`units` no puede estar vacío.")
-    if max_year < min_year:
+    if not (1 <= start_month <= 12 and 1 <= end_month <= 12):
+        raise ValueError("start_month / end_month deben estar en 1..12")
+    n_months = (max_year - min_year) * 12 + end_month - start_month + 1
+    if n_months < 1:
         raise ValueError("max_year < min_year")
 
     units_in = ",".join(f"'{u}'" for u in units_list)
-    n_months = (max_year - min_year + 1) * 12
-    exclusive_max = f"{max_year + 1}-01-01"
+    calendar_start = f"{min_year}-{start_month:02d}-01"
+    if end_month == 12:
+        exclusive_max = f"{max_year + 1}-01-01"
+    else:
+        exclusive_max = f"{max_year}-{end_month + 1:02d}-01"
 
     fake_ids = list(fake_bed_place_refs or [])
     if fake_ids:
@@ -117,7 +129,7 @@ def build_sql(
         fake_bed_filter = ""
 
     return _SQL_TEMPLATE.format(
-        min_year=min_year,
+        calendar_start=calendar_start,
         n_months=n_months,
         exclusive_max=exclusive_max,
         units_in=units_in,
@@ -131,16 +143,22 @@ def query_bed_capacity(
     max_year: int,
     fake_bed_place_refs: Optional[Iterable[int]] = None,
     verbose: bool = True,
+    start_month: int = 1,
+    end_month: int = 12,
+    force_refresh: bool = False,
 ) -> pd.DataFrame:
     """Ejecuta la query de capacidad y devuelve un DataFrame mensual.
 
     Columnas: unit, year, month, hours_in_month, bed_hours_used,
-    n_active_place_refs, bed_hours_available.
+    n_active_place_refs, bed_hours_available. `force_refresh` se
+    propaga a `execute_query`.
     """
     from indicadors_iso.connection import execute_query
 
-    sql = build_sql(units, min_year, max_year, fake_bed_place_refs)
-    df = execute_query(sql, verbose=verbose)
+    sql = build_sql(
+        units, min_year, max_year, fake_bed_place_refs, start_month, end_month
+    )
+    df = execute_query(sql, verbose=verbose, force_refresh=force_refresh)
 
     if df.empty:
         return df
@@ -0,0 +1,325 @@
+"""Censo de camas local por barrido (sweep-line) a cualquier resolución.
+
+`_bed_capacity_sql.py` sólo devuelve bed-hours mensuales calculadas en
+Athena, lo que no permite responder a picos de ocupación, tiempo por
+encima del 100 % ni camas libres en cada ingreso. Este módulo trabaja
+sobre los movimientos crudos (`ou_loc_ref`, `place_ref`, `start_date`,
+`end_date`; p.ej. leídos de `indicadors_iso.mirror`) y construye la
+función escalón "pacientes ingresados en cada instante" por unidad
+efectiva:
+
+1. `prepare_bed_intervals` — misma limpieza que la CTE `clean_moves`
+   (sin `place_ref`, duración no positiva y la cama falsa
+   `FAKE_BED_PLACE_REFS_E073` fuera; `end_date` nulo → ahora) y fechas
+   en hora local (`DB_TIMEZONE`).
+2. Los intervalos se cortan en los límites de las épocas de capacidad y
+   cada trozo se asigna a su unidad efectiva (`lookup_capacity`): en la
+   época `covid` E073 e I073 suman en "UCI".
+3. Barrido: un evento +1 / −1 por trozo más los bordes de los
+   intervalos de salida, una sola ordenación y `cumsum`. Coste
+   O(n log n); ningún intervalo se expande fila a fila por hora.
+
+`bed_census` agrega los segmentos por intervalo de salida (`freq`
+cualquiera de pandas: "h", "8h" para turnos, "D", "MS"…),
+`summarize_census` resume la serie por unidad y `occupancy_at` da la
+ocupación y las camas libres en instantes concretos (p.ej. cada
+ingreso).
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from indicadors_iso.demographics._bed_capacity_eras import (
+    era_boundaries,
+    era_table,
+    lookup_capacity,
+    lookup_effective_capacity,
+)
+from indicadors_iso.demographics._config import FAKE_BED_PLACE_REFS_E073
+from indicadors_iso.demographics._stays import _as_datetime, _local
+from indicadors_iso.demographics._stays_sql import DB_TIMEZONE
+
+DEFAULT_FREQ = "h"
+DEFAULT_PERCENTILES = (50, 90, 95)
+
+_NS_PER_HOUR = 3_600 * 10**9
+
+CENSUS_COLS = [
+    "effective_unit",
+    "bin_start",
+    "bin_end",
+    "regimen",
+    "nominal_beds",
+    "bed_hours",
+    "capacity_hours",
+    "pct",
+    "mean_occupancy",
+    "max_occupancy",
+    "saturation_minutes",
+]
+
+
+def prepare_bed_intervals(
+    movements: pd.DataFrame,
+    fake_bed_place_refs: Optional[Iterable[int]] = FAKE_BED_PLACE_REFS_E073,
+    now=None,
+) -> pd.DataFrame:
+    """Intervalos de ocupación `[start, end)` en hora local naive.
+
+    Columnas: ou_loc_ref, place_ref, start, end. `now` sustituye a
+    `current_timestamp` para los movimientos abiertos (por defecto,
+    ahora en `DB_TIMEZONE`).
+    """
+    start = _local(_as_datetime(movements["start_date"]))
+    end = _local(_as_datetime(movements["end_date"]))
+    if now is None:
+        now = pd.Timestamp.now(tz=DB_TIMEZONE)
+    now = pd.Timestamp(now)
+    if now.tzinfo is not None:
+        now = now.tz_convert(DB_TIMEZONE).tz_localize(None)
+    df = pd.DataFrame({
+        "ou_loc_ref": movements["ou_loc_ref"].astype(str),
+        "place_ref": movements["place_ref"],
+        "start": start.astype("datetime64[ns]"),
+        "end": end.fillna(now).astype("datetime64[ns]"),
+    })
+    keep = df["place_ref"].notna() & df["start"].notna() & (df["end"] > df["start"])
+    fake_ids = list(fake_bed_place_refs or [])
+    if fake_ids:
+        keep &= ~pd.to_numeric(df["place_ref"], errors="coerce").isin(fake_ids)
+    return df[keep].reset_index(drop=True)
+
+
+def _effective_pieces(intervals: pd.DataFrame) -> pd.DataFrame:
+    """Corta cada intervalo en los límites de época y le asigna la unidad
+    efectiva vigente en cada trozo (la propia `ou_loc_ref` si la unidad
+    no tiene épocas)."""
+    bounds = era_boundaries().to_numpy()
+    start = intervals["start"].to_numpy()
+    end = intervals["end"].to_numpy()
+    first = np.searchsorted(bounds, start, side="right")
+    n_pieces = np.searchsorted(bounds, end, side="left") - first + 1
+
+    rows = np.repeat(np.arange(len(intervals)), n_pieces)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(n_pieces) - n_pieces, n_pieces)
+    first = first[rows]
+    last = offsets == n_pieces[rows] - 1
+    piece_start = np.where(offsets == 0, start[rows], bounds[np.maximum(first + offsets - 1, 0)])
+    piece_end = np.where(
+        last, end[rows], bounds[np.minimum(first + offsets, len(bounds) - 1)]
+    )
+
+    raw_unit = intervals["ou_loc_ref"].to_numpy()[rows]
+    effective = lookup_capacity(pd.Series(raw_unit), piece_start)["effective_unit"]
+    return pd.DataFrame({
+        "effective_unit": effective.fillna(pd.Series(raw_unit)).to_numpy(),
+        "start": piece_start,
+        "end": piece_end,
+    })
+
+
+def _bin_edges(intervals: pd.DataFrame, freq: str, start, end) -> pd.DatetimeIndex:
+    start = pd.Timestamp(start) if start is not None else intervals["start"].min().floor("D")
+    end = pd.Timestamp(end) if end is not None else intervals["end"].max().ceil("D")
+    if not end > start:
+        raise ValueError(f"Ventana vacía: start={start} >= end={end}.")
+    edges = pd.date_range(start, end, freq=freq).union(pd.DatetimeIndex([start, end]))
+    return edges[(edges >= start) & (edges <= end)].as_unit("ns")
+
+
+def _sweep(pieces: pd.DataFrame, edges: pd.DatetimeIndex) -> pd.DataFrame:
+    """Segmentos de ocupación constante por unidad efectiva dentro de
+    `[edges[0], edges[-1])`, cortados en cada borde y límite de época.
+
+    Columnas: effective_unit, start, hours, occupancy, bin."""
+    lo, hi = edges[0].to_datetime64(), edges[-1].to_datetime64()
+    start = np.maximum(pieces["start"].to_numpy(), lo)
+    end = np.minimum(pieces["end"].to_numpy(), hi)
+    inside = end > start
+    codes, units = pd.factorize(pieces["effective_unit"].to_numpy()[inside], sort=True)
+    start, end = start[inside], end[inside]
+
+    bounds = era_boundaries()
+    breaks = edges.union(bounds[(bounds > edges[0]) & (bounds < edges[-1])]).to_numpy()
+    n_units = len(units)
+    times = np.concatenate([start, end, np.tile(breaks, n_units)])
+    unit = np.concatenate([codes, codes, np.repeat(np.arange(n_units), len(breaks))])
+    delta = np.concatenate([
+        np.ones(len(start), "int64"),
+        -np.ones(len(end), "int64"),
+        np.zeros(len(breaks) * n_units, "int64"),
+    ])
+    order = np.lexsort((times, unit))
+    times, unit = times[order], unit[order]
+    # Cada unidad suma 0 (todo intervalo recortado cierra dentro de la
+    # ventana), así que el cumsum global es el de cada unidad.
+    occupancy = np.cumsum(delta[order])
+
+    span = np.zeros(len(times), "int64")
+    same_unit = unit[1:] == unit[:-1]
+    span[:-1] = np.where(same_unit, (times[1:] - times[:-1]).astype("int64"), 0)
+    keep = span > 0
+    seg_start = times[keep]
+    return pd.DataFrame({
+        "effective_unit": units[unit[keep]],
+        "start": seg_start,
+        "hours": span[keep] / _NS_PER_HOUR,
+        "occupancy": occupancy[keep],
+        "bin": np.searchsorted(edges.to_numpy(), seg_start, side="right") - 1,
+    })
+
+
+def _with_capacity(segments: pd.DataFrame) -> pd.DataFrame:
+    """Añade nominal_beds / regimen vigentes en cada segmento y descarta
+    los de unidades con épocas fuera de ellas (E073 durante `covid`,
+    "UCI" fuera de `covid`), que siempre tienen ocupación 0."""
+    capacity = lookup_effective_capacity(segments["effective_unit"], segments["start"])
+    segments = segments.assign(
+        nominal_beds=capacity["nominal_beds"], regimen=capacity["regimen"]
+    )
+    era_units = set(era_table()["effective_unit"])
+    orphan = segments["effective_unit"].isin(era_units) & segments["nominal_beds"].isna()
+    return segments[~orphan]
+
+
+def bed_census(
+    movements: pd.DataFrame,
+    freq: str = DEFAULT_FREQ,
+    start=None,
+    end=None,
+    fake_bed_place_refs: Optional[Iterable[int]] = FAKE_BED_PLACE_REFS_E073,
+    now=None,
+) -> pd.DataFrame:
+    """Serie de censo por (unidad efectiva, intervalo de `freq`).
+
+    `start` / `end` (hora local) delimitan la ventana; por defecto, del
+    día del primer movimiento al del último. Columnas (`CENSUS_COLS`):
+
+        bed_hours           Σ ocupación × horas (numerador de la ocupación)
+        capacity_hours      nominal_beds × horas (NaN si no hay época)
+        pct                 bed_hours / capacity_hours × 100
+        mean_occupancy      pacientes de media en el intervalo
+        max_occupancy       pico de pacientes simultáneos
+        saturation_minutes  minutos con ocupación > nominal_beds
+
+    `nominal_beds` y `regimen` son los vigentes al inicio del intervalo.
+    Sólo salen los intervalos en que la unidad existe (en `covid`, "UCI"
+    sustituye a E073 / I073).
+    """
+    intervals = prepare_bed_intervals(movements, fake_bed_place_refs, now)
+    if intervals.empty:
+        return pd.DataFrame(columns=CENSUS_COLS)
+    edges = _bin_edges(intervals, freq, start, end)
+    segments = _with_capacity(_sweep(_effective_pieces(intervals), edges))
+    if segments.empty:
+        return pd.DataFrame(columns=CENSUS_COLS)
+
+    nominal = segments["nominal_beds"].astype("float64")
+    segments = segments.assign(
+        bed_hours=segments["occupancy"] * segments["hours"],
+        capacity_hours=nominal * segments["hours"],
+        saturated_minutes=(segments["occupancy"] > nominal) * segments["hours"] * 60,
+    )
+    grouped = segments.groupby(["effective_unit", "bin"], sort=True)
+    census = grouped.agg(
+        regimen=("regimen", "first"),
+        nominal_beds=("nominal_beds", "first"),
+        hours=("hours", "sum"),
+        bed_hours=("bed_hours", "sum"),
+        max_occupancy=("occupancy", "max"),
+        saturation_minutes=("saturated_minutes", "sum"),
+    )
+    # Unidades sin épocas: NaN en lugar de 0.
+    census["capacity_hours"] = grouped["capacity_hours"].sum(min_count=1)
+    census = census.reset_index()
+    bins = census["bin"].to_numpy()
+    census["bin_start"] = edges[bins]
+    census["bin_end"] = edges[bins + 1]
+    census["pct"] = census["bed_hours"] / census["capacity_hours"].where(
+        census["capacity_hours"] > 0
+    ) * 100
+    census["mean_occupancy"] = census["bed_hours"] / census["hours"]
+    return census[CENSUS_COLS]
+
+
+def summarize_census(
+    census: pd.DataFrame,
+    percentiles: Iterable[float] = DEFAULT_PERCENTILES,
+    by: Iterable[str] = ("effective_unit",),
+) -> pd.DataFrame:
+    """Resumen de una serie de `bed_census` por `by`: bed_hours, pct,
+    pico (`peak_occupancy`), percentiles `p<q>_occupancy` del pico de
+    cada intervalo, minutos y nº de intervalos con saturación."""
+    by = list(by)
+    grouped = census.groupby(by, sort=True)
+    out = grouped.agg(
+        n_bins=("bin_start", "size"),
+        bed_hours=("bed_hours", "sum"),
+        peak_occupancy=("max_occupancy", "max"),
+        saturation_minutes=("saturation_minutes", "sum"),
+    )
+    out["capacity_hours"] = grouped["capacity_hours"].sum(min_count=1)
+    out["n_bins_saturated"] = (census["saturation_minutes"] > 0).groupby(
+        [census[c] for c in by]
+    ).sum()
+    out["pct"] = out["bed_hours"] / out["capacity_hours"].where(out["capacity_hours"] > 0) * 100
+    peaks = census["max_occupancy"].astype("float64").groupby([census[c] for c in by])
+    for q in percentiles:
+        out[f"p{q:g}_occupancy"] = peaks.quantile(q / 100)
+    return out.reset_index()
+
+
+def occupancy_at(
+    movements: pd.DataFrame,
+    raw_units,
+    when,
+    fake_bed_place_refs: Optional[Iterable[int]] = FAKE_BED_PLACE_REFS_E073,
+    now=None,
+) -> pd.DataFrame:
+    """Ocupación de la unidad efectiva de cada `raw_units` en cada
+    instante `when` (hora local o con zona), contando los intervalos con
+    `start <= when < end`: en el instante de un ingreso incluye al propio
+    paciente. Columnas: effective_unit, occupancy, nominal_beds,
+    beds_free (nominal_beds − occupancy; negativo si hay sobreocupación).
+    """
+    pieces = _effective_pieces(prepare_bed_intervals(movements, fake_bed_place_refs, now))
+    raw_units = pd.Series(np.asarray(raw_units, dtype=object)).astype(str)
+    when = pd.DatetimeIndex(pd.to_datetime(when))
+    if when.tz is not None:
+        when = when.tz_convert(DB_TIMEZONE).tz_localize(None)
+    when = when.as_unit("ns").to_numpy()
+
+    effective = lookup_capacity(raw_units, when)["effective_unit"].fillna(raw_units)
+    occupancy = np.zeros(len(when), "int64")
+    for unit, unit_pieces in pieces.groupby("effective_unit", sort=False):
+        rows = np.flatnonzero(effective.to_numpy() == unit)
+        if not len(rows):
+            continue
+        starts = np.sort(unit_pieces["start"].to_numpy())
+        ends = np.sort(unit_pieces["end"].to_numpy())
+        occupancy[rows] = (
+            np.searchsorted(starts, when[rows], side="right")
+            - np.searchsorted(ends, when[rows], side="right")
+        )
+    nominal = lookup_effective_capacity(effective, when)["nominal_beds"]
+    return pd.DataFrame({
+        "effective_unit": effective.to_numpy(),
+        "occupancy": occupancy,
+        "nominal_beds": nominal.array,
+        "beds_free": nominal.array - occupancy,
+    })
+
+
+__all__ = [
+    "CENSUS_COLS",
+    "DEFAULT_FREQ",
+    "DEFAULT_PERCENTILES",
+    "bed_census",
+    "occupancy_at",
+    "prepare_bed_intervals",
+    "summarize_census",
+]
@@ -6,8 +6,9 @@ Durante la época `covid` los movimientos en E073 e I073 se agregan en
 la unidad sintética "UCI" (12 camas nominales), sorteando el
 reetiquetado COVID-19.
 
-El SQL mensual está en `_bed_capacity_sql.py`; los resultados mensuales
-se cachean en CSV bajo `demographics/output/`. La cama falsa de E073
+El SQL mensual está en `_bed_capacity_sql.py`; los resultados se
+cachean por (unidad, año, mes) bajo `demographics/output/` y sólo se
+consultan los meses que faltan o caducados. La cama falsa de E073
 (auxiliar de procedimientos) se excluye en el SQL — ver `_config.py`.
 """
 
@@ -18,19 +19,118 @@ from typing import Iterable, Optional
 
 import pandas as pd
 
+from indicadors_iso._filelock import FileLock
+from indicadors_iso._frame_io import find_frame, read_frame, write_frame
 from indicadors_iso._paths import module_output_dir
 from indicadors_iso.demographics._bed_capacity_eras import (
     COMBINED_UNIT_LABEL,
-    lookup_capacity_for_month,
+    lookup_capacity,
 )
 from indicadors_iso.demographics._bed_capacity_sql import query_bed_capacity
+from indicadors_iso.demographics._stays_sql import DB_TIMEZONE
 
 _CACHE_DIR = module_output_dir("demographics", "_bed_capacity_cache")
+_CACHE_NAME = "_bed_capacity_monthly"
+
+MONTHLY_COLS = [
+    "unit",
+    "year",
+    "month",
+    "hours_in_month",
+    "bed_hours_used",
+    "n_active_place_refs",
+    "bed_hours_available",
+]
+# Columnas de control de la cache (no salen de `load_or_query_monthly`).
+_CACHE_COLS = MONTHLY_COLS + ["fake_beds", "has_data", "fetched_at"]
+
+# Los meses desde el anterior al actual (y los futuros) se consideran
+# siempre caducados: el DW todavía puede estar cargándolos.
+STALE_RECENT_MONTHS = 2
+# Un mes consultado menos de `SETTLE_DAYS` después de acabar aún puede
+# recibir cargas tardías: se vuelve a pedir pasados `LATE_LOAD_TTL_DAYS`
+# desde `fetched_at`. Los meses sin movimientos (`has_data=False`)
+# caducan siempre a los `PLACEHOLDER_TTL_DAYS`: el hueco puede ser una
+# carga pendiente del DW y no una unidad vacía.
+SETTLE_DAYS = 90
+LATE_LOAD_TTL_DAYS = 7
+PLACEHOLDER_TTL_DAYS = 30
+
+
+def _cache_base() -> Path:
+    return _CACHE_DIR / _CACHE_NAME
+
+
+def _read_cache() -> pd.DataFrame:
+    path = find_frame(_cache_base())
+    if path is None:
+        return pd.DataFrame(columns=_CACHE_COLS)
+    return read_frame(path)
+
+
+def _write_cache(df: pd.DataFrame) -> None:
+    write_frame(_cache_base(), df)
+
+
+def _fake_beds_tag(fake_bed_place_refs: Optional[Iterable[int]]) -> str:
+    return ",".join(str(p) for p in sorted(int(p) for p in fake_bed_place_refs or []))
+
+
+def _month_index(year: int, month: int) -> int:
+    return year * 12 + month - 1
+
+
+def _expired(cache: pd.DataFrame, today: pd.Timestamp) -> pd.Series:
+    """Filas de la cache cuyo `fetched_at` ya no vale (ver `SETTLE_DAYS`)."""
+    day = 86400.0
+    fetched_at = pd.to_numeric(cache["fetched_at"], errors="coerce").fillna(0.0)
+    age = today.timestamp() - fetched_at
+    month_end = pd.to_datetime(pd.DataFrame({
+        "year": cache["year"].astype(int), "month": cache["month"].astype(int), "day": 1,
+    })) + pd.offsets.MonthBegin(1)
+    month_end_s = (month_end - pd.Timestamp(0)).dt.total_seconds()
+    settled = fetched_at >= month_end_s + SETTLE_DAYS * day
+    has_data = cache["has_data"].astype(bool)
+    return (has_data & ~settled & (age > LATE_LOAD_TTL_DAYS * day)) | (
+        ~has_data & (age > PLACEHOLDER_TTL_DAYS * day)
+    )
+
+
+def _month_runs(indices: Iterable[int]) -> list[tuple[int, int]]:
+    """Agrupa índices de mes en tramos contiguos `(primero, último)`."""
+    runs: list[tuple[int, int]] = []
+    for i in sorted(set(indices)):
+        if runs and i == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], i)
+        else:
+            runs.append((i, i))
+    return runs
 
 
-def _cache_path(units: Iterable[str], min_year: int, max_year: int) -> Path:
-    units_tag = "-".join(sorted(units))
-    return _CACHE_DIR / f"_bed_capacity_{units_tag}_{min_year}-{max_year}.csv"
+def _months_to_fetch(
+    cache: pd.DataFrame,
+    units: list[str],
+    min_year: int,
+    max_year: int,
+    fake_tag: str,
+    today: pd.Timestamp,
+) -> list[int]:
+    """Meses del rango que faltan en la cache para alguna unidad o que
+    están caducados (`STALE_RECENT_MONTHS`, `SETTLE_DAYS`,
+    `PLACEHOLDER_TTL_DAYS`)."""
+    wanted = pd.MultiIndex.from_product(
+        [units, range(_month_index(min_year, 1), _month_index(max_year, 12) + 1)]
+    )
+    cached = cache[cache["fake_beds"] == fake_tag]
+    cached = cached[~_expired(cached, today)]
+    have = pd.MultiIndex.from_arrays([
+        cached["unit"].astype(str),
+        cached["year"].astype(int) * 12 + cached["month"].astype(int) - 1,
+    ])
+    stale_from = _month_index(today.year, today.month) - (STALE_RECENT_MONTHS - 1)
+    months = wanted.get_level_values(1)
+    missing = ~wanted.isin(have) | (months >= stale_from)
+    return sorted(set(months[missing]))
 
 
 def load_or_query_monthly(
@@ -40,76 +140,126 @@ def load_or_query_monthly(
     fake_bed_place_refs: Optional[Iterable[int]] = None,
     force_refresh: bool = False,
     verbose: bool = True,
+    today=None,
 ) -> pd.DataFrame:
-    """Devuelve la tabla mensual (unit, year, month, ...) usando cache CSV."""
-    units_list = list(units)
-    cache = _cache_path(units_list, min_year, max_year)
-
-    if cache.exists() and not force_refresh:
-        if verbose:
-            print(f"[bed_occupancy] Usando cache: {cache.name}")
-        df = pd.read_csv(cache)
+    """Devuelve la tabla mensual (unit, year, month, ...) usando la cache.
+
+    La cache guarda una fila por (unit, year, month, cama falsa) en un
+    único fichero columnar, así que cualquier rango se arma con trozos
+    ya descargados: sólo se consultan los meses que faltan o caducados
+    (`STALE_RECENT_MONTHS` respecto a `today`, por defecto hoy en
+    `DB_TIMEZONE`; y los que caducan según `fetched_at`, ver
+    `SETTLE_DAYS`), agrupados en tramos contiguos. Los meses sin
+    movimientos se recuerdan (`has_data=False`) durante
+    `PLACEHOLDER_TTL_DAYS`, pero no salen en el resultado, igual que en
+    la query.
+    """
+    units_list = sorted({str(u) for u in units})
+    if not units_list:
+        raise ValueError("`units` no puede estar vacío.")
+    fake_tag = _fake_beds_tag(fake_bed_place_refs)
+    today = pd.Timestamp(today) if today is not None else pd.Timestamp.now(tz=DB_TIMEZONE)
+
+    # Las queries se lanzan sin el lock (un backfill de varios años tarda
+    # más que `stale_after`); bajo el lock solo se relee, fusiona y
+    # escribe, para no pisar los meses que otro proceso haya guardado.
+    cache = _read_cache()
+    if force_refresh:
+        to_fetch = list(range(_month_index(min_year, 1), _month_index(max_year, 12) + 1))
     else:
-        if verbose:
-            print(
-                f"[bed_occupancy] Consultando capacidad empírica "
-                f"{units_list} {min_year}-{max_year}…"
-            )
-        df = query_bed_capacity(
-            units=units_list,
-            min_year=min_year,
-            max_year=max_year,
-            fake_bed_place_refs=fake_bed_place_refs,
-            verbose=verbose,
-        )
-        if df.empty:
+        to_fetch = _months_to_fetch(cache, units_list, min_year, max_year, fake_tag, today)
+
+    if to_fetch:
+        fetched = []
+        for first, last in _month_runs(to_fetch):
+            (y0, m0), (y1, m1) = divmod(first, 12), divmod(last, 12)
             if verbose:
                 print(
-                    "[bed_occupancy] La query devolvió 0 filas; "
-                    "no se cachea nada."
+                    f"[bed_occupancy] Consultando capacidad empírica {units_list} "
+                    f"{y0}-{m0 + 1:02d}…{y1}-{m1 + 1:02d}"
                 )
-            return df
-        cache.parent.mkdir(parents=True, exist_ok=True)
-        df.to_csv(cache, index=False, encoding="utf-8")
+            df = query_bed_capacity(
+                units=units_list,
+                min_year=y0,
+                max_year=y1,
+                fake_bed_place_refs=fake_bed_place_refs,
+                verbose=verbose,
+                start_month=m0 + 1,
+                end_month=m1 + 1,
+                force_refresh=force_refresh,
+            )
+            fetched.append(df)
+        fresh = _with_placeholders(fetched, units_list, to_fetch, fake_tag, today.timestamp())
+        with FileLock(_cache_base().with_suffix(".lock"), stale_after=600):
+            cache = _read_cache()
+            keep = ~(
+                (cache["fake_beds"] == fake_tag)
+                & cache["unit"].isin(units_list)
+                & (cache["year"].astype(int) * 12 + cache["month"].astype(int) - 1).isin(to_fetch)
+            )
+            cache = pd.concat([cache[keep], fresh], ignore_index=True)
+            cache = cache.sort_values(["fake_beds", "unit", "year", "month"], ignore_index=True)
+            _write_cache(cache[_CACHE_COLS])
         if verbose:
-            print(f"[bed_occupancy] Cache escrito en {cache.name}")
-
-    numeric_cols = [
-        "year",
-        "month",
-        "hours_in_month",
-        "bed_hours_used",
-        "n_active_place_refs",
-        "bed_hours_available",
+            print(f"[bed_occupancy] Cache actualizada ({len(to_fetch)} meses consultados)")
+    elif verbose:
+        print(f"[bed_occupancy] Usando cache: {_cache_base().name}")
+
+    months = cache["year"].astype(int) * 12 + cache["month"].astype(int) - 1
+    rows = cache[
+        (cache["fake_beds"] == fake_tag)
+        & cache["unit"].isin(units_list)
+        & months.between(_month_index(min_year, 1), _month_index(max_year, 12))
+        & cache["has_data"].astype(bool)
     ]
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
+    df = rows[MONTHLY_COLS].sort_values(["unit", "year", "month"], ignore_index=True)
+    for col in MONTHLY_COLS[1:]:
+        df[col] = pd.to_numeric(df[col], errors="coerce")
     return df
 
 
+def _with_placeholders(
+    fetched: list[pd.DataFrame],
+    units: list[str],
+    months: list[int],
+    fake_tag: str,
+    fetched_at: float,
+) -> pd.DataFrame:
+    """Filas consultadas + una fila `has_data=False` por cada (unidad,
+    mes) pedido que la query no devolvió (sin movimientos)."""
+    fetched = [df for df in fetched if not df.empty]
+    got = (
+        pd.concat(fetched, ignore_index=True)[MONTHLY_COLS]
+        if fetched else pd.DataFrame(columns=MONTHLY_COLS)
+    )
+    got = got.assign(unit=got["unit"].astype(str), has_data=True)
+    grid = pd.MultiIndex.from_product([units, months], names=["unit", "_m"]).to_frame(index=False)
+    grid["year"], grid["month"] = grid["_m"] // 12, grid["_m"] % 12 + 1
+    absent = grid.merge(
+        got[["unit", "year", "month"]].astype({"year": int, "month": int}),
+        on=["unit", "year", "month"], how="left", indicator=True,
+    )
+    absent = absent[absent["_merge"] == "left_only"].drop(columns=["_m", "_merge"])
+    absent["has_data"] = False
+    out = pd.concat([got, absent], ignore_index=True)
+    out["fake_beds"] = fake_tag
+    out["fetched_at"] = fetched_at
+    return out.astype({"year": int, "month": int})
+
+
 def _default_incomplete_months() -> set[tuple[int, int]]:
     """Meses que se excluyen del cálculo por falta de carga al DW.
 
-    Se derivan del rango sintético de la cohorte (`_loader.SYNTHETIC_
-    DATE_RANGE`) para que numerador y denominador del bed_capacity
-    coincidan con el periodo que el loader tuvo que rellenar mediante
-    bootstrap. Excluir estos meses (no aparecen en numerador ni en
+    Son los meses que rellena la augmentación sintética de la cohorte
+    (`_loader.SYNTHETIC_INCOMPLETE_MONTHS`), para que numerador y
+    denominador del bed_capacity coincidan con el periodo que el loader
+    tuvo que rellenar mediante bootstrap. Excluir estos meses (no aparecen en numerador ni en
     denominador) preserva el ratio anual sobre los meses con datos
     completos: equivale a anualizar la ocupación observada en lo que
     sí está cargado.
     """
-    from demographics._loader import SYNTHETIC_DATE_RANGE
-    start, end = SYNTHETIC_DATE_RANGE
-    months: set[tuple[int, int]] = set()
-    y, m = start.year, start.month
-    while (y, m) <= (end.year, end.month):
-        months.add((y, m))
-        m += 1
-        if m > 12:
-            m = 1
-            y += 1
-    return months
+    from indicadors_iso.demographics._loader import SYNTHETIC_INCOMPLETE_MONTHS
+    return {(int(y), int(m)) for y, m in SYNTHETIC_INCOMPLETE_MONTHS}
 
 
 def compute_bed_occupancy_nominal(
@@ -144,7 +294,7 @@ def compute_bed_occupancy_nominal(
 
     `exclude_months` permite descartar meses con carga incompleta del
     data warehouse (Nov-Dic 2025 mientras los datos no han aterrizado).
-    Si es None se autodetecta a partir de `_loader.SYNTHETIC_DATE_RANGE`,
+    Si es None se autodetecta a partir de `_loader.SYNTHETIC_INCOMPLETE_MONTHS`,
     coincidiendo con el periodo que el loader rellena por bootstrap en
     la cohorte. Pasar `exclude_months=[]` desactiva la exclusión.
     """
@@ -168,17 +318,18 @@ def compute_bed_occupancy_nominal(
 
     excluded_per_year: dict[int, int] = {}
     if exclude_set:
-        ym_pairs = list(zip(monthly["year"].astype(int), monthly["month"].astype(int)))
-        excl_mask = pd.Series(
-            [(y, m) in exclude_set for y, m in ym_pairs], index=monthly.index
+        ym = pd.MultiIndex.from_arrays(
+            [monthly["year"].astype(int), monthly["month"].astype(int)]
         )
+        excl_mask = pd.Series(ym.isin(list(exclude_set)), index=monthly.index)
         excluded_rows = monthly[excl_mask]
         # Cuántos meses calendario distintos descartamos por año (1 evento
         # cuenta una vez aunque aparezca en E073 e I073).
-        for y, sub in excluded_rows.groupby(excluded_rows["year"].astype(int)):
-            excluded_per_year[int(y)] = int(
-                sub["month"].astype(int).nunique()
-            )
+        excluded_per_year = {
+            int(y): int(n)
+            for y, n in excluded_rows["month"].astype(int)
+            .groupby(excluded_rows["year"].astype(int)).nunique().items()
+        }
         monthly = monthly[~excl_mask].copy()
         if verbose and excluded_per_year:
             summary = ", ".join(
@@ -191,15 +342,16 @@ def compute_bed_occupancy_nominal(
         if monthly.empty:
             return monthly
 
-    mapped = monthly.apply(
-        lambda r: lookup_capacity_for_month(
-            int(r["year"]), int(r["month"]), str(r["unit"])
-        ),
-        axis=1,
-    )
-    monthly["effective_unit"] = mapped.map(lambda x: x[0] if x else None)
-    monthly["nominal_beds"] = mapped.map(lambda x: x[1] if x else None)
-    monthly["regimen"] = mapped.map(lambda x: x[2] if x else None)
+    # Join por intervalos contra las épocas precompiladas (sin `apply`
+    # fila a fila): el mes se evalúa en su día 1, como en
+    # `lookup_capacity_for_month`.
+    month_start = pd.to_datetime(pd.DataFrame({
+        "year": monthly["year"].astype(int),
+        "month": monthly["month"].astype(int),
+        "day": 1,
+    }))
+    mapped = lookup_capacity(monthly["unit"], month_start)
+    monthly[["effective_unit", "nominal_beds", "regimen"]] = mapped
     monthly = monthly.dropna(subset=["effective_unit"])
     if monthly.empty:
         return monthly
@@ -234,11 +386,8 @@ def compute_bed_occupancy_nominal(
             max_active_place_refs=("n_active_place_refs", "max"),
         )
     )
-    yearly["pct"] = yearly.apply(
-        lambda r: (r["bed_hours_used"] / r["bed_hours_available"] * 100)
-        if r["bed_hours_available"] > 0 else float("nan"),
-        axis=1,
-    )
+    available = yearly["bed_hours_available"].where(yearly["bed_hours_available"] > 0)
+    yearly["pct"] = yearly["bed_hours_used"] / available * 100
     yearly["year"] = yearly["year"].astype(int)
     yearly["n_months_excluded"] = (
         yearly["year"].map(excluded_per_year).fillna(0).astype(int)
@@ -5,6 +5,24 @@ La cohorte se descarga directamente de Metabase **año a año** vía
 2000 filas por respuesta. Cada anualidad de E073+I073 cabe holgadamente
 bajo ese tope.
 
+Sincronización incremental:
+    Por defecto cada año descargado se guarda en
+    `output/_yearly_store/cohort_<hash de la plantilla>/`. En la
+    siguiente ejecución un sondeo barato (`COHORT_WATERMARK_SQL`: nº de
+    movimientos y `max(load_date)` por año de las unidades que indique
+    el llamador con `watermark_units`, o la SQL que pase en
+    `watermark_sql`) decide qué años han cambiado; solo esos (en la práctica, el año en curso) se
+    vuelven a pedir a Metabase. Un año con estancias aún abiertas
+    (`still_admitted = "Yes"`) se re-descarga siempre, y toda partición
+    caduca a los `COHORT_STORE_MAX_AGE_DAYS` días para recoger cambios
+    tardíos de otras tablas (diagnósticos, exitus…). Sin marca de agua
+    la carga no es incremental.
+
+Tipos:
+    La cohorte se devuelve con los tipos compactos de
+    `demographics._schemas.COHORT_SCHEMA` (refs int64, unidades / sexo /
+    "Yes"-"No" como category, fechas datetime64[Europe/Madrid], flags int8).
+
 Augmentación sintética 2025:
     La BBDD dejó de cargar a finales de 2025, por lo que falta Nov-Dic.
     Para mantener un reporting visualmente comparable con 2024 (año
@@ -20,8 +38,8 @@ Augmentación sintética 2025:
         para no colisionar con los reales.
       - Mantienen idénticas todas las variables clínicas (edad, sexo,
         AISBE, cirrosis, procedencia, etc.) → proporciones preservadas.
-      - Reubican `admission_date` aleatoria en `SYNTHETIC_DATE_RANGE`
-        (Nov-Dic 2025 por defecto).
+      - Reubican `admission_date` aleatoria (hora local) en los meses
+        de `SYNTHETIC_INCOMPLETE_MONTHS` (Nov-Dic 2025 por defecto).
       - Desplazan `exitus_date` por el mismo delta que la admisión, así
         las cuentas de mortalidad 30/90 d siguen coherentes.
       - Marcan `still_admitted = "No"` y `synthetic = True`.
@@ -29,24 +47,93 @@ Augmentación sintética 2025:
     Cuando lleguen los datos reales el bootstrap deja de añadir filas
     automáticamente: si `n_real >= target`, el loader avisa y no inyecta
     nada.
+
+    El resultado es idéntico entre ejecuciones (la semilla de cada grupo
+    sale de un digest, no de `hash()`), así que puede cachearse.
 """
 from __future__ import annotations
 
-import random
-from datetime import datetime, timedelta
-from typing import Optional, Union
+import hashlib
+from typing import Callable, Iterable, Optional, Union
 
+import numpy as np
 import pandas as pd
 
-from indicadors_iso.connection import execute_query_yearly
+from indicadors_iso._dtypes import apply_schema
+from indicadors_iso._query_cache import query_fingerprint
+from indicadors_iso.connection import (
+    execute_query_yearly,
+    execute_query_yearly_incremental,
+)
+from indicadors_iso.demographics._schemas import COHORT_SCHEMA
+from indicadors_iso.demographics._stays_sql import DB_TIMEZONE
 
 # ---------------------------------------------------------------------------
-# Augmentación sintética 2025 — TEMPORAL
+# Sincronización incremental de la cohorte
 # ---------------------------------------------------------------------------
-SYNTHETIC_DATE_RANGE = (
-    datetime(2025, 11, 1),
-    datetime(2025, 12, 31, 23, 59, 59),
+COHORT_WATERMARK_SQL = """
+SELECT
+    year(start_date) AS year,
+    COUNT(*) AS n_movements,
+    MAX(load_date) AS max_load_date
+FROM datascope_gestor_prod.movements
+WHERE ou_loc_ref IN ({units_in})
+  AND start_date BETWEEN timestamp '{min_year}-01-01 00:00:00'
+                     AND timestamp '{max_year}-12-31 23:59:59'
+GROUP BY year(start_date)
+"""
+COHORT_STORE_MAX_AGE_DAYS = 30
+
+
+def cohort_watermark_sql(units: Iterable[str]) -> Callable[[int, int], str]:
+    """Sondeo `COHORT_WATERMARK_SQL` para `units` como función
+    `(min_year, max_year) -> SQL`."""
+    units_list = sorted({str(u) for u in units})
+    if not units_list:
+        raise ValueError("`units` no puede estar vacío.")
+    units_in = ",".join(f"'{u}'" for u in units_list)
+
+    def render(min_year: int, max_year: int) -> str:
+        return COHORT_WATERMARK_SQL.format(
+            min_year=min_year, max_year=max_year, units_in=units_in
+        )
+
+    return render
+
+
+# Columnas que se conservan siempre al recortar la proyección de la
+# cohorte (`load_cohort(columns=…)`): claves de estancia para los
+# merges de los subloaders, `still_admitted` para el almacén
+# incremental y las que reescribe la augmentación sintética.
+PROJECTION_KEY_COLS = (
+    "patient_ref",
+    "episode_ref",
+    "ou_loc_ref",
+    "stay_id",
+    "admission_date",
+    "discharge_date",
+    "effective_discharge_date",
+    "hours_stay",
+    "still_admitted",
+    "year_admission",
+    "exitus_date",
 )
+
+
+def project_sql(sql: str, columns) -> str:
+    """Envuelve `sql` en un SELECT que solo devuelve `columns`."""
+    body = sql.strip().rstrip(";")
+    cols = ",\n    ".join(f"q.{c}" for c in columns)
+    return f"SELECT\n    {cols}\nFROM (\n{body}\n) q\n"
+
+
+# ---------------------------------------------------------------------------
+# Augmentación sintética 2025 — TEMPORAL
+# ---------------------------------------------------------------------------
+# Meses (año, mes) sin cargar en el DW. Las admisiones sintéticas se
+# reparten uniformemente sobre todos ellos (no tienen por qué ser
+# consecutivos) y `_bed_occupancy` los excluye del % de ocupación.
+SYNTHETIC_INCOMPLETE_MONTHS = ((2025, 11), (2025, 12))
 SYNTHETIC_RANDOM_SEED = 42
 SYNTHETIC_YEAR = 2025
 SYNTHETIC_LOOKBACK_YEARS = 3  # promedio sobre los 3 años previos
@@ -58,9 +145,13 @@ SYNTHETIC_LOOKBACK_YEARS = 3  # promedio sobre los 3 años previos
 def load_cohort(
     min_year: int,
     max_year: int,
-    sql_template: str,
+    sql_template: Union[str, Callable[[int, int], str]],
     synthetic_group_col: Optional[str] = None,
     skip_synthetic: bool = False,
+    incremental: bool = True,
+    columns: Optional[list[str]] = None,
+    watermark_units: Optional[Iterable[str]] = None,
+    watermark_sql: Optional[Callable[[int, int], str]] = None,
 ) -> pd.DataFrame:
     """Descarga la cohorte de Metabase año a año y la concatena.
 
@@ -72,7 +163,9 @@ def load_cohort(
         min_year, max_year: rango (inclusivo) por `year_admission`.
         sql_template: plantilla SQL con `{min_year}` / `{max_year}` —
             la función la rellena con el mismo año en ambos campos para
-            cada chunk.
+            cada chunk. También acepta una función `(min_year, max_year)
+            -> SQL` para plantillas que no caben en un `str.format`
+            (p.ej. la query consolidada de `per_unit/_wide_sql.py`).
         synthetic_group_col: si se pasa (p.ej. "ou_loc_ref"), el target
             y el bootstrap se calculan por grupo. Si es None, se aplican
             de forma global a toda la cohorte 2025.
@@ -81,18 +174,72 @@ def load_cohort(
             enriquecen la cohorte (p.ej. mergear SOFA) y luego invocan
             `compute_3y_mean_target` + `augment_synthetic_2025`
             manualmente sobre el resultado enriquecido.
+        incremental: si True (por defecto), reutiliza los años guardados
+            cuya marca de agua no ha cambiado (ver docstring del
+            módulo). False = descarga completa como antes. Sólo aplica
+            si se pasa `watermark_units` o `watermark_sql`; sin ellos no
+            hay forma de saber si la fuente de la plantilla cambió y la
+            descarga es completa.
+        watermark_units: unidades (`ou_loc_ref`) de las que sale la
+            cohorte; el sondeo mira sus `movements`
+            (`cohort_watermark_sql`).
+        watermark_sql: sondeo propio `(min_year, max_year) -> SQL` para
+            plantillas con otras fuentes; tiene prioridad sobre
+            `watermark_units`.
+        columns: si se pasa (p.ej. `_metrics.metric_columns(["age", …])`),
+            la query se envuelve en un SELECT que solo devuelve esas
+            columnas más `PROJECTION_KEY_COLS`. Menos columnas que
+            serializar en Metabase y transferir por cada año.
     """
     print(
         f"[loader] descargando cohorte año a año desde Metabase "
         f"({min_year}-{max_year})…"
     )
 
-    df = execute_query_yearly(
-        lambda year: sql_template.format(min_year=year, max_year=year),
-        min_year,
-        max_year,
-        label="cohort",
-    )
+    if callable(sql_template):
+        render_range = sql_template
+        # Huella del almacén: la query renderizada con un año ficticio.
+        template_text = sql_template(0, 0)
+    else:
+        def render_range(lo, hi):
+            return sql_template.format(min_year=lo, max_year=hi)
+
+        template_text = sql_template
+
+    if columns is not None:
+        full_render = render_range
+        keep = list(PROJECTION_KEY_COLS) + [
+            c for c in columns if c not in PROJECTION_KEY_COLS
+        ]
+
+        def render_range(lo, hi):
+            return project_sql(full_render(lo, hi), keep)
+
+        template_text = render_range(0, 0)
+
+    def render(year):
+        return render_range(year, year)
+
+    if watermark_sql is None and watermark_units is not None:
+        watermark_sql = cohort_watermark_sql(watermark_units)
+    if incremental and watermark_sql is None:
+        print("[loader] sin marca de agua para esta plantilla: descarga completa.")
+        incremental = False
+
+    if incremental:
+        df = execute_query_yearly_incremental(
+            render,
+            watermark_sql,
+            min_year,
+            max_year,
+            store=f"cohort_{query_fingerprint(template_text)[:12]}",
+            label="cohort",
+            max_age_days=COHORT_STORE_MAX_AGE_DAYS,
+            is_final=_no_open_stays,
+        )
+    else:
+        df = execute_query_yearly(render, min_year, max_year, label="cohort")
+    df = apply_schema(df, COHORT_SCHEMA, label="loader")
 
     if not skip_synthetic and min_year <= SYNTHETIC_YEAR <= max_year and not df.empty:
         target = compute_3y_mean_target(
@@ -107,6 +254,14 @@ def load_cohort(
     return df
 
 
+def _no_open_stays(df: pd.DataFrame) -> bool:
+    """Una anualidad es definitiva si no quedan estancias abiertas (sus
+    horas/días de estancia dependen de `current_timestamp`)."""
+    if "still_admitted" not in df.columns:
+        return True
+    return not (df["still_admitted"] == "Yes").any()
+
+
 # ---------------------------------------------------------------------------
 # Cálculo de target sintético
 # ---------------------------------------------------------------------------
@@ -128,7 +283,7 @@ def compute_3y_mean_target(
 
     if group_col is not None and group_col in df.columns:
         targets: dict[str, int] = {}
-        for value, group in src.groupby(group_col):
+        for value, group in src.groupby(group_col, observed=True):
             counts = group.groupby("year_admission").size()
             present = counts.reindex(years_to_avg, fill_value=0)
             targets[str(value)] = int(round(present.mean())) if len(present) else 0
@@ -147,14 +302,23 @@ def augment_synthetic_2025(
     target: Union[int, dict],
     group_col: Optional[str] = None,
     seed: int = SYNTHETIC_RANDOM_SEED,
+    months: Optional[Iterable[tuple[int, int]]] = None,
 ) -> pd.DataFrame:
-    """Bootstrap-sampling de estancias 2025 para rellenar Nov-Dic.
+    """Bootstrap-sampling de estancias 2025 para rellenar los meses sin
+    cargar (`months`, por defecto `SYNTHETIC_INCOMPLETE_MONTHS`).
 
     No modifica el CSV en disco. Las filas sintéticas son copias de filas
     reales 2025 con IDs y fechas reescritas; preservan todas las
     variables clínicas. Si `target` es dict y `group_col` está definido,
-    aplica el target por grupo (p.ej. 'E073' y 'I073' por separado).
+    aplica el target por grupo (p.ej. 'E073' y 'I073' por separado), con
+    una semilla por grupo estable entre ejecuciones (`_group_seed`).
     """
+    months = tuple(SYNTHETIC_INCOMPLETE_MONTHS if months is None else months)
+    if any(int(y) != SYNTHETIC_YEAR for y, _m in months):
+        raise ValueError(
+            f"augment_synthetic_2025: los meses a rellenar deben ser de "
+            f"{SYNTHETIC_YEAR} (recibido {list(months)})."
+        )
     if "year_admission" not in df.columns:
         return df
 
@@ -195,14 +359,17 @@ def augment_synthetic_2025(
             summary_parts.append(f"{grp_value}: {n_real}→{n_real + n_needed}")
             if n_needed == 0 or n_real == 0:
                 continue
-            chunks.append(_make_synthetic_rows(grp_src, n_needed, seed + hash(str(grp_value)) % 10000))
+            chunks.append(_make_synthetic_rows(
+                grp_src, n_needed, _group_seed(seed, grp_value), months,
+                first_id=total_added,
+            ))
             total_added += n_needed
     else:
         n_real = len(src_full_2025)
         n_needed = max(int(target or 0) - n_real, 0)
         summary_parts.append(f"global: {n_real}→{n_real + n_needed}")
         if n_needed > 0:
-            chunks.append(_make_synthetic_rows(src_full_2025, n_needed, seed))
+            chunks.append(_make_synthetic_rows(src_full_2025, n_needed, seed, months))
             total_added = n_needed
 
     if total_added == 0:
@@ -212,7 +379,10 @@ def augment_synthetic_2025(
         )
         return df
 
-    out = pd.concat(chunks, ignore_index=True)
+    # Las filas sintéticas traen IDs "SYN…" (y la cohorte puede venir con
+    # fechas en texto): se vuelve a aplicar el schema para que la cohorte
+    # final tenga tipos homogéneos.
+    out = apply_schema(pd.concat(chunks, ignore_index=True), COHORT_SCHEMA)
     print(
         f"[loader] AUGMENTACION SINTETICA 2025: +{total_added} filas "
         f"({'; '.join(summary_parts)})."
@@ -224,54 +394,72 @@ def augment_synthetic_2025(
     return out
 
 
+def _group_seed(seed: int, group) -> int:
+    """Semilla del grupo `group`, estable entre ejecuciones (a diferencia
+    de `hash()`, que cambia con PYTHONHASHSEED)."""
+    digest = hashlib.sha256(f"{seed}:{group}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def _month_bounds(months) -> tuple[np.ndarray, np.ndarray]:
+    """Inicio (datetime64[s]) y duración en segundos de cada mes."""
+    starts = np.array([f"{int(y):04d}-{int(m):02d}" for y, m in sorted(set(months))],
+                      dtype="datetime64[M]")
+    spans = ((starts + 1).astype("datetime64[s]") - starts.astype("datetime64[s]"))
+    return starts.astype("datetime64[s]"), spans.astype("int64")
+
+
 def _make_synthetic_rows(
-    template_df: pd.DataFrame, n_needed: int, seed: int
+    template_df: pd.DataFrame,
+    n_needed: int,
+    seed: int,
+    months=SYNTHETIC_INCOMPLETE_MONTHS,
+    first_id: int = 0,
 ) -> pd.DataFrame:
-    """Bootstrap-sampling sobre `template_df` produciendo `n_needed` filas."""
-    synth = template_df.sample(
-        n=n_needed, replace=True, random_state=seed
-    ).reset_index(drop=True)
-
-    rng = random.Random(seed)
-    start, end = SYNTHETIC_DATE_RANGE
-    span_seconds = int((end - start).total_seconds())
-
-    new_admissions = [
-        start + timedelta(seconds=rng.randint(0, span_seconds))
-        for _ in range(n_needed)
-    ]
-
-    hours_stay = (
-        pd.to_numeric(synth["hours_stay"], errors="coerce")
-        .fillna(0)
-        .astype(int)
-        .tolist()
+    """Bootstrap-sampling sobre `template_df` produciendo `n_needed` filas.
+
+    Todo vectorizado: muestreo con `numpy.random.Generator`, admisiones
+    uniformes (al segundo) sobre la unión de `months` en hora local y
+    altas / éxitus desplazados con aritmética datetime64. Las fechas
+    salen ya como datetime64 en `DB_TIMEZONE`, igual que las reales
+    (sin pasar por texto). Los IDs son
+    `SYN2025-{first_id + i:05d}` para no repetirse entre grupos.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(template_df), size=n_needed)
+    synth = template_df.iloc[rows].reset_index(drop=True)
+
+    starts, spans = _month_bounds(months)
+    ends = np.cumsum(spans)
+    offsets = rng.integers(0, ends[-1], size=n_needed)
+    which = np.searchsorted(ends, offsets, side="right")
+    local = starts[which] + (offsets - (ends - spans)[which]).astype("timedelta64[s]")
+    new_admissions = (
+        pd.DatetimeIndex(local)
+        .tz_localize(DB_TIMEZONE, ambiguous=np.zeros(n_needed, dtype=bool),
+                     nonexistent="shift_forward")
     )
-    new_discharges = [
-        adm + timedelta(hours=h) for adm, h in zip(new_admissions, hours_stay)
-    ]
-
-    src_admission_dt = pd.to_datetime(synth["admission_date"], errors="coerce", utc=True)
-    src_exitus_dt = pd.to_datetime(synth["exitus_date"], errors="coerce", utc=True)
-    delta_exitus = src_exitus_dt - src_admission_dt
-
-    new_exitus_strs: list[Optional[str]] = []
-    for adm, d in zip(new_admissions, delta_exitus):
-        if pd.isna(d):
-            new_exitus_strs.append(None)
-        else:
-            new_exitus_strs.append((adm + d.to_pytimedelta()).strftime("%Y-%m-%d"))
 
-    synth["patient_ref"] = [f"SYN2025-{i:05d}" for i in range(n_needed)]
-    synth["episode_ref"] = [f"SYN2025E-{i:05d}" for i in range(n_needed)]
+    hours_stay = pd.to_numeric(synth["hours_stay"], errors="coerce").fillna(0).astype("int64")
+    new_discharges = new_admissions + pd.to_timedelta(hours_stay.to_numpy(), unit="h")
+
+    src_admission_dt = pd.to_datetime(
+        synth["admission_date"], errors="coerce", utc=True, format="ISO8601"
+    )
+    src_exitus_dt = pd.to_datetime(
+        synth["exitus_date"], errors="coerce", utc=True, format="ISO8601"
+    )
+    delta_exitus = (src_exitus_dt - src_admission_dt).to_numpy()
+
+    ids = pd.Series(np.arange(first_id, first_id + n_needed)).astype(str).str.zfill(5)
+    synth["patient_ref"] = f"SYN{SYNTHETIC_YEAR}-" + ids
+    synth["episode_ref"] = f"SYN{SYNTHETIC_YEAR}E-" + ids
     synth["stay_id"] = 1
-    synth["admission_date"] = [adm.strftime("%Y-%m-%dT%H:%M:%S") for adm in new_admissions]
-    synth["discharge_date"] = [d.strftime("%Y-%m-%dT%H:%M:%S") for d in new_discharges]
-    synth["effective_discharge_date"] = [
-        d.strftime("%Y-%m-%dT%H:%M:%S+01:00") for d in new_discharges
-    ]
+    synth["admission_date"] = new_admissions
+    synth["discharge_date"] = new_discharges
+    synth["effective_discharge_date"] = new_discharges
     synth["still_admitted"] = "No"
     synth["year_admission"] = SYNTHETIC_YEAR
-    synth["exitus_date"] = new_exitus_strs
+    synth["exitus_date"] = new_admissions + delta_exitus
     synth["synthetic"] = True
     return synth
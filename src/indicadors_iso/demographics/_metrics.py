@@ -1,5 +1,8 @@
-from typing import Optional
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Callable, Iterable, Optional
 
+import numpy as np
 import pandas as pd
 
 from indicadors_iso.demographics._bed_capacity_eras import COMBINED_UNIT_LABEL
@@ -16,47 +19,176 @@ CP_CLINIC = [
     "08022", "08028", "08029", "08034", "08036", "08038",
 ]
 
-# (name, csv_label, html_label, section_key, style)
-_ROW_DEFS = [
-    ("n_stays",   "N estancias",                                 "N estancias",                   "demo",               "bold"),
-    ("n_patients","N pacientes",                                 "N pacientes",                   "demo",               "bold"),
-    ("occupancy", "Ocupaci\u00f3n de camas (%)",                 "Ocupaci\u00f3n de camas",       "demo",               ""),
-    # (*) en la columna de ocupaci\u00f3n indica que ese a\u00f1o incluye
-    # meses de la \u00e9poca COVID (2020-03 \u2192 2022-02): durante ese
+# ---------------------------------------------------------------------------
+# Registro de métricas
+# ---------------------------------------------------------------------------
+# Cada fila del resumen es un `Metric`: etiquetas y sección del informe,
+# columnas de la cohorte que lee (para recortar la proyección SQL, ver
+# `metric_columns`) y cómo se agrega por año:
+#   - "n_pct":  `compute` devuelve una máscara booleana por estancia (o
+#     por paciente-año con `level="patient"`); se cuenta por año frente
+#     a `denominator` (None = todas las filas del nivel).
+#   - "median": `compute` devuelve los valores numéricos; mediana [IQR]
+#     por año y de todos los años.
+#   - "text":   `compute` devuelve `(valores_por_año, total)` ya
+#     formateados.
+# `source` marca las métricas que dependen de un enriquecimiento
+# (SOFA, nutrición, autopsia): solo aparecen si la cohorte lo trae.
+# Para añadir una fila basta con añadir una entrada a `METRICS`; los
+# resultados intermedios compartidos viven en `_SummaryContext`.
+@dataclass(frozen=True)
+class Metric:
+    name: str
+    csv_label: str
+    html_label: str
+    section: str
+    kind: str                                   # "n_pct" | "median" | "text"
+    compute: Callable[["_SummaryContext"], object]
+    columns: tuple[str, ...] = ()
+    level: str = "stay"                         # "stay" | "patient" (n_pct)
+    denominator: Optional[Callable[["_SummaryContext"], pd.Series]] = None
+    source: Optional[str] = None                # "sofa" | "nutrition" | "autopsy"
+    style: str = ""
+    # n (%) cuyas celdas por año quedan en blanco si falta esta columna
+    # (el total sí se muestra, con numerador 0).
+    years_require: Optional[str] = None
+
+
+# Columnas que cualquier resumen necesita (filtro de estancias cerradas,
+# columnas por año, pacientes).
+SUMMARY_BASE_COLS = ("patient_ref", "year_admission", "still_admitted", "ou_loc_ref")
+
+_CIRR_COLS = ("has_cirrhosis", "liver_transplant_during_episode")
+_MORTALITY_COLS = ("exitus_during_stay", "admission_date", "exitus_date")
+
+# Qué indica que la cohorte trae cada enriquecimiento. Para SOFA no
+# basta con la columna: para una unidad que no es UCI (p.ej. I073) la
+# cohorte enriquecida SÍ trae `sofa_total` tras el merge, pero todos los
+# valores son NaN — así que se exige AL MENOS un valor real para no
+# ensuciar el informe con filas vacías.
+_SOURCE_PRESENT: dict[str, Callable[[pd.DataFrame], bool]] = {
+    "sofa": lambda df: (
+        "sofa_total" in df.columns
+        and bool(pd.to_numeric(df["sofa_total"], errors="coerce").notna().any())
+    ),
+    "nutrition": lambda df: (
+        "received_enteral" in df.columns or "received_parenteral" in df.columns
+    ),
+    "autopsy": lambda df: "received_autopsy" in df.columns,
+}
+
+
+def _mortality_metrics(
+    prefix: str, label: str, section: str, subgroup=None, columns=()
+) -> list[Metric]:
+    """Las tres filas de mortalidad (en estancia, 30 d, 90 d) de un subgrupo."""
+    rows = []
+    for key, csv_suffix, html_label in (
+        ("stay", "en estancia", "En estancia"),
+        ("30", "30 días", "A 30 días"),
+        ("90", "90 días", "A 90 días"),
+    ):
+        if subgroup is None:
+
+            def compute(ctx, k=key):
+                return ctx.deaths[k]
+
+        else:
+
+            def compute(ctx, k=key):
+                return ctx.deaths[k] & subgroup(ctx)
+
+        rows.append(Metric(
+            f"{prefix}_{key}", f"Mortalidad {label} - {csv_suffix} (n, %)", html_label,
+            section, "n_pct", compute, _MORTALITY_COLS + tuple(columns),
+            denominator=subgroup,
+        ))
+    return rows
+
+
+def _nutrition_time(ctx: "_SummaryContext", kind: str) -> pd.Series:
+    if f"received_{kind}" not in ctx.df.columns:
+        return pd.Series(dtype=float)
+    hours = ctx.numeric(f"hours_to_{kind}")
+    return hours[hours >= 0]
+
+
+METRICS: list[Metric] = [
+    Metric("n_stays", "N estancias", "N estancias", "demo", "text",
+           lambda ctx: ctx.counts("stay"), style="bold"),
+    Metric("n_patients", "N pacientes", "N pacientes", "demo", "text",
+           lambda ctx: ctx.counts("patient"), style="bold"),
+    # (*) en la columna de ocupación indica que ese año incluye
+    # meses de la época COVID (2020-03 → 2022-02): durante ese
     # tramo E073 e I073 se reportan agregadas como UCI sobre 12 camas.
-    ("age",       "Edad, mediana [IQR]",                         "Edad, mediana [IQR]",           "demo",               ""),
-    ("male",      "Sexo masculino (n, %)",                       "Sexo masculino",                "demo",               "indent"),
-    ("female",    "Sexo femenino (n, %)",                        "Sexo femenino",                 "demo",               "indent"),
-    ("spain",     "Nacionalidad espa\u00f1ola (n, %)",           "Nacionalidad espa\u00f1ola",    "demo",               "indent"),
-    ("other_nat", "Otras nacionalidades (n, %)",                 "Otras nacionalidades",          "demo",               "indent"),
-    ("aisbe",     "Pacientes AISBE (n, %)",                      "Pacientes AISBE",               "demo",               ""),
-    ("other_hosp","Procedencia otro hospital (n, %)",            "Procedencia otro hospital",     "demo",               ""),
-    ("los",       "Estancia (d\u00edas), mediana [IQR]",         "Estancia (d\u00edas), mediana [IQR]", "clinical",    ""),
-    ("cirr",      "Cirrosis (n, %)",                             "Cirrosis",                      "clinical",           ""),
-    ("readm24",   "Reingreso 24h (n, %)",                        "Reingreso 24h",                 "clinical",           ""),
-    ("readm72",   "Reingreso 72h (n, %)",                        "Reingreso 72h",                 "clinical",           ""),
-    ("sofa_all",  "SOFA al ingreso, mediana [IQR]",              "SOFA al ingreso, mediana [IQR]", "clinical",          ""),
-    ("sofa_full", "SOFA cobertura completa 6/6 (n, %)",          "SOFA cobertura 6/6",            "clinical",           "indent"),
-    ("sofa_cirr", "SOFA cirrosis, mediana [IQR]",                "SOFA cirrosis",                 "clinical",           "indent"),
-    ("sofa_oh",   "SOFA otro hospital, mediana [IQR]",           "SOFA otro hospital",            "clinical",           "indent"),
-    ("nutr_ent",   "Nutrición enteral (n, %)",                "Nutrición enteral",         "nutrition",          ""),
-    ("nutr_par",   "Nutrición parenteral (n, %)",             "Nutrición parenteral",      "nutrition",          ""),
-    ("nutr_t_ent", "Tiempo a inicio enteral (h), mediana [IQR]",   "Tiempo a inicio enteral (h)",   "nutrition",          "indent"),
-    ("nutr_t_par", "Tiempo a inicio parenteral (h), mediana [IQR]","Tiempo a inicio parenteral (h)","nutrition",          "indent"),
-    ("mg_stay",   "Mortalidad global - en estancia (n, %)",      "En estancia",                   "mortality",          ""),
-    ("mg_30",     "Mortalidad global - 30 d\u00edas (n, %)",     "A 30 d\u00edas",               "mortality",          ""),
-    ("mg_90",     "Mortalidad global - 90 d\u00edas (n, %)",     "A 90 d\u00edas",               "mortality",          ""),
-    ("autopsy",   "Autopsia/necropsia en \u00e9xitus (n, %)",         "Autopsia/necropsia en \u00e9xitus",  "mortality",          "indent"),
-    ("mc_stay",   "Mortalidad cirrosis - en estancia (n, %)",    "En estancia",                   "mortality-cirr",     ""),
-    ("mc_30",     "Mortalidad cirrosis - 30 d\u00edas (n, %)",   "A 30 d\u00edas",               "mortality-cirr",     ""),
-    ("mc_90",     "Mortalidad cirrosis - 90 d\u00edas (n, %)",   "A 90 d\u00edas",               "mortality-cirr",     ""),
-    ("mn_stay",   "Mortalidad no AISBE - en estancia (n, %)",    "En estancia",                   "mortality-noaisbe",  ""),
-    ("mn_30",     "Mortalidad no AISBE - 30 d\u00edas (n, %)",   "A 30 d\u00edas",               "mortality-noaisbe",  ""),
-    ("mn_90",     "Mortalidad no AISBE - 90 d\u00edas (n, %)",   "A 90 d\u00edas",               "mortality-noaisbe",  ""),
-    ("mo_stay",   "Mortalidad otro hospital - en estancia (n, %)","En estancia",                  "mortality-otherhosp","" ),
-    ("mo_30",     "Mortalidad otro hospital - 30 d\u00edas (n, %)","A 30 d\u00edas",              "mortality-otherhosp","" ),
-    ("mo_90",     "Mortalidad otro hospital - 90 d\u00edas (n, %)","A 90 d\u00edas",              "mortality-otherhosp","" ),
+    Metric("occupancy", "Ocupación de camas (%)", "Ocupación de camas", "demo",
+           "text", lambda ctx: ctx.occupancy),
+    Metric("age", "Edad, mediana [IQR]", "Edad, mediana [IQR]", "demo", "median",
+           lambda ctx: ctx.numeric("age_at_admission"), ("age_at_admission",)),
+    Metric("male", "Sexo masculino (n, %)", "Sexo masculino", "demo", "n_pct",
+           lambda ctx: ctx.patients["sex"] == "Male", ("sex",), level="patient",
+           style="indent"),
+    Metric("female", "Sexo femenino (n, %)", "Sexo femenino", "demo", "n_pct",
+           lambda ctx: ctx.patients["sex"] == "Female", ("sex",), level="patient",
+           style="indent"),
+    Metric("spain", "Nacionalidad española (n, %)", "Nacionalidad española", "demo",
+           "n_pct", lambda ctx: ctx.patient_spain, ("natio_ref",), level="patient",
+           style="indent"),
+    Metric("other_nat", "Otras nacionalidades (n, %)", "Otras nacionalidades", "demo",
+           "n_pct", lambda ctx: ~ctx.patient_spain, ("natio_ref",), level="patient",
+           style="indent"),
+    Metric("aisbe", "Pacientes AISBE (n, %)", "Pacientes AISBE", "demo", "n_pct",
+           lambda ctx: ctx.patient_aisbe, ("health_area", "postcode"), level="patient"),
+    Metric("other_hosp", "Procedencia otro hospital (n, %)", "Procedencia otro hospital",
+           "demo", "n_pct", lambda ctx: ctx.flag("from_other_hospital", ctx.patients),
+           ("from_other_hospital",), level="patient"),
+    Metric("los", "Estancia (días), mediana [IQR]", "Estancia (días), mediana [IQR]",
+           "clinical", "median", lambda ctx: ctx.numeric("days_stay"), ("days_stay",)),
+    Metric("cirr", "Cirrosis (n, %)", "Cirrosis", "clinical", "n_pct",
+           lambda ctx: ctx.cirrhosis, _CIRR_COLS),
+    Metric("readm24", "Reingreso 24h (n, %)", "Reingreso 24h", "clinical", "n_pct",
+           lambda ctx: ctx.flag("readmission_24h"), ("readmission_24h",)),
+    Metric("readm72", "Reingreso 72h (n, %)", "Reingreso 72h", "clinical", "n_pct",
+           lambda ctx: ctx.flag("readmission_72h"), ("readmission_72h",)),
+    # SOFA al ingreso: `sofa_total` solo existe si se ha mergeado la
+    # cohorte SOFA (per_unit/run.py).
+    Metric("sofa_all", "SOFA al ingreso, mediana [IQR]", "SOFA al ingreso, mediana [IQR]",
+           "clinical", "median", lambda ctx: ctx.numeric("sofa_total"), source="sofa"),
+    Metric("sofa_full", "SOFA cobertura completa 6/6 (n, %)", "SOFA cobertura 6/6",
+           "clinical", "n_pct", lambda ctx: ctx.numeric("sofa_components_available") == 6,
+           source="sofa", style="indent", years_require="sofa_components_available"),
+    Metric("sofa_cirr", "SOFA cirrosis, mediana [IQR]", "SOFA cirrosis", "clinical", "median",
+           lambda ctx: ctx.numeric("sofa_total")[ctx.cirrhosis], _CIRR_COLS,
+           source="sofa", style="indent"),
+    Metric("sofa_oh", "SOFA otro hospital, mediana [IQR]", "SOFA otro hospital", "clinical",
+           "median", lambda ctx: ctx.numeric("sofa_total")[ctx.flag("from_other_hospital")],
+           ("from_other_hospital",), source="sofa", style="indent"),
+    Metric("nutr_ent", "Nutrición enteral (n, %)", "Nutrición enteral", "nutrition", "n_pct",
+           lambda ctx: ctx.flag("received_enteral"), source="nutrition"),
+    Metric("nutr_par", "Nutrición parenteral (n, %)", "Nutrición parenteral", "nutrition",
+           "n_pct", lambda ctx: ctx.flag("received_parenteral"), source="nutrition"),
+    Metric("nutr_t_ent", "Tiempo a inicio enteral (h), mediana [IQR]",
+           "Tiempo a inicio enteral (h)", "nutrition", "median",
+           lambda ctx: _nutrition_time(ctx, "enteral"), source="nutrition", style="indent"),
+    Metric("nutr_t_par", "Tiempo a inicio parenteral (h), mediana [IQR]",
+           "Tiempo a inicio parenteral (h)", "nutrition", "median",
+           lambda ctx: _nutrition_time(ctx, "parenteral"), source="nutrition",
+           style="indent"),
+    *_mortality_metrics("mg", "global", "mortality"),
+    Metric("autopsy", "Autopsia/necropsia en éxitus (n, %)",
+           "Autopsia/necropsia en éxitus", "mortality", "n_pct",
+           lambda ctx: ctx.flag("received_autopsy") & ctx.deaths["stay"],
+           ("exitus_during_stay",), denominator=lambda ctx: ctx.deaths["stay"],
+           source="autopsy", style="indent"),
+    *_mortality_metrics("mc", "cirrosis", "mortality-cirr",
+                        lambda ctx: ctx.cirrhosis, _CIRR_COLS),
+    *_mortality_metrics("mn", "no AISBE", "mortality-noaisbe",
+                        lambda ctx: ~ctx.stay_aisbe, ("health_area", "postcode")),
+    *_mortality_metrics("mo", "otro hospital", "mortality-otherhosp",
+                        lambda ctx: ctx.flag("from_other_hospital"), ("from_other_hospital",)),
 ]
+METRICS_BY_NAME = {m.name: m for m in METRICS}
+
 
 _SECTION_DEFS = [
     ("demo",                "Demograf\u00eda",                       "demo"),
@@ -95,41 +227,259 @@ def _classify_aisbe(patient_df: pd.DataFrame) -> pd.Series:
     return is_abs | is_cp
 
 
-def _mortality(sub: pd.DataFrame) -> dict:
-    """Compute in-stay, 30-day and 90-day mortality from admission date."""
-    n = len(sub)
-    if n == 0:
-        return {
-            "deaths_stay": 0, "deaths_30": 0, "deaths_90": 0, "n": 0,
-            "stay_fmt": "", "d30_fmt": "", "d90_fmt": "",
-        }
+def _median_iqr_by(values: pd.Series, groups: pd.Series) -> dict:
+    """`_format_median_iqr` de cada grupo con una sola ordenación.
+
+    Reproduce la interpolación lineal de `Series.quantile` (`_lerp` de
+    NumPy) y la mediana de `Series.median` (media de los dos centrales)
+    para que el texto coincida exactamente con el cálculo por grupo.
+    """
+    frame = pd.DataFrame({"g": groups.reindex(values.index), "v": values}).dropna()
+    if frame.empty:
+        return {}
+    frame = frame.sort_values(["g", "v"], kind="mergesort")
+    sorted_values = frame["v"].to_numpy(dtype=float)
+    counts = frame.groupby("g", sort=True).size()
+    n = counts.to_numpy()
+    starts = np.concatenate(([0], np.cumsum(n)[:-1]))
+
+    def quantile(q: float) -> np.ndarray:
+        virtual = (n - 1) * q
+        previous = np.floor(virtual)
+        gamma = virtual - previous
+        below = sorted_values[starts + previous.astype(int)]
+        above = sorted_values[starts + np.minimum(previous.astype(int) + 1, n - 1)]
+        diff = above - below
+        return np.where(gamma >= 0.5, above - diff * (1 - gamma), below + diff * gamma)
+
+    mid = starts + n // 2
+    median = np.where(
+        n % 2 == 1,
+        sorted_values[mid],
+        (sorted_values[np.maximum(mid - 1, starts)] + sorted_values[mid]) / 2,
+    )
+    q1, q3 = quantile(0.25), quantile(0.75)
+    return {
+        key: f"{q2:.1f} [{lo:.1f}-{hi:.1f}]"
+        for key, lo, q2, hi in zip(counts.index, q1, median, q3)
+    }
 
-    deaths_stay = int((sub["exitus_during_stay"] == "Yes").sum())
 
-    admission_dt = pd.to_datetime(sub["admission_date"], errors="coerce", utc=True)
-    exitus_dt = pd.to_datetime(sub["exitus_date"], errors="coerce", utc=True)
+def _mortality_flags(df: pd.DataFrame) -> dict[str, pd.Series]:
+    """Muerte en estancia, a 30 y a 90 días del ingreso, por estancia."""
+    admission_dt = pd.to_datetime(df["admission_date"], errors="coerce", utc=True)
+    exitus_dt = pd.to_datetime(df["exitus_date"], errors="coerce", utc=True)
     valid = exitus_dt.notna() & admission_dt.notna()
     delta = (exitus_dt - admission_dt).dt.total_seconds() / 86400
-
-    deaths_30 = int((valid & (delta >= 0) & (delta <= 30)).sum())
-    deaths_90 = int((valid & (delta >= 0) & (delta <= 90)).sum())
-
     return {
-        "deaths_stay": deaths_stay,
-        "deaths_30": deaths_30,
-        "deaths_90": deaths_90,
-        "n": n,
-        "stay_fmt": _fmt_n_pct(deaths_stay, n),
-        "d30_fmt": _fmt_n_pct(deaths_30, n),
-        "d90_fmt": _fmt_n_pct(deaths_90, n),
+        "stay": df["exitus_during_stay"] == "Yes",
+        "30": valid & (delta >= 0) & (delta <= 30),
+        "90": valid & (delta >= 0) & (delta <= 90),
     }
 
 
+def _occupancy_text(
+    bed_occupancy: Optional[pd.DataFrame], units_in_cohort: list[str]
+) -> tuple[dict[int, str], str]:
+    """Ocupación de camas por año y total, ya formateada."""
+    # Filtrado y agregación de la ocupación de camas. El bed_occupancy
+    # esperado proviene de `compute_bed_occupancy_nominal()` y trae:
+    #   effective_unit ∈ {"E073", "I073", "UCI"}, year, regimen, used, avail.
+    # En la época `covid` E073 e I073 se colapsan en "UCI" (12 camas), así
+    # que para una cohorte que toque cualquiera de las dos unidades hay
+    # que aceptar también las filas "UCI". Marcamos los años que incluyen
+    # algún tramo COVID con un asterisco; la nota a pie de tabla explica
+    # que durante esa época el etiquetado por unidad no es interpretable.
+    occupancy_by_year: dict[int, str] = {}
+    occupancy_total_text: str = ""
+    if bed_occupancy is None or bed_occupancy.empty or not units_in_cohort:
+        return occupancy_by_year, occupancy_total_text
+    unit_col = (
+        "effective_unit"
+        if "effective_unit" in bed_occupancy.columns
+        else "unit"
+    )
+    allowed_units = set(units_in_cohort)
+    if any(u in {"E073", "I073"} for u in units_in_cohort):
+        allowed_units.add(COMBINED_UNIT_LABEL)
+    occ = bed_occupancy[bed_occupancy[unit_col].isin(allowed_units)].copy()
+    if not occ.empty:
+        occ["year"] = pd.to_numeric(occ["year"], errors="coerce").astype("Int64")
+        occ["bed_hours_used"] = pd.to_numeric(
+            occ["bed_hours_used"], errors="coerce"
+        ).fillna(0.0)
+        occ["bed_hours_available"] = pd.to_numeric(
+            occ["bed_hours_available"], errors="coerce"
+        ).fillna(0.0)
+        has_regimen = "regimen" in occ.columns
+        agg = {
+            "used": ("bed_hours_used", "sum"),
+            "avail": ("bed_hours_available", "sum"),
+        }
+        if has_regimen:
+            agg["covid_in_year"] = (
+                "regimen", lambda s: bool((s == "covid").any())
+            )
+        yearly = occ.groupby("year", as_index=False).agg(**agg)
+        for _, row in yearly.iterrows():
+            year_int = int(row["year"])
+            avail = float(row["avail"])
+            used = float(row["used"])
+            if avail > 0:
+                txt = f"{used / avail * 100:.1f}%"
+                if has_regimen and bool(row.get("covid_in_year", False)):
+                    txt += " *"
+                occupancy_by_year[year_int] = txt
+        total_used = float(yearly["used"].sum())
+        total_avail = float(yearly["avail"].sum())
+        if total_avail > 0:
+            occupancy_total_text = f"{total_used / total_avail * 100:.1f}%"
+            if has_regimen and bool(yearly["covid_in_year"].any()):
+                occupancy_total_text += " *"
+    return occupancy_by_year, occupancy_total_text
+
+
+class _SummaryContext:
+    """Resultados intermedios compartidos entre métricas.
+
+    Cada uno se calcula la primera vez que alguna métrica lo pide
+    (pacientes por año, fechas parseadas, máscaras de subgrupo…), así
+    que un resumen con pocas métricas no paga por el resto.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        years: list,
+        bed_occupancy: Optional[pd.DataFrame],
+    ):
+        self.df = df
+        self.years = years
+        self.year = df["year_admission"]
+        self.bed_occupancy = bed_occupancy
+        self._numeric: dict[str, pd.Series] = {}
+
+    def numeric(self, col: str) -> pd.Series:
+        """`col` como número (NaN si no existe la columna)."""
+        if col not in self._numeric:
+            if col in self.df.columns:
+                values = pd.to_numeric(self.df[col], errors="coerce")
+            else:
+                values = pd.Series(np.nan, index=self.df.index)
+            self._numeric[col] = values
+        return self._numeric[col]
+
+    def flag(self, col: str, frame: Optional[pd.DataFrame] = None) -> pd.Series:
+        """`col == 1` (NaN y columna ausente cuentan como 0)."""
+        frame = self.df if frame is None else frame
+        if col not in frame.columns:
+            return pd.Series(False, index=frame.index)
+        if frame is self.df:
+            values = self.numeric(col)
+        else:
+            values = pd.to_numeric(frame[col], errors="coerce")
+        return values.fillna(0) == 1
+
+    @cached_property
+    def patients(self) -> pd.DataFrame:
+        """Pacientes de cada año: su primera estancia del año (como un
+        `drop_duplicates` sobre el año)."""
+        return self.df[~self.df.duplicated(subset=["year_admission", "patient_ref"])]
+
+    @cached_property
+    def patient_spain(self) -> pd.Series:
+        natio = self.patients["natio_ref"].astype(object).fillna("").astype(str)
+        return natio == "ES"
+
+    @cached_property
+    def patient_aisbe(self) -> pd.Series:
+        return _classify_aisbe(self.patients)
+
+    @cached_property
+    def stay_aisbe(self) -> pd.Series:
+        """AISBE por estancia: la clasificación del paciente en ese año."""
+        return (
+            self.patient_aisbe.reindex(self.df.index)
+            .groupby([self.year, self.df["patient_ref"]], dropna=False, observed=True)
+            .transform("first")
+            .fillna(False)
+            .astype(bool)
+        )
+
+    @cached_property
+    def cirrhosis(self) -> pd.Series:
+        # "Cirrosis" excluye episodios con trasplante hepático: estos
+        # pacientes ingresan electivamente para trasplante y su mortalidad
+        # depende del trasplante, no de la cirrosis. Si el snapshot no
+        # trae la columna `liver_transplant_during_episode` (snapshot
+        # antiguo), se mantiene el comportamiento anterior.
+        cirr = self.numeric("has_cirrhosis").fillna(0) == 1
+        if "liver_transplant_during_episode" in self.df.columns:
+            cirr &= self.numeric("liver_transplant_during_episode").fillna(0) == 0
+        return cirr
+
+    @cached_property
+    def deaths(self) -> dict[str, pd.Series]:
+        return _mortality_flags(self.df)
+
+    @cached_property
+    def occupancy(self) -> tuple[dict, str]:
+        units = (
+            sorted(self.df["ou_loc_ref"].dropna().unique().tolist())
+            if "ou_loc_ref" in self.df.columns
+            else []
+        )
+        by_year, total = _occupancy_text(self.bed_occupancy, units)
+        return {y: by_year.get(int(y), "") for y in self.years}, total
+
+    def counts(self, level: str) -> tuple[dict, str]:
+        """N estancias / N pacientes por año y total."""
+        frame = self.df if level == "stay" else self.patients
+        per_year = frame.groupby("year_admission").size()
+        values = {y: str(int(per_year.get(y, 0))) for y in self.years}
+        if level == "stay":
+            return values, str(len(frame))
+        return values, str(self.df["patient_ref"].nunique(dropna=False))
+
+
+def select_metrics(names: Optional[Iterable[str]] = None) -> list[Metric]:
+    """Métricas de `names` en el orden del registro (todas si None)."""
+    if names is None:
+        return list(METRICS)
+    names = set(names)
+    unknown = sorted(names - set(METRICS_BY_NAME))
+    if unknown:
+        raise ValueError(
+            f"Métricas desconocidas: {unknown} (opciones: {list(METRICS_BY_NAME)})."
+        )
+    return [m for m in METRICS if m.name in names]
+
+
+def metric_columns(names: Optional[Iterable[str]] = None) -> list[str]:
+    """Columnas de la cohorte SQL que necesitan las métricas `names`.
+
+    Sirve para recortar la proyección de la query de la cohorte (ver
+    `_loader.load_cohort(columns=…)`). No incluye las columnas de los
+    enriquecimientos (`Metric.source`), que llegan por sus subloaders.
+    """
+    columns = list(SUMMARY_BASE_COLS)
+    for metric in select_metrics(names):
+        columns += [c for c in metric.columns if c not in columns]
+    return columns
+
+
+def metric_sources(names: Optional[Iterable[str]] = None) -> set[str]:
+    """Enriquecimientos (`"sofa"`, `"nutrition"`, `"autopsy"`) que
+    necesitan las métricas `names`."""
+    return {m.source for m in select_metrics(names) if m.source is not None}
+
+
 def compute_summary(
     df: pd.DataFrame,
     bed_occupancy: Optional[pd.DataFrame] = None,
+    metrics: Optional[Iterable[str]] = None,
 ) -> tuple[list[dict], list[int]]:
-    """Compute all metrics once and return structured sections + years list.
+    """Compute the requested metrics and return structured sections + years list.
 
     Args:
         df: cohort DataFrame.
@@ -139,11 +489,14 @@ def compute_summary(
             `bed_hours_used`, `bed_hours_available`, `pct`. If provided,
             the "Ocupación de camas" row is filled from this table. If
             None or empty, that row is left blank.
+        metrics: names from `METRICS` to compute (all if None). Sections
+            without any requested metric are omitted.
 
     Returns:
         (sections, years) where sections is a list of section dicts suitable
         for both HTML rendering and CSV flattening via _report.to_dataframe().
     """
+    selected = select_metrics(metrics)
     if df.empty:
         return [], []
 
@@ -156,396 +509,81 @@ def compute_summary(
     df["year_admission"] = df["year_admission"].astype(int)
 
     years = sorted(df["year_admission"].dropna().unique())
+    ctx = _SummaryContext(df, years, bed_occupancy)
 
-    units_in_cohort: list[str] = sorted(
-        u for u in df["ou_loc_ref"].dropna().unique().tolist()
-    ) if "ou_loc_ref" in df.columns else []
-
-    # Filtrado y agregación de la ocupación de camas. El bed_occupancy
-    # esperado proviene de `compute_bed_occupancy_nominal()` y trae:
-    #   effective_unit ∈ {"E073", "I073", "UCI"}, year, regimen, used, avail.
-    # En la época `covid` E073 e I073 se colapsan en "UCI" (12 camas), así
-    # que para una cohorte que toque cualquiera de las dos unidades hay
-    # que aceptar también las filas "UCI". Marcamos los años que incluyen
-    # algún tramo COVID con un asterisco; la nota a pie de tabla explica
-    # que durante esa época el etiquetado por unidad no es interpretable.
-    occupancy_by_year: dict[int, str] = {}
-    occupancy_total_text: str = ""
-    if bed_occupancy is not None and not bed_occupancy.empty and units_in_cohort:
-        unit_col = (
-            "effective_unit"
-            if "effective_unit" in bed_occupancy.columns
-            else "unit"
-        )
-        allowed_units = set(units_in_cohort)
-        if any(u in {"E073", "I073"} for u in units_in_cohort):
-            allowed_units.add(COMBINED_UNIT_LABEL)
-        occ = bed_occupancy[bed_occupancy[unit_col].isin(allowed_units)].copy()
-        if not occ.empty:
-            occ["year"] = pd.to_numeric(occ["year"], errors="coerce").astype("Int64")
-            occ["bed_hours_used"] = pd.to_numeric(
-                occ["bed_hours_used"], errors="coerce"
-            ).fillna(0.0)
-            occ["bed_hours_available"] = pd.to_numeric(
-                occ["bed_hours_available"], errors="coerce"
-            ).fillna(0.0)
-            has_regimen = "regimen" in occ.columns
-            agg = {
-                "used": ("bed_hours_used", "sum"),
-                "avail": ("bed_hours_available", "sum"),
-            }
-            if has_regimen:
-                agg["covid_in_year"] = (
-                    "regimen", lambda s: bool((s == "covid").any())
-                )
-            yearly = occ.groupby("year", as_index=False).agg(**agg)
-            for _, row in yearly.iterrows():
-                year_int = int(row["year"])
-                avail = float(row["avail"])
-                used = float(row["used"])
-                if avail > 0:
-                    txt = f"{used / avail * 100:.1f}%"
-                    if has_regimen and bool(row.get("covid_in_year", False)):
-                        txt += " *"
-                    occupancy_by_year[year_int] = txt
-            total_used = float(yearly["used"].sum())
-            total_avail = float(yearly["avail"].sum())
-            if total_avail > 0:
-                occupancy_total_text = f"{total_used / total_avail * 100:.1f}%"
-                if has_regimen and bool(yearly["covid_in_year"].any()):
-                    occupancy_total_text += " *"
+    # Las filas de un enriquecimiento que la cohorte no trae (p.ej. SOFA
+    # en unidades no UCI) se omiten para no ensuciar el informe.
+    present = {
+        source: _SOURCE_PRESENT[source](df)
+        for source in {m.source for m in selected if m.source is not None}
+    }
+    visible = [m for m in selected if m.source is None or present[m.source]]
 
     rows = {
-        name: {
-            "label": html_label,
-            "csv_label": csv_label,
+        m.name: {
+            "label": m.html_label,
+            "csv_label": m.csv_label,
             "values": {},
             "total": "",
-            "style": style,
+            "style": m.style,
             "sticky": False,
         }
-        for name, csv_label, html_label, _section, style in _ROW_DEFS
+        for m in visible
     }
 
-    # Totals accumulators
-    total_stays = 0
-    all_patients: set = set()
-    all_ages: list = []
-    total_male = total_female = 0
-    total_spain = total_other_nat = 0
-    total_aisbe = total_n_pat = 0
-    total_other_hosp = 0
-    all_los: list = []
-    total_cirr = total_readm24 = total_readm72 = 0
-    # `has_sofa` controla si las filas SOFA aparecen en el reporting.
-    # Para una unidad que no es UCI (p.ej. I073) la cohorte enriquecida
-    # SÍ trae la columna `sofa_total` tras el merge, pero todos los
-    # valores son NaN — así que comprobamos que haya AL MENOS un valor
-    # real para no ensuciar el informe con filas vacías.
-    has_sofa = (
-        "sofa_total" in df.columns
-        and pd.to_numeric(df["sofa_total"], errors="coerce").notna().any()
-    )
-    all_sofa: list = []
-    all_sofa_cirr: list = []
-    all_sofa_oh: list = []
-    total_sofa_n = 0
-    total_sofa_full = 0
-    has_nutrition = (
-        "received_enteral" in df.columns or "received_parenteral" in df.columns
-    )
-    total_nutr_ent = total_nutr_par = 0
-    all_t_ent: list = []
-    all_t_par: list = []
-    has_autopsy = "received_autopsy" in df.columns
-    total_autopsy = total_exitus_for_autopsy = 0
-    t_mg = {"stay": 0, "d30": 0, "d90": 0, "n": 0}
-    t_mc = {"stay": 0, "d30": 0, "d90": 0, "n": 0}
-    t_mn = {"stay": 0, "d30": 0, "d90": 0, "n": 0}
-    t_mo = {"stay": 0, "d30": 0, "d90": 0, "n": 0}
-
-    for year in years:
-        sub = df[df["year_admission"] == year]
-        n = len(sub)
-        total_stays += n
-        rows["n_stays"]["values"][year] = str(n)
-
-        if n == 0:
-            for r in rows.values():
-                r["values"].setdefault(year, "")
+    # n (%): un solo `groupby` por nivel (estancia / paciente-año) con
+    # numerador y denominador de todas las métricas a la vez. El total
+    # es la suma de los años.
+    for level in ("stay", "patient"):
+        batch = [m for m in visible if m.kind == "n_pct" and m.level == level]
+        if not batch:
             continue
-
-        patients = sub.drop_duplicates(subset=["patient_ref"])
-        n_pat = len(patients)
-        all_patients.update(patients["patient_ref"].tolist())
-        total_n_pat += n_pat
-        rows["n_patients"]["values"][year] = str(n_pat)
-
-        rows["occupancy"]["values"][year] = occupancy_by_year.get(int(year), "")
-
-        ages = pd.to_numeric(sub["age_at_admission"], errors="coerce").dropna()
-        all_ages.extend(ages.tolist())
-        rows["age"]["values"][year] = _format_median_iqr(ages)
-
-        sex_counts = patients["sex"].value_counts(dropna=False)
-        male = int(sex_counts.get("Male", 0))
-        female = int(sex_counts.get("Female", 0))
-        total_male += male
-        total_female += female
-        rows["male"]["values"][year] = _fmt_n_pct(male, n_pat)
-        rows["female"]["values"][year] = _fmt_n_pct(female, n_pat)
-
-        natio = patients["natio_ref"].fillna("").astype(str)
-        n_spain = int((natio == "ES").sum())
-        n_other = n_pat - n_spain
-        total_spain += n_spain
-        total_other_nat += n_other
-        rows["spain"]["values"][year] = _fmt_n_pct(n_spain, n_pat)
-        rows["other_nat"]["values"][year] = _fmt_n_pct(n_other, n_pat)
-
-        patient_health = patients[["patient_ref", "health_area", "postcode"]].set_index(
-            "patient_ref"
+        frame = df if level == "stay" else ctx.patients
+        counts = pd.DataFrame({m.name: m.compute(ctx) for m in batch}, index=frame.index)
+        denominators = pd.DataFrame(
+            {m.name: True if m.denominator is None else m.denominator(ctx) for m in batch},
+            index=frame.index,
         )
-        is_aisbe = _classify_aisbe(patient_health)
-        n_aisbe = int(is_aisbe.sum())
-        total_aisbe += n_aisbe
-        rows["aisbe"]["values"][year] = _fmt_n_pct(n_aisbe, n_pat)
-
-        if "from_other_hospital" in patients.columns:
-            other_hosp_col = pd.to_numeric(
-                patients["from_other_hospital"], errors="coerce"
-            ).fillna(0)
-            n_other_hosp = int((other_hosp_col == 1).sum())
-        else:
-            n_other_hosp = 0
-        total_other_hosp += n_other_hosp
-        rows["other_hosp"]["values"][year] = _fmt_n_pct(n_other_hosp, n_pat)
-
-        los = pd.to_numeric(sub["days_stay"], errors="coerce").dropna()
-        all_los.extend(los.tolist())
-        rows["los"]["values"][year] = _format_median_iqr(los)
-
-        # "Cirrosis" excluye episodios con trasplante hepático: estos
-        # pacientes ingresan electivamente para trasplante y su mortalidad
-        # depende del trasplante, no de la cirrosis. Si el snapshot no
-        # trae la columna `liver_transplant_during_episode` (snapshot
-        # antiguo), se mantiene el comportamiento anterior.
-        cirr_dx = pd.to_numeric(sub["has_cirrhosis"], errors="coerce").fillna(0)
-        if "liver_transplant_during_episode" in sub.columns:
-            tx = pd.to_numeric(
-                sub["liver_transplant_during_episode"], errors="coerce"
-            ).fillna(0)
-            cirr = ((cirr_dx == 1) & (tx == 0)).astype(int)
-        else:
-            cirr = (cirr_dx == 1).astype(int)
-        has_cirr = int((cirr == 1).sum())
-        total_cirr += has_cirr
-        rows["cirr"]["values"][year] = _fmt_n_pct(has_cirr, n)
-
-        for col, key in [("readmission_24h", "readm24"), ("readmission_72h", "readm72")]:
-            vals = pd.to_numeric(sub[col], errors="coerce").fillna(0)
-            count = int((vals == 1).sum())
-            rows[key]["values"][year] = _fmt_n_pct(count, n)
-            if key == "readm24":
-                total_readm24 += count
-            else:
-                total_readm72 += count
-
-        # SOFA al ingreso. La columna `sofa_total` solo viene presente si
-        # se ha mergeado la cohorte SOFA (per_unit/run.py). Para subgrupos
-        # cirrosis y procedencia "otro hospital" reusamos las máscaras ya
-        # calculadas más arriba (`cirr` y `from_other_hospital`).
-        if has_sofa:
-            sofa_year = pd.to_numeric(sub["sofa_total"], errors="coerce")
-            sofa_valid = sofa_year.dropna()
-            rows["sofa_all"]["values"][year] = _format_median_iqr(sofa_valid)
-            all_sofa.extend(sofa_valid.tolist())
-            total_sofa_n += int(sofa_valid.size)
-
-            if "sofa_components_available" in sub.columns:
-                comp = pd.to_numeric(
-                    sub["sofa_components_available"], errors="coerce"
-                ).fillna(0)
-                full = int((comp == 6).sum())
-                total_sofa_full += full
-                rows["sofa_full"]["values"][year] = _fmt_n_pct(full, n)
-
-            sofa_cirr = sofa_year[(cirr == 1).values].dropna()
-            rows["sofa_cirr"]["values"][year] = _format_median_iqr(sofa_cirr)
-            all_sofa_cirr.extend(sofa_cirr.tolist())
-
-            if "from_other_hospital" in sub.columns:
-                stay_oh = pd.to_numeric(
-                    sub["from_other_hospital"], errors="coerce"
-                ).fillna(0)
-                sofa_oh = sofa_year[(stay_oh == 1).values].dropna()
-                rows["sofa_oh"]["values"][year] = _format_median_iqr(sofa_oh)
-                all_sofa_oh.extend(sofa_oh.tolist())
-
-        if has_nutrition:
-            if "received_enteral" in sub.columns:
-                ent_flag = pd.to_numeric(
-                    sub["received_enteral"], errors="coerce"
-                ).fillna(0)
-                ent_count = int((ent_flag == 1).sum())
-                total_nutr_ent += ent_count
-                rows["nutr_ent"]["values"][year] = _fmt_n_pct(ent_count, n)
-
-                if "hours_to_enteral" in sub.columns:
-                    t_ent = pd.to_numeric(
-                        sub["hours_to_enteral"], errors="coerce"
-                    ).dropna()
-                    t_ent = t_ent[t_ent >= 0]
-                    rows["nutr_t_ent"]["values"][year] = _format_median_iqr(t_ent)
-                    all_t_ent.extend(t_ent.tolist())
-
-            if "received_parenteral" in sub.columns:
-                par_flag = pd.to_numeric(
-                    sub["received_parenteral"], errors="coerce"
-                ).fillna(0)
-                par_count = int((par_flag == 1).sum())
-                total_nutr_par += par_count
-                rows["nutr_par"]["values"][year] = _fmt_n_pct(par_count, n)
-
-                if "hours_to_parenteral" in sub.columns:
-                    t_par = pd.to_numeric(
-                        sub["hours_to_parenteral"], errors="coerce"
-                    ).dropna()
-                    t_par = t_par[t_par >= 0]
-                    rows["nutr_t_par"]["values"][year] = _format_median_iqr(t_par)
-                    all_t_par.extend(t_par.tolist())
-
-        mort = _mortality(sub)
-        rows["mg_stay"]["values"][year] = mort["stay_fmt"]
-        rows["mg_30"]["values"][year] = mort["d30_fmt"]
-        rows["mg_90"]["values"][year] = mort["d90_fmt"]
-        t_mg["stay"] += mort["deaths_stay"]
-        t_mg["d30"] += mort["deaths_30"]
-        t_mg["d90"] += mort["deaths_90"]
-        t_mg["n"] += mort["n"]
-
-        if has_autopsy:
-            ex_mask = sub["exitus_during_stay"] == "Yes"
-            n_exitus = int(ex_mask.sum())
-            autop_flag = pd.to_numeric(
-                sub["received_autopsy"], errors="coerce"
-            ).fillna(0)
-            n_autopsy = int(((autop_flag == 1) & ex_mask).sum())
-            total_autopsy += n_autopsy
-            total_exitus_for_autopsy += n_exitus
-            rows["autopsy"]["values"][year] = _fmt_n_pct(n_autopsy, n_exitus)
-
-        sub_cirr = sub[cirr == 1]
-        mort_c = _mortality(sub_cirr)
-        rows["mc_stay"]["values"][year] = mort_c["stay_fmt"]
-        rows["mc_30"]["values"][year] = mort_c["d30_fmt"]
-        rows["mc_90"]["values"][year] = mort_c["d90_fmt"]
-        t_mc["stay"] += mort_c["deaths_stay"]
-        t_mc["d30"] += mort_c["deaths_30"]
-        t_mc["d90"] += mort_c["deaths_90"]
-        t_mc["n"] += mort_c["n"]
-
-        patient_is_aisbe = sub["patient_ref"].map(is_aisbe).fillna(False)
-        sub_no_aisbe = sub[~patient_is_aisbe.values]
-        mort_n = _mortality(sub_no_aisbe)
-        rows["mn_stay"]["values"][year] = mort_n["stay_fmt"]
-        rows["mn_30"]["values"][year] = mort_n["d30_fmt"]
-        rows["mn_90"]["values"][year] = mort_n["d90_fmt"]
-        t_mn["stay"] += mort_n["deaths_stay"]
-        t_mn["d30"] += mort_n["deaths_30"]
-        t_mn["d90"] += mort_n["deaths_90"]
-        t_mn["n"] += mort_n["n"]
-
-        if "from_other_hospital" in sub.columns:
-            stay_other_hosp = pd.to_numeric(
-                sub["from_other_hospital"], errors="coerce"
-            ).fillna(0)
-            sub_other_hosp = sub[stay_other_hosp == 1]
-        else:
-            sub_other_hosp = sub.iloc[0:0]
-        mort_o = _mortality(sub_other_hosp)
-        rows["mo_stay"]["values"][year] = mort_o["stay_fmt"]
-        rows["mo_30"]["values"][year] = mort_o["d30_fmt"]
-        rows["mo_90"]["values"][year] = mort_o["d90_fmt"]
-        t_mo["stay"] += mort_o["deaths_stay"]
-        t_mo["d30"] += mort_o["deaths_30"]
-        t_mo["d90"] += mort_o["deaths_90"]
-        t_mo["n"] += mort_o["n"]
-
-    # Fill totals
-    rows["n_stays"]["total"] = str(total_stays)
-    rows["n_patients"]["total"] = str(len(all_patients))
-    rows["occupancy"]["total"] = occupancy_total_text
-    rows["age"]["total"] = _format_median_iqr(pd.Series(all_ages)) if all_ages else ""
-    rows["male"]["total"] = _fmt_n_pct(total_male, total_n_pat)
-    rows["female"]["total"] = _fmt_n_pct(total_female, total_n_pat)
-    rows["spain"]["total"] = _fmt_n_pct(total_spain, total_n_pat)
-    rows["other_nat"]["total"] = _fmt_n_pct(total_other_nat, total_n_pat)
-    rows["aisbe"]["total"] = _fmt_n_pct(total_aisbe, total_n_pat)
-    rows["other_hosp"]["total"] = _fmt_n_pct(total_other_hosp, total_n_pat)
-    rows["los"]["total"] = _format_median_iqr(pd.Series(all_los)) if all_los else ""
-    rows["cirr"]["total"] = _fmt_n_pct(total_cirr, total_stays)
-    rows["readm24"]["total"] = _fmt_n_pct(total_readm24, total_stays)
-    rows["readm72"]["total"] = _fmt_n_pct(total_readm72, total_stays)
-    if has_sofa:
-        rows["sofa_all"]["total"] = (
-            _format_median_iqr(pd.Series(all_sofa)) if all_sofa else ""
-        )
-        rows["sofa_full"]["total"] = _fmt_n_pct(total_sofa_full, total_stays)
-        rows["sofa_cirr"]["total"] = (
-            _format_median_iqr(pd.Series(all_sofa_cirr)) if all_sofa_cirr else ""
+        flags = (
+            pd.concat({"n": counts, "d": denominators}, axis=1)
+            .astype("int64")
+            .groupby(frame["year_admission"])
+            .sum()
+            .reindex(years, fill_value=0)
         )
-        rows["sofa_oh"]["total"] = (
-            _format_median_iqr(pd.Series(all_sofa_oh)) if all_sofa_oh else ""
-        )
-    if has_nutrition:
-        rows["nutr_ent"]["total"] = _fmt_n_pct(total_nutr_ent, total_stays)
-        rows["nutr_par"]["total"] = _fmt_n_pct(total_nutr_par, total_stays)
-        rows["nutr_t_ent"]["total"] = (
-            _format_median_iqr(pd.Series(all_t_ent)) if all_t_ent else ""
-        )
-        rows["nutr_t_par"]["total"] = (
-            _format_median_iqr(pd.Series(all_t_par)) if all_t_par else ""
-        )
-    if has_autopsy:
-        rows["autopsy"]["total"] = _fmt_n_pct(
-            total_autopsy, total_exitus_for_autopsy
-        )
-    rows["mg_stay"]["total"] = _fmt_n_pct(t_mg["stay"], t_mg["n"])
-    rows["mg_30"]["total"] = _fmt_n_pct(t_mg["d30"], t_mg["n"])
-    rows["mg_90"]["total"] = _fmt_n_pct(t_mg["d90"], t_mg["n"])
-    rows["mc_stay"]["total"] = _fmt_n_pct(t_mc["stay"], t_mc["n"])
-    rows["mc_30"]["total"] = _fmt_n_pct(t_mc["d30"], t_mc["n"])
-    rows["mc_90"]["total"] = _fmt_n_pct(t_mc["d90"], t_mc["n"])
-    rows["mn_stay"]["total"] = _fmt_n_pct(t_mn["stay"], t_mn["n"])
-    rows["mn_30"]["total"] = _fmt_n_pct(t_mn["d30"], t_mn["n"])
-    rows["mn_90"]["total"] = _fmt_n_pct(t_mn["d90"], t_mn["n"])
-    rows["mo_stay"]["total"] = _fmt_n_pct(t_mo["stay"], t_mo["n"])
-    rows["mo_30"]["total"] = _fmt_n_pct(t_mo["d30"], t_mo["n"])
-    rows["mo_90"]["total"] = _fmt_n_pct(t_mo["d90"], t_mo["n"])
-
-    # Assemble sections — si la cohorte no trae datos SOFA mergeados
-    # (p.ej. unidades no UCI), filtramos las filas SOFA para no
-    # ensuciar el informe con celdas vacías.
-    skip_rows: set[str] = set()
-    if not has_sofa:
-        skip_rows.update({"sofa_all", "sofa_full", "sofa_cirr", "sofa_oh"})
-    if not has_nutrition:
-        skip_rows.update({"nutr_ent", "nutr_par", "nutr_t_ent", "nutr_t_par"})
-    if not has_autopsy:
-        skip_rows.add("autopsy")
+        totals = flags.sum()
+        for m in batch:
+            if m.years_require is None or m.years_require in frame.columns:
+                rows[m.name]["values"] = {
+                    y: _fmt_n_pct(
+                        int(flags.at[y, ("n", m.name)]), int(flags.at[y, ("d", m.name)])
+                    )
+                    for y in years
+                }
+            rows[m.name]["total"] = _fmt_n_pct(
+                int(totals[("n", m.name)]), int(totals[("d", m.name)])
+            )
+
+    # Medianas [IQR]: todos los años con una sola ordenación; el total es
+    # la mediana de todos los valores.
+    for m in visible:
+        if m.kind == "median":
+            values = m.compute(ctx)
+            by_year = _median_iqr_by(values, ctx.year)
+            rows[m.name]["values"] = {y: by_year.get(y, "") for y in years}
+            rows[m.name]["total"] = _format_median_iqr(values)
+        elif m.kind == "text":
+            rows[m.name]["values"], rows[m.name]["total"] = m.compute(ctx)
 
     sections = []
     for section_key, section_title, css_class in _SECTION_DEFS:
-        section_rows = [
-            rows[name]
-            for name, _csv, _html, sk, _style in _ROW_DEFS
-            if sk == section_key and name not in skip_rows
-        ]
+        in_section = [m for m in selected if m.section == section_key]
+        if metrics is not None and not in_section:
+            continue
         sections.append({
             "section": section_title,
             "css": css_class,
-            "rows": section_rows,
+            "rows": [rows[m.name] for m in in_section if m.name in rows],
         })
 
     return sections, [int(y) for y in years]
@@ -0,0 +1,96 @@
+"""Schemas de tipos de los loaders de demographics.
+
+Se aplican una sola vez al cargar con `indicadors_iso._dtypes.apply_schema`.
+Los flags 0/1 se quedan como enteros int8 (no bool) para que los CSV de
+cohorte sigan escribiendo 0/1; las columnas "Yes"/"No" pasan a category
+y las comparaciones `== "Yes"` aguas abajo no cambian.
+
+Las claves de merge (`patient_ref`, `episode_ref`, `ou_loc_ref`,
+`stay_id`) tienen el mismo tipo en todos los schemas para que los merges
+cohorte ↔ SOFA / nutrición / autopsia no mezclen int y object.
+"""
+
+from __future__ import annotations
+
+from indicadors_iso._dtypes import (
+    CATEGORY,
+    DATETIME,
+    FLAG,
+    FLOAT32,
+    INT,
+    NULLABLE_INT,
+    REF,
+)
+
+JOIN_KEYS_SCHEMA = {
+    "patient_ref": REF,
+    "episode_ref": REF,
+    "ou_loc_ref": CATEGORY,
+    "stay_id": NULLABLE_INT,
+}
+
+COHORT_SCHEMA = {
+    **JOIN_KEYS_SCHEMA,
+    "admission_date": DATETIME,
+    "discharge_date": DATETIME,
+    "effective_discharge_date": DATETIME,
+    "exitus_date": DATETIME,
+    "hours_stay": INT,
+    "days_stay": INT,
+    "minutes_stay": INT,
+    "num_movements": INT,
+    "num_units_visited": INT,
+    "year_admission": INT,
+    "age_at_admission": INT,
+    "still_admitted": CATEGORY,
+    "had_transfer": CATEGORY,
+    "exitus_during_stay": CATEGORY,
+    "sex": CATEGORY,
+    "natio_ref": CATEGORY,
+    "nationality": CATEGORY,
+    "health_area": CATEGORY,
+    "postcode": CATEGORY,
+    "procedencia_codigo": CATEGORY,
+    "procedencia": CATEGORY,
+    "has_cirrhosis": FLAG,
+    "liver_transplant_during_episode": FLAG,
+    "readmission_24h": FLAG,
+    "readmission_72h": FLAG,
+    "from_other_hospital": FLAG,
+}
+
+NUTRITION_SCHEMA = {
+    **JOIN_KEYS_SCHEMA,
+    "nutr_enteral_start": DATETIME,
+    "nutr_parenteral_start": DATETIME,
+    "received_enteral": FLAG,
+    "received_parenteral": FLAG,
+    "hours_to_enteral": FLOAT32,
+    "hours_to_parenteral": FLOAT32,
+}
+
+AUTOPSY_SCHEMA = {
+    **JOIN_KEYS_SCHEMA,
+    "first_autopsy_date": DATETIME,
+    "received_autopsy": FLAG,
+}
+
+SOFA_SCHEMA = {
+    **JOIN_KEYS_SCHEMA,
+    "sofa_total": INT,
+    "sofa_components_available": INT,
+    "sofa_resp": FLOAT32,
+    "sofa_coag": FLOAT32,
+    "sofa_liver": FLOAT32,
+    "sofa_cardio": FLOAT32,
+    "sofa_neuro": FLOAT32,
+    "sofa_renal": FLOAT32,
+}
+
+__all__ = [
+    "AUTOPSY_SCHEMA",
+    "COHORT_SCHEMA",
+    "JOIN_KEYS_SCHEMA",
+    "NUTRITION_SCHEMA",
+    "SOFA_SCHEMA",
+]
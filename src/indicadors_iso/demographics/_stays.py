@@ -0,0 +1,253 @@
+"""Construcción de estancias en pandas a partir de movimientos crudos.
+
+Reproduce en local la agrupación con tolerancia de 5 min que las
+plantillas SQL repiten (`LAG(effective_end_date) … is_new_stay …
+SUM() OVER`), para poder descargar `movements` una vez (p.ej. de
+`indicadors_iso.mirror`) y derivar cualquier grano sin volver a Athena.
+
+Granos (`GRAINS`):
+    per_unit          partición `(patient_ref, episode_ref, ou_loc_ref)`
+                      — `demographics/per_unit/_sql.py`, `sofa`, deliris.
+    predominant_unit  partición `(patient_ref, episode_ref)`; la estancia
+                      se asigna a la unidad con más minutos (desempate:
+                      primera en empezar) —
+                      `demographics/predominant_unit/_sql.py`.
+    episode           partición solo por `episode_ref`, con la misma
+                      asignación a unidad predominante —
+                      `drg_complexity_report.build_drg_query`.
+
+Semántica copiada de Athena / Trino para que el resultado sea idéntico
+(ver `tests/test_stays.py`, que ejecuta las CTEs originales):
+
+- `effective_end_date = COALESCE(end_date, current_timestamp)`; se
+  descartan movimientos sin `place_ref` o con `effective_end_date <=
+  start_date`, con `units` los de otras unidades (`ou_loc_ref IN …`) y
+  con `min_year` / `max_year` los que no tocan el rango.
+- `date_diff(unit, a, b)` trunca hacia cero.
+- Primer movimiento de cada partición (LAG nulo) → estancia nueva.
+- `SUM() OVER (ORDER BY start_date)` usa el marco RANGE: los movimientos
+  con el mismo `start_date` reciben el mismo `stay_id`.
+- `HAVING year(MIN(start_date)) BETWEEN min_year AND max_year`.
+
+Las fechas pueden venir naive (hora local, como en la BBDD) o con zona
+(como las devuelve Metabase); los límites de año y `year()` se evalúan
+siempre en hora local (`DB_TIMEZONE`).
+
+Todo se hace con una sola ordenación por `(episode_ref, start_date)`:
+dentro de ella cada partición de cualquier grano queda ya en orden de
+`start_date`, y el resto son `groupby` vectorizados.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from indicadors_iso.demographics._stays_sql import DB_TIMEZONE
+
+STAY_TOLERANCE_MINUTES = 5
+
+GRAINS = {
+    "per_unit": ["patient_ref", "episode_ref", "ou_loc_ref"],
+    "predominant_unit": ["patient_ref", "episode_ref"],
+    "episode": ["episode_ref"],
+}
+
+STAY_COLS = [
+    "admission_date",
+    "discharge_date",
+    "effective_discharge_date",
+    "hours_stay",
+    "days_stay",
+    "minutes_stay",
+    "still_admitted",
+    "num_movements",
+    "num_units_visited",
+]
+
+
+def _trunc(delta: pd.Series, unit: str) -> pd.Series:
+    """`date_diff(unit, a, b)` de Trino sobre `delta = b - a`."""
+    return np.trunc(delta / pd.Timedelta(1, unit=unit))
+
+
+def _local(col: pd.Series) -> pd.Series:
+    if isinstance(col.dtype, pd.DatetimeTZDtype):
+        return col.dt.tz_convert(DB_TIMEZONE).dt.tz_localize(None)
+    return col
+
+
+def _as_datetime(col: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(col.dtype):
+        return col
+    return pd.to_datetime(col, errors="coerce", format="ISO8601")
+
+
+def _now_like(col: pd.Series) -> pd.Timestamp:
+    if isinstance(col.dtype, pd.DatetimeTZDtype):
+        return pd.Timestamp.now(tz=col.dt.tz)
+    return pd.Timestamp.now(tz=DB_TIMEZONE).tz_localize(None)
+
+
+def prepare_movements(
+    movements: pd.DataFrame,
+    min_year: Optional[int] = None,
+    max_year: Optional[int] = None,
+    now=None,
+    units: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """CTE `all_related_moves`: añade `effective_end_date`, filtra y
+    ordena por `(episode_ref, start_date)`.
+
+    `now` sustituye a `current_timestamp` (por defecto, ahora). `units`
+    es el `ou_loc_ref IN (…)` de las plantillas (None = todas).
+    """
+    df = movements.copy()
+    df["start_date"] = _as_datetime(df["start_date"])
+    df["end_date"] = _as_datetime(df["end_date"])
+    if now is None:
+        now = _now_like(df["start_date"])
+    now = pd.Timestamp(now)
+    if isinstance(df["start_date"].dtype, pd.DatetimeTZDtype) and now.tzinfo is None:
+        now = now.tz_localize(DB_TIMEZONE)
+    df["effective_end_date"] = df["end_date"].fillna(now)
+
+    keep = df["start_date"].notna() & (df["effective_end_date"] > df["start_date"])
+    if "place_ref" in df.columns:
+        keep &= df["place_ref"].notna()
+    if units is not None:
+        keep &= df["ou_loc_ref"].isin(list(units))
+    if max_year is not None:
+        keep &= _local(df["start_date"]) <= pd.Timestamp(f"{max_year}-12-31 23:59:59")
+    if min_year is not None:
+        keep &= _local(df["effective_end_date"]) >= pd.Timestamp(f"{min_year}-01-01")
+    df = df[keep]
+    return df.sort_values(["episode_ref", "start_date"], kind="mergesort", ignore_index=True)
+
+
+def assign_stay_ids(
+    moves: pd.DataFrame,
+    partition: list[str],
+    tolerance_minutes: int = STAY_TOLERANCE_MINUTES,
+) -> pd.Series:
+    """`stay_id` (1, 2, …) dentro de cada `partition` para movimientos
+    ya preparados con `prepare_movements`."""
+    by = [moves[c] for c in partition]
+    prev_end = moves["effective_end_date"].groupby(by, sort=False, dropna=False, observed=True).shift()
+    gap = _trunc(moves["start_date"] - prev_end, "min")
+    is_new = (~(gap.abs() <= tolerance_minutes)).astype("int64")
+    running = is_new.groupby(by, sort=False, dropna=False, observed=True).cumsum()
+    # Marco RANGE: los empates en `start_date` comparten el valor final.
+    return running.groupby(
+        by + [moves["start_date"]], sort=False, dropna=False, observed=True
+    ).transform("max")
+
+
+def _aggregate(moves: pd.DataFrame, keys: list[str]) -> pd.DataFrame:
+    grouped = moves.groupby(keys, sort=True, dropna=False, observed=True)
+    out = grouped.agg(
+        admission_date=("start_date", "min"),
+        discharge_date=("end_date", "max"),
+        effective_discharge_date=("effective_end_date", "max"),
+        num_movements=("start_date", "size"),
+        num_units_visited=("ou_loc_ref", "nunique"),
+    ).reset_index()
+    span = out["effective_discharge_date"] - out["admission_date"]
+    out["hours_stay"] = _trunc(span, "h").astype("int64")
+    out["days_stay"] = _trunc(span, "D").astype("int64")
+    out["minutes_stay"] = _trunc(span, "min").astype("int64")
+    out["still_admitted"] = np.where(out["discharge_date"].isna(), "Yes", "No")
+    return out
+
+
+def _predominant_units(moves: pd.DataFrame) -> pd.DataFrame:
+    """CTEs `time_per_unit` + `predominant_unit`: una unidad por estancia."""
+    keys = ["patient_ref", "episode_ref", "stay_id"]
+    per_unit = (
+        moves.assign(_minutes=_trunc(moves["effective_end_date"] - moves["start_date"], "min"))
+        .groupby(keys + ["ou_loc_ref"], sort=False, dropna=False, observed=True)
+        .agg(minutes_in_unit=("_minutes", "sum"), first_start_date=("start_date", "min"))
+        .reset_index()
+    )
+    ranked = per_unit.sort_values(
+        keys + ["minutes_in_unit", "first_start_date", "ou_loc_ref"],
+        ascending=[True, True, True, False, True, True],
+        kind="mergesort",
+    )
+    return ranked.drop_duplicates(keys)[keys + ["ou_loc_ref"]]
+
+
+def _stays_from_moves(
+    moves: pd.DataFrame,
+    grain: str,
+    min_year: Optional[int],
+    max_year: Optional[int],
+    tolerance_minutes: int,
+) -> pd.DataFrame:
+    if grain not in GRAINS:
+        raise ValueError(f"Grano desconocido: {grain!r} (opciones: {sorted(GRAINS)}).")
+    moves = moves.assign(stay_id=assign_stay_ids(moves, GRAINS[grain], tolerance_minutes))
+
+    if grain == "per_unit":
+        keys = ["patient_ref", "episode_ref", "ou_loc_ref", "stay_id"]
+        stays = _aggregate(moves, keys)
+        order = keys
+    else:
+        keys = ["patient_ref", "episode_ref", "stay_id"]
+        stays = _aggregate(moves, keys).merge(_predominant_units(moves), on=keys, how="inner")
+        order = keys + ["ou_loc_ref"]
+
+    if min_year is not None or max_year is not None:
+        year = _local(stays["admission_date"]).dt.year
+        lo = min_year if min_year is not None else year.min()
+        hi = max_year if max_year is not None else year.max()
+        stays = stays[year.between(lo, hi)]
+    return stays[order + STAY_COLS].reset_index(drop=True)
+
+
+def build_stays(
+    movements: pd.DataFrame,
+    grain: str = "per_unit",
+    min_year: Optional[int] = None,
+    max_year: Optional[int] = None,
+    now=None,
+    tolerance_minutes: int = STAY_TOLERANCE_MINUTES,
+    units: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """Estancias de `grain` a partir de movimientos crudos (`patient_ref`,
+    `episode_ref`, `ou_loc_ref`, `start_date`, `end_date` y, si está,
+    `place_ref`) de las `units` pedidas (todas si None). Columnas:
+    claves + `stay_id` + `STAY_COLS`, como la CTE `cohort` de las
+    plantillas SQL."""
+    moves = prepare_movements(movements, min_year, max_year, now, units)
+    return _stays_from_moves(moves, grain, min_year, max_year, tolerance_minutes)
+
+
+def build_all_stays(
+    movements: pd.DataFrame,
+    min_year: Optional[int] = None,
+    max_year: Optional[int] = None,
+    now=None,
+    tolerance_minutes: int = STAY_TOLERANCE_MINUTES,
+    units: Optional[Iterable[str]] = None,
+) -> dict[str, pd.DataFrame]:
+    """`{grano: estancias}` para todos los `GRAINS` con una sola
+    preparación / ordenación de los movimientos (de `units`, si se da)."""
+    moves = prepare_movements(movements, min_year, max_year, now, units)
+    return {
+        grain: _stays_from_moves(moves, grain, min_year, max_year, tolerance_minutes)
+        for grain in GRAINS
+    }
+
+
+__all__ = [
+    "GRAINS",
+    "STAY_COLS",
+    "STAY_TOLERANCE_MINUTES",
+    "assign_stay_ids",
+    "build_all_stays",
+    "build_stays",
+    "prepare_movements",
+]
@@ -0,0 +1,168 @@
+"""CTE compartida de estancias per-unit y su alternativa por claves.
+
+Los subloaders que enriquecen la cohorte (SOFA, nutrición, autopsia,
+frotis rectal MDR) necesitan las mismas estancias que
+`demographics/per_unit/_sql.py`: `stay_id` particionado por
+`(patient_ref, episode_ref, ou_loc_ref)` con tolerancia de 5 min entre
+movimientos de la misma unidad. Cada plantilla recibe esas estancias
+como una CTE `cohort` con columnas:
+
+    patient_ref, episode_ref, ou_loc_ref, stay_id,
+    admission_date, effective_discharge_date
+
+y tiene dos formas de obtenerla:
+
+- `per_unit_stays_ctes(...)`: recalcula las estancias desde `movements`
+  (LAG/SUM sobre ventanas). Es lo que hace cada subloader por sí solo.
+- `STAYS_FROM_KEYS_CTES`: las lee de una tabla `VALUES` en línea con las
+  claves de una cohorte ya descargada (`stay_keys(cohort)`), troceada
+  por `connection.execute_query_in_batches`. Así `movements` se escanea
+  y ventanea una sola vez por ejecución (la query de la cohorte) en
+  lugar de una vez por subloader.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, Optional
+
+import pandas as pd
+
+from indicadors_iso.connection import KEY_VALUES_PLACEHOLDER, execute_query_in_batches
+
+STAY_KEY_COLS = [
+    "patient_ref",
+    "episode_ref",
+    "ou_loc_ref",
+    "stay_id",
+    "admission_date",
+    "effective_discharge_date",
+]
+
+# DataNex guarda los timestamps sin zona, en hora local del hospital;
+# Metabase los devuelve con offset CET/CEST y la cohorte los tiene en
+# UTC (ver `demographics._schemas`). Para volver a pasarlos como
+# literales se devuelven a hora local (igual que
+# `data_quality._metrics.LOCAL_TZ`).
+DB_TIMEZONE = "Europe/Madrid"
+
+# Una fila por estancia como máximo en SOFA / nutrición / autopsia.
+PUSHDOWN_ROWS_PER_STAY = 1
+PUSHDOWN_MAX_WORKERS = 4
+
+STAYS_FROM_KEYS_CTES = f"cohort AS (\n    SELECT * FROM {KEY_VALUES_PLACEHOLDER}\n)"
+
+
+def per_unit_stays_ctes(units, min_year: int, max_year: int) -> str:
+    """CTEs `all_related_moves → flagged_starts → grouped_stays → cohort`
+    (estancias per-unit de `units` con admisión en [min_year, max_year])."""
+    units_sql = ", ".join(f"'{u}'" for u in units)
+    return f"""all_related_moves AS (
+    SELECT
+        patient_ref,
+        episode_ref,
+        ou_loc_ref,
+        start_date,
+        end_date,
+        COALESCE(end_date, current_timestamp) AS effective_end_date
+    FROM datascope_gestor_prod.movements
+    WHERE ou_loc_ref IN ({units_sql})
+      AND start_date <= timestamp '{max_year}-12-31 23:59:59'
+      AND COALESCE(end_date, current_timestamp) >= timestamp '{min_year}-01-01 00:00:00'
+      AND place_ref IS NOT NULL
+      AND COALESCE(end_date, current_timestamp) > start_date
+),
+flagged_starts AS (
+    SELECT
+        *,
+        CASE
+            WHEN ABS(date_diff('minute',
+                LAG(effective_end_date) OVER (
+                    PARTITION BY patient_ref, episode_ref, ou_loc_ref ORDER BY start_date
+                ),
+                start_date
+            )) <= 5
+            THEN 0
+            ELSE 1
+        END AS is_new_stay
+    FROM all_related_moves
+),
+grouped_stays AS (
+    SELECT
+        *,
+        SUM(is_new_stay) OVER (
+            PARTITION BY patient_ref, episode_ref, ou_loc_ref ORDER BY start_date
+        ) AS stay_id
+    FROM flagged_starts
+),
+cohort AS (
+    SELECT
+        patient_ref,
+        episode_ref,
+        ou_loc_ref,
+        stay_id,
+        MIN(start_date)         AS admission_date,
+        MAX(effective_end_date) AS effective_discharge_date
+    FROM grouped_stays
+    GROUP BY patient_ref, episode_ref, ou_loc_ref, stay_id
+    HAVING year(MIN(start_date)) BETWEEN {min_year} AND {max_year}
+)"""
+
+
+def stay_keys(cohort: pd.DataFrame, units=None) -> pd.DataFrame:
+    """Claves `STAY_KEY_COLS` de `cohort` (solo filas reales y, si se
+    pasa, de `units`), con las fechas en hora local sin zona."""
+    missing = [c for c in STAY_KEY_COLS if c not in cohort.columns]
+    if missing:
+        raise ValueError(f"La cohorte no tiene las columnas {missing}.")
+    df = cohort
+    if "synthetic" in df.columns:
+        df = df[~df["synthetic"].fillna(False).astype(bool)]
+    if units is not None:
+        df = df[df["ou_loc_ref"].isin(list(units))]
+    keys = df[STAY_KEY_COLS].copy()
+    keys["ou_loc_ref"] = keys["ou_loc_ref"].astype(str)
+    for col in ("admission_date", "effective_discharge_date"):
+        dt = pd.to_datetime(keys[col], errors="coerce", utc=True, format="ISO8601")
+        keys[col] = dt.dt.tz_convert(DB_TIMEZONE).dt.tz_localize(None)
+    return keys.dropna()
+
+
+def query_for_stays(
+    render_sql: Callable[[str], str],
+    stays: pd.DataFrame,
+    units=None,
+    *,
+    label: str,
+    rows_per_stay: Optional[float] = PUSHDOWN_ROWS_PER_STAY,
+    max_workers: int = PUSHDOWN_MAX_WORKERS,
+) -> pd.DataFrame:
+    """Lanza `render_sql(STAYS_FROM_KEYS_CTES)` sobre las estancias de
+    `stays` en lotes de tablas `VALUES`.
+
+    `render_sql` recibe el texto de las CTEs de estancias y devuelve la
+    plantilla completa (p.ej. `lambda ctes: render_sql(y0, y1, units,
+    cohort_ctes=ctes)`).
+    """
+    keys = stay_keys(stays, units)
+    print(
+        f"[{label}] {len(keys)} estancias de la cohorte como tabla VALUES "
+        "(sin recalcular estancias desde movements)…"
+    )
+    return execute_query_in_batches(
+        render_sql(STAYS_FROM_KEYS_CTES),
+        keys,
+        STAY_KEY_COLS,
+        label=label,
+        rows_per_key=rows_per_stay,
+        max_workers=max_workers,
+    )
+
+
+__all__ = [
+    "DB_TIMEZONE",
+    "STAYS_FROM_KEYS_CTES",
+    "STAY_KEY_COLS",
+    "per_unit_stays_ctes",
+    "query_for_stays",
+    "stay_keys",
+]
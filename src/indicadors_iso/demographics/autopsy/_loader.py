@@ -1,9 +1,14 @@
 """Loader y mergers para indicadores de autopsia/necropsia."""
 from __future__ import annotations
 
+from typing import Optional
+
 import pandas as pd
 
+from indicadors_iso._dtypes import apply_schema
 from indicadors_iso.connection import execute_query_yearly
+from indicadors_iso.demographics._schemas import AUTOPSY_SCHEMA
+from indicadors_iso.demographics._stays_sql import query_for_stays
 from indicadors_iso.demographics.autopsy._sql import render_sql
 
 AUTOPSY_JOIN_KEYS_PER_UNIT = ["patient_ref", "episode_ref", "ou_loc_ref", "stay_id"]
@@ -16,22 +21,39 @@ AUTOPSY_OUTPUT_COLS = [
 
 
 def load_autopsy_cohort(
-    min_year: int, max_year: int, units: list[str]
+    min_year: int,
+    max_year: int,
+    units: list[str],
+    stays: Optional[pd.DataFrame] = None,
 ) -> pd.DataFrame:
     """Descarga año a año las autopsias/necropsias ligadas a estancias
     de la cohorte (per-unit grain).
+
+    Con `stays`, las estancias se envían como tabla `VALUES` (ver
+    `load_nutrition_cohort`).
     """
     print(
-        f"[autopsy] descargando autopsias/necropsias año a año desde Metabase "
+        f"[autopsy] descargando autopsias/necropsias desde Metabase "
         f"({min_year}-{max_year}, {list(units)})…"
     )
 
-    df = execute_query_yearly(
-        lambda year: render_sql(year, year, units=units),
-        min_year,
-        max_year,
-        label="autopsy",
-    )
+    if stays is not None:
+        df = query_for_stays(
+            lambda ctes: render_sql(min_year, max_year, units=units, cohort_ctes=ctes),
+            stays,
+            units,
+            label="autopsy",
+        )
+    else:
+        df = execute_query_yearly(
+            lambda year: render_sql(year, year, units=units),
+            min_year,
+            max_year,
+            label="autopsy",
+            # `per_unit` y `predominant_unit` piden los mismos años en una
+            # misma ejecución: la segunda se sirve de memoria.
+            memoize=True,
+        )
 
     if df.empty:
         print("[autopsy] sin filas — saltando.")
@@ -53,7 +75,7 @@ def load_autopsy_cohort(
     )
 
     keep = AUTOPSY_JOIN_KEYS_PER_UNIT + AUTOPSY_OUTPUT_COLS
-    return df[keep].copy()
+    return apply_schema(df[keep], AUTOPSY_SCHEMA, label="autopsy")
 
 
 def aggregate_to_predominant(per_unit_df: pd.DataFrame) -> pd.DataFrame:
@@ -1,7 +1,7 @@
 """SQL para autopsias / necropsias (no neonatales) ligadas a la cohorte
 E073/I073.
 
-Replica la cohorte canónica per-unit (idéntico `stay_id`/`ou_loc_ref` que
+Usa la cohorte canónica per-unit (idéntico `stay_id`/`ou_loc_ref` que
 `demographics/per_unit/_sql.py`) y le hace un INNER JOIN con las
 provisiones de tipo autopsia/necropsia ordenadas por `regexp_like` sobre
 `prov_descr`.
@@ -20,70 +20,36 @@ estancia (la del éxitus) se aplica en el cálculo de la métrica en
 """
 from __future__ import annotations
 
+from typing import Optional
+
+from indicadors_iso.demographics._stays_sql import per_unit_stays_ctes
+
 # Regex que define una autopsia válida sobre `prov_descr`.
 AUTOPSY_REGEX_INCLUDE = "(?i)necr[oó]psia|autopsia"
 AUTOPSY_REGEX_EXCLUDE = "(?i)fetal|neonatal"
 
 
-def render_sql(
-    min_year: int,
-    max_year: int,
-    units: list[str] = ("E073", "I073"),
-) -> str:
-    units_sql = ", ".join(f"'{u}'" for u in units)
+# Agregado por estancia: INNER JOIN `cohort` × `autopsy_provisions`.
+AGG_SELECT = """SELECT
+    c.patient_ref,
+    c.episode_ref,
+    c.ou_loc_ref,
+    c.stay_id,
+    MIN(ap.autopsy_date)        AS first_autopsy_date,
+    COUNT(*)                    AS n_autopsy_provisions,
+    COUNT(DISTINCT ap.prov_descr) AS n_distinct_autopsy_descr
+FROM cohort c
+INNER JOIN autopsy_provisions ap
+    ON c.patient_ref = ap.patient_ref
+   AND c.episode_ref = ap.episode_ref
+   AND ap.autopsy_date >= c.admission_date
+GROUP BY c.patient_ref, c.episode_ref, c.ou_loc_ref, c.stay_id"""
 
-    return f"""
-WITH all_related_moves AS (
-    SELECT
-        patient_ref,
-        episode_ref,
-        ou_loc_ref,
-        start_date,
-        end_date,
-        COALESCE(end_date, current_timestamp) AS effective_end_date
-    FROM datascope_gestor_prod.movements
-    WHERE ou_loc_ref IN ({units_sql})
-      AND start_date <= timestamp '{max_year}-12-31 23:59:59'
-      AND COALESCE(end_date, current_timestamp) >= timestamp '{min_year}-01-01 00:00:00'
-      AND place_ref IS NOT NULL
-      AND COALESCE(end_date, current_timestamp) > start_date
-),
-flagged_starts AS (
-    SELECT
-        *,
-        CASE
-            WHEN ABS(date_diff('minute',
-                LAG(effective_end_date) OVER (
-                    PARTITION BY patient_ref, episode_ref, ou_loc_ref ORDER BY start_date
-                ),
-                start_date
-            )) <= 5
-            THEN 0
-            ELSE 1
-        END AS is_new_stay
-    FROM all_related_moves
-),
-grouped_stays AS (
-    SELECT
-        *,
-        SUM(is_new_stay) OVER (
-            PARTITION BY patient_ref, episode_ref, ou_loc_ref ORDER BY start_date
-        ) AS stay_id
-    FROM flagged_starts
-),
-cohort AS (
-    SELECT
-        patient_ref,
-        episode_ref,
-        ou_loc_ref,
-        stay_id,
-        MIN(start_date)         AS admission_date,
-        MAX(effective_end_date) AS effective_discharge_date
-    FROM grouped_stays
-    GROUP BY patient_ref, episode_ref, ou_loc_ref, stay_id
-    HAVING year(MIN(start_date)) BETWEEN {min_year} AND {max_year}
-),
-autopsy_provisions AS (
+
+def render_ctes(min_year: int, max_year: int) -> str:
+    """CTE `autopsy_provisions` (sin `WITH`). La ventana llega hasta
+    `max_year + 2`: la autopsia se registra después del éxitus."""
+    return f"""autopsy_provisions AS (
     SELECT
         patient_ref,
         episode_ref,
@@ -96,19 +62,22 @@ autopsy_provisions AS (
                           AND timestamp '{max_year + 2}-12-31 23:59:59'
       AND regexp_like(prov_descr, '{AUTOPSY_REGEX_INCLUDE}')
       AND NOT regexp_like(prov_descr, '{AUTOPSY_REGEX_EXCLUDE}')
-)
-SELECT
-    c.patient_ref,
-    c.episode_ref,
-    c.ou_loc_ref,
-    c.stay_id,
-    MIN(ap.autopsy_date)        AS first_autopsy_date,
-    COUNT(*)                    AS n_autopsy_provisions,
-    COUNT(DISTINCT ap.prov_descr) AS n_distinct_autopsy_descr
-FROM cohort c
-INNER JOIN autopsy_provisions ap
-    ON c.patient_ref = ap.patient_ref
-   AND c.episode_ref = ap.episode_ref
-   AND ap.autopsy_date >= c.admission_date
-GROUP BY c.patient_ref, c.episode_ref, c.ou_loc_ref, c.stay_id
+)"""
+
+
+def render_sql(
+    min_year: int,
+    max_year: int,
+    units: list[str] = ("E073", "I073"),
+    cohort_ctes: Optional[str] = None,
+) -> str:
+    """`cohort_ctes` sustituye a las CTEs de estancias recalculadas desde
+    `movements` (ver `demographics._stays_sql`)."""
+    if cohort_ctes is None:
+        cohort_ctes = per_unit_stays_ctes(units, min_year, max_year)
+
+    return f"""
+WITH {cohort_ctes},
+{render_ctes(min_year, max_year)}
+{AGG_SELECT}
 """
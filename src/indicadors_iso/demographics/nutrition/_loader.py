@@ -19,9 +19,14 @@ es:
 """
 from __future__ import annotations
 
+from typing import Optional
+
 import pandas as pd
 
+from indicadors_iso._dtypes import apply_schema
 from indicadors_iso.connection import execute_query_yearly
+from indicadors_iso.demographics._schemas import NUTRITION_SCHEMA
+from indicadors_iso.demographics._stays_sql import query_for_stays
 from indicadors_iso.demographics.nutrition._sql import render_sql
 
 NUTRITION_JOIN_KEYS_PER_UNIT = ["patient_ref", "episode_ref", "ou_loc_ref", "stay_id"]
@@ -39,20 +44,39 @@ NUTRITION_OUTPUT_COLS = [
 
 
 def load_nutrition_cohort(
-    min_year: int, max_year: int, units: list[str]
+    min_year: int,
+    max_year: int,
+    units: list[str],
+    stays: Optional[pd.DataFrame] = None,
 ) -> pd.DataFrame:
-    """Descarga datos de nutrición año a año (per-unit grain)."""
+    """Descarga datos de nutrición año a año (per-unit grain).
+
+    Si se pasa `stays` (la cohorte per-unit ya descargada), sus estancias
+    se envían como tabla `VALUES` en lugar de recalcularlas desde
+    `movements` (ver `demographics._stays_sql`).
+    """
     print(
-        f"[nutrition] descargando nutrición año a año desde Metabase "
+        f"[nutrition] descargando nutrición desde Metabase "
         f"({min_year}-{max_year}, {list(units)})…"
     )
 
-    df = execute_query_yearly(
-        lambda year: render_sql(year, year, units=units),
-        min_year,
-        max_year,
-        label="nutrition",
-    )
+    if stays is not None:
+        df = query_for_stays(
+            lambda ctes: render_sql(min_year, max_year, units=units, cohort_ctes=ctes),
+            stays,
+            units,
+            label="nutrition",
+        )
+    else:
+        df = execute_query_yearly(
+            lambda year: render_sql(year, year, units=units),
+            min_year,
+            max_year,
+            label="nutrition",
+            # `per_unit` y `predominant_unit` piden los mismos años en una
+            # misma ejecución: la segunda se sirve de memoria.
+            memoize=True,
+        )
 
     if df.empty:
         print("[nutrition] sin filas — saltando.")
@@ -79,7 +103,7 @@ def load_nutrition_cohort(
 
     df["stay_id"] = pd.to_numeric(df["stay_id"], errors="coerce").astype("Int64")
     keep = NUTRITION_JOIN_KEYS_PER_UNIT + NUTRITION_OUTPUT_COLS
-    return df[keep].copy()
+    return apply_schema(df[keep], NUTRITION_SCHEMA, label="nutrition")
 
 
 def aggregate_to_predominant(per_unit_df: pd.DataFrame) -> pd.DataFrame:
@@ -1,6 +1,6 @@
 """SQL para indicadores de nutrición enteral / parenteral por estancia.
 
-Replica la **cohorte canónica per-unit** de `demographics/per_unit/_sql.py`
+Usa la **cohorte canónica per-unit** de `demographics/per_unit/_sql.py`
 (con `stay_id` particionado por `(patient_ref, episode_ref, ou_loc_ref)`
 y tolerancia 5 min entre movimientos de la misma unidad) para que la
 clave `[patient_ref, episode_ref, ou_loc_ref, stay_id]` sea idéntica al
@@ -23,73 +23,34 @@ dos consultas SQL casi idénticas.
 """
 from __future__ import annotations
 
+from typing import Optional
+
+from indicadors_iso.demographics._stays_sql import per_unit_stays_ctes
 from indicadors_iso.demographics.nutrition._config import (
     enteral_predicate,
     parenteral_predicate,
 )
 
+# Agregado por estancia sobre `matched` (ver `render_ctes`).
+AGG_SELECT = """SELECT
+    patient_ref,
+    episode_ref,
+    ou_loc_ref,
+    stay_id,
+    admission_date,
+    MIN(CASE WHEN is_enteral    = 1 THEN start_drug_date END) AS nutr_enteral_start,
+    MIN(CASE WHEN is_parenteral = 1 THEN start_drug_date END) AS nutr_parenteral_start
+FROM matched
+GROUP BY patient_ref, episode_ref, ou_loc_ref, stay_id, admission_date"""
 
-def render_sql(
-    min_year: int,
-    max_year: int,
-    units: list[str] = ("E073", "I073"),
-) -> str:
-    units_sql = ", ".join(f"'{u}'" for u in units)
+
+def render_ctes(min_year: int, max_year: int) -> str:
+    """CTEs `nutrition_prescriptions → matched` sobre una CTE `cohort`
+    ya definida (sin `WITH`)."""
     enteral_pred = enteral_predicate("p.drug_descr")
     parenteral_pred = parenteral_predicate("p.drug_descr")
 
-    return f"""
-WITH all_related_moves AS (
-    SELECT
-        patient_ref,
-        episode_ref,
-        ou_loc_ref,
-        start_date,
-        end_date,
-        COALESCE(end_date, current_timestamp) AS effective_end_date
-    FROM datascope_gestor_prod.movements
-    WHERE ou_loc_ref IN ({units_sql})
-      AND start_date <= timestamp '{max_year}-12-31 23:59:59'
-      AND COALESCE(end_date, current_timestamp) >= timestamp '{min_year}-01-01 00:00:00'
-      AND place_ref IS NOT NULL
-      AND COALESCE(end_date, current_timestamp) > start_date
-),
-flagged_starts AS (
-    SELECT
-        *,
-        CASE
-            WHEN ABS(date_diff('minute',
-                LAG(effective_end_date) OVER (
-                    PARTITION BY patient_ref, episode_ref, ou_loc_ref ORDER BY start_date
-                ),
-                start_date
-            )) <= 5
-            THEN 0
-            ELSE 1
-        END AS is_new_stay
-    FROM all_related_moves
-),
-grouped_stays AS (
-    SELECT
-        *,
-        SUM(is_new_stay) OVER (
-            PARTITION BY patient_ref, episode_ref, ou_loc_ref ORDER BY start_date
-        ) AS stay_id
-    FROM flagged_starts
-),
-cohort AS (
-    SELECT
-        patient_ref,
-        episode_ref,
-        ou_loc_ref,
-        stay_id,
-        MIN(start_date)        AS admission_date,
-        MAX(effective_end_date) AS effective_discharge_date
-    FROM grouped_stays
-    GROUP BY patient_ref, episode_ref, ou_loc_ref, stay_id
-    HAVING year(MIN(start_date)) BETWEEN {min_year} AND {max_year}
-),
-nutrition_prescriptions AS (
+    return f"""nutrition_prescriptions AS (
     SELECT
         p.patient_ref,
         p.episode_ref,
@@ -117,15 +78,21 @@ matched AS (
        AND c.episode_ref = np.episode_ref
        AND np.start_drug_date >= c.admission_date
        AND np.start_drug_date <= c.effective_discharge_date
-)
-SELECT
-    patient_ref,
-    episode_ref,
-    ou_loc_ref,
-    stay_id,
-    admission_date,
-    MIN(CASE WHEN is_enteral    = 1 THEN start_drug_date END) AS nutr_enteral_start,
-    MIN(CASE WHEN is_parenteral = 1 THEN start_drug_date END) AS nutr_parenteral_start
-FROM matched
-GROUP BY patient_ref, episode_ref, ou_loc_ref, stay_id, admission_date
+)"""
+
+
+def render_sql(
+    min_year: int,
+    max_year: int,
+    units: list[str] = ("E073", "I073"),
+    cohort_ctes: Optional[str] = None,
+) -> str:
+    """`cohort_ctes` sustituye a las CTEs de estancias recalculadas desde
+    `movements` (ver `demographics._stays_sql`)."""
+    if cohort_ctes is None:
+        cohort_ctes = per_unit_stays_ctes(units, min_year, max_year)
+    return f"""
+WITH {cohort_ctes},
+{render_ctes(min_year, max_year)}
+{AGG_SELECT}
 """
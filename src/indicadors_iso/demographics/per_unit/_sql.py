@@ -1,4 +1,4 @@
-SQL_TEMPLATE = """
+COHORT_CTES = """
 -- =====================================================================
 -- Demographics — variante PER-UNIT
 -- =====================================================================
@@ -139,8 +139,11 @@ procedencia_episodio AS (
           AND status = 'CO'
     ) x
     WHERE rn = 1
-)
-SELECT DISTINCT
+)"""
+
+# SELECT final (una fila por estancia). Se reutiliza tal cual en la
+# query consolidada de `per_unit/_wide_sql.py`.
+STAYS_SELECT = """SELECT DISTINCT
     cw.patient_ref,
     cw.episode_ref,
     cw.stay_id,
@@ -209,6 +212,11 @@ LEFT JOIN datascope_gestor_prod.exitus ex
     ON cw.patient_ref = ex.patient_ref
 LEFT JOIN procedencia_episodio proc
     ON cw.patient_ref = proc.patient_ref
-    AND cw.episode_ref = proc.episode_ref
-ORDER BY cw.ou_loc_ref, cw.admission_date;
-"""
+    AND cw.episode_ref = proc.episode_ref"""
+
+SQL_TEMPLATE = (
+    COHORT_CTES
+    + "\n"
+    + STAYS_SELECT
+    + "\nORDER BY cw.ou_loc_ref, cw.admission_date;\n"
+)
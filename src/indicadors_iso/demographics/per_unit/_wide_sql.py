@@ -0,0 +1,103 @@
+"""Query consolidada per-unit: cohorte + SOFA + nutrición + autopsia.
+
+En lugar de cuatro series de queries anuales (cohorte, SOFA, nutrición,
+autopsia) que recalculan cada una las estancias desde `movements` y se
+mergean después en pandas, se lanza **una query por año** que:
+
+- construye las estancias una sola vez (`per_unit._sql.COHORT_CTES`);
+- calcula sobre esa misma CTE `cohort` los agregados SOFA
+  (`sofa._sql.SOFA_CTES`, restringido a UCI), de nutrición y de
+  autopsia (`render_ctes` + `AGG_SELECT` de cada subpaquete);
+- devuelve una fila ancha por estancia: las columnas de la cohorte
+  (`STAYS_SELECT`) + los valores crudos SOFA + los inicios de nutrición
+  + la fecha de la primera autopsia, unidos con LEFT JOIN por
+  `(patient_ref, episode_ref, ou_loc_ref, stay_id)`.
+
+Las CTEs se reutilizan tal cual de las plantillas de cada subloader, así
+que la lógica clínica no se duplica. La puntuación SOFA y los flags /
+horas de nutrición y autopsia se derivan en Python
+(`per_unit.run.load_wide_cohort`).
+"""
+
+from __future__ import annotations
+
+from indicadors_iso.demographics.autopsy._sql import (
+    AGG_SELECT as AUTOPSY_AGG_SELECT,
+)
+from indicadors_iso.demographics.autopsy._sql import (
+    render_ctes as render_autopsy_ctes,
+)
+from indicadors_iso.demographics.nutrition._sql import (
+    AGG_SELECT as NUTRITION_AGG_SELECT,
+)
+from indicadors_iso.demographics.nutrition._sql import (
+    render_ctes as render_nutrition_ctes,
+)
+from indicadors_iso.demographics.per_unit._sql import COHORT_CTES, STAYS_SELECT
+from indicadors_iso.demographics.sofa._metrics import INPUT_COLS as SOFA_INPUT_COLS
+from indicadors_iso.demographics.sofa._sql import SOFA_CTES, SOFA_SELECT
+
+STAY_JOIN_KEYS = ["patient_ref", "episode_ref", "ou_loc_ref", "stay_id"]
+
+# Columnas de los subloaders que se añaden a cada fila de la cohorte.
+NUTRITION_RAW_COLS = ["nutr_enteral_start", "nutr_parenteral_start"]
+AUTOPSY_RAW_COLS = ["first_autopsy_date"]
+
+
+def _join_on(alias: str) -> str:
+    return " AND ".join(f"{alias}.{k} = ds.{k}" for k in STAY_JOIN_KEYS)
+
+
+def render_wide_sql(
+    min_year: int,
+    max_year: int,
+    icu_units,
+    window_hours: int = 24,
+) -> str:
+    """Query anual consolidada (ver docstring del módulo). El SOFA solo
+    se calcula para las estancias de `icu_units`."""
+    units_sql = ", ".join(f"'{u}'" for u in icu_units)
+    sofa_ctes = SOFA_CTES.format(
+        window_hours=window_hours,
+        cohort_filter=f"\n    WHERE c.ou_loc_ref IN ({units_sql})",
+    )
+    sofa_cols = ",\n    ".join(f"ss.{c}" for c in SOFA_INPUT_COLS)
+    nutrition_cols = ",\n    ".join(f"na.{c}" for c in NUTRITION_RAW_COLS)
+    autopsy_cols = ",\n    ".join(f"aa.{c}" for c in AUTOPSY_RAW_COLS)
+
+    return f"""{COHORT_CTES.format(min_year=min_year, max_year=max_year)},
+-- ---------------------------------------------------------------------
+-- SOFA al ingreso (solo UCI) sobre la misma CTE `cohort`.
+-- ---------------------------------------------------------------------
+{sofa_ctes},
+sofa_stays AS (
+{SOFA_SELECT}
+),
+-- ---------------------------------------------------------------------
+-- Nutrición enteral / parenteral.
+-- ---------------------------------------------------------------------
+{render_nutrition_ctes(min_year, max_year)},
+nutrition_agg AS (
+{NUTRITION_AGG_SELECT}
+),
+-- ---------------------------------------------------------------------
+-- Autopsias / necropsias.
+-- ---------------------------------------------------------------------
+{render_autopsy_ctes(min_year, max_year)},
+autopsy_agg AS (
+{AUTOPSY_AGG_SELECT}
+),
+demo_stays AS (
+{STAYS_SELECT}
+)
+SELECT
+    ds.*,
+    {sofa_cols},
+    {nutrition_cols},
+    {autopsy_cols}
+FROM demo_stays ds
+LEFT JOIN sofa_stays ss      ON {_join_on("ss")}
+LEFT JOIN nutrition_agg na   ON {_join_on("na")}
+LEFT JOIN autopsy_agg aa     ON {_join_on("aa")}
+ORDER BY ds.ou_loc_ref, ds.admission_date;
+"""
@@ -14,9 +14,13 @@ mergea en la cohorte para enriquecer el reporting (mediana global,
 subgrupo cirrosis y subgrupo procedencia "otro hospital").
 """
 
+from typing import Optional
+
 import pandas as pd
 
+from indicadors_iso._dtypes import apply_schema
 from indicadors_iso._paths import module_output_dir
+from indicadors_iso.connection import execute_query_yearly
 from indicadors_iso.demographics._bed_occupancy import compute_bed_occupancy_nominal
 from indicadors_iso.demographics._config import FAKE_BED_PLACE_REFS_E073
 from indicadors_iso.demographics._loader import (
@@ -28,16 +32,26 @@ from indicadors_iso.demographics._loader import (
 )
 from indicadors_iso.demographics._metrics import compute_summary
 from indicadors_iso.demographics._report import generate_html, to_dataframe
+from indicadors_iso.demographics._schemas import (
+    AUTOPSY_SCHEMA,
+    NUTRITION_SCHEMA,
+    SOFA_SCHEMA,
+)
+from indicadors_iso.demographics._stays_sql import query_for_stays
 from indicadors_iso.demographics.autopsy._loader import (
+    AUTOPSY_OUTPUT_COLS,
     load_autopsy_cohort,
     merge_per_unit as merge_autopsy_per_unit,
 )
 from indicadors_iso.demographics.nutrition._loader import (
+    NUTRITION_OUTPUT_COLS,
     load_nutrition_cohort,
     merge_per_unit as merge_nutrition_per_unit,
 )
 from indicadors_iso.demographics.per_unit._sql import SQL_TEMPLATE
+from indicadors_iso.demographics.per_unit._wide_sql import render_wide_sql
 from indicadors_iso.demographics.sofa._config import ICU_UNITS, WINDOW_HOURS
+from indicadors_iso.demographics.sofa._metrics import INPUT_COLS as SOFA_INPUT_COLS
 from indicadors_iso.demographics.sofa._metrics import compute_sofa
 from indicadors_iso.demographics.sofa._sql import render_sql as render_sofa_sql
 
@@ -45,6 +59,19 @@ OUTPUT_DIR = module_output_dir("demographics", "per_unit")
 
 UNITS = ["E073", "I073"]
 
+# Si True, cohorte + SOFA + nutrición + autopsia salen de UNA query
+# anual consolidada (`per_unit/_wide_sql.py`): las estancias se
+# construyen una sola vez y no hace falta mergear en pandas. False (por
+# defecto) = cuatro series de queries (cohorte y subloaders) + merges.
+# Opt-in hasta validar la paridad de ambos caminos con datos reales.
+SINGLE_SCAN = False
+
+# Solo con `SINGLE_SCAN = False`: si True, SOFA / nutrición / autopsia
+# reciben las estancias de la cohorte ya descargada como tabla VALUES en
+# lugar de recalcularlas desde `movements` en cada query (ver
+# `demographics._stays_sql`).
+PUSHDOWN_COHORT_KEYS = True
+
 # Claves de merge entre la cohorte demographic per_unit y la cohorte SOFA.
 # Ambas usan la misma lógica per-unit (`PARTITION BY patient_ref,
 # episode_ref, ou_loc_ref` con tolerancia 5 min en `start_date`), por lo
@@ -78,12 +105,17 @@ def parse_year_input(text: str) -> tuple[int, int]:
 
 
 def load_sofa_cohort(
-    min_year: int, max_year: int, units: list[str]
+    min_year: int,
+    max_year: int,
+    units: list[str],
+    stays: Optional[pd.DataFrame] = None,
 ) -> pd.DataFrame:
     """Descarga la cohorte SOFA año a año para las `units` que sean UCI.
 
     Devuelve un DataFrame vacío si ninguna unidad pedida está en
     `ICU_UNITS` (p.ej. una unidad de hospitalización convencional).
+    Con `stays`, las estancias se envían como tabla `VALUES` (ver
+    `demographics._stays_sql`).
     """
     icu_subset = [u for u in units if u in ICU_UNITS]
     if not icu_subset:
@@ -94,19 +126,27 @@ def load_sofa_cohort(
         return pd.DataFrame(columns=SOFA_JOIN_KEYS)
 
     print(
-        f"[sofa] descargando SOFA año a año desde Metabase "
+        f"[sofa] descargando SOFA desde Metabase "
         f"({min_year}-{max_year}, {icu_subset})…"
     )
-    from connection import execute_query_yearly
-
-    df = execute_query_yearly(
-        lambda year: render_sofa_sql(
-            year, year, icu_subset, window_hours=WINDOW_HOURS
-        ),
-        min_year,
-        max_year,
-        label="sofa",
-    )
+    if stays is not None:
+        df = query_for_stays(
+            lambda ctes: render_sofa_sql(
+                min_year, max_year, icu_subset, window_hours=WINDOW_HOURS, cohort_ctes=ctes
+            ),
+            stays,
+            icu_subset,
+            label="sofa",
+        )
+    else:
+        df = execute_query_yearly(
+            lambda year: render_sofa_sql(
+                year, year, icu_subset, window_hours=WINDOW_HOURS
+            ),
+            min_year,
+            max_year,
+            label="sofa",
+        )
 
     if df.empty:
         print("[sofa] sin filas — saltando cálculo SOFA.")
@@ -123,7 +163,79 @@ def load_sofa_cohort(
     )
 
     keep = SOFA_JOIN_KEYS + [c for c in SOFA_OUTPUT_COLS if c in df.columns]
-    return df[keep].copy()
+    return apply_schema(df[keep], SOFA_SCHEMA, label="sofa")
+
+
+def load_wide_cohort(min_year: int, max_year: int) -> pd.DataFrame:
+    """Cohorte per-unit ya enriquecida con SOFA, nutrición y autopsia.
+
+    Una query por año (`render_wide_sql`); las columnas derivadas se
+    calculan aquí igual que en `load_sofa_cohort` + `merge_sofa` y los
+    `merge_per_unit` de nutrición y autopsia. Sin augmentación
+    sintética.
+
+    Sin almacén incremental: su marca de agua sólo mira `movements`, y
+    labs, constantes, prescripciones o autopsias cargadas tarde dejarían
+    SOFA / nutrición / autopsia desfasados. Se consulta siempre en vivo,
+    como los subloaders.
+    """
+    icu_subset = [u for u in UNITS if u in ICU_UNITS]
+    df = load_cohort(
+        min_year=min_year,
+        max_year=max_year,
+        sql_template=lambda lo, hi: render_wide_sql(
+            lo, hi, icu_subset, window_hours=WINDOW_HOURS
+        ),
+        synthetic_group_col="ou_loc_ref",
+        skip_synthetic=True,
+        incremental=False,
+    )
+    if df.empty:
+        return df
+    df = df.reset_index(drop=True)
+
+    # SOFA: solo estancias UCI (el resto queda NaN, como tras `merge_sofa`).
+    in_icu = df["ou_loc_ref"].isin(icu_subset).to_numpy()
+    sofa = compute_sofa(df.loc[in_icu, SOFA_INPUT_COLS]) if in_icu.any() else None
+    df = df.drop(columns=SOFA_INPUT_COLS)
+    for col in SOFA_OUTPUT_COLS:
+        df[col] = sofa[col].reindex(df.index) if sofa is not None else float("nan")
+    print(
+        f"[sofa] {int(in_icu.sum())} estancias UCI con SOFA "
+        f"(query consolidada). Mediana SOFA={df['sofa_total'].median():.0f}."
+    )
+
+    # Nutrición: flags/horas solo en estancias con alguna prescripción
+    # (el resto queda NA, como tras `merge_per_unit`).
+    ent = pd.to_datetime(df["nutr_enteral_start"], errors="coerce", utc=True)
+    par = pd.to_datetime(df["nutr_parenteral_start"], errors="coerce", utc=True)
+    adm = pd.to_datetime(df["admission_date"], errors="coerce", utc=True)
+    has_nutrition = ent.notna() | par.notna()
+    df["nutr_enteral_start"] = ent
+    df["nutr_parenteral_start"] = par
+    df["received_enteral"] = ent.notna().astype("Int64").where(has_nutrition)
+    df["received_parenteral"] = par.notna().astype("Int64").where(has_nutrition)
+    df["hours_to_enteral"] = (ent - adm).dt.total_seconds() / 3600
+    df["hours_to_parenteral"] = (par - adm).dt.total_seconds() / 3600
+
+    # Autopsia: 0 si la estancia no tiene ninguna.
+    autopsy = pd.to_datetime(df["first_autopsy_date"], errors="coerce", utc=True)
+    df["first_autopsy_date"] = autopsy
+    df["received_autopsy"] = autopsy.notna().astype("Int64")
+    print(
+        f"[wide] {len(df)} estancias: "
+        f"{int((df['received_enteral'] == 1).sum())} con enteral | "
+        f"{int((df['received_parenteral'] == 1).sum())} con parenteral | "
+        f"{int(df['received_autopsy'].sum())} con autopsia."
+    )
+    # Mismo orden de columnas que tras los merges.
+    enrich_cols = SOFA_OUTPUT_COLS + NUTRITION_OUTPUT_COLS + AUTOPSY_OUTPUT_COLS
+    df = df[[c for c in df.columns if c not in enrich_cols] + enrich_cols]
+    return apply_schema(
+        df,
+        {**SOFA_SCHEMA, **NUTRITION_SCHEMA, **AUTOPSY_SCHEMA},
+        label="wide",
+    )
 
 
 def merge_sofa(cohort: pd.DataFrame, sofa_df: pd.DataFrame) -> pd.DataFrame:
@@ -161,11 +273,9 @@ def merge_sofa(cohort: pd.DataFrame, sofa_df: pd.DataFrame) -> pd.DataFrame:
     return merged
 
 
-def main():
-    year_input = input("Periodo (p.ej. 2019-2025) [2019-2025]: ").strip()
-    min_year, max_year = parse_year_input(year_input)
-    years_str = f"{min_year}-{max_year}" if min_year != max_year else str(min_year)
-
+def load_enriched_cohort(min_year: int, max_year: int, years_str: str) -> pd.DataFrame:
+    """Cohorte per-unit + subloaders SOFA / nutrición / autopsia por
+    separado, mergeados en pandas (`SINGLE_SCAN = False`)."""
     print(f"Consultando cohorte (per_unit) {years_str}…")
     df = load_cohort(
         min_year=min_year,
@@ -173,19 +283,37 @@ def main():
         sql_template=SQL_TEMPLATE,
         synthetic_group_col="ou_loc_ref",
         skip_synthetic=True,
+        watermark_units=UNITS,
     )
 
+    stays = df if PUSHDOWN_COHORT_KEYS and not df.empty else None
+
     print(f"Consultando SOFA al ingreso (UCI) {years_str}…")
-    sofa_df = load_sofa_cohort(min_year, max_year, UNITS)
+    sofa_df = load_sofa_cohort(min_year, max_year, UNITS, stays=stays)
     df = merge_sofa(df, sofa_df)
 
     print(f"Consultando nutrición enteral / parenteral {years_str}…")
-    nutrition_df = load_nutrition_cohort(min_year, max_year, UNITS)
+    nutrition_df = load_nutrition_cohort(min_year, max_year, UNITS, stays=stays)
     df = merge_nutrition_per_unit(df, nutrition_df)
 
     print(f"Consultando autopsias / necropsias {years_str}…")
-    autopsy_df = load_autopsy_cohort(min_year, max_year, UNITS)
-    df = merge_autopsy_per_unit(df, autopsy_df)
+    autopsy_df = load_autopsy_cohort(min_year, max_year, UNITS, stays=stays)
+    return merge_autopsy_per_unit(df, autopsy_df)
+
+
+def main():
+    year_input = input("Periodo (p.ej. 2019-2025) [2019-2025]: ").strip()
+    min_year, max_year = parse_year_input(year_input)
+    years_str = f"{min_year}-{max_year}" if min_year != max_year else str(min_year)
+
+    if SINGLE_SCAN:
+        print(
+            f"Consultando cohorte + SOFA + nutrición + autopsia (per_unit, "
+            f"query consolidada) {years_str}…"
+        )
+        df = load_wide_cohort(min_year, max_year)
+    else:
+        df = load_enriched_cohort(min_year, max_year, years_str)
 
     # Augmentación sintética 2025 — se hace AHORA, después de los merges
     # de SOFA y nutrición, para que las filas sintéticas hereden valores
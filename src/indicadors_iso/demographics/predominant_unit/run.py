@@ -56,6 +56,7 @@ def main():
         sql_template=SQL_TEMPLATE,
         synthetic_group_col=None,
         skip_synthetic=True,
+        watermark_units=UNITS,
     )
 
     print(f"Consultando nutrición enteral / parenteral {years_str}…")
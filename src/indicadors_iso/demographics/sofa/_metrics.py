@@ -31,9 +31,15 @@ Limitaciones conocidas (v1):
   * Renal: sin diuresis (no disponible en BBDD). Sólo creatinina.
   * Respiratorio: si no hay FiO2 registrada se asume FiO2 = 0.21 (aire
     ambiente). Si tampoco hay PaO2 → componente NA.
+
+`compute_sofa` no llama a las `score_*` fila a fila: usa los kernels
+`*_column` (mismos cortes y NA, con `np.select` sobre columnas
+enteras). Las `score_*` quedan como referencia legible de cada regla;
+`tests/test_sofa.py` comprueba que ambas versiones coinciden.
 """
 from __future__ import annotations
 
+import numpy as np
 import pandas as pd
 
 # ---------------------------------------------------------------------------
@@ -146,6 +152,93 @@ def score_renal(creatinine_mgdl):
     return 0
 
 
+# ---------------------------------------------------------------------------
+# Kernels vectorizados (mismas reglas que las `score_*`)
+# ---------------------------------------------------------------------------
+def _values(col) -> np.ndarray:
+    """Columna como float64, con NaN en los nulos."""
+    return pd.to_numeric(pd.Series(col), errors="coerce").to_numpy(
+        dtype="float64", na_value=np.nan
+    )
+
+
+def _truthy(col) -> np.ndarray:
+    """`bool(x)` elemento a elemento (NaN cuenta como cierto, igual que
+    en Python)."""
+    return _values(col) != 0
+
+
+def _component(conditions, grades, missing, index) -> pd.Series:
+    """Puntuación 0-4 (Int64) del primer `conditions` que se cumple; NA
+    donde `missing`."""
+    score = np.select(conditions, grades, default=0).astype("int64")
+    return pd.Series(pd.arrays.IntegerArray(score, mask=missing), index=index)
+
+
+def _graded(col, cuts, below: bool) -> pd.Series:
+    """Componente de un solo valor: 4, 3, 2, 1 para el primer corte de
+    `cuts` (de peor a mejor) que se cumple (`x < corte` si `below`, si
+    no `x >= corte`); 0 si ninguno; NA si falta el valor."""
+    x = _values(col)
+    conditions = [x < c if below else x >= c for c in cuts]
+    return _component(conditions, [4, 3, 2, 1], np.isnan(x), pd.Series(col).index)
+
+
+def respiratory_column(pao2_mmhg, fio2_pct, on_vmi) -> pd.Series:
+    """`score_respiratory` sobre columnas."""
+    pao2 = _values(pao2_mmhg)
+    fio2 = _values(fio2_pct)
+    fio2 = np.where(np.isnan(fio2), 21.0, np.where(fio2 <= 1.0, fio2 * 100.0, fio2))
+    missing = np.isnan(pao2) | (fio2 <= 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = pao2 / (fio2 / 100.0)
+    vmi = _values(on_vmi)
+    on_support = ~np.isnan(vmi) & (vmi != 0)
+    conditions = [
+        (ratio < 100) & on_support,
+        (ratio < 200) & on_support,
+        ratio < 300,
+        ratio < 400,
+    ]
+    return _component(conditions, [4, 3, 2, 1], missing, pd.Series(pao2_mmhg).index)
+
+
+def coagulation_column(platelets_k) -> pd.Series:
+    """`score_coagulation` sobre una columna."""
+    return _graded(platelets_k, (20, 50, 100, 150), below=True)
+
+
+def liver_column(bilirubin_mgdl) -> pd.Series:
+    """`score_liver` sobre una columna."""
+    return _graded(bilirubin_mgdl, (12.0, 6.0, 2.0, 1.2), below=False)
+
+
+def cardiovascular_column(map_min, on_norepi, on_epi, on_dopa, on_dobu,
+                          on_vasop, on_phenyl, on_inotrope_other) -> pd.Series:
+    """`score_cardiovascular` sobre columnas."""
+    high_dose_pressor = _truthy(on_norepi) | _truthy(on_epi)
+    low_dose_pressor = (_truthy(on_dopa) | _truthy(on_dobu) | _truthy(on_vasop)
+                        | _truthy(on_phenyl) | _truthy(on_inotrope_other))
+    pam = _values(map_min)
+    pressor = high_dose_pressor | low_dose_pressor
+    return _component(
+        [high_dose_pressor, low_dose_pressor, pam < 70],
+        [4, 3, 1],
+        np.isnan(pam) & ~pressor,
+        pd.Series(map_min).index,
+    )
+
+
+def neuro_column(gcs) -> pd.Series:
+    """`score_neuro` sobre una columna."""
+    return _graded(gcs, (6, 10, 13, 15), below=True)
+
+
+def renal_column(creatinine_mgdl) -> pd.Series:
+    """`score_renal` sobre una columna."""
+    return _graded(creatinine_mgdl, (5.0, 3.5, 2.0, 1.2), below=False)
+
+
 # ---------------------------------------------------------------------------
 # Aplicación al DataFrame de cohorte
 # ---------------------------------------------------------------------------
@@ -154,21 +247,26 @@ COMPONENT_COLS = [
     "sofa_cardio", "sofa_neuro", "sofa_renal",
 ]
 
+# Columnas crudas que lee `compute_sofa`.
+INPUT_COLS = [
+    "pao2_min", "fio2_max", "on_vmi", "platelets_min", "bilirubin_max",
+    "map_min", "on_norepi", "on_epi", "on_dopa", "on_dobu", "on_vasop",
+    "on_phenyl", "on_inotrope_other", "gcs_min", "creatinine_max",
+]
+
 
 def compute_sofa(df: pd.DataFrame) -> pd.DataFrame:
-    """Añade columnas `sofa_*` y `sofa_total` al DataFrame de entrada."""
+    """Añade columnas `sofa_*` (Int64, NA si el componente no es
+    evaluable) y `sofa_total` al DataFrame de entrada."""
     out = df.copy()
-    out["sofa_resp"] = out.apply(
-        lambda r: score_respiratory(r["pao2_min"], r["fio2_max"], r["on_vmi"]), axis=1)
-    out["sofa_coag"]   = out["platelets_min"].apply(score_coagulation)
-    out["sofa_liver"]  = out["bilirubin_max"].apply(score_liver)
-    out["sofa_cardio"] = out.apply(
-        lambda r: score_cardiovascular(
-            r["map_min"], r["on_norepi"], r["on_epi"], r["on_dopa"],
-            r["on_dobu"], r["on_vasop"], r["on_phenyl"], r["on_inotrope_other"]),
-        axis=1)
-    out["sofa_neuro"]  = out["gcs_min"].apply(score_neuro)
-    out["sofa_renal"]  = out["creatinine_max"].apply(score_renal)
+    out["sofa_resp"] = respiratory_column(out["pao2_min"], out["fio2_max"], out["on_vmi"])
+    out["sofa_coag"] = coagulation_column(out["platelets_min"])
+    out["sofa_liver"] = liver_column(out["bilirubin_max"])
+    out["sofa_cardio"] = cardiovascular_column(
+        out["map_min"], out["on_norepi"], out["on_epi"], out["on_dopa"],
+        out["on_dobu"], out["on_vasop"], out["on_phenyl"], out["on_inotrope_other"])
+    out["sofa_neuro"] = neuro_column(out["gcs_min"])
+    out["sofa_renal"] = renal_column(out["creatinine_max"])
 
     # Total = suma de componentes disponibles (componentes NA cuentan 0
     # pero los marcamos para reporting).
@@ -183,7 +281,7 @@ def compute_sofa(df: pd.DataFrame) -> pd.DataFrame:
 # ---------------------------------------------------------------------------
 def summarize_by_unit_year(df: pd.DataFrame) -> pd.DataFrame:
     """Devuelve estadísticos del SOFA por (ou_loc_ref, year_admission)."""
-    grp = df.groupby(["ou_loc_ref", "year_admission"], dropna=False)
+    grp = df.groupby(["ou_loc_ref", "year_admission"], dropna=False, observed=True)
     summary = grp.agg(
         n_stays=("sofa_total", "size"),
         n_full=("sofa_components_available", lambda s: int((s == 6).sum())),
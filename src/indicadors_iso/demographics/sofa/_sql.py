@@ -8,62 +8,25 @@ incrustar lógica clínica en SQL.
 Parámetros de plantilla:
     {min_year}, {max_year}      -> rango de admisión
     {window_hours}              -> ventana de medición (24 por defecto)
-    {icu_units_csv}             -> lista entrecomillada de UCIs, p.ej.
-                                   "'E016','E103',..."
+    {cohort_ctes}               -> CTEs que definen `cohort` (estancias
+                                   UCI per-unit, ver
+                                   `demographics._stays_sql`)
+    {cohort_filter}             -> WHERE opcional sobre `cohort_window`
+                                   (vacío en la query SOFA sola)
 """
 
-SQL_TEMPLATE = r"""
--- =====================================================================
--- SOFA al ingreso — cohorte UCI + agregados por componente (24 h)
--- Dialect: Athena (Trino/Presto)
--- =====================================================================
+from typing import Optional
 
--- 1. Cohorte de estancias UCI (per-unit, lógica de demographics/per_unit).
-WITH all_related_moves AS (
-    SELECT
-        patient_ref, episode_ref, ou_loc_ref,
-        start_date, end_date,
-        COALESCE(end_date, current_timestamp) AS effective_end_date
-    FROM datascope_gestor_prod.movements
-    WHERE ou_loc_ref IN ({icu_units_csv})
-      AND start_date <= timestamp '{max_year}-12-31 23:59:59'
-      AND COALESCE(end_date, current_timestamp) >= timestamp '{min_year}-01-01 00:00:00'
-      AND place_ref IS NOT NULL
-      AND COALESCE(end_date, current_timestamp) > start_date
-),
-flagged_starts AS (
-    SELECT *,
-        CASE
-            WHEN ABS(date_diff('minute',
-                LAG(effective_end_date) OVER (
-                    PARTITION BY patient_ref, episode_ref, ou_loc_ref ORDER BY start_date
-                ),
-                start_date
-            )) <= 5 THEN 0 ELSE 1
-        END AS is_new_stay
-    FROM all_related_moves
-),
-grouped_stays AS (
-    SELECT *,
-        SUM(is_new_stay) OVER (
-            PARTITION BY patient_ref, episode_ref, ou_loc_ref ORDER BY start_date
-        ) AS stay_id
-    FROM flagged_starts
-),
-cohort AS (
-    SELECT
-        patient_ref, episode_ref, ou_loc_ref, stay_id,
-        MIN(start_date) AS admission_date,
-        MAX(effective_end_date) AS effective_discharge_date
-    FROM grouped_stays
-    GROUP BY patient_ref, episode_ref, ou_loc_ref, stay_id
-    HAVING year(MIN(start_date)) BETWEEN {min_year} AND {max_year}
-),
-cohort_window AS (
+from indicadors_iso.demographics._stays_sql import per_unit_stays_ctes
+
+# CTEs de agregados SOFA sobre `cohort` (ventana → labs/RC/GCS/vasoactivos/
+# peso/form → demo). `{cohort_filter}` restringe `cohort_window` (p.ej. a
+# las unidades UCI cuando `cohort` trae también otras unidades).
+SOFA_CTES = r"""cohort_window AS (
     SELECT
         c.*,
         date_add('hour', {window_hours}, c.admission_date) AS window_end
-    FROM cohort c
+    FROM cohort c{cohort_filter}
 ),
 
 -- 2. LABS dentro de las primeras 24 h.
@@ -292,9 +255,9 @@ demo AS (
         d.sex,
         d.natio_descr AS nationality
     FROM datascope_gestor_prod.demographics d
-)
+)"""
 
-SELECT
+SOFA_SELECT = r"""SELECT
     cw.patient_ref,
     cw.episode_ref,
     cw.ou_loc_ref,
@@ -347,16 +310,38 @@ LEFT JOIN gcs_from_rc gr         ON gr.patient_ref = cw.patient_ref AND gr.episo
 LEFT JOIN vasoactive_agg va      ON va.patient_ref = cw.patient_ref AND va.episode_ref = cw.episode_ref AND va.ou_loc_ref = cw.ou_loc_ref AND va.stay_id = cw.stay_id
 LEFT JOIN weight_agg wa          ON wa.patient_ref = cw.patient_ref AND wa.episode_ref = cw.episode_ref AND wa.ou_loc_ref = cw.ou_loc_ref AND wa.stay_id = cw.stay_id
 LEFT JOIN sofa_form_agg sf       ON sf.patient_ref = cw.patient_ref AND sf.episode_ref = cw.episode_ref AND sf.ou_loc_ref = cw.ou_loc_ref AND sf.stay_id = cw.stay_id
-LEFT JOIN datascope_gestor_prod.exitus ex ON ex.patient_ref = cw.patient_ref
-ORDER BY cw.ou_loc_ref, cw.admission_date;
+LEFT JOIN datascope_gestor_prod.exitus ex ON ex.patient_ref = cw.patient_ref"""
+
+SQL_TEMPLATE = (
+    r"""
+-- =====================================================================
+-- SOFA al ingreso — cohorte UCI + agregados por componente (24 h)
+-- Dialect: Athena (Trino/Presto)
+-- =====================================================================
+
+-- 1. Cohorte de estancias UCI (per-unit, lógica de demographics/per_unit).
+WITH {cohort_ctes},
 """
+    + SOFA_CTES
+    + "\n\n"
+    + SOFA_SELECT
+    + "\nORDER BY cw.ou_loc_ref, cw.admission_date;\n"
+)
 
 
-def render_sql(min_year: int, max_year: int, icu_units, window_hours: int = 24) -> str:
-    units_csv = ",".join(f"'{u}'" for u in icu_units)
+def render_sql(
+    min_year: int,
+    max_year: int,
+    icu_units,
+    window_hours: int = 24,
+    cohort_ctes: Optional[str] = None,
+) -> str:
+    if cohort_ctes is None:
+        cohort_ctes = per_unit_stays_ctes(icu_units, min_year, max_year)
     return SQL_TEMPLATE.format(
         min_year=min_year,
         max_year=max_year,
         window_hours=window_hours,
-        icu_units_csv=units_csv,
+        cohort_ctes=cohort_ctes,
+        cohort_filter="",
     )
@@ -5,8 +5,8 @@ Usa los CSVs ya descargados (micro/output/rectal_mdr_<unit>_2019-2025.csv).
 Filtra a Enterobacterales del top-10 y lanza dos sondeos contra Metabase:
 
 1. Sondeo `antibiograms`: lista todos los `antibiotic_descr` distintos y
-   las sensitivity para los `antibiogram_ref` de la cohorte. Chunk por
-   (año × unidad) para esquivar el cap de 2000.
+   las sensitivity para los `antibiogram_ref` de la cohorte, en lotes
+   de lista IN (`execute_query_in_batches`) para esquivar el cap de 2000.
 2. Sondeo `micro.result_text`: filas de la cohorte que mencionen
    BLEE/ESBL/Carbapenemasa/KPC/OXA/NDM/VIM/IMP/productor/multiresistente.
 
@@ -23,7 +23,7 @@ import re
 import pandas as pd
 
 from indicadors_iso._paths import REPO_ROOT, module_output_dir
-from indicadors_iso.connection import execute_query
+from indicadors_iso.connection import execute_query_in_batches
 
 OUT_DIR = module_output_dir("micro", "rectal_mdr")
 EXP_DIR = module_output_dir("micro", "rectal_mdr", "exploratory")
@@ -69,81 +69,73 @@ def load_cohort_isolates() -> pd.DataFrame:
 
 
 def fetch_antibiograms_chunked(isolates: pd.DataFrame) -> pd.DataFrame:
-    """Descarga antibiograma por (año × unidad) usando antibiogram_ref."""
-    chunks = []
-    for (year, unit), grp in isolates.groupby(["year_admission", "unit"]):
-        refs = sorted({int(x) for x in grp["antibiogram_ref"].dropna().tolist()})
-        if not refs:
-            print(f"  [{unit} {year}] sin antibiogram_ref")
-            continue
-        # split por seguridad si la lista IN supera 1000 elementos
-        for i in range(0, len(refs), 800):
-            sub_refs = refs[i:i + 800]
-            in_list = ",".join(str(r) for r in sub_refs)
-            sql = f"""
-            SELECT
-                ab.patient_ref,
-                ab.episode_ref,
-                ab.antibiogram_ref,
-                ab.micro_ref,
-                ab.micro_descr,
-                ab.antibiotic_ref,
-                ab.antibiotic_descr,
-                ab.result,
-                ab.sensitivity,
-                ab.extrac_date
-            FROM datascope_gestor_prod.antibiograms ab
-            WHERE ab.antibiogram_ref IN ({in_list})
-            LIMIT 2000
-            """
-            df = execute_query(sql, verbose=False)
-            chunks.append(df.assign(unit=unit, year_admission=year, chunk_size=len(df)))
-            marker = "  ⚠ posible truncado" if len(df) >= 1900 else ""
-            print(f"  [{unit} {year} part{i // 800}] {len(df)} filas{marker}")
-    if not chunks:
-        return pd.DataFrame()
-    return pd.concat(chunks, ignore_index=True)
+    """Descarga el antibiograma de todos los antibiogram_ref de la cohorte.
+
+    `execute_query_in_batches` trocea la lista IN y parte los lotes que
+    rozan el cap de 2000; unidad y año se reasignan desde la cohorte.
+    """
+    refs = isolates[["antibiogram_ref", "unit", "year_admission"]].dropna(
+        subset=["antibiogram_ref"]
+    )
+    refs = refs.astype({"antibiogram_ref": "int64"}).drop_duplicates("antibiogram_ref")
+    sql = """
+    SELECT
+        ab.patient_ref,
+        ab.episode_ref,
+        ab.antibiogram_ref,
+        ab.micro_ref,
+        ab.micro_descr,
+        ab.antibiotic_ref,
+        ab.antibiotic_descr,
+        ab.result,
+        ab.sensitivity,
+        ab.extrac_date
+    FROM datascope_gestor_prod.antibiograms ab
+    WHERE {key_filter}
+    """
+    df = execute_query_in_batches(
+        sql,
+        refs["antibiogram_ref"],
+        ["ab.antibiogram_ref"],
+        label="antibiograms",
+        rows_per_key=30,
+    )
+    if df.empty:
+        return df
+    return df.merge(refs, on="antibiogram_ref", how="left")
 
 
 def fetch_result_text(isolates: pd.DataFrame) -> pd.DataFrame:
-    """Para no replicar la cohorte en Athena, traemos result_text por
-    (patient_ref, episode_ref, extrac_date) año a año."""
-    chunks = []
-    for (year, unit), grp in isolates.groupby(["year_admission", "unit"]):
-        if grp.empty:
-            continue
-        # construimos predicado por (patient_ref, episode_ref) lista
-        pairs = grp[["patient_ref", "episode_ref"]].drop_duplicates()
-        if pairs.empty:
-            continue
-        # limit por seguridad
-        pairs_chunks = [pairs.iloc[i:i + 400] for i in range(0, len(pairs), 400)]
-        for j, pchunk in enumerate(pairs_chunks):
-            tuples = ",".join(
-                f"({int(p)},{int(e)})"
-                for p, e in pchunk.itertuples(index=False, name=None)
-            )
-            sql = f"""
-            SELECT
-                m.patient_ref,
-                m.episode_ref,
-                m.extrac_date,
-                m.method_descr,
-                m.micro_descr,
-                m.result_text
-            FROM datascope_gestor_prod.micro m
-            WHERE (m.patient_ref, m.episode_ref) IN ({tuples})
-              AND m.method_descr LIKE '%Frotis rectal%multi%'
-              AND m.positive = 'X'
-            LIMIT 2000
-            """
-            df = execute_query(sql, verbose=False)
-            chunks.append(df.assign(unit=unit, year_admission=year))
-            marker = "  ⚠ posible truncado" if len(df) >= 1900 else ""
-            print(f"  [result_text {unit} {year} part{j}] {len(df)} filas{marker}")
-    if not chunks:
-        return pd.DataFrame()
-    return pd.concat(chunks, ignore_index=True)
+    """Para no replicar la cohorte en Athena, traemos result_text filtrando
+    por los pares (patient_ref, episode_ref) de la cohorte en lotes."""
+    pairs = isolates[["patient_ref", "episode_ref", "unit", "year_admission"]].dropna(
+        subset=["patient_ref", "episode_ref"]
+    )
+    pairs = pairs.astype({"patient_ref": "int64", "episode_ref": "int64"}).drop_duplicates()
+    sql = """
+    SELECT
+        m.patient_ref,
+        m.episode_ref,
+        m.extrac_date,
+        m.method_descr,
+        m.micro_descr,
+        m.result_text
+    FROM datascope_gestor_prod.micro m
+    WHERE {key_filter}
+      AND m.method_descr LIKE '%Frotis rectal%multi%'
+      AND m.positive = 'X'
+    """
+    df = execute_query_in_batches(
+        sql,
+        pairs[["patient_ref", "episode_ref"]],
+        ["m.patient_ref", "m.episode_ref"],
+        label="result_text",
+        rows_per_key=4,
+    )
+    if df.empty:
+        return df
+    # Un episodio que pasa por E073 e I073 aparece una vez por unidad.
+    return df.merge(pairs, on=["patient_ref", "episode_ref"], how="inner")
 
 
 def main() -> None:
@@ -154,7 +146,7 @@ def main() -> None:
           f"I073={int((isolates['unit']=='I073').sum())})")
 
     # ----- Sondeo 1: antibiograms -----
-    print("\n[sondeo 1] descargando antibiograms (chunk por unidad × año)…")
+    print("\n[sondeo 1] descargando antibiograms (lotes de antibiogram_ref)…")
     abs_df = fetch_antibiograms_chunked(isolates)
     print(f"[sondeo 1] total filas: {len(abs_df)}")
     abs_df.to_csv(EXP_DIR / "antibiograms_full.csv", index=False)
@@ -1,11 +1,19 @@
+from typing import Optional
+
+from indicadors_iso.demographics._stays_sql import per_unit_stays_ctes
+
+UNITS = ("E073", "I073")
+
 SQL_TEMPLATE = """
 -- =====================================================================
 -- Aislamientos positivos en frotis rectal de multirresistentes
 -- restringidos a estancias E073 / I073 (lógica per_unit).
 -- =====================================================================
--- Replica EXACTAMENTE la definición de estancia de
+-- Usa EXACTAMENTE la definición de estancia de
 -- demographics/per_unit/_sql.py (sin agrupar traslados, tolerancia
--- 5 min, place_ref IS NOT NULL, prescripción durante la estancia).
+-- 5 min, place_ref IS NOT NULL, prescripción durante la estancia):
+-- la CTE `cohort` se recalcula desde movements o se lee de una tabla
+-- VALUES (ver demographics/_stays_sql.py).
 --
 -- Sobre esa cohorte se cruzan los registros de
 -- datascope_gestor_prod.micro filtrando:
@@ -17,56 +25,7 @@ SQL_TEMPLATE = """
 -- Salida: una fila por aislamiento positivo. La clasificación final de
 -- qué microorganismos son "MDR" se hace a posteriori por el clínico.
 -- =====================================================================
-WITH all_related_moves AS (
-    SELECT
-        patient_ref,
-        episode_ref,
-        ou_loc_ref,
-        start_date,
-        end_date,
-        COALESCE(end_date, current_timestamp) AS effective_end_date
-    FROM datascope_gestor_prod.movements
-    WHERE ou_loc_ref IN ('E073','I073')
-      AND start_date <= timestamp '{max_year}-12-31 23:59:59'
-      AND COALESCE(end_date, current_timestamp) >= timestamp '{min_year}-01-01 00:00:00'
-      AND place_ref IS NOT NULL
-      AND COALESCE(end_date, current_timestamp) > start_date
-),
-flagged_starts AS (
-    SELECT
-        *,
-        CASE
-            WHEN ABS(date_diff('minute',
-                LAG(effective_end_date) OVER (
-                    PARTITION BY patient_ref, episode_ref, ou_loc_ref ORDER BY start_date
-                ),
-                start_date
-            )) <= 5
-            THEN 0
-            ELSE 1
-        END AS is_new_stay
-    FROM all_related_moves
-),
-grouped_stays AS (
-    SELECT
-        *,
-        SUM(is_new_stay) OVER (
-            PARTITION BY patient_ref, episode_ref, ou_loc_ref ORDER BY start_date
-        ) AS stay_id
-    FROM flagged_starts
-),
-cohort AS (
-    SELECT
-        patient_ref,
-        episode_ref,
-        ou_loc_ref,
-        stay_id,
-        MIN(start_date) AS admission_date,
-        MAX(effective_end_date) AS effective_discharge_date
-    FROM grouped_stays
-    GROUP BY patient_ref, episode_ref, ou_loc_ref, stay_id
-    HAVING year(MIN(start_date)) BETWEEN {min_year} AND {max_year}
-),
+WITH {cohort_ctes},
 prescription_filtered AS (
     SELECT DISTINCT c.*
     FROM cohort c
@@ -137,3 +96,11 @@ INNER JOIN rectal_mdr_micro m
        AND c.effective_discharge_date
 ORDER BY c.ou_loc_ref, c.admission_date, m.extrac_date, m.num_micro;
 """
+
+
+def render_sql(min_year: int, max_year: int, cohort_ctes: Optional[str] = None) -> str:
+    if cohort_ctes is None:
+        cohort_ctes = per_unit_stays_ctes(UNITS, min_year, max_year)
+    return SQL_TEMPLATE.format(
+        min_year=min_year, max_year=max_year, cohort_ctes=cohort_ctes
+    )
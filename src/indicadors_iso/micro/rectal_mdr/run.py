@@ -13,14 +13,20 @@ Salida:
 """
 from __future__ import annotations
 
+from typing import Optional
+
 import pandas as pd
 
 from indicadors_iso._paths import REPO_ROOT, module_output_dir
 from indicadors_iso.connection import execute_query_yearly
-from indicadors_iso.micro.rectal_mdr._sql import SQL_TEMPLATE
+from indicadors_iso.demographics._stays_sql import query_for_stays
+from indicadors_iso.micro.rectal_mdr._sql import render_sql
 
 OUTPUT_DIR = module_output_dir("micro", "rectal_mdr")
 UNITS = ["E073", "I073"]
+# Aislamientos positivos esperados por estancia (para dimensionar los
+# lotes de `load_isolates(stays=…)` bajo el tope de 2000 filas).
+ISOLATES_PER_STAY = 5
 
 
 def parse_year_input(text: str) -> tuple[int, int]:
@@ -34,13 +40,26 @@ def parse_year_input(text: str) -> tuple[int, int]:
     return year_val, year_val
 
 
-def load_isolates(min_year: int, max_year: int) -> pd.DataFrame:
+def load_isolates(
+    min_year: int, max_year: int, stays: Optional[pd.DataFrame] = None
+) -> pd.DataFrame:
+    """Aislamientos por año. Con `stays` (cohorte per_unit de
+    demographics ya descargada) las estancias se envían como tabla
+    `VALUES` en lugar de recalcularlas desde `movements`."""
     print(
-        f"[loader] descargando aislamientos rectal-MDR año a año "
+        f"[loader] descargando aislamientos rectal-MDR "
         f"({min_year}-{max_year})…"
     )
+    if stays is not None:
+        return query_for_stays(
+            lambda ctes: render_sql(min_year, max_year, cohort_ctes=ctes),
+            stays,
+            UNITS,
+            label="rectal_mdr",
+            rows_per_stay=ISOLATES_PER_STAY,
+        )
     df = execute_query_yearly(
-        lambda year: SQL_TEMPLATE.format(min_year=year, max_year=year),
+        lambda year: render_sql(year, year),
         min_year,
         max_year,
         label="rectal_mdr",
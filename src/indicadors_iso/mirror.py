@@ -0,0 +1,113 @@
+"""Réplica local de `movements` (ver `indicadors_iso._mirror`).
+
+Uso:
+    python -m indicadors_iso.mirror sync 2019-2025          # unidades por defecto
+    python -m indicadors_iso.mirror sync 2024 --units E073 I073
+    python -m indicadors_iso.mirror info                    # meses replicados
+
+Lectura desde los módulos:
+    from indicadors_iso.mirror import read_movements
+    df = read_movements("2024-01-01", "2025-01-01", units=["E073"],
+                        columns=["patient_ref", "episode_ref", "start_date", "end_date"])
+
+Las unidades por defecto son `DEFAULT_UNITS` o las de la variable de
+entorno `INDICADORS_MIRROR_UNITS` (separadas por comas).
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import Optional
+
+import pandas as pd
+
+from indicadors_iso._mirror import (
+    DEFAULT_MIRROR_DIR,
+    DEFAULT_UNITS,
+    MIRROR_UNITS_ENV,
+    MovementsMirror,
+    default_units,
+    read_movements,
+)
+
+
+def parse_years(text: str) -> tuple[int, int]:
+    """"2019-2025" → (2019, 2025); "2024" → (2024, 2024)."""
+    text = text.strip()
+    if "-" in text:
+        start, end = text.split("-", 1)
+        return int(start), int(end)
+    return int(text), int(text)
+
+
+def info(mirror: MovementsMirror) -> pd.DataFrame:
+    """Una fila por mes replicado: filas, marca de agua, unidades, fecha."""
+    manifest = mirror.manifest()
+    rows = [
+        {
+            "month": key,
+            "rows": entry.get("rows"),
+            "max_load_date": (entry.get("watermark") or {}).get("max_load_date"),
+            "units": ",".join(entry.get("units", [])),
+            "synced_at": pd.Timestamp(entry.get("synced_at", 0), unit="s").floor("s"),
+        }
+        for key, entry in sorted(manifest.items())
+    ]
+    return pd.DataFrame(rows)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Réplica local de movements particionada por mes."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_sync = sub.add_parser("sync", help="Sincroniza los meses que cambiaron.")
+    p_sync.add_argument("years", help="Año o rango (p.ej. 2019-2025).")
+    p_sync.add_argument(
+        "--units", nargs="+", default=None,
+        help=f"ou_loc_ref a replicar (por defecto {MIRROR_UNITS_ENV} o DEFAULT_UNITS).",
+    )
+    p_sync.add_argument(
+        "--force", action="store_true", help="Re-descarga todos los meses del rango."
+    )
+    p_sync.add_argument("--workers", type=int, default=4, help="Meses en paralelo (4).")
+
+    sub.add_parser("info", help="Lista los meses replicados.")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        table = info(MovementsMirror())
+        if table.empty:
+            print(f"No hay réplica en {DEFAULT_MIRROR_DIR}.")
+            return 1
+        print(table.to_string(index=False))
+        print(f"\n{len(table)} meses · {int(table['rows'].sum())} filas")
+        return 0
+
+    min_year, max_year = parse_years(args.years)
+    mirror = MovementsMirror(units=args.units)
+    result = mirror.sync(
+        min_year, max_year, force_refresh=args.force, max_workers=args.workers
+    )
+    print(
+        f"Listo: {len(result['refetched'])} mes(es) descargados, "
+        f"{len(result['unchanged'])} sin cambios, {len(result['removed'])} eliminados "
+        f"({mirror.root})."
+    )
+    return 0
+
+
+__all__ = [
+    "DEFAULT_MIRROR_DIR",
+    "DEFAULT_UNITS",
+    "MovementsMirror",
+    "default_units",
+    "info",
+    "read_movements",
+]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
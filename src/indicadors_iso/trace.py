@@ -0,0 +1,141 @@
+"""Traza JSONL por query y resumen de latencias.
+
+Cada `connection.execute_query` añade una línea a
+`output/_traces/<YYYY-MM-DD>.jsonl` con:
+
+    ts, pid, label          cuándo, qué proceso y qué etiqueta (la que
+                            pasan `execute_query_yearly` / `_partitioned`)
+    fingerprint, sql_head   huella del SQL normalizado (misma que la
+                            cache) y sus primeros caracteres
+    total_s                 latencia de punta a punta
+    auth_s, db_map_s,       desglose: login, mapa de bases, `/api/dataset`,
+    dataset_s, parse_s,     conversión a DataFrame y exportación CSV
+    export_s
+    running_time_ms         tiempo de ejecución que reporta Metabase
+    payload_bytes, rows     tamaño de la respuesta HTTP y filas
+    cap_ratio, truncated    filas / tope silencioso y si quedó truncada
+    cache_hit, retries      resultado servido por la cache / reintentos
+    queue_wait_s            espera por un slot del governor de concurrencia
+    error                   excepción, si la query falló
+
+`INDICADORS_TRACE=0` la desactiva; `INDICADORS_TRACE=/ruta/x.jsonl`
+escribe en otro fichero.
+
+Uso:
+    python -m indicadors_iso.trace                       # traza de hoy
+    python -m indicadors_iso.trace output/_traces/*.jsonl --top 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from indicadors_iso._trace import TRACE_DIR, trace_path, write_event
+
+
+def read_events(paths: Iterable[Path]) -> pd.DataFrame:
+    """Carga una o varias trazas JSONL (ignora líneas corruptas)."""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return pd.DataFrame.from_records(records)
+
+
+def summarize(events: pd.DataFrame) -> pd.DataFrame:
+    """p50 / p95 de latencia y volumen por label, ordenado por tiempo total."""
+    if events.empty:
+        return pd.DataFrame()
+    df = events.copy()
+    df["label"] = df["label"].fillna("(sin label)")
+    for col in ("cache_hit", "retries", "rows", "payload_bytes"):
+        if col not in df:
+            df[col] = 0
+    grouped = df.groupby("label")
+    summary = pd.DataFrame(
+        {
+            "queries": grouped.size(),
+            "total_s": grouped["total_s"].sum(),
+            "p50_s": grouped["total_s"].quantile(0.50),
+            "p95_s": grouped["total_s"].quantile(0.95),
+            "max_s": grouped["total_s"].max(),
+            "rows": grouped["rows"].sum(),
+            "mb": grouped["payload_bytes"].sum() / 1e6,
+            "cache_hits": grouped["cache_hit"].sum(),
+            "retries": grouped["retries"].sum(),
+        }
+    )
+    if "queue_wait_s" in df:
+        summary["queue_s"] = grouped["queue_wait_s"].sum()
+        summary["queue_p95_s"] = grouped["queue_wait_s"].quantile(0.95)
+    if "error" in df:
+        summary["errors"] = grouped["error"].count()
+    return summary.sort_values("total_s", ascending=False)
+
+
+def top_slow(events: pd.DataFrame, n: int = 10) -> pd.DataFrame:
+    """Las `n` queries más lentas (excluye hits de cache)."""
+    if events.empty:
+        return pd.DataFrame()
+    df = events
+    if "cache_hit" in df:
+        df = df[~df["cache_hit"].fillna(False).astype(bool)]
+    cols = [
+        c
+        for c in ("ts", "label", "total_s", "dataset_s", "running_time_ms",
+                  "rows", "fingerprint", "sql_head")
+        if c in df
+    ]
+    return df.nlargest(n, "total_s")[cols]
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Resume trazas JSONL de queries (latencia por label, queries lentas)."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        type=Path,
+        help="Ficheros .jsonl (por defecto, la traza de hoy).",
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="Nº de queries lentas a listar (10)."
+    )
+    args = parser.parse_args(argv)
+
+    paths = args.paths or [p for p in [trace_path()] if p is not None]
+    paths = [p for p in paths if p.exists()]
+    if not paths:
+        print("No hay trazas que resumir.")
+        return 1
+
+    events = read_events(paths)
+    if events.empty or "total_s" not in events:
+        print("Las trazas están vacías.")
+        return 1
+
+    with pd.option_context("display.width", 200, "display.max_colwidth", 80):
+        print(f"{len(events)} queries en {len(paths)} fichero(s)\n")
+        print("Por label:")
+        print(summarize(events).round(3).to_string())
+        print(f"\nTop {args.top} queries más lentas:")
+        print(top_slow(events, args.top).round(3).to_string(index=False))
+    return 0
+
+
+__all__ = ["TRACE_DIR", "read_events", "summarize", "top_slow", "trace_path", "write_event"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,4 +3,62 @@
 Real DB-touching tests (e.g. ``test_metabase_row_cap``) require a working
 Metabase ``.env`` and are therefore not auto-collected — run them
 explicitly with ``python tests/test_metabase_row_cap.py``.
+
+Everything else runs offline against ``metabase_standin.MetabaseStandIn``,
+a local HTTP server that mimics the Metabase API over a synthetic SQLite
+database (``standin`` / ``standin_client`` fixtures).
 """
+
+import pytest
+
+from indicadors_iso._governor import DEFAULT_MAX_CONCURRENT, ConcurrencyGovernor
+from indicadors_iso.connection import MetabaseClient, clear_single_flight, set_governor
+from tests.metabase_standin import MetabaseStandIn, build_fixture_db
+
+
+@pytest.fixture(autouse=True)
+def _no_trace(monkeypatch):
+    """Los tests no escriben en `output/_traces/`."""
+    monkeypatch.setenv("INDICADORS_TRACE", "0")
+
+
+@pytest.fixture(autouse=True)
+def _fresh_single_flight():
+    """Cada test empieza sin resultados memorizados por la deduplicación."""
+    clear_single_flight()
+    yield
+    clear_single_flight()
+
+
+@pytest.fixture(autouse=True)
+def _isolated_governor(tmp_path):
+    """Slots de concurrencia propios del test (no los del host)."""
+    set_governor(ConcurrencyGovernor(DEFAULT_MAX_CONCURRENT, tmp_path / "governor"))
+    yield
+    set_governor(None)
+
+
+@pytest.fixture(scope="session")
+def fixture_db(tmp_path_factory):
+    return build_fixture_db(tmp_path_factory.mktemp("standin") / "datanex.sqlite")
+
+
+@pytest.fixture
+def standin(fixture_db):
+    """Metabase local sobre la base sintética (ver `metabase_standin.py`)."""
+    with MetabaseStandIn(fixture_db) as server:
+        yield server
+
+
+@pytest.fixture
+def standin_client(standin):
+    client = MetabaseClient(
+        standin.url,
+        standin.email,
+        standin.password,
+        standin.database_name,
+        persist_state=False,
+        backoff_base_s=0.0,
+    )
+    yield client
+    client.close()
@@ -0,0 +1,353 @@
+"""
+Servidor HTTP local que imita la API de Metabase para tests y benchmarks
+sin red.
+
+Implementa lo que usa `indicadors_iso.connection`:
+
+    POST /api/session        login (cualquier email/contraseña configurados)
+    GET  /api/database       una única base, `database_name`
+    POST /api/dataset        SQL nativo contra un fichero SQLite; truncado
+                             silencioso a `row_cap` filas (2000, como
+                             producción) y respuesta 202 con `status`
+    POST /api/dataset/csv    misma query exportada a CSV, sin tope
+
+Las queries se ejecutan en SQLite, así que el SQL de los tests debe ser
+compatible con SQLite (no Athena/Trino). Un error de SQL se devuelve como
+Metabase: 202 con `status: "failed"`.
+
+Inyección de fallos y latencia (para medir pooling, reintentos,
+concurrencia y cache de punta a punta):
+
+    latency_s, latency_jitter_s   espera añadida a cada /api/dataset*
+    error_rate                    fracción de /api/dataset* que responden 502
+    fail_first                    las N primeras /api/dataset* responden 502
+
+Uso como servidor independiente:
+    python tests/metabase_standin.py --build-fixture /tmp/datanex.sqlite
+    python tests/metabase_standin.py --db /tmp/datanex.sqlite --port 3999 --latency 0.3
+
+y en el `.env` de pruebas `METABASE_URL=http://127.0.0.1:3999`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import random
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs
+
+METABASE_ROW_CAP = 2000
+
+_SQLITE_TO_METABASE = {
+    int: "type/Integer",
+    float: "type/Float",
+    str: "type/Text",
+    bytes: "type/Text",
+}
+
+
+class MetabaseStandIn:
+    """Servidor en un hilo de fondo. Uso:
+
+        with MetabaseStandIn(db_path) as server:
+            client = MetabaseClient(server.url, "user", "pass", server.database_name,
+                                    persist_state=False)
+    """
+
+    def __init__(
+        self,
+        db_path,
+        *,
+        database_name: str = "datanex",
+        email: str = "user",
+        password: str = "pass",
+        host: str = "127.0.0.1",
+        port: int = 0,
+        row_cap: int = METABASE_ROW_CAP,
+        latency_s: float = 0.0,
+        latency_jitter_s: float = 0.0,
+        error_rate: float = 0.0,
+        fail_first: int = 0,
+        seed: int = 0,
+    ):
+        self.db_path = str(db_path)
+        self.database_name = database_name
+        self.email = email
+        self.password = password
+        self.row_cap = row_cap
+        self.latency_s = latency_s
+        self.latency_jitter_s = latency_jitter_s
+        self.error_rate = error_rate
+        self.fail_first = fail_first
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens: set[str] = set()
+        self.calls: Counter = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MetabaseStandIn":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MetabaseStandIn":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def expire_sessions(self) -> None:
+        """Invalida todos los tokens (el siguiente request recibe 401)."""
+        with self._lock:
+            self._tokens.clear()
+
+    # ------------------------------------------------------------------
+    # Lógica de la API (llamada desde el handler)
+    # ------------------------------------------------------------------
+    def login(self, body: dict) -> str | None:
+        if body.get("username") != self.email or body.get("password") != self.password:
+            return None
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._tokens.add(token)
+        return token
+
+    def is_authenticated(self, token: str | None) -> bool:
+        with self._lock:
+            return token in self._tokens
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return True
+            return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+    def sleep(self) -> None:
+        delay = self.latency_s
+        if self.latency_jitter_s:
+            with self._lock:
+                delay += self._rng.uniform(0, self.latency_jitter_s)
+        if delay > 0:
+            time.sleep(delay)
+
+    def run_sql(self, sql: str) -> tuple[list[str], list[tuple]]:
+        con = sqlite3.connect(self.db_path)
+        try:
+            cur = con.execute(sql)
+            names = [d[0] for d in cur.description or []]
+            return names, cur.fetchall()
+        finally:
+            con.close()
+
+
+def _infer_cols(names: list[str], rows: list[tuple]) -> list[dict]:
+    cols = []
+    for i, name in enumerate(names):
+        value = next((r[i] for r in rows if r[i] is not None), None)
+        base_type = _SQLITE_TO_METABASE.get(type(value), "type/*")
+        cols.append({"name": name, "display_name": name, "base_type": base_type})
+    return cols
+
+
+def _make_handler(server: MetabaseStandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _body(self) -> bytes:
+            length = int(self.headers.get("Content-Length", 0))
+            return self.rfile.read(length) if length else b""
+
+        def _send(self, status: int, payload, content_type="application/json"):
+            if content_type == "application/json":
+                payload = json.dumps(payload)
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _authorized(self) -> bool:
+            if server.is_authenticated(self.headers.get("X-Metabase-Session")):
+                return True
+            self._send(401, "Unauthenticated", content_type="text/plain")
+            return False
+
+        def do_GET(self):
+            server.calls[self.path] += 1
+            if self.path != "/api/database":
+                return self._send(404, {"error": "not found"})
+            if self._authorized():
+                self._send(200, {"data": [{"id": 1, "name": server.database_name}]})
+
+        def do_POST(self):
+            server.calls[self.path] += 1
+            raw = self._body()
+            if self.path == "/api/session":
+                token = server.login(json.loads(raw or b"{}"))
+                if token is None:
+                    return self._send(401, {"errors": {"password": "did not match"}})
+                return self._send(200, {"id": token})
+            if self.path not in ("/api/dataset", "/api/dataset/csv"):
+                return self._send(404, {"error": "not found"})
+            if not self._authorized():
+                return
+
+            with server._lock:
+                server.in_flight += 1
+                server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            try:
+                server.sleep()
+                if server.should_fail():
+                    return self._send(502, "Bad Gateway", content_type="text/plain")
+                if self.path == "/api/dataset":
+                    self._dataset(json.loads(raw or b"{}"))
+                else:
+                    form = parse_qs(raw.decode("utf-8"))
+                    self._export(json.loads(form["query"][0]))
+            finally:
+                with server._lock:
+                    server.in_flight -= 1
+
+        def _dataset(self, payload: dict):
+            start = time.perf_counter()
+            try:
+                names, rows = server.run_sql(payload["native"]["query"])
+            except sqlite3.Error as exc:
+                return self._send(
+                    202, {"status": "failed", "error": str(exc), "error_type": "invalid-query"}
+                )
+            rows = rows[: server.row_cap]
+            self._send(
+                202,
+                {
+                    "status": "completed",
+                    "row_count": len(rows),
+                    "running_time": int((time.perf_counter() - start) * 1000),
+                    "data": {"cols": _infer_cols(names, rows), "rows": rows},
+                },
+            )
+
+        def _export(self, payload: dict):
+            try:
+                names, rows = server.run_sql(payload["native"]["query"])
+            except sqlite3.Error as exc:
+                return self._send(400, {"error": str(exc)})
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator="\n")
+            writer.writerow(names)
+            writer.writerows(rows)
+            self._send(200, buf.getvalue().encode("utf-8"), content_type="text/csv")
+
+    return Handler
+
+
+def build_fixture_db(path, n_patients: int = 1500, years=range(2019, 2026), seed: int = 7) -> Path:
+    """Crea una tabla `movements` sintética (≈ estructura DataNex) en SQLite.
+
+    ~2 movimientos por paciente y año: con los valores por defecto cada
+    año supera el tope de 2000 filas.
+    """
+    rng = random.Random(seed)
+    path = Path(path)
+    path.unlink(missing_ok=True)
+    con = sqlite3.connect(path)
+    con.execute(
+        """
+        CREATE TABLE movements (
+            patient_ref INTEGER, episode_ref INTEGER, start_date TEXT,
+            end_date TEXT, ou_loc_ref TEXT, place_ref INTEGER
+        )
+        """
+    )
+    rows = []
+    episode = 0
+    for year in years:
+        for patient in range(n_patients):
+            episode += 1
+            start = datetime(year, 1, 1) + timedelta(minutes=rng.randrange(365 * 24 * 60))
+            for _ in range(2):
+                end = start + timedelta(hours=rng.randrange(4, 240))
+                rows.append(
+                    (
+                        patient,
+                        episode,
+                        start.isoformat(sep=" "),
+                        end.isoformat(sep=" "),
+                        rng.choice(["E073", "I073", "E016", "E103"]),
+                        rng.randrange(1, 40),
+                    )
+                )
+                start = end
+    con.executemany("INSERT INTO movements VALUES (?, ?, ?, ?, ?, ?)", rows)
+    con.commit()
+    con.close()
+    return path
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Metabase stand-in sobre SQLite.")
+    parser.add_argument("--db", type=Path, help="Fichero SQLite a servir.")
+    parser.add_argument("--build-fixture", type=Path, help="Crea la base sintética y sale.")
+    parser.add_argument("--port", type=int, default=3999)
+    parser.add_argument("--database-name", default="datanex")
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos por query.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Jitter máximo (s).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de 502.")
+    parser.add_argument("--row-cap", type=int, default=METABASE_ROW_CAP)
+    args = parser.parse_args()
+
+    if args.build_fixture:
+        print(f"Base sintética: {build_fixture_db(args.build_fixture)}")
+        return 0
+    if not args.db:
+        parser.error("--db o --build-fixture")
+
+    server = MetabaseStandIn(
+        args.db,
+        database_name=args.database_name,
+        port=args.port,
+        row_cap=args.row_cap,
+        latency_s=args.latency,
+        latency_jitter_s=args.jitter,
+        error_rate=args.error_rate,
+    )
+    print(f"Metabase stand-in en {server.url} (usuario '{server.email}' / '{server.password}')")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
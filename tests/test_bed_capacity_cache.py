@@ -0,0 +1,129 @@
+"""Tests de la cache mensual de capacidad (`demographics/_bed_occupancy.py`)."""
+
+import pandas as pd
+import pytest
+
+from indicadors_iso.demographics import _bed_occupancy
+from indicadors_iso.demographics._bed_capacity_sql import build_sql
+
+TODAY = pd.Timestamp("2026-10-17")
+
+
+class _Calls(list):
+    """Llamadas a la query falsa, con el `force_refresh` recibido en cada una."""
+
+    def __init__(self):
+        super().__init__()
+        self.forced = []
+
+
+@pytest.fixture
+def fake_query(monkeypatch, tmp_path):
+    monkeypatch.setattr(_bed_occupancy, "_CACHE_DIR", tmp_path)
+    calls = _Calls()
+
+    def query(units, min_year, max_year, fake_bed_place_refs, verbose,
+              start_month, end_month, force_refresh=False):
+        calls.forced.append(force_refresh)
+        calls.append(((min_year, start_month), (max_year, end_month), tuple(fake_bed_place_refs or ())))
+        months = pd.period_range(f"{min_year}-{start_month:02d}", f"{max_year}-{end_month:02d}", freq="M")
+        rows = [
+            {"unit": u, "year": p.year, "month": p.month, "hours_in_month": p.days_in_month * 24,
+             "bed_hours_used": float(p.year * 100 + p.month + len(calls)),
+             "n_active_place_refs": 4, "bed_hours_available": 4.0 * p.days_in_month * 24}
+            for u in units for p in months
+            # I073 sin movimientos en junio de 2020.
+            if not (u == "I073" and p.year == 2020 and p.month == 6)
+        ]
+        return pd.DataFrame(rows)
+
+    monkeypatch.setattr(_bed_occupancy, "query_bed_capacity", query)
+    return calls
+
+
+def _load(min_year, max_year, fake=(1,), today=TODAY, **kw):
+    return _bed_occupancy.load_or_query_monthly(
+        ["E073", "I073"], min_year, max_year, fake_bed_place_refs=fake,
+        verbose=False, today=today, **kw
+    )
+
+
+def test_ranges_reuse_cached_months(fake_query):
+    first = _load(2019, 2024)
+    assert fake_query == [((2019, 1), (2024, 12), (1,))]
+    assert len(first) == 2 * 72 - 1
+
+    _load(2019, 2025)
+    assert fake_query[1:] == [((2025, 1), (2025, 12), (1,))]
+
+    sub = _load(2020, 2021)
+    assert len(fake_query) == 2
+    expected = first[first["year"].between(2020, 2021)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(sub, expected)
+    # El mes sin movimientos se recuerda y no se vuelve a pedir.
+    assert not ((sub["unit"] == "I073") & (sub["year"] == 2020) & (sub["month"] == 6)).any()
+
+    # Otra lista de camas falsas es otra cache.
+    _load(2020, 2020, fake=(2,))
+    assert fake_query[-1] == ((2020, 1), (2020, 12), (2,))
+
+
+def test_recent_months_are_always_refetched(fake_query):
+    _load(2025, 2026)
+    assert fake_query == [((2025, 1), (2026, 12), (1,))]
+    before = _load(2026, 2026)
+    # Mes anterior, actual y futuros.
+    assert fake_query[1:] == [((2026, 9), (2026, 12), (1,))]
+    assert before.loc[before["month"] == 8, "bed_hours_used"].tolist() == [202609.0] * 2
+    assert before.loc[before["month"] == 9, "bed_hours_used"].tolist() == [202611.0] * 2
+
+    _load(2025, 2025, force_refresh=True)
+    assert fake_query[-1] == ((2025, 1), (2025, 12), (1,))
+    assert fake_query.forced[-1] is True
+    assert not any(fake_query.forced[:-1])
+
+
+def test_placeholders_and_unsettled_months_expire(fake_query):
+    _load(2020, 2020)
+    _load(2026, 2026, today=pd.Timestamp("2026-05-10"))
+    assert len(fake_query) == 2
+
+    # Dentro de los plazos no se vuelve a pedir nada (salvo los recientes).
+    _load(2020, 2020, today=TODAY + pd.Timedelta(days=6))
+    assert len(fake_query) == 2
+
+    # Pasados 7 días, los meses de 2026 consultados antes de asentarse
+    # (`SETTLE_DAYS`) se vuelven a pedir: enero se consultó 98 días
+    # después de acabar y ya vale. 2020 también estaba asentado.
+    _load(2026, 2026, today=TODAY + pd.Timedelta(days=8))
+    assert fake_query[2][:2] == ((2026, 2), (2026, 12))
+    _load(2020, 2020, today=TODAY + pd.Timedelta(days=8))
+    assert len(fake_query) == 3
+
+    # El mes sin movimientos (I073 2020-06) caduca a los 30 días.
+    _load(2020, 2020, today=TODAY + pd.Timedelta(days=31))
+    assert fake_query[-1] == ((2020, 6), (2020, 6), (1,))
+
+
+def test_queries_run_outside_the_lock_and_merge(fake_query, monkeypatch):
+    query = _bed_occupancy.query_bed_capacity
+
+    def slow_query(**kw):
+        # Mientras esta carga consulta, otro proceso guarda otra cache.
+        monkeypatch.setattr(_bed_occupancy, "query_bed_capacity", query)
+        _load(2021, 2021, fake=(2,))
+        return query(**kw)
+
+    monkeypatch.setattr(_bed_occupancy, "query_bed_capacity", slow_query)
+    _load(2020, 2020)
+    cache = _bed_occupancy._read_cache()
+    assert set(cache["fake_beds"]) == {"1", "2"}
+
+
+def test_build_sql_month_bounds():
+    sql = build_sql(["E073"], 2025, 2026, start_month=11, end_month=2)
+    assert "sequence(0, 4 - 1)" in sql
+    assert "timestamp '2025-11-01 00:00:00'" in sql
+    assert "start_date < timestamp '2026-03-01 00:00:00'" in sql
+    with pytest.raises(ValueError):
+        build_sql(["E073"], 2026, 2026, start_month=5, end_month=4)
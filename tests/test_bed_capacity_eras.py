@@ -0,0 +1,69 @@
+"""Tests del join por intervalos de `demographics/_bed_capacity_eras.py`."""
+
+import numpy as np
+import pandas as pd
+
+from indicadors_iso.demographics import _bed_occupancy
+from indicadors_iso.demographics._bed_capacity_eras import (
+    lookup_capacity,
+    lookup_capacity_for_month,
+)
+
+
+def test_lookup_capacity_matches_month_lookup():
+    months = pd.date_range("2017-01-01", "2027-12-01", freq="MS")
+    units = ["E073", "I073", "UCI", "E016"]
+    grid = pd.DataFrame(
+        [(u, m) for u in units for m in months], columns=["unit", "month_start"]
+    )
+    got = lookup_capacity(grid["unit"], grid["month_start"])
+    for row, (unit, start) in zip(got.itertuples(index=False), grid.itertuples(index=False)):
+        expected = lookup_capacity_for_month(start.year, start.month, unit)
+        if expected is None:
+            assert pd.isna(row.effective_unit) and pd.isna(row.nominal_beds)
+        else:
+            assert (row.effective_unit, int(row.nominal_beds), row.regimen) == expected
+
+
+def test_lookup_capacity_sub_month_grain():
+    # Último día / hora de cada época y primera hora de la siguiente;
+    # con zona, se evalúa en hora local.
+    when = pd.Series(pd.to_datetime([
+        "2020-02-29 23:00", "2020-03-01 00:00", "2022-03-31 23:59", "2022-04-01 00:00",
+    ]))
+    got = lookup_capacity(["E073"] * 4, when)
+    assert got["effective_unit"].tolist() == ["E073", "UCI", "UCI", "E073"]
+    assert got["nominal_beds"].tolist() == [8, 12, 12, 10]
+
+    utc = pd.Series(pd.to_datetime(["2020-02-29T23:30:00+00:00"]))
+    assert lookup_capacity(["I073"], utc)["regimen"].tolist() == ["covid"]
+
+
+def test_compute_bed_occupancy_nominal(monkeypatch):
+    rows = []
+    for year, month in [(2020, 2), (2020, 3), (2025, 11)]:
+        hours = pd.Period(f"{year}-{month:02d}").days_in_month * 24
+        for unit, used in [("E073", 1000.0), ("I073", 300.0)]:
+            rows.append({
+                "unit": unit, "year": year, "month": month,
+                "bed_hours_used": used, "hours_in_month": hours,
+                "n_active_place_refs": 6,
+            })
+    monkeypatch.setattr(
+        _bed_occupancy, "load_or_query_monthly", lambda **_: pd.DataFrame(rows)
+    )
+    yearly = _bed_occupancy.compute_bed_occupancy_nominal(
+        ["E073", "I073"], 2020, 2025, verbose=False
+    ).set_index(["effective_unit", "year"])
+
+    assert yearly.loc[("E073", 2020), "pct"] == 1000 / (8 * 29 * 24) * 100
+    assert yearly.loc[("UCI", 2020), "pct"] == 1300 / (12 * 31 * 24) * 100
+    assert ("E073", 2025) not in yearly.index
+    assert yearly["n_months_excluded"].eq(0).all()
+
+    kept = _bed_occupancy.compute_bed_occupancy_nominal(
+        ["E073", "I073"], 2020, 2025, verbose=False, exclude_months=[(2020, 3)]
+    ).set_index(["effective_unit", "year"])
+    assert yearly.loc[("I073", 2020), "pct"] == kept.loc[("I073", 2020), "pct"]
+    assert np.isclose(kept.loc[("E073", 2025), "pct"], 1000 / (10 * 30 * 24) * 100)
+    assert kept.loc[("E073", 2020), "n_months_excluded"] == 1
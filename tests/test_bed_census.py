@@ -0,0 +1,111 @@
+"""Tests del censo de camas por barrido (`demographics/_bed_census.py`),
+contra un cálculo por fuerza bruta."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicadors_iso.demographics._bed_census import (
+    bed_census,
+    occupancy_at,
+    prepare_bed_intervals,
+    summarize_census,
+)
+
+FAKE = 42109160000
+NOW = pd.Timestamp("2020-03-04 00:00")
+
+
+def _movements(n=300, seed=5):
+    """Movimientos alrededor del cambio a la época `covid` (2020-03-01),
+    con abiertos, sin cama, de duración cero y en la cama falsa."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2020-02-25") + pd.to_timedelta(rng.integers(0, 7 * 24 * 60, n), unit="min")
+    hours = rng.choice([0, 0.5, 3, 20, 50, 100], n)
+    end = pd.Series(start + pd.to_timedelta(hours, unit="h"))
+    end[rng.random(n) < 0.05] = pd.NaT
+    place = rng.integers(1, 15, n).astype(float)
+    place[rng.random(n) < 0.05] = np.nan
+    place[rng.random(n) < 0.05] = FAKE
+    return pd.DataFrame({
+        "ou_loc_ref": rng.choice(["E073", "I073"], n, p=[0.7, 0.3]),
+        "place_ref": place,
+        "start_date": start,
+        "end_date": end,
+    })
+
+
+def _brute(intervals, unit_of, lo, hi):
+    """(bed_hours, max_occupancy) de la unidad efectiva en [lo, hi)."""
+    rows = intervals[unit_of(intervals)]
+    s = rows["start"].clip(lower=lo)
+    e = rows["end"].clip(upper=hi)
+    bed_hours = ((e - s).clip(lower=pd.Timedelta(0)) / pd.Timedelta(hours=1)).sum()
+    points = [lo] + [t for t in rows["start"] if lo <= t < hi]
+    peak = max(((rows["start"] <= t) & (rows["end"] > t)).sum() for t in points)
+    return bed_hours, peak
+
+
+def _unit_of(name):
+    if name == "UCI":
+        return lambda df: df["ou_loc_ref"].isin(["E073", "I073"])
+    return lambda df: df["ou_loc_ref"] == name
+
+
+@pytest.mark.parametrize("freq", ["h", "8h", "D"])
+def test_census_matches_brute_force(freq):
+    moves = _movements()
+    census = bed_census(moves, freq=freq, start="2020-02-27", end="2020-03-03", now=NOW)
+    intervals = prepare_bed_intervals(moves, now=NOW)
+    assert FAKE not in intervals["place_ref"].tolist()
+
+    assert set(census["effective_unit"]) == {"E073", "I073", "UCI"}
+    assert (census.loc[census["effective_unit"] == "UCI", "bin_start"] >= "2020-03-01").all()
+    assert (census.loc[census["effective_unit"] != "UCI", "bin_end"] <= "2020-03-01").all()
+    # El 2020-03-01 es borde en todas las `freq`: ningún intervalo
+    # mezcla épocas.
+    for row in census.sample(min(40, len(census)), random_state=0).itertuples():
+        bed_hours, peak = _brute(
+            intervals, _unit_of(row.effective_unit), row.bin_start, row.bin_end
+        )
+        assert row.bed_hours == pytest.approx(bed_hours)
+        assert row.max_occupancy == peak
+
+    totals = census.groupby(census["bin_start"] < "2020-03-01")["bed_hours"].sum()
+    clipped = intervals.assign(
+        start=intervals["start"].clip(lower=pd.Timestamp("2020-02-27")),
+        end=intervals["end"].clip(upper=pd.Timestamp("2020-03-03")),
+    )
+    expected = ((clipped["end"] - clipped["start"]).clip(lower=pd.Timedelta(0))
+                / pd.Timedelta(hours=1)).sum()
+    assert totals.sum() == pytest.approx(expected)
+
+
+def test_saturation_and_occupancy_at():
+    # 5 pacientes en I073 (4 camas) que coinciden 30 min.
+    start = pd.Timestamp("2023-05-10 10:00")
+    moves = pd.DataFrame({
+        "ou_loc_ref": "I073",
+        "place_ref": [1, 2, 3, 4, 5],
+        "start_date": [start] * 4 + [start + pd.Timedelta(minutes=90)],
+        "end_date": [start + pd.Timedelta(hours=2)] * 4 + [start + pd.Timedelta(hours=3)],
+    })
+    census = bed_census(moves, freq="h", start="2023-05-10", end="2023-05-11", now=NOW)
+    assert len(census) == 24
+    assert census["saturation_minutes"].sum() == pytest.approx(30)
+    assert census["bed_hours"].sum() == pytest.approx(4 * 2 + 1.5)
+    assert census.set_index("bin_start").loc["2023-05-10 11:00", "max_occupancy"] == 5
+    assert census["pct"].iloc[10] == pytest.approx(100)
+
+    summary = summarize_census(census)
+    assert summary.loc[0, "peak_occupancy"] == 5
+    assert summary.loc[0, "n_bins_saturated"] == 1
+    assert summary.loc[0, "p50_occupancy"] == 0
+
+    got = occupancy_at(
+        moves, ["I073"] * 3,
+        [start, start + pd.Timedelta(minutes=90), start + pd.Timedelta(hours=2)],
+        now=NOW,
+    )
+    assert got["occupancy"].tolist() == [4, 5, 1]
+    assert got["beds_free"].tolist() == [0, -1, 3]
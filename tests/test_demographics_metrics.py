@@ -0,0 +1,216 @@
+"""Tests del resumen vectorizado de `demographics/_metrics.py`."""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicadors_iso.demographics._loader import project_sql
+from indicadors_iso.demographics._metrics import (
+    SUMMARY_BASE_COLS,
+    _format_median_iqr,
+    _median_iqr_by,
+    compute_summary,
+    metric_columns,
+    metric_sources,
+)
+
+
+def _cohort(n=600, seed=3):
+    rng = np.random.default_rng(seed)
+    admission = pd.Timestamp("2021-01-01", tz="UTC") + pd.to_timedelta(
+        rng.integers(0, 3 * 365 * 24, n), unit="h"
+    )
+    exitus = admission + pd.to_timedelta(rng.normal(30, 50, n), unit="D")
+    return pd.DataFrame({
+        "patient_ref": rng.integers(0, n // 3, n),
+        "ou_loc_ref": "E073",
+        "admission_date": admission,
+        "exitus_date": exitus.where(rng.random(n) < 0.3),
+        "exitus_during_stay": rng.choice(["Yes", "No"], n, p=[0.1, 0.9]),
+        "still_admitted": rng.choice(["Yes", "No"], n, p=[0.05, 0.95]),
+        "year_admission": admission.year,
+        "age_at_admission": rng.integers(18, 95, n),
+        "sex": rng.choice(["Male", "Female"], n),
+        "natio_ref": rng.choice(["ES", "MA", None], n),
+        "health_area": rng.choice(["2A", "9Z"], n),
+        "postcode": rng.choice(["08004", "08999"], n),
+        "from_other_hospital": rng.choice([0, 1, np.nan], n),
+        "days_stay": rng.exponential(5, n).round(2),
+        "has_cirrhosis": rng.choice([0, 1], n),
+        "readmission_24h": rng.choice([0, 1], n),
+        "readmission_72h": rng.choice([0, 1], n),
+        "sofa_total": np.where(rng.random(n) < 0.3, np.nan, rng.integers(0, 20, n)),
+        "received_autopsy": rng.choice([0, 1], n),
+    })
+
+
+def test_median_iqr_by_matches_series_quantile():
+    rng = np.random.default_rng(0)
+    values = pd.Series(np.round(rng.exponential(7, 5000), rng.integers(0, 4)))
+    values[rng.random(5000) < 0.1] = np.nan
+    groups = pd.Series(rng.integers(0, 40, 5000))
+    got = _median_iqr_by(values, groups)
+    expected = {
+        g: _format_median_iqr(values[groups == g]) for g in sorted(groups.unique())
+    }
+    assert got == expected
+
+
+def test_summary_years_match_single_year_summaries():
+    """Cada columna anual es el resumen de ese año por separado y los
+    totales de n (%) suman los años."""
+    df = _cohort()
+    sections, years = compute_summary(df)
+    assert years == [2021, 2022, 2023]
+    rows = {r["csv_label"]: r for s in sections for r in s["rows"]}
+    for year in years:
+        single, _ = compute_summary(df[df["year_admission"] == year])
+        for row in (r for s in single for r in s["rows"]):
+            label = row["csv_label"]
+            assert rows[label]["values"].get(year) == row["values"].get(year), label
+
+    n_stays = rows["N estancias"]
+    assert n_stays["total"] == str(sum(int(n_stays["values"][y]) for y in years))
+    deaths = sum(int(rows["Mortalidad global - en estancia (n, %)"]["values"][y].split()[0])
+                 for y in years)
+    assert rows["Mortalidad global - en estancia (n, %)"]["total"].startswith(f"{deaths} (")
+    closed = df[df["still_admitted"] == "No"]
+    assert rows["Edad, mediana [IQR]"]["total"] == _format_median_iqr(closed["age_at_admission"])
+
+
+def _frozen_cohort(n=80, seed=11):
+    """Cohorte fija con enriquecimientos SOFA, nutrición y autopsia."""
+    rng = np.random.default_rng(seed)
+    admission = pd.Timestamp("2022-01-01", tz="UTC") + pd.to_timedelta(
+        rng.integers(0, 2 * 365 * 24, n), unit="h"
+    )
+    exitus = admission + pd.to_timedelta(rng.normal(30, 50, n).round(), unit="D")
+    return pd.DataFrame({
+        "patient_ref": rng.integers(0, n // 3, n),
+        "ou_loc_ref": "E073",
+        "admission_date": admission,
+        "exitus_date": exitus.where(rng.random(n) < 0.3),
+        "exitus_during_stay": rng.choice(["Yes", "No"], n, p=[0.1, 0.9]),
+        "still_admitted": rng.choice(["Yes", "No"], n, p=[0.05, 0.95]),
+        "year_admission": admission.year,
+        "age_at_admission": rng.integers(18, 95, n),
+        "sex": rng.choice(["Male", "Female"], n),
+        "natio_ref": rng.choice(["ES", "MA", None], n),
+        "health_area": rng.choice(["2A", "9Z"], n),
+        "postcode": rng.choice(["08004", "08999"], n),
+        "from_other_hospital": rng.choice([0, 1, np.nan], n),
+        "days_stay": rng.exponential(5, n).round(2),
+        "has_cirrhosis": rng.choice([0, 1], n),
+        "readmission_24h": rng.choice([0, 1], n),
+        "readmission_72h": rng.choice([0, 1], n),
+        "sofa_total": np.where(rng.random(n) < 0.3, np.nan, rng.integers(0, 20, n)),
+        "received_autopsy": rng.choice([0, 1], n),
+        "received_enteral": rng.choice([0, 1], n),
+        "received_parenteral": rng.choice([0, 1], n),
+        "hours_to_enteral": np.where(rng.random(n) < 0.5, np.nan, rng.integers(0, 200, n)),
+        "hours_to_parenteral": np.where(rng.random(n) < 0.7, np.nan, rng.integers(0, 200, n)),
+    })
+
+
+# Salida de `compute_summary` sobre `_frozen_cohort()` con la
+# implementación anterior a las pasadas agrupadas (fila a fila, año a
+# año): `(csv_label, (2022, 2023), total)`.
+FROZEN_SUMMARY = [
+    ("N estancias", ("32", "42"), "74"),
+    ("N pacientes", ("19", "22"), "23"),
+    ("Ocupación de camas (%)", ("", ""), ""),
+    ("Edad, mediana [IQR]", ("61.0 [46.0-80.0]", "56.0 [46.0-79.0]"), "59.0 [46.0-79.0]"),
+    ("Sexo masculino (n, %)", ("11 (57.9%)", "9 (40.9%)"), "20 (48.8%)"),
+    ("Sexo femenino (n, %)", ("8 (42.1%)", "13 (59.1%)"), "21 (51.2%)"),
+    ("Nacionalidad española (n, %)", ("8 (42.1%)", "9 (40.9%)"), "17 (41.5%)"),
+    ("Otras nacionalidades (n, %)", ("11 (57.9%)", "13 (59.1%)"), "24 (58.5%)"),
+    ("Pacientes AISBE (n, %)", ("15 (78.9%)", "16 (72.7%)"), "31 (75.6%)"),
+    ("Procedencia otro hospital (n, %)", ("6 (31.6%)", "8 (36.4%)"), "14 (34.1%)"),
+    ("Estancia (días), mediana [IQR]", ("3.3 [1.4-6.8]", "3.5 [1.3-7.7]"), "3.5 [1.3-7.1]"),
+    ("Cirrosis (n, %)", ("17 (53.1%)", "16 (38.1%)"), "33 (44.6%)"),
+    ("Reingreso 24h (n, %)", ("18 (56.2%)", "23 (54.8%)"), "41 (55.4%)"),
+    ("Reingreso 72h (n, %)", ("16 (50.0%)", "19 (45.2%)"), "35 (47.3%)"),
+    ("SOFA al ingreso, mediana [IQR]", ("12.5 [6.8-17.2]", "11.0 [8.0-13.8]"), "12.0 [7.0-16.8]"),
+    ("SOFA cobertura completa 6/6 (n, %)", ("", ""), "0 (0.0%)"),
+    ("SOFA cirrosis, mediana [IQR]", ("14.0 [7.0-17.0]", "10.5 [7.2-13.0]"), "12.0 [7.0-15.5]"),
+    ("SOFA otro hospital, mediana [IQR]",
+     ("13.0 [10.0-16.8]", "12.5 [7.8-17.0]"), "12.5 [9.2-17.0]"),
+    ("Nutrición enteral (n, %)", ("13 (40.6%)", "22 (52.4%)"), "35 (47.3%)"),
+    ("Nutrición parenteral (n, %)", ("15 (46.9%)", "24 (57.1%)"), "39 (52.7%)"),
+    ("Tiempo a inicio enteral (h), mediana [IQR]",
+     ("57.0 [22.2-150.8]", "107.0 [61.8-142.8]"), "87.5 [53.0-147.8]"),
+    ("Tiempo a inicio parenteral (h), mediana [IQR]",
+     ("85.0 [31.2-137.2]", "83.0 [49.0-115.0]"), "83.0 [40.5-127.0]"),
+    ("Mortalidad global - en estancia (n, %)", ("5 (15.6%)", "5 (11.9%)"), "10 (13.5%)"),
+    ("Mortalidad global - 30 días (n, %)", ("3 (9.4%)", "2 (4.8%)"), "5 (6.8%)"),
+    ("Mortalidad global - 90 días (n, %)", ("7 (21.9%)", "7 (16.7%)"), "14 (18.9%)"),
+    ("Autopsia/necropsia en éxitus (n, %)", ("4 (80.0%)", "3 (60.0%)"), "7 (70.0%)"),
+    ("Mortalidad cirrosis - en estancia (n, %)", ("2 (11.8%)", "2 (12.5%)"), "4 (12.1%)"),
+    ("Mortalidad cirrosis - 30 días (n, %)", ("1 (5.9%)", "2 (12.5%)"), "3 (9.1%)"),
+    ("Mortalidad cirrosis - 90 días (n, %)", ("4 (23.5%)", "3 (18.8%)"), "7 (21.2%)"),
+    ("Mortalidad no AISBE - en estancia (n, %)", ("0 (0.0%)", "3 (27.3%)"), "3 (15.8%)"),
+    ("Mortalidad no AISBE - 30 días (n, %)", ("1 (12.5%)", "0 (0.0%)"), "1 (5.3%)"),
+    ("Mortalidad no AISBE - 90 días (n, %)", ("3 (37.5%)", "1 (9.1%)"), "4 (21.1%)"),
+    ("Mortalidad otro hospital - en estancia (n, %)", ("0 (0.0%)", "1 (6.2%)"), "1 (4.3%)"),
+    ("Mortalidad otro hospital - 30 días (n, %)", ("0 (0.0%)", "1 (6.2%)"), "1 (4.3%)"),
+    ("Mortalidad otro hospital - 90 días (n, %)", ("1 (14.3%)", "4 (25.0%)"), "5 (21.7%)"),
+]
+
+
+def test_summary_matches_frozen_pre_vectorized_output():
+    sections, years = compute_summary(_frozen_cohort())
+    assert years == [2022, 2023]
+    got = [
+        (r["csv_label"], tuple(r["values"].get(y, "") for y in years), r["total"])
+        for s in sections for r in s["rows"]
+    ]
+    assert got == FROZEN_SUMMARY
+
+    # Con la columna de cobertura SOFA (y estancias abiertas, que se
+    # excluyen), la fila 6/6 se llena por año como en la versión anterior.
+    df = _frozen_cohort()
+    df["sofa_components_available"] = np.random.default_rng(1).integers(3, 7, len(df))
+    df.loc[:4, "still_admitted"] = "Yes"
+    rows = {r["csv_label"]: r for s in compute_summary(df)[0] for r in s["rows"]}
+    coverage = rows["SOFA cobertura completa 6/6 (n, %)"]
+    assert coverage["values"] == {2022: "12 (41.4%)", 2023: "6 (15.0%)"}
+    assert coverage["total"] == "18 (26.1%)"
+
+
+def test_requested_metrics_only():
+    df = _cohort()
+    full, years = compute_summary(df)
+    full_rows = {r["csv_label"]: r for s in full for r in s["rows"]}
+    names = ["n_stays", "age", "mn_30", "nutr_ent", "autopsy"]
+    sections, sub_years = compute_summary(df, metrics=names)
+    assert sub_years == years
+    assert [s["section"] for s in sections] == [
+        "Demografía", "Nutrición", "Mortalidad global", "Mortalidad en no AISBE"
+    ]
+    rows = [r for s in sections for r in s["rows"]]
+    # `nutr_ent` no sale: la cohorte no trae nutrición.
+    assert [r["csv_label"] for r in rows] == [
+        "N estancias", "Edad, mediana [IQR]",
+        "Autopsia/necropsia en éxitus (n, %)", "Mortalidad no AISBE - 30 días (n, %)",
+    ]
+    for row in rows:
+        assert row == full_rows[row["csv_label"]]
+
+    with pytest.raises(ValueError):
+        compute_summary(df, metrics=["n_beds"])
+
+
+def test_metric_columns_prune_cohort_projection():
+    assert metric_columns(["age"]) == list(SUMMARY_BASE_COLS) + ["age_at_admission"]
+    cols = metric_columns(["mc_90", "sofa_all"])
+    assert {"has_cirrhosis", "exitus_date"} <= set(cols)
+    assert "sofa_total" not in cols
+    assert metric_sources(["mc_90", "sofa_all"]) == {"sofa"}
+    assert not {"sofa_total", "received_enteral", "received_autopsy"} & set(metric_columns())
+
+    sql = "WITH t AS (SELECT 1 AS a, 2 AS b, 3 AS c)\nSELECT * FROM t\nORDER BY a;\n"
+    with sqlite3.connect(":memory:") as con:
+        got = pd.read_sql(project_sql(sql, ["c", "a"]), con)
+    assert got.to_dict("records") == [{"c": 3, "a": 1}]
@@ -0,0 +1,47 @@
+"""Tests de `indicadors_iso._dtypes.apply_schema`."""
+
+import pandas as pd
+
+from indicadors_iso._dtypes import CATEGORY, DATETIME, FLAG, INT, REF, apply_schema
+
+
+def test_apply_schema_compacts_and_keeps_values():
+    df = pd.DataFrame(
+        {
+            "patient_ref": ["101", "102", "103"],
+            "ou_loc_ref": ["E073", "I073", "E073"],
+            "admission_date": ["2024-01-01T10:00:00Z", "2024-01-02T00:00:00+01:00", None],
+            "hours_stay": [12, 48, 300],
+            "has_cirrhosis": [0, 1, None],
+            "untouched": ["a", "b", "c"],
+        }
+    )
+    schema = {
+        "patient_ref": REF,
+        "ou_loc_ref": CATEGORY,
+        "admission_date": DATETIME,
+        "hours_stay": INT,
+        "has_cirrhosis": FLAG,
+        "not_in_df": FLAG,
+    }
+    out = apply_schema(df, schema, verbose=False)
+
+    assert out["patient_ref"].dtype == "int64"
+    assert isinstance(out["ou_loc_ref"].dtype, pd.CategoricalDtype)
+    assert str(out["admission_date"].dt.tz) == "Europe/Madrid"
+    assert out["admission_date"].iloc[1] == pd.Timestamp("2024-01-01T23:00:00Z")
+    # Hora local del hospital: el día de calendario no se desplaza.
+    assert out["admission_date"].dt.day.tolist()[:2] == [1, 2]
+    assert out["hours_stay"].dtype == "int16"
+    assert out["has_cirrhosis"].dtype == "Int8"
+    assert out["untouched"].equals(df["untouched"])
+    assert (out["ou_loc_ref"] == "E073").tolist() == [True, False, True]
+    assert out.attrs["dtype_bytes_saved"] > 0
+    # El original no se modifica.
+    assert df["patient_ref"].dtype != "int64"
+
+
+def test_apply_schema_leaves_non_numeric_refs():
+    df = pd.DataFrame({"patient_ref": [1, 2, "SYN2025-00001"]})
+    out = apply_schema(df, {"patient_ref": REF}, verbose=False)
+    assert out["patient_ref"].tolist() == [1, 2, "SYN2025-00001"]
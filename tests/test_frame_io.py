@@ -0,0 +1,25 @@
+"""Tests de `indicadors_iso._frame_io`."""
+
+import pandas as pd
+
+from indicadors_iso import _frame_io
+from indicadors_iso._frame_io import find_frame, read_frame, remove_frame, write_frame
+
+
+def test_write_read_and_replace_other_suffix(tmp_path, monkeypatch):
+    base = tmp_path / "sub" / "part-0"
+    df = pd.DataFrame({"a": [1, 2], "b": ["x", "y"]})
+    # Copia antigua con el otro formato: la escritura nueva la sustituye.
+    base.parent.mkdir()
+    base.with_suffix(".parquet").write_bytes(b"stale")
+    monkeypatch.setattr(_frame_io, "HAS_PYARROW", False)
+
+    path = write_frame(base, df)
+    assert path == base.with_suffix(".pkl")
+    assert find_frame(base) == path
+    assert sorted(p.name for p in base.parent.iterdir()) == ["part-0.pkl"]
+    pd.testing.assert_frame_equal(read_frame(path), df)
+    assert read_frame(path, columns=["b", "missing"]).columns.tolist() == ["b"]
+
+    remove_frame(base)
+    assert find_frame(base) is None
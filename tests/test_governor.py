@@ -0,0 +1,80 @@
+"""Tests de `indicadors_iso._governor` entre procesos."""
+
+import os
+import subprocess
+import sys
+import time
+
+from indicadors_iso import _filelock
+from indicadors_iso._filelock import FileLock
+from indicadors_iso._governor import ConcurrencyGovernor
+
+_HOLD_SLOT = """
+import sys, time
+from indicadors_iso._governor import ConcurrencyGovernor
+gov = ConcurrencyGovernor(1, sys.argv[1])
+with gov.slot() as waited:
+    start = time.time()
+    time.sleep(0.3)
+    print(start, time.time(), waited)
+"""
+
+
+def test_slots_are_shared_across_processes(tmp_path):
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-c", _HOLD_SLOT, str(tmp_path)],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for _ in range(3)
+    ]
+    spans = sorted(tuple(map(float, p.communicate(timeout=60)[0].split())) for p in procs)
+    assert all(p.returncode == 0 for p in procs)
+    # Con un solo slot, las tres secciones no se solapan.
+    for (_, end, _), (start, _, _) in zip(spans, spans[1:]):
+        assert start >= end
+    assert sum(waited for _, _, waited in spans) > 0.3
+
+
+def test_stale_slot_of_dead_process_is_broken(tmp_path):
+    slot = tmp_path / "slot_00.lock"
+    slot.write_text("99999\n")
+    old = time.time() - 10
+    os.utime(slot, (old, old))
+    gov = ConcurrencyGovernor(1, tmp_path, stale_after=5)
+    with gov.slot(timeout=5) as waited:
+        assert waited < 5
+    assert not slot.exists()
+
+
+def test_breaking_a_stale_lock_never_steals_a_fresh_one(tmp_path, monkeypatch):
+    path = tmp_path / "x.lock"
+    path.write_text("99999\n")
+    old = time.time() - 10
+    os.utime(path, (old, old))
+    late, other = FileLock(path, stale_after=5), FileLock(path, stale_after=5)
+    real_replace = os.replace
+
+    def replace(src, dst):
+        # Entre el `stat` y el `replace` de `late`, otro rompe el lock
+        # abandonado y coge uno nuevo.
+        monkeypatch.setattr(_filelock.os, "replace", real_replace)
+        path.unlink()
+        assert other.try_acquire()
+        real_replace(src, dst)
+
+    monkeypatch.setattr(_filelock.os, "replace", replace)
+    assert not late.try_acquire()
+    assert other.held and path.exists()
+    assert not late.try_acquire()
+    assert [p.name for p in tmp_path.iterdir()] == ["x.lock"]
+    other.release()
+    assert late.try_acquire()
+
+
+def test_disabled_governor_never_waits(tmp_path):
+    gov = ConcurrencyGovernor(0, tmp_path)
+    with gov.slot() as waited:
+        assert waited == 0.0
+    assert not any(tmp_path.iterdir())
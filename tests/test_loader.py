@@ -0,0 +1,45 @@
+"""Tests de la carga incremental de `demographics/_loader.load_cohort`."""
+
+import pandas as pd
+
+from indicadors_iso.demographics import _loader
+
+
+def _patch(monkeypatch):
+    calls = []
+
+    def yearly(render, min_year, max_year, label, **kwargs):
+        calls.append(("full", None))
+        return pd.DataFrame()
+
+    def incremental(render, render_probe, min_year, max_year, **kwargs):
+        calls.append(("incremental", render_probe(min_year, max_year)))
+        return pd.DataFrame()
+
+    monkeypatch.setattr(_loader, "execute_query_yearly", yearly)
+    monkeypatch.setattr(_loader, "execute_query_yearly_incremental", incremental)
+    return calls
+
+
+def test_incremental_needs_a_matching_watermark(monkeypatch):
+    calls = _patch(monkeypatch)
+    template = "SELECT {min_year} AS y, {max_year} AS z"
+
+    _loader.load_cohort(2024, 2024, template, skip_synthetic=True)
+    assert calls[-1] == ("full", None)
+
+    _loader.load_cohort(2024, 2024, template, skip_synthetic=True,
+                        watermark_units=["E016", "E073"])
+    kind, probe = calls[-1]
+    assert kind == "incremental"
+    assert "ou_loc_ref IN ('E016','E073')" in probe
+    assert "timestamp '2024-01-01 00:00:00'" in probe
+
+    _loader.load_cohort(2024, 2024, template, skip_synthetic=True,
+                        watermark_units=["E073"],
+                        watermark_sql=lambda lo, hi: f"SELECT {lo} AS year")
+    assert calls[-1] == ("incremental", "SELECT 2024 AS year")
+
+    _loader.load_cohort(2024, 2024, template, skip_synthetic=True,
+                        watermark_units=["E073"], incremental=False)
+    assert calls[-1] == ("full", None)
@@ -79,7 +79,8 @@ def main() -> int:
     print(f"   Total real (COUNT(*)): {total_rows}")
 
     print("2) Ejecutando query de prueba con LIMIT alto...")
-    probe_df = execute_query(build_probe_query(args.year, args.probe_limit), verbose=False)
+    probe_sql = build_probe_query(args.year, args.probe_limit)
+    probe_df = execute_query(probe_sql, verbose=False, export=False)
     returned_rows = len(probe_df)
     print(f"   Filas devueltas por API: {returned_rows}")
     print(f"   Límite solicitado en query: {args.probe_limit}")
@@ -97,6 +98,11 @@ def main() -> int:
     if returned_rows == METABASE_SILENT_ROW_CAP and total_rows > METABASE_SILENT_ROW_CAP:
         print("- PROBABLE TRUNCADO: la API devuelve exactamente 2000 filas.")
         print("- Conclusión: el límite silencioso sigue activo.")
+        export_df = execute_query(probe_sql, verbose=False, export="csv")
+        print(
+            f"- Exportación /api/dataset/csv: {len(export_df)} filas "
+            f"(esperadas {min(total_rows, args.probe_limit)})."
+        )
         return 1
 
     if returned_rows > METABASE_SILENT_ROW_CAP:
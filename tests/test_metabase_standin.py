@@ -0,0 +1,327 @@
+"""Tests de `indicadors_iso.connection` contra el Metabase local (sin red)."""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from indicadors_iso import _single_flight, connection
+from indicadors_iso._governor import ConcurrencyGovernor
+from indicadors_iso._query_cache import QueryCache
+from indicadors_iso._single_flight import SingleFlight
+from indicadors_iso._yearly_store import YearlyStore
+from indicadors_iso.connection import (
+    METABASE_SILENT_ROW_CAP,
+    MetabaseClient,
+    execute_query,
+    execute_query_in_batches,
+    execute_query_partitioned,
+    execute_query_yearly,
+    execute_query_yearly_incremental,
+    explicit_row_limit,
+    governor_stats,
+    metabase_response_to_frame,
+    set_governor,
+    single_flight_stats,
+)
+from tests.metabase_standin import MetabaseStandIn
+
+YEAR_SQL = "SELECT patient_ref, start_date FROM movements WHERE start_date LIKE '{year}-%'"
+
+
+def test_session_and_database_map_are_reused(standin, standin_client):
+    for _ in range(3):
+        df = execute_query(
+            "SELECT 1 AS x, 'a' AS s", client=standin_client, cache=False, dedup=False
+        )
+    assert df["x"].tolist() == [1]
+    assert standin.calls["/api/session"] == 1
+    assert standin.calls["/api/database"] == 1
+    assert standin.calls["/api/dataset"] == 3
+
+
+def test_expired_session_triggers_single_relogin(standin, standin_client):
+    execute_query("SELECT 1 AS x", client=standin_client, cache=False)
+    standin.expire_sessions()
+    execute_query("SELECT 2 AS x", client=standin_client, cache=False)
+    assert standin.calls["/api/session"] == 2
+
+
+def test_row_cap_is_emulated_and_recovered_by_export(fixture_db, standin_client):
+    sql = YEAR_SQL.format(year=2024)
+    with sqlite3.connect(fixture_db) as con:
+        expected = len(con.execute(sql).fetchall())
+    assert expected > METABASE_SILENT_ROW_CAP
+
+    capped = execute_query(sql, client=standin_client, cache=False, export=False)
+    assert len(capped) == METABASE_SILENT_ROW_CAP
+
+    full = execute_query(sql, client=standin_client, cache=False)
+    assert len(full) == expected
+    assert full["patient_ref"].dtype.kind == "i"
+
+
+def test_explicit_limit_at_cap_is_not_exported_again(standin, standin_client, capsys):
+    sql = YEAR_SQL.format(year=2024) + f"\nLIMIT {METABASE_SILENT_ROW_CAP} -- tope"
+    df = execute_query(sql, client=standin_client, cache=False, verbose=False)
+    assert len(df) == METABASE_SILENT_ROW_CAP
+    assert standin.calls["/api/dataset"] == 1
+    assert standin.calls["/api/dataset/csv"] == 0
+    assert capsys.readouterr().out == ""
+
+    assert explicit_row_limit("SELECT * FROM (SELECT 1 LIMIT 5) t") is None
+    assert explicit_row_limit("SELECT 1 limit 10 OFFSET 20;") == 10
+
+
+def test_query_cache_never_serves_a_truncated_result(fixture_db, standin, standin_client, tmp_path):
+    sql = YEAR_SQL.format(year=2024)
+    cache = QueryCache(root=tmp_path / "qc")
+    kwargs = dict(client=standin_client, cache=cache, dedup=False)
+
+    capped = execute_query(sql, export=False, **kwargs)
+    assert len(capped) == METABASE_SILENT_ROW_CAP
+    assert cache.writes == 0
+
+    full = execute_query(sql, **kwargs)
+    assert len(full) > METABASE_SILENT_ROW_CAP
+    assert cache.writes == 1
+    assert len(execute_query(sql, **kwargs)) == len(full)
+    assert cache.hits == 1
+    # Con `export=False` es otra entrada: no recibe el resultado completo.
+    assert len(execute_query(sql, export=False, **kwargs)) == METABASE_SILENT_ROW_CAP
+
+
+def test_timestamps_keep_hospital_local_time_in_csv():
+    response = {"data": {
+        "cols": [{"name": "start_date", "base_type": "type/DateTimeWithLocalTZ"}],
+        # CET y CEST, ambos justo después de medianoche local.
+        "rows": [["2024-01-01T00:30:00+01:00"], ["2024-07-01T00:15:00+02:00"]],
+    }}
+    df = metabase_response_to_frame(response)
+    assert df["start_date"].dt.year.tolist() == [2024, 2024]
+    assert df.to_csv(index=False) == (
+        "start_date\n"
+        "2024-01-01 00:30:00+01:00\n"
+        "2024-07-01 00:15:00+02:00\n"
+    )
+
+
+def test_transient_errors_are_retried(standin, standin_client):
+    standin.fail_first = 2
+    df = execute_query("SELECT 1 AS x", client=standin_client, cache=False)
+    assert len(df) == 1
+    assert standin_client.last_query_stats()["retries"] == 2
+
+
+def test_retries_exhausted_raise(standin, standin_client):
+    standin.error_rate = 1.0
+    standin_client.max_retries = 1
+    with pytest.raises(RuntimeError, match="502"):
+        execute_query("SELECT 1 AS x", client=standin_client, cache=False)
+
+
+def test_sql_error_in_202_body_raises(standin_client):
+    with pytest.raises(RuntimeError, match="failed"):
+        execute_query("SELECT * FROM no_such_table", client=standin_client, cache=False)
+
+
+def test_yearly_parallel_matches_serial(standin, standin_client):
+    standin.latency_s = 0.05
+    kwargs = dict(client=standin_client, cache=False, export=False, dedup=False)
+    serial = execute_query_yearly(lambda y: YEAR_SQL.format(year=y), 2019, 2022, **kwargs)
+    parallel = execute_query_yearly(lambda y: YEAR_SQL.format(year=y), 2019, 2022, max_workers=4, **kwargs)
+    assert serial.equals(parallel)
+    assert standin.max_in_flight > 1
+
+
+def test_concurrent_clients_share_one_login(standin, standin_client):
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(
+            lambda i: execute_query(f"SELECT {i} AS x", client=standin_client, cache=False),
+            range(8),
+        ))
+    assert standin.calls["/api/session"] == 1
+    assert standin.calls["/api/dataset"] == 8
+
+
+def test_identical_inflight_queries_share_one_execution(standin, standin_client):
+    standin.latency_s = 0.2
+    before = single_flight_stats()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        frames = list(pool.map(
+            lambda _: execute_query("SELECT  1 AS x -- mismo SQL", client=standin_client,
+                                    cache=False),
+            range(4),
+        ))
+
+    assert standin.calls["/api/dataset"] == 1
+    after = single_flight_stats()
+    assert after["executions"] - before["executions"] == 1
+    assert after["saved"] - before["saved"] == 3
+    assert after["memo_entries"] == 0
+
+    # Cada llamante recibe su propia copia.
+    frames[0].loc[0, "x"] = 99
+    assert frames[1]["x"].iat[0] == 1
+
+    # Sin `memoize`, repetida después vuelve a Metabase.
+    execute_query("SELECT 1 AS x", client=standin_client, cache=False)
+    assert standin.calls["/api/dataset"] == 2
+
+
+def test_memoize_serves_repeats_from_memory(standin, standin_client):
+    first = execute_query("SELECT  1 AS x", client=standin_client, cache=False, memoize=True)
+    # Repetida después: se sirve de memoria, también con otro formato.
+    again = execute_query("SELECT 1 AS x", client=standin_client, cache=False, memoize=True)
+    assert standin.calls["/api/dataset"] == 1
+    assert first.equals(again)
+    assert single_flight_stats()["memo_hits"] >= 1
+
+    first.loc[0, "x"] = 99
+    repeat = execute_query("SELECT 1 AS x", client=standin_client, cache=False, memoize=True)
+    assert repeat["x"].iat[0] == 1
+
+
+def test_yearly_memoize_is_forwarded(standin, standin_client):
+    kwargs = dict(client=standin_client, cache=False, export=False, memoize=True)
+    first = execute_query_yearly(lambda y: YEAR_SQL.format(year=y), 2019, 2021, **kwargs)
+    again = execute_query_yearly(lambda y: YEAR_SQL.format(year=y), 2019, 2021, **kwargs)
+    assert standin.calls["/api/dataset"] == 3
+    assert first.equals(again)
+
+
+def test_force_refresh_bypasses_dedup_memory(standin, standin_client):
+    execute_query("SELECT 1 AS x", client=standin_client, cache=False, memoize=True)
+    execute_query("SELECT 1 AS x", client=standin_client, cache=False, memoize=True,
+                  force_refresh=True)
+    assert standin.calls["/api/dataset"] == 2
+
+
+def test_single_flight_memo_expires_and_counts_deep_bytes(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(_single_flight.time, "monotonic", lambda: clock[0])
+    flight = SingleFlight(memo_ttl_s=60)
+    df = pd.DataFrame({"s": ["x" * 200] * 100})
+    runs = []
+
+    def fn():
+        runs.append(1)
+        return df
+
+    flight.run("k", fn, memoize=True)
+    assert flight.stats()["memo_bytes"] == int(df.memory_usage(deep=True).sum())
+    assert flight.run("k", fn, memoize=True)[1] == "memo"
+    clock[0] += 61
+    assert flight.run("k", fn, memoize=True)[1] is None
+    assert len(runs) == 2
+
+
+def test_governor_caps_concurrency_and_traces_queue_wait(
+    standin, standin_client, tmp_path, monkeypatch
+):
+    trace = tmp_path / "trace.jsonl"
+    monkeypatch.setenv("INDICADORS_TRACE", str(trace))
+    set_governor(ConcurrencyGovernor(2, tmp_path / "slots"))
+    standin.latency_s = 0.1
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        list(pool.map(
+            lambda i: execute_query(f"SELECT {i} AS x", client=standin_client, cache=False),
+            range(6),
+        ))
+
+    assert standin.max_in_flight == 2
+    stats = governor_stats()
+    assert stats["acquisitions"] == 6 and stats["queued"] >= 4 and stats["held"] == 0
+    waits = [json.loads(line)["queue_wait_s"] for line in trace.read_text().splitlines()]
+    assert len(waits) == 6 and max(waits) >= 0.1
+
+
+def test_in_batches_splits_saturated_batches(fixture_db, standin, standin_client):
+    sql = "SELECT patient_ref, episode_ref FROM movements WHERE {key_filter}"
+    with sqlite3.connect(fixture_db) as con:
+        expected = len(con.execute("SELECT 1 FROM movements WHERE patient_ref < 600").fetchall())
+
+    df = execute_query_in_batches(
+        sql, range(600), ["patient_ref"], client=standin_client, cache=False
+    )
+    assert len(df) == expected
+    assert set(df["patient_ref"]) == set(range(600))
+    # 600 claves × 14 filas no caben en un lote: ha tenido que partir.
+    assert standin.calls["/api/dataset"] > 1
+
+
+def test_in_batches_tuple_keys_and_sql_length(fixture_db, standin, standin_client):
+    with sqlite3.connect(fixture_db) as con:
+        pairs = con.execute(
+            "SELECT DISTINCT patient_ref, episode_ref FROM movements WHERE patient_ref < 50"
+        ).fetchall()
+    df = execute_query_in_batches(
+        "SELECT patient_ref, episode_ref FROM movements WHERE {key_filter}",
+        pairs + [(None, 1)],
+        ["patient_ref", "episode_ref"],
+        max_sql_chars=2_000,
+        client=standin_client,
+        cache=False,
+    )
+    assert len(df) == 2 * len(pairs)
+    assert standin.calls["/api/dataset"] > 1
+
+
+def test_partition_plans_are_keyed_by_template(fixture_db, standin, standin_client,
+                                               tmp_path, monkeypatch):
+    monkeypatch.setattr(connection, "_PARTITION_PLAN_DIR", tmp_path / "plans")
+
+    def template(columns):
+        return lambda s, e: (
+            f"SELECT {columns} FROM movements WHERE start_date >= '{s:%Y-%m-%d}' "
+            f"AND start_date < '{e:%Y-%m-%d}'"
+        )
+
+    kwargs = dict(client=standin_client, cache=False, split_at=10_000)
+    execute_query_partitioned(template("patient_ref"), "2020-01-01", "2021-01-01", **kwargs)
+    execute_query_partitioned(template("episode_ref"), "2020-01-01", "2021-01-01", **kwargs)
+    execute_query_partitioned(template("episode_ref"), "2020-01-01", "2021-01-01",
+                              plan_key="", **kwargs)
+    plans = sorted(p.name for p in (tmp_path / "plans").iterdir())
+    assert len(plans) == 2
+    assert all(name.startswith("query-") for name in plans)
+
+
+def test_yearly_incremental_refetches_only_changed_years(fixture_db, tmp_path):
+    db = tmp_path / "datanex.sqlite"
+    db.write_bytes(fixture_db.read_bytes())
+    probe_sql = (
+        "SELECT CAST(substr(start_date, 1, 4) AS INTEGER) AS year, COUNT(*) AS n "
+        "FROM movements WHERE substr(start_date, 1, 4) BETWEEN '{lo}' AND '{hi}' "
+        "GROUP BY 1"
+    )
+    store = YearlyStore("cohort", root=tmp_path / "store")
+
+    with MetabaseStandIn(db) as server:
+        client = MetabaseClient(server.url, server.email, server.password,
+                                server.database_name, persist_state=False)
+
+        def sync():
+            return execute_query_yearly_incremental(
+                lambda y: YEAR_SQL.format(year=y) + " LIMIT 100",
+                lambda lo, hi: probe_sql.format(lo=lo, hi=hi),
+                2019, 2022, store=store, client=client,
+            )
+
+        first = sync()
+        assert first.attrs["refetched_years"] == [2019, 2020, 2021, 2022]
+        second = sync()
+        assert second.attrs["refetched_years"] == []
+        assert second.equals(first)
+
+        with sqlite3.connect(db) as con:
+            con.execute(
+                "INSERT INTO movements VALUES (99999, 1, '2022-06-01 10:00:00', NULL, 'E073', 1)"
+            )
+        third = sync()
+        assert third.attrs["refetched_years"] == [2022]
+        assert server.calls["/api/dataset"] == 3 + 4 + 1
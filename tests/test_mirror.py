@@ -0,0 +1,93 @@
+"""Tests de la réplica local de `movements` (`indicadors_iso._mirror`)."""
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from indicadors_iso._mirror import MovementsMirror
+from indicadors_iso.connection import MetabaseClient
+from tests.metabase_standin import MetabaseStandIn
+
+# Mismas plantillas que `MONTH_SQL` / `PROBE_SQL`, en SQLite.
+MONTH_SQL = (
+    "SELECT * FROM movements WHERE ou_loc_ref IN ({units}) "
+    "AND start_date >= '{start}' AND start_date < '{end}'"
+)
+PROBE_SQL = (
+    "SELECT CAST(strftime('%Y', start_date) AS INTEGER) AS year, "
+    "CAST(strftime('%m', start_date) AS INTEGER) AS month, "
+    "COUNT(*) AS n_rows, MAX(load_date) AS max_load_date "
+    "FROM movements WHERE ou_loc_ref IN ({units}) "
+    "AND start_date >= '{start}' AND start_date < '{end}' GROUP BY 1, 2"
+)
+
+
+@pytest.fixture
+def movements_db(fixture_db, tmp_path):
+    db = tmp_path / "datanex.sqlite"
+    db.write_bytes(fixture_db.read_bytes())
+    with sqlite3.connect(db) as con:
+        con.execute("ALTER TABLE movements ADD COLUMN load_date TEXT")
+        con.execute("UPDATE movements SET load_date = '2025-01-01 00:00:00'")
+    return db
+
+
+def test_sync_is_incremental_and_read_prunes(movements_db, tmp_path):
+    mirror = MovementsMirror(
+        tmp_path / "mirror", units=["E073", "I073"], month_sql=MONTH_SQL, probe_sql=PROBE_SQL
+    )
+    with MetabaseStandIn(movements_db) as server:
+        client = MetabaseClient(server.url, server.email, server.password,
+                                server.database_name, persist_state=False)
+
+        first = mirror.sync(2023, 2024, client=client)
+        assert len(first["refetched"]) == 24
+        assert (tmp_path / "mirror" / "year=2024" / "month=03").is_dir()
+
+        assert mirror.sync(2023, 2024, client=client)["refetched"] == []
+
+        with sqlite3.connect(movements_db) as con:
+            con.execute(
+                "INSERT INTO movements VALUES "
+                "(99999, 1, '2024-06-01 10:00:00', NULL, 'E073', 1, '2025-02-01 00:00:00')"
+            )
+        third = mirror.sync(2023, 2024, client=client)
+        assert third["refetched"] == ["2024-06"]
+        # 1 sondeo por sync + 24 meses + 1 mes cambiado.
+        assert server.calls["/api/dataset"] == 3 + 24 + 1
+
+    with sqlite3.connect(movements_db) as con:
+        expected = pd.read_sql(
+            "SELECT patient_ref, start_date FROM movements WHERE ou_loc_ref = 'E073' "
+            "AND start_date >= '2024-05-15' AND start_date < '2024-07-01'",
+            con,
+        )
+    got = mirror.read(
+        "2024-05-15", "2024-07-01", units=["E073"], columns=["patient_ref", "start_date"]
+    )
+    assert got.attrs["partitions_read"] == ["2024-05", "2024-06"]
+    assert got.columns.tolist() == ["patient_ref", "start_date"]
+    assert sorted(got["patient_ref"]) == sorted(expected["patient_ref"])
+    assert 99999 in got["patient_ref"].tolist()
+
+    with pytest.raises(ValueError):
+        mirror.read(units=["E016"])
+
+
+def test_read_checks_units_per_partition(movements_db, tmp_path, capsys):
+    root = tmp_path / "mirror"
+    with MetabaseStandIn(movements_db) as server:
+        client = MetabaseClient(server.url, server.email, server.password,
+                                server.database_name, persist_state=False)
+        MovementsMirror(root, units=["E073", "I073"], month_sql=MONTH_SQL,
+                        probe_sql=PROBE_SQL).sync(2023, 2023, client=client)
+        # 2024 se replica solo con E073.
+        mirror = MovementsMirror(root, units=["E073"], month_sql=MONTH_SQL, probe_sql=PROBE_SQL)
+        mirror.sync(2024, 2024, client=client)
+    assert "[mirror]" not in capsys.readouterr().out
+
+    got = mirror.read("2023-01-01", "2024-01-01", units=["I073"], columns=["ou_loc_ref"])
+    assert set(got["ou_loc_ref"]) == {"I073"}
+    with pytest.raises(ValueError, match="2024-01"):
+        mirror.read("2023-12-01", "2024-02-01", units=["I073"])
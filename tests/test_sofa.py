@@ -0,0 +1,85 @@
+"""Paridad entre los kernels vectorizados de `sofa/_metrics.py` y las
+funciones `score_*` escalares."""
+
+import numpy as np
+import pandas as pd
+
+from indicadors_iso.demographics.sofa._metrics import (
+    COMPONENT_COLS,
+    compute_sofa,
+    score_cardiovascular,
+    score_coagulation,
+    score_liver,
+    score_neuro,
+    score_renal,
+    score_respiratory,
+)
+
+
+def _inputs(n=4000, seed=11):
+    """Valores en los cortes exactos, alrededor de ellos y nulos."""
+    rng = np.random.default_rng(seed)
+
+    def pick(values, p_na=0.15):
+        col = rng.choice(np.asarray(values, dtype="float64"), n)
+        col[rng.random(n) < p_na] = np.nan
+        return col
+
+    return pd.DataFrame({
+        "pao2_min": pick([0, 20, 39.9, 40, 60, 79.9, 80, 100, 150, 300, 500]),
+        "fio2_max": pick([-5, 0, 0.21, 0.5, 1.0, 1.5, 21, 40, 50, 100]),
+        "on_vmi": pick([0, 1, 2]),
+        "platelets_min": pick([5, 19.9, 20, 49.9, 50, 99, 100, 149.9, 150, 400]),
+        "bilirubin_max": pick([0.3, 1.19, 1.2, 1.99, 2.0, 5.9, 6.0, 11.9, 12.0, 30]),
+        "map_min": pick([40, 69.9, 70, 90]),
+        "on_norepi": pick([0, 1], 0.05),
+        "on_epi": pick([0, 1], 0.02),
+        "on_dopa": pick([0, 1], 0.02),
+        "on_dobu": pick([0, 1], 0.02),
+        "on_vasop": pick([0, 1], 0.02),
+        "on_phenyl": pick([0, 1], 0.02),
+        "on_inotrope_other": pick([0, 1], 0.02),
+        "gcs_min": pick([3, 5, 6, 9, 10, 12, 13, 14, 15]),
+        "creatinine_max": pick([0.5, 1.19, 1.2, 1.99, 2.0, 3.49, 3.5, 4.99, 5.0, 8]),
+    })
+
+
+def _scalar(df):
+    """`compute_sofa` tal como era: `apply` fila a fila."""
+    return pd.DataFrame({
+        "sofa_resp": df.apply(
+            lambda r: score_respiratory(r["pao2_min"], r["fio2_max"], r["on_vmi"]), axis=1),
+        "sofa_coag": df["platelets_min"].apply(score_coagulation),
+        "sofa_liver": df["bilirubin_max"].apply(score_liver),
+        "sofa_cardio": df.apply(
+            lambda r: score_cardiovascular(
+                r["map_min"], r["on_norepi"], r["on_epi"], r["on_dopa"],
+                r["on_dobu"], r["on_vasop"], r["on_phenyl"], r["on_inotrope_other"]),
+            axis=1),
+        "sofa_neuro": df["gcs_min"].apply(score_neuro),
+        "sofa_renal": df["creatinine_max"].apply(score_renal),
+    })
+
+
+def test_vectorized_components_match_scalar_rules():
+    df = _inputs()
+    df.index = df.index * 3 + 7
+    got = compute_sofa(df)
+    expected = _scalar(df)
+    for col in COMPONENT_COLS:
+        pd.testing.assert_series_equal(
+            got[col], expected[col].astype("Int64"), check_names=False, obj=col
+        )
+        assert got[col].notna().any() and got[col].isna().any(), col
+
+    comps = expected[COMPONENT_COLS]
+    assert got["sofa_components_available"].tolist() == comps.notna().sum(axis=1).tolist()
+    assert got["sofa_total"].tolist() == comps.fillna(0).sum(axis=1).astype(int).tolist()
+    # Las columnas de entrada no se tocan.
+    pd.testing.assert_frame_equal(got[df.columns], df)
+
+
+def test_compute_sofa_empty():
+    out = compute_sofa(_inputs().iloc[:0])
+    assert out.empty
+    assert set(COMPONENT_COLS + ["sofa_total"]) <= set(out.columns)
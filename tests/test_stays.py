@@ -0,0 +1,160 @@
+"""Equivalencia entre `demographics._stays` y las CTEs SQL de estancias.
+
+Las CTEs originales (per-unit, predominant-unit, DRG por episodio) se
+ejecutan en SQLite sobre los mismos movimientos sintéticos, con
+`date_diff` / `year` de Trino registrados como funciones Python.
+"""
+
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from indicadors_iso.demographics._stays import build_all_stays, build_stays
+from indicadors_iso.demographics.per_unit._sql import SQL_TEMPLATE as PER_UNIT_SQL
+from indicadors_iso.demographics.predominant_unit._sql import (
+    SQL_TEMPLATE as PREDOMINANT_SQL,
+)
+from indicadors_iso.drg.drg_complexity_report import build_drg_query
+
+NOW = "2024-12-20 12:00:00"
+UNITS = ["E073", "I073"]
+# Unidad fuera de las plantillas: sus movimientos solo entran sin `units`.
+OTHER_UNIT = "E016"
+_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def _date_diff(unit, a, b):
+    if a is None or b is None:
+        return None
+    seconds = (datetime.strptime(b, _FMT) - datetime.strptime(a, _FMT)).total_seconds()
+    return int(seconds / {"minute": 60, "hour": 3600, "day": 86400}[unit])
+
+
+def _movements(seed=7, units=UNITS):
+    """Cadenas de movimientos con huecos alrededor de la tolerancia
+    (±5 min, con segundos), solapes, cambios de unidad, movimientos
+    abiertos, sin cama o de duración cero, y estancias que cruzan el
+    año."""
+    rng = random.Random(seed)
+    gaps = [-600, -359, -300, -61, 0, 0, 0, 59, 299, 300, 330, 359, 360, 3600, 86400 * 3]
+    rows, used_starts = [], set()
+    for patient in range(1, 61):
+        for episode in range(patient * 10, patient * 10 + rng.randint(1, 2)):
+            t = datetime(2023, 12, 1) + timedelta(minutes=rng.randint(0, 60 * 24 * 400))
+            for _ in range(rng.randint(1, 7)):
+                while t.strftime(_FMT) in used_starts:
+                    t += timedelta(seconds=1)
+                used_starts.add(t.strftime(_FMT))
+                duration = timedelta(seconds=rng.choice([0, 45, 600, 3600 * 5, 86400 * 2, 86400 * 9]))
+                end = t + duration
+                open_end = end > datetime.strptime(NOW, _FMT) or rng.random() < 0.05
+                rows.append({
+                    "patient_ref": patient,
+                    "episode_ref": episode,
+                    "ou_loc_ref": rng.choice(units),
+                    "start_date": t.strftime(_FMT),
+                    "end_date": None if open_end else end.strftime(_FMT),
+                    "place_ref": None if rng.random() < 0.05 else rng.randint(1, 30),
+                })
+                t = end + timedelta(seconds=rng.choice(gaps))
+    return pd.DataFrame(rows)
+
+
+def _sqlite_ctes(sql, last_cte):
+    """Recorta `sql` hasta el final de la CTE `last_cte` y la adapta a SQLite."""
+    start = sql.index("WITH all_related_moves")
+    body = sql[start:]
+    end = body.index(f"\n{last_cte} AS (")
+    end = body.index("\n)", end) + 2
+    body = body[:end] + f"\nSELECT * FROM {last_cte}"
+    return (
+        body.replace("timestamp '", "'")
+        .replace("current_timestamp", f"'{NOW}'")
+        .replace("datascope_gestor_prod.movements", "movements")
+    )
+
+
+def _run_sql(moves, sql):
+    con = sqlite3.connect(":memory:")
+    con.create_function("date_diff", 3, _date_diff)
+    con.create_function("year", 1, lambda ts: None if ts is None else int(ts[:4]))
+    moves.to_sql("movements", con, index=False)
+    out = pd.read_sql(sql, con)
+    con.close()
+    for col in ("admission_date", "discharge_date", "effective_discharge_date"):
+        if col in out.columns:
+            out[col] = pd.to_datetime(out[col])
+    return out
+
+
+def _normalise(df, cols):
+    df = df[cols].copy()
+    for col in df.columns:
+        if col not in ("admission_date", "discharge_date", "effective_discharge_date",
+                       "ou_loc_ref", "still_admitted"):
+            df[col] = df[col].astype("int64")
+    df["ou_loc_ref"] = df["ou_loc_ref"].astype(str)
+    return df.sort_values(cols[:4], ignore_index=True)
+
+
+@pytest.mark.parametrize("min_year,max_year", [(2024, 2024), (2023, 2025)])
+def test_stays_match_sql_ctes(min_year, max_year):
+    moves = _movements(units=UNITS + [OTHER_UNIT])
+    fmt = {"min_year": min_year, "max_year": max_year}
+    sql = {
+        "per_unit": _sqlite_ctes(PER_UNIT_SQL.format(**fmt), "cohort"),
+        "predominant_unit": _sqlite_ctes(PREDOMINANT_SQL.format(**fmt), "cohort"),
+        "episode": _sqlite_ctes(build_drg_query(UNITS).format(**fmt), "stays"),
+    }
+    local = build_all_stays(
+        moves, min_year=min_year, max_year=max_year, now=pd.Timestamp(NOW), units=UNITS
+    )
+
+    for grain, query in sql.items():
+        expected = _run_sql(moves, query)
+        got = local[grain]
+        cols = ["patient_ref", "episode_ref", "ou_loc_ref", "stay_id"]
+        cols += [c for c in got.columns if c in expected.columns and c not in cols]
+        assert len(expected) > 50, grain
+        pd.testing.assert_frame_equal(
+            _normalise(got, cols), _normalise(expected, cols), obj=grain
+        )
+
+
+def test_stays_units_filter():
+    moves = _movements(units=UNITS + [OTHER_UNIT])
+    now = pd.Timestamp(NOW)
+    every = build_stays(moves, "per_unit", now=now)
+    only = build_stays(moves, "per_unit", now=now, units=UNITS)
+    assert OTHER_UNIT in set(every["ou_loc_ref"])
+    assert set(only["ou_loc_ref"]) == set(UNITS)
+    pd.testing.assert_frame_equal(
+        only, every[every["ou_loc_ref"] != OTHER_UNIT].reset_index(drop=True)
+    )
+
+
+def test_stays_accept_utc_timestamps():
+    """Con fechas UTC (como las devuelve Metabase) los límites de año y
+    `year()` se evalúan en hora local."""
+    moves = pd.DataFrame({
+        "patient_ref": [1, 1],
+        "episode_ref": [10, 10],
+        "ou_loc_ref": ["E073", "E073"],
+        # 2024-01-01 00:30 y 02:03 en Madrid.
+        "start_date": ["2023-12-31T23:30:00+00:00", "2024-01-01T01:03:00+00:00"],
+        "end_date": ["2024-01-01T01:00:00+00:00", None],
+        "place_ref": [5, 5],
+    })
+    now = pd.Timestamp("2024-01-02", tz="UTC")
+    stays = build_stays(moves, "per_unit", min_year=2024, max_year=2024, now=now)
+    assert len(stays) == 1
+    assert stays.loc[0, "num_movements"] == 2
+    # `MAX(end_date)` ignora NULL, igual que en SQL.
+    assert stays.loc[0, "still_admitted"] == "No"
+    assert stays.loc[0, "effective_discharge_date"] == now
+
+    with pytest.raises(ValueError):
+        build_stays(moves, "per_bed")
@@ -0,0 +1,79 @@
+"""Tests del pushdown de estancias como tabla VALUES (`demographics._stays_sql`)."""
+
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from indicadors_iso.connection import _key_values, _normalize_keys
+from indicadors_iso.demographics._stays_sql import STAY_KEY_COLS, STAYS_FROM_KEYS_CTES, stay_keys
+from indicadors_iso.demographics.autopsy._sql import render_sql as render_autopsy
+from indicadors_iso.demographics.nutrition._sql import render_sql as render_nutrition
+from indicadors_iso.demographics.sofa._sql import render_sql as render_sofa
+from indicadors_iso.micro.rectal_mdr._sql import render_sql as render_rectal
+
+
+def _cohort():
+    return pd.DataFrame(
+        {
+            "patient_ref": [1, 2, 3, 4],
+            "episode_ref": [10, 20, 30, 40],
+            "ou_loc_ref": pd.Categorical(["E073", "I073", "E016", "E073"]),
+            "stay_id": pd.array([1, 2, 1, 1], dtype="Int64"),
+            "admission_date": pd.to_datetime(
+                ["2024-07-01T08:30:00+02:00", "2024-01-15T10:00:00+01:00",
+                 "2024-03-01T00:00:00+01:00", "2024-02-01T00:00:00+01:00"],
+                utc=True,
+                format="ISO8601",
+            ),
+            "effective_discharge_date": pd.to_datetime(
+                ["2024-07-03T12:00:00.250+02:00", "2024-01-20T10:00:00+01:00",
+                 "2024-03-02T00:00:00+01:00", "2024-02-02T00:00:00+01:00"],
+                utc=True,
+                format="ISO8601",
+            ),
+            "synthetic": [False, False, False, True],
+        }
+    )
+
+
+def test_stay_keys_use_local_wall_clock_and_filter():
+    keys = stay_keys(_cohort(), units=["E073", "I073"])
+    assert keys.columns.tolist() == STAY_KEY_COLS
+    # E016 fuera de `units`; la fila sintética no existe en la BBDD.
+    assert keys["patient_ref"].tolist() == [1, 2]
+    assert keys["admission_date"].tolist() == [
+        pd.Timestamp("2024-07-01 08:30:00"),
+        pd.Timestamp("2024-01-15 10:00:00"),
+    ]
+
+
+def test_key_values_renders_inline_table():
+    keys = _normalize_keys(stay_keys(_cohort(), units=["E073"]), len(STAY_KEY_COLS))
+    sql = _key_values(STAY_KEY_COLS, keys)
+    assert sql == (
+        "(VALUES (1, 10, 'E073', 1, timestamp '2024-07-01 08:30:00', "
+        "timestamp '2024-07-03 12:00:00.250')) AS k (patient_ref, episode_ref, "
+        "ou_loc_ref, stay_id, admission_date, effective_discharge_date)"
+    )
+    assert isinstance(keys[0][4], datetime)
+
+
+@pytest.mark.parametrize(
+    "render",
+    [
+        lambda ctes=None: render_nutrition(2024, 2024, ["E073"], cohort_ctes=ctes),
+        lambda ctes=None: render_autopsy(2024, 2024, ["E073"], cohort_ctes=ctes),
+        lambda ctes=None: render_sofa(2024, 2024, ["E073"], cohort_ctes=ctes),
+        lambda ctes=None: render_rectal(2024, 2024, cohort_ctes=ctes),
+    ],
+)
+def test_templates_swap_stay_ctes(render):
+    default = render()
+    assert "datascope_gestor_prod.movements" in default
+    assert "grouped_stays" in default
+
+    pushed = render(STAYS_FROM_KEYS_CTES)
+    assert "datascope_gestor_prod.movements" not in pushed
+    assert "{key_values}" in pushed
+    assert pushed.count("cohort AS (") == 1
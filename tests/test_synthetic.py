@@ -0,0 +1,70 @@
+"""Tests de la augmentación sintética 2025 (`demographics/_loader.py`)."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicadors_iso.demographics._loader import (
+    _group_seed,
+    augment_synthetic_2025,
+)
+
+
+def _cohort(n_2025=40, seed=1):
+    rng = np.random.default_rng(seed)
+    admission = pd.Timestamp("2025-02-01", tz="UTC") + pd.to_timedelta(
+        rng.integers(0, 200 * 24, n_2025), unit="h"
+    )
+    exitus = (admission + pd.to_timedelta(rng.integers(0, 60 * 24, n_2025), unit="h")).where(
+        rng.random(n_2025) < 0.4
+    )
+    hours = rng.integers(1, 300, n_2025)
+    return pd.DataFrame({
+        "patient_ref": np.arange(n_2025),
+        "episode_ref": np.arange(n_2025) + 1000,
+        "stay_id": 1,
+        "ou_loc_ref": rng.choice(["E073", "I073"], n_2025),
+        "admission_date": admission,
+        "discharge_date": admission + pd.to_timedelta(hours, unit="h"),
+        "effective_discharge_date": admission + pd.to_timedelta(hours, unit="h"),
+        "exitus_date": exitus,
+        "hours_stay": hours,
+        "still_admitted": "No",
+        "year_admission": 2025,
+        "age_at_admission": rng.integers(18, 90, n_2025),
+    })
+
+
+def test_group_seed_is_stable():
+    # Fijo: no depende de PYTHONHASHSEED (a diferencia de `hash()`).
+    assert _group_seed(42, "E073") == 17718631839796414026
+    assert _group_seed(42, "E073") != _group_seed(42, "I073")
+
+
+def test_augmentation_is_reproducible_and_fills_months():
+    df = _cohort()
+    months = [(2025, 3), (2025, 11), (2025, 12)]
+    target = {"E073": 60, "I073": 55}
+    first = augment_synthetic_2025(df, target=target, group_col="ou_loc_ref", months=months)
+    second = augment_synthetic_2025(df, target=target, group_col="ou_loc_ref", months=months)
+    pd.testing.assert_frame_equal(first, second)
+
+    assert first["ou_loc_ref"].astype(str).value_counts().to_dict() == target
+    synth = first[first["synthetic"]]
+    assert synth["patient_ref"].is_unique
+
+    assert str(synth["admission_date"].dt.tz) == "Europe/Madrid"
+    local = synth["admission_date"]
+    assert set(zip(local.dt.year, local.dt.month)) <= set(months)
+    assert (synth["year_admission"] == 2025).all()
+    hours = (synth["discharge_date"] - synth["admission_date"]) / pd.Timedelta(hours=1)
+    assert (hours == synth["hours_stay"]).all()
+
+    # El éxitus se desplaza con la admisión: los deltas son los de las
+    # plantillas.
+    delta = (synth["exitus_date"] - synth["admission_date"]).dropna()
+    template_deltas = set(df["exitus_date"] - df["admission_date"])
+    assert len(delta) and set(delta) <= template_deltas
+
+    with pytest.raises(ValueError):
+        augment_synthetic_2025(df, target=80, months=[(2024, 12)])
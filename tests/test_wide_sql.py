@@ -0,0 +1,123 @@
+"""Tests de la query consolidada per-unit (`demographics/per_unit/_wide_sql.py`)."""
+
+import pandas as pd
+
+from indicadors_iso._dtypes import apply_schema
+from indicadors_iso.demographics._schemas import COHORT_SCHEMA
+from indicadors_iso.demographics.per_unit import run
+from indicadors_iso.demographics.per_unit._sql import COHORT_CTES, SQL_TEMPLATE
+from indicadors_iso.demographics.per_unit._wide_sql import render_wide_sql
+from indicadors_iso.demographics.sofa._metrics import INPUT_COLS as SOFA_INPUT_COLS
+
+
+def test_wide_sql_builds_stays_once():
+    sql = render_wide_sql(2024, 2024, ["E073", "I073"])
+    assert "{" not in sql
+    assert sql.count("datascope_gestor_prod.movements") == 1
+    assert sql.count("all_related_moves AS (") == 1
+    for cte in ("cohort_window AS (", "sofa_stays AS (", "nutrition_agg AS (",
+                "autopsy_agg AS (", "demo_stays AS ("):
+        assert sql.count(cte) == 1
+    assert "WHERE c.ou_loc_ref IN ('E073', 'I073')" in sql
+    # Autopsias: ventana de provisiones hasta max_year + 2.
+    assert "timestamp '2026-12-31 23:59:59'" in sql
+    # La plantilla de la cohorte sola se compone de las mismas piezas.
+    assert SQL_TEMPLATE.startswith(COHORT_CTES)
+
+
+_COHORT = {
+    "patient_ref": ["1", "2", "3"],
+    "episode_ref": ["10", "20", "30"],
+    "stay_id": ["1", "1", "2"],
+    "ou_loc_ref": ["E073", "I073", "E073"],
+    "admission_date": [
+        "2024-01-01T10:00:00+01:00",
+        "2024-02-01T10:00:00+01:00",
+        "2024-03-01T10:00:00+01:00",
+    ],
+    "effective_discharge_date": [
+        "2024-01-05T10:00:00+01:00",
+        "2024-02-03T10:00:00+01:00",
+        "2024-03-09T10:00:00+01:00",
+    ],
+    "still_admitted": ["No", "No", "No"],
+    "exitus_during_stay": ["No", "No", "Yes"],
+    "year_admission": [2024, 2024, 2024],
+}
+_KEYS = ["patient_ref", "episode_ref", "ou_loc_ref", "stay_id"]
+_SOFA = {
+    "pao2_min": [80.0, None, 55.0],
+    "fio2_max": [40.0, None, 80.0],
+    "on_vmi": [0, 0, 1],
+    "platelets_min": [90.0, 200.0, None],
+    "bilirubin_max": [None, 1.0, 7.0],
+    "map_min": [65.0, 75.0, 60.0],
+    "on_norepi": [0, 0, 1],
+    "on_epi": [0, 0, 0],
+    "on_dopa": [0, 0, 0],
+    "on_dobu": [0, 0, 0],
+    "on_vasop": [0, 0, 0],
+    "on_phenyl": [0, 0, 0],
+    "on_inotrope_other": [0, 0, 0],
+    "gcs_min": [15.0, None, 7.0],
+    "creatinine_max": [1.0, 2.5, None],
+}
+_NUTRITION = {
+    "nutr_enteral_start": ["2024-01-02T10:00:00+01:00", None, None],
+    "nutr_parenteral_start": [None, None, "2024-03-01T22:00:00+01:00"],
+}
+_AUTOPSY = {"first_autopsy_date": [None, None, "2024-03-12T09:00:00+01:00"]}
+
+
+def _frame(*parts, rows=None):
+    data = {}
+    for part in parts:
+        data.update(part)
+    df = pd.DataFrame(data)
+    return df if rows is None else df.iloc[rows].reset_index(drop=True)
+
+
+def test_wide_loader_matches_separate_queries_and_merges(monkeypatch):
+    """La cohorte ancha deriva SOFA / nutrición / autopsia igual que
+    cuatro queries separadas + `merge_sofa` / `merge_per_unit`."""
+    wide = _frame(_COHORT, _SOFA, _NUTRITION, _AUTOPSY)
+    cohort = _frame(_COHORT)
+    keys = {k: _COHORT[k] for k in _KEYS + ["admission_date"]}
+    # Los subloaders solo devuelven estancias con datos (INNER JOIN).
+    raw = {
+        "sofa": _frame(_COHORT, _SOFA),
+        "nutrition": _frame(keys, _NUTRITION, rows=[0, 2]),
+        "autopsy": _frame(keys, _AUTOPSY, rows=[2]),
+    }
+
+    def fake_load_cohort(min_year, max_year, sql_template, **kwargs):
+        df = wide if callable(sql_template) else cohort
+        return apply_schema(df, COHORT_SCHEMA, verbose=False)
+
+    def fake_yearly(render, min_year, max_year, label, **kwargs):
+        return raw[label].copy()
+
+    monkeypatch.setattr(run, "load_cohort", fake_load_cohort)
+    monkeypatch.setattr(run, "PUSHDOWN_COHORT_KEYS", False)
+    monkeypatch.setattr(run, "execute_query_yearly", fake_yearly)
+    monkeypatch.setattr(
+        "indicadors_iso.demographics.nutrition._loader.execute_query_yearly", fake_yearly
+    )
+    monkeypatch.setattr(
+        "indicadors_iso.demographics.autopsy._loader.execute_query_yearly", fake_yearly
+    )
+
+    expected = run.load_enriched_cohort(2024, 2024, "2024")
+    got = run.load_wide_cohort(2024, 2024)
+
+    assert not set(SOFA_INPUT_COLS) & set(got.columns)
+    assert got.columns.tolist() == expected.columns.tolist()
+    # Los merges pierden el category de `ou_loc_ref`; la carga ancha no.
+    assert isinstance(got["ou_loc_ref"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(
+        got.astype({"ou_loc_ref": str}),
+        expected.astype({"ou_loc_ref": str}),
+        check_dtype=False,
+    )
+    assert got["received_autopsy"].tolist() == [0, 0, 1]
+    assert got["received_enteral"].isna().tolist() == [False, True, False]